@@ -24,15 +24,22 @@ import psycopg2
 from cftime import date2num, num2date
 from netCDF4 import Dataset
 
+import csv
 import glob
+import io
 import numpy
 import dateutil.parser
-from psycopg2._psycopg import IntegrityError
+from psycopg2.extras import execute_values
 
 conn = psycopg2.connect("dbname=data_db user=pete")
 
 verbose = 3
 
+copy_chunk = 100000  # number of variable_data rows sent in each COPY
+
+# seconds in each time unit, for the vectorised timestamps
+time_unit_seconds = {'days': 86400, 'hours': 3600, 'minutes': 60, 'seconds': 1}
+
 def getAttributeOrDefault(nc, name, default):
     try:
         value = nc.getncattr(name)
@@ -52,13 +59,73 @@ def getDateOrDefault(nc, name, default):
     return value
 
 
+def timestamp_strings(values, units, calendar):
+    # ISO timestamp strings for all time values at once, an empty string for missing times
+    # for the standard calendars this uses datetime64 arithmetic rather than creating a cftime object for each value
+    t = numpy.ma.filled(numpy.ma.asarray(values, dtype=numpy.float64), numpy.nan).flatten()
+    missing = ~numpy.isfinite(t)
+
+    unit = units.split(' ')[0].lower()
+    t0 = num2date(0, units=units, calendar=calendar)
+    if unit in time_unit_seconds and calendar in ('standard', 'gregorian', 'proleptic_gregorian') and t0.year > 1582:
+        us = numpy.round(numpy.where(missing, 0, t) * time_unit_seconds[unit] * 1e6).astype('timedelta64[us]')
+        ts = numpy.datetime_as_string(numpy.datetime64(t0.strftime('%Y-%m-%dT%H:%M:%S'), 'us') + us, unit='us')
+    else:
+        ts = numpy.array([str(d) for d in num2date(numpy.where(missing, 0, t), units=units, calendar=calendar)])
+
+    ts = ts.astype(object)
+    ts[missing] = ''
+
+    return ts
+
+
+def copy_variable_data(cur, file_id, var_name, deployment_code, lat, lon, depth, sensor, ts, values):
+    # stream the data of one variable into variable_data using COPY, copy_chunk rows at a time
+    # the columns which are the same for every row are formatted once
+    buf = io.StringIO()
+    csv.writer(buf, lineterminator='').writerow([file_id, var_name, deployment_code, lat, lon, depth, sensor])
+    prefix = buf.getvalue() + ','
+
+    values = numpy.ma.filled(numpy.ma.asarray(values, dtype=numpy.float64), numpy.nan).flatten()
+    if ts is None:
+        ts = numpy.full(len(values), '', dtype=object)
+
+    for i0 in range(0, len(values), copy_chunk):
+        i1 = min(i0 + copy_chunk, len(values))
+        idx = numpy.arange(i0, i1)
+        rows = prefix + idx.astype(str).astype(object) + ',' + ts[idx] + ',' + values[i0:i1].astype(str).astype(object)
+
+        cur.copy_expert("COPY variable_data (file_id, variable, deployment, lat, lon, depth, sensor, idx, timestamp, value) "
+                        "FROM STDIN WITH (FORMAT csv)", io.StringIO('\n'.join(rows) + '\n'))
+
+        if verbose > 1:
+            print('variable_data', var_name, i1, 'rows')
+
+    return len(values)
+
+
+def loaded_files():
+    # file names already in the database, to skip when resuming
+    cur = conn.cursor()
+    cur.execute("SELECT file_name FROM file")
+    names = set(r[0] for r in cur.fetchall())
+    cur.close()
+
+    return names
+
+
 # example url
 # http://tds0.ifremer.fr/thredds/dodsC/CORIOLIS-OCEANSITES-GDAC-OBS/DATA/WHOTS/OS_WHOTS_2019_R_M-2.nc.html
 # https://dods.ndbc.noaa.gov/thredds/dodsC/oceansites/DATA/ALOHA/OS_ACO_20110613-08-16_P_CTD3-4726m.nc.html
 
 def postgres_insert(file_name):
 
-    nc = Dataset(file_name , "r")
+    # a missing, corrupt or unreachable file fails this file only, not the whole batch
+    try:
+        nc = Dataset(file_name , "r")
+    except Exception as e:
+        print ('failed', file_name, type(e).__name__, e)
+        return None
 
     url = file_name
 
@@ -119,6 +186,7 @@ def postgres_insert(file_name):
 
         # insert all global attributes
         glob_atts = nc.ncattrs()
+        att_rows = []
         for att_name in glob_atts:
             att_value = nc.getncattr(att_name)
             att_type = type(att_value).__name__
@@ -131,9 +199,9 @@ def postgres_insert(file_name):
             if verbose > 3:
                 print('global ', att_name, att_type, att_value)
 
-            cur.execute("INSERT INTO global_attributes (file_id, name, type, value)"
-                        "VALUES (%s, %s, %s, %s)",
-                        (file_id, att_name, att_type, str(att_value)))
+            att_rows.append((file_id, att_name, att_type, str(att_value)))
+
+        execute_values(cur, "INSERT INTO global_attributes (file_id, name, type, value) VALUES %s", att_rows)
 
         # get a list of auxiliary variables
         auxList = []
@@ -152,11 +220,12 @@ def postgres_insert(file_name):
         ts = None
         # hack for MNF CTD file
         if 'firingTime' in nc.variables:
-            ts = num2date(nc.variables['firingTime'], units=nc.variables['time'].units, calendar="gregorian").flatten()
+            ts = timestamp_strings(nc.variables['firingTime'][:], units=nc.variables['time'].units, calendar="gregorian")
         # standard netCDF TIME
         if 'TIME' in nc.variables:
             if nc.variables['TIME'].long_name == 'time':
-                ts = num2date(nc.variables['TIME'], units=nc.variables['TIME'].units, calendar=nc.variables['TIME'].calendar).flatten()
+                ts = timestamp_strings(nc.variables['TIME'][:], units=nc.variables['TIME'].units,
+                                       calendar=getAttributeOrDefault(nc.variables['TIME'], 'calendar', 'standard'))
 
         lat = float(nc.variables['LATITUDE'][0])
         lon = float(nc.variables['LONGITUDE'][0])
@@ -171,6 +240,9 @@ def postgres_insert(file_name):
                     (file_id, lat, lon, depth, sensor))
 
         # insert all variable metadata
+        var_rows = []
+        var_att_rows = []
+        data_vars = []
         for var_name in nc.variables:
             var = nc.variables[var_name]
             #var_type = type(var[:].data[0]).__name__
@@ -227,9 +299,7 @@ def postgres_insert(file_name):
                 print('variable', var_name, var_type, units)
 
             # insert variables into database
-            cur.execute("INSERT INTO variable (file_id, variable, name, units, dimensions, is_aux, is_coord, aux_vars, type)"
-                        "VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)",
-                        (file_id, var_name, name, units, buf, is_aux, is_coord, aux_vars, var_type))
+            var_rows.append((file_id, var_name, name, units, buf, is_aux, is_coord, aux_vars, var_type))
 
             # add the variable attributes
             for att_name in var.ncattrs():
@@ -242,37 +312,70 @@ def postgres_insert(file_name):
                 if verbose > 2:
                     print('var-att', var_name, att_name, att_type)
 
-                # insert variables_attributes into database
-                cur.execute("INSERT INTO variable_attributes (file_id, variable, name, type, value)"
-                            "VALUES (%s, %s, %s, %s, %s)",
-                            (file_id , var_name, att_name, att_type, str(att_value)))
+                var_att_rows.append((file_id, var_name, att_name, att_type, str(att_value)))
 
             # insert any float data
             if not is_aux and var_type.startswith('float'):
-                v = var[:].flatten()
-                i = 0
+                data_vars.append(var_name)
 
-                for val in v:
-                    if verbose > 3:
-                        print('data ', i, val)
+        execute_values(cur, "INSERT INTO variable (file_id, variable, name, units, dimensions, is_aux, is_coord, aux_vars, type) VALUES %s", var_rows)
+        execute_values(cur, "INSERT INTO variable_attributes (file_id, variable, name, type, value) VALUES %s", var_att_rows)
 
-                    dval = numpy.float(val)
+        n_data = 0
+        for var_name in data_vars:
+            n_data += copy_variable_data(cur, file_id, var_name, deployment_code, lat, lon, depth, sensor, ts, nc.variables[var_name][:])
 
-                    # insert data into database
-                    cur.execute("INSERT INTO variable_data (file_id, variable, idx, deployment, lat, lon, depth, sensor, timestamp, value)"
-                                "VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)",
-                                (file_id, var_name, i, deployment_code, lat, lon, depth, sensor, str(ts[i]), dval))
-                    i = i + 1
+        # the file is loaded in one transaction, so a failed file leaves nothing in the database and can be loaded again
+        conn.commit()
+        print('loaded', file_name, 'data rows', n_data)
 
-    except IntegrityError as e:
-        print ('IntegrityError', e)
+    except Exception as e:
+        print ('failed', file_name, type(e).__name__, e)
+        conn.rollback()
+        file_id = None
 
-    conn.commit()
     cur.close()
+    nc.close()
+
+    return file_id
+
+
+def postgres_insert_files(files, resume=False):
+    # load each file in its own transaction, carrying on after a failed file
+    # with resume, skip files already in the database (ie loaded before a failure)
+    skip = set()
+    if resume:
+        skip = loaded_files()
+        print('files already loaded', len(skip))
+
+    failed = []
+    for f in files:
+        if os.path.basename(urllib.parse.unquote(f)) in skip:
+            print('skipping, already loaded', f)
+            continue
+
+        if postgres_insert(f) is None:
+            failed.append(f)
+
+    if failed:
+        print('failed files, load again with --resume :')
+        for f in failed:
+            print('  ', f)
 
-    return id
+    return failed
 
 
 if __name__ == "__main__":
+    resume = False
+    files = []
     for f in sys.argv[1:]:
-        postgres_insert(f)
+        if f == '--resume':
+            resume = True
+        elif f.startswith('http://') or f.startswith('https://'):
+            # OPeNDAP urls are passed on as they are
+            files.append(f)
+        else:
+            # a name that matches no files is kept, so it is reported as a failed file
+            files.extend(glob.glob(f) or [f])
+
+    postgres_insert_files(files, resume=resume)
@@ -19,7 +19,10 @@ import os
 import sys
 sys.path.extend(['.'])
 
+import threading
+import time
 from datetime import datetime, UTC
+from queue import Queue
 
 from cftime import num2date
 from netCDF4 import Dataset
@@ -29,125 +32,236 @@ import glob
 
 from influxdb import InfluxDBClient
 
+batch_size = 5000  # points in each write
+queue_size = 8  # batches waiting to be written, reading the file waits when the queue is full
+writer_threads = 1
 
-def parse(files):
+# seconds in each time unit, for the vectorised time conversion
+time_unit_seconds = {'days': 86400, 'hours': 3600, 'minutes': 60, 'seconds': 1}
 
-    fn = files
-    print(files)
-    #for f in files:
-    #    fn.extend(glob.glob(f))
 
-    client = InfluxDBClient(host='144.6.230.0', port=8086)
-    client.switch_database('rtdp')
+def escape(s):
+    # escape a line protocol tag key, tag value or field key
+    return str(s).replace('\\', '\\\\').replace(',', '\\,').replace('=', '\\=').replace(' ', '\\ ')
 
-    print(fn)
 
-    for filepath in fn:
-        print('file name', filepath)
+def escape_measurement(s):
+    # escape a line protocol measurement, only commas and spaces are escaped in a measurement
+    return str(s).replace(',', '\\,').replace(' ', '\\ ')
 
-        nc = Dataset(filepath, 'r')
 
-        # get time variable
-        vs = nc.get_variables_by_attributes(standard_name='time')
-        nctime = vs[0]
-        t_unit = nctime.units  # get unit  "days since 1950-01-01T00:00:00Z"
+def time_ns(times, t_unit, t_cal):
+    # time values to integer nanoseconds since 1970 (to the nearest microsecond, as num2date),
+    # all at once for the standard calendars
+    t = np.ma.filled(np.ma.asarray(times, dtype=np.float64), np.nan)
 
-        try:
-            t_cal = nctime.calendar
-        except AttributeError:  # Attribute doesn't exist
-            t_cal = u"gregorian"  # or standard
-
-        print('time variable', nctime.name)
-        time_dims = nctime.get_dims()
-        time_dims_name = time_dims[0].name
-        print('time dimension(0)', time_dims_name)
-
-        z_coords = nc.get_variables_by_attributes(axis='Z')
-        #print('z coords', z_coords)
-        nom_depth = None
-        try:
-            nom_depth_var = z_coords[0] # TODO not take first one
-            nom_depth = nom_depth_var[:].data
-        except KeyError:
-            pass
+    unit = t_unit.split(' ')[0].lower()
+    t0 = num2date(0, units=t_unit, calendar=t_cal, only_use_cftime_datetimes=False)
+    if unit in time_unit_seconds and t_cal in ('standard', 'gregorian', 'proleptic_gregorian') and t0.year > 1582:
+        t0_ns = np.datetime64(t0.replace(tzinfo=None), 'ns').astype(np.int64)
+        return t0_ns + np.round(np.where(np.isfinite(t), t, 0) * time_unit_seconds[unit] * 1e6).astype(np.int64) * 1000
+
+    dt = num2date(np.where(np.isfinite(t), t, 0), units=t_unit, calendar=t_cal, only_use_cftime_datetimes=False)
+
+    return np.array([np.datetime64(d.replace(tzinfo=None), 'ns') for d in dt]).astype(np.int64)
+
+
+class BatchWriter:
+    # write batches of line protocol points to influxdb from a bounded queue, with one or more writer threads
 
-        coords = None
-        time_vars_name = []
-        for v in nc.variables:
-            if v != nctime.name:
-                dim_names = [d.name for d in nc.variables[v].get_dims()]
-                print('variable ', v, dim_names)
-                if time_dims_name in dim_names:
-                    print(' has time dimension')
-                    time_vars_name.append(v)
-            if 'coordinates' in nc.variables[v].ncattrs():
-                #print('coord', nc.variables[v].ncattrs())
-                coords = nc.variables[v].getncattr('coordinates')
-
-            print(' coords:', coords)
-
-        #print('time vars', time_vars)
-
-        # remove an auxiliary variables from the list to plot
-        aux_vars = list()
-        for var in nc.variables:
+    def __init__(self, host, port, database, threads=1):
+        self.database = database
+        self.queue = Queue(maxsize=queue_size)
+        self.points = 0
+        self.errors = 0
+        self.lock = threading.Lock()
+        self.threads = []
+        for i in range(threads):
+            client = InfluxDBClient(host=host, port=port)
+            thread = threading.Thread(target=self.worker, args=(client,), daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def worker(self, client):
+        while True:
+            lines = self.queue.get()
+            if lines is None:
+                break
             try:
-                aux_vars.extend(nc.variables[var].getncattr('ancillary_variables').split(' '))
-            except AttributeError:
-                pass
-
-        for var in aux_vars:
-            print('remove aux', var)
-            time_vars_name.remove(var)
-
-        print('time vars not aux', time_vars_name)
-        time_vars = []
-        for v in time_vars_name:
-            data = nc.variables[v]
-            qc = None
-            if v + "_quality_control" in nc.variables:
-                qc = nc.variables[v + "_quality_control"]
-            time_vars.append({'var': data, 'time_dim': data.dimensions.index('TIME'), 'qc': qc})
-
-        date_time_start = datetime.strptime(nc.getncattr('time_deployment_start'), '%Y-%m-%dT%H:%M:%SZ')
+                client.write_points(lines, database=self.database, protocol='line')
+                with self.lock:
+                    self.points += len(lines)
+            except Exception as e:
+                print('write error', type(e).__name__, e)
+                with self.lock:
+                    self.errors += len(lines)
+
+    def put(self, lines):
+        for i in range(0, len(lines), batch_size):
+            self.queue.put(lines[i:i+batch_size])
+
+    def close(self):
+        for thread in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+
+        return self.points
+
+
+def file_lines(nc):
+    # line protocol points for one file, one point for each time in the deployment with the good data (QC <= 2)
+    # as fields, made from the whole variables at once
+
+    # get time variable
+    vs = nc.get_variables_by_attributes(standard_name='time')
+    nctime = vs[0]
+    t_unit = nctime.units  # get unit  "days since 1950-01-01T00:00:00Z"
+
+    try:
+        t_cal = nctime.calendar
+    except AttributeError:  # Attribute doesn't exist
+        t_cal = u"gregorian"  # or standard
+
+    print('time variable', nctime.name)
+    time_dims = nctime.get_dims()
+    time_dims_name = time_dims[0].name
+    print('time dimension(0)', time_dims_name)
+
+    z_coords = nc.get_variables_by_attributes(axis='Z')
+    #print('z coords', z_coords)
+    nom_depth = None
+    try:
+        nom_depth_var = z_coords[0] # TODO not take first one
+        nom_depth = nom_depth_var[:].data
+    except (KeyError, IndexError):
+        pass
+
+    coords = None
+    time_vars_name = []
+    for v in nc.variables:
+        if v != nctime.name:
+            dim_names = [d.name for d in nc.variables[v].get_dims()]
+            print('variable ', v, dim_names)
+            if time_dims_name in dim_names:
+                print(' has time dimension')
+                time_vars_name.append(v)
+        if 'coordinates' in nc.variables[v].ncattrs():
+            #print('coord', nc.variables[v].ncattrs())
+            coords = nc.variables[v].getncattr('coordinates')
+
+        print(' coords:', coords)
+
+    #print('time vars', time_vars)
+
+    # remove an auxiliary variables from the list to plot
+    aux_vars = list()
+    for var in nc.variables:
         try:
-            date_time_end = datetime.strptime(nc.getncattr('time_deployment_end'), '%Y-%m-%dT%H:%M:%SZ')
+            aux_vars.extend(nc.variables[var].getncattr('ancillary_variables').split(' '))
         except AttributeError:
-            date_time_end = datetime.strptime(nc.getncattr('time_coverage_end'), '%Y-%m-%dT%H:%M:%SZ')
+            pass
+
+    for var in aux_vars:
+        print('remove aux', var)
+        time_vars_name.remove(var)
+
+    print('time vars not aux', time_vars_name)
+
+    date_time_start = datetime.strptime(nc.getncattr('time_deployment_start'), '%Y-%m-%dT%H:%M:%SZ')
+    try:
+        date_time_end = datetime.strptime(nc.getncattr('time_deployment_end'), '%Y-%m-%dT%H:%M:%SZ')
+    except AttributeError:
+        date_time_end = datetime.strptime(nc.getncattr('time_coverage_end'), '%Y-%m-%dT%H:%M:%SZ')
 
-        # read the TIME variable and convert to python datetime
-        dt_time = num2date(nctime[:], units=t_unit, calendar=t_cal, only_use_cftime_datetimes=False)
+    # read the TIME variable and convert to nanoseconds, keep the times in the deployment
+    t_ns = time_ns(nctime[:], t_unit, t_cal)
+    in_deployment = (t_ns > np.datetime64(date_time_start, 'ns').astype(np.int64)) & (t_ns < np.datetime64(date_time_end, 'ns').astype(np.int64))
 
-        point = {'measurement': nc.platform_code, 'tags': {'site': nc.deployment_code, 'nominal_depth': nom_depth}}
-        for n in range(0, len(time_dims[0])):
-            if (dt_time[n] > date_time_start) & (dt_time[n] < date_time_end):
+    # build the fields for each time, a variable only where its QC <= 2, and the data is not missing
+    fields = np.full(len(t_ns), '', dtype=object)
+    for v in time_vars_name:
+        var = nc.variables[v]
+        qc = None
+        if v + "_quality_control" in nc.variables:
+            qc = nc.variables[v + "_quality_control"]
 
-                #print(n, dt_time[n], nom_depth)
+        if var.dimensions.index('TIME') == 0:
+            data = var[:]
+            if qc is not None:
+                qc = qc[:]
+        else:
+            data = var[0, :]
+            if qc is not None:
+                qc = qc[0, :]
+        data = np.ma.filled(np.ma.asarray(data, dtype=np.float64), np.nan)
 
-                point['time'] = dt_time[n]
-                fields = {}
-                for v in time_vars:
-                    qc = 0
-                    if v['qc']:
-                        qc = v['qc'][n]
-                    if qc <= 2:
-                        #print('field ', v['var'].name, v['time_dim'], qc)
-                        if v['time_dim'] == 0:
-                            fields[v['var'].name] = np.float(v['var'][n].data)
-                        elif v['time_dim'] == 1:
-                            fields[v['var'].name] = np.float(v['var'][0, n].data)
+        good = np.isfinite(data)
+        if qc is not None:
+            good &= np.ma.filled(qc <= 2, False)
 
-                point['fields'] = fields
+        field = np.where(good, escape(v) + '=' + data.astype(str).astype(object), '')
+        fields = fields + np.where((fields != '') & good, ',', '') + field
 
-                if (n % 1000) == 0:
-                    print('point', point)
+    keep = in_deployment & (fields != '')
 
-                client.write_points([point], database='rtdp', protocol='json')
+    tags = escape_measurement(nc.platform_code) + ',site=' + escape(nc.deployment_code)
+    if nom_depth is not None:
+        tags += ',nominal_depth=' + escape(nom_depth)
+
+    lines = tags + ' ' + fields[keep] + ' ' + t_ns[keep].astype(str).astype(object)
+
+    return lines
+
+
+def parse(files, host='144.6.230.0', port=8086, database='rtdp', threads=writer_threads):
+
+    fn = files
+    print(files)
+    #for f in files:
+    #    fn.extend(glob.glob(f))
+
+    print(fn)
+
+    writer = BatchWriter(host, port, database, threads=threads)
+    t_start = time.time()
+
+    for filepath in fn:
+        print('file name', filepath)
+
+        nc = Dataset(filepath, 'r')
+
+        lines = file_lines(nc)
+        print('points', len(lines))
+        if len(lines) > 0:
+            print('point', lines[0])
+
+        writer.put(list(lines))
 
         nc.close()
 
-    return None
+    points = writer.close()
+    t_run = time.time() - t_start
+    print('points written', points, 'errors', writer.errors, 'in', round(t_run, 2), 's,', round(points / max(t_run, 1e-9)), 'points/s')
+
+    return points
 
 
 if __name__ == "__main__":
-    parse(sys.argv[1:])
+    host = '144.6.230.0'
+    port = 8086
+    threads = writer_threads
+    files = []
+    for f in sys.argv[1:]:
+        if f.startswith('--host='):
+            host = f.replace('--host=', '')
+        elif f.startswith('--port='):
+            port = int(f.replace('--port=', ''))
+        elif f.startswith('--batch='):
+            batch_size = int(f.replace('--batch=', ''))
+        elif f.startswith('--threads='):
+            threads = int(f.replace('--threads=', ''))
+        else:
+            files.append(f)
+
+    parse(files, host=host, port=port, threads=threads)
@@ -17,15 +17,14 @@
 # v1.7 - Improve data extraction for corrupt files
 # v2.0 - Change Data Structure to include Acceleration
 # v2.1 - Added netcdf output
-SoftwareVersion = 'v2.1'
+# v2.2 - Decode samples with numpy structured arrays from a memory mapped file, write netCDF and CSV by sample
+SoftwareVersion = 'v2.2'
 
 # ------------------------------------------------------------------------------
-import struct  # unpack
 import datetime  # date time for sec conversion
-import pytz
 #import tzlocal
 import os
-import ctypes  # c struct and union routines
+import mmap  # memory mapped deployment file
 import pandas as pd  # pandas data frame
 import numpy as np
 import matplotlib.pyplot as plt
@@ -41,7 +40,6 @@ import MPESS_Struct
 import sys
 
 from netCDF4 import Dataset
-from netCDF4 import date2num
 import numpy as np
 from datetime import timedelta
 
@@ -82,6 +80,14 @@ if (Flag_PlotData == False):
 DeploymentFilePath = './'
 DeploymentFileName = sys.argv[1]
 
+# optional CSV file of the data, --csv
+if '--csv' in sys.argv[2:]:
+    Flag_CreateCSV = True
+
+# the plots are made from the netCDF file
+if Flag_PlotData:
+    Flag_CreateNetCDF = True
+
 PressureUnits = ''
 LineTensionUnits = ''
 NrOfSamplesPerStop = 0
@@ -90,90 +96,177 @@ NrOfSamplesPerStop = 0
 
 
 # ------------------------------------------------------------------------------
-def ExtractAllSamples(deployment_file, file_Info, writer_CSV):
+# Sample Structures (big endian, v2.1 logger layout, see MPESS_Struct-v2.1.py)
+
+# info sample, 104 bytes after the sample type
+Dtype_Sample_Info = np.dtype([('Sys_OppMode',               '>u4'),
+                              ('Sys_SerialNumber',          '>u4'),
+                              ('Sys_UnitNumber',            '>u2'),
+                              ('Dep_Number',                '>u2'),
+                              ('Dep_Int_NrOfSamples',       '>u4'),
+                              ('Dep_Norm_SampleInterval',   '>u4'),
+                              ('Dep_Norm_NrOfSamples',      '>u4'),
+                              ('Dep_StartTime',             '>u4'),
+                              ('Dep_StopTime',              '>u4'),
+                              ('RTC_LastTimeSync',          '>u4'),
+                              ('RTC_DriftSec',              '>i4'),
+                              ('RTC_DriftInterval',         '>u4'),
+                              ('RTC_Calibration',           'i1'),
+                              ('Sns_SensorsPresent',        'u1'),
+                              ('Sns_ModelIMU',              'u1'),
+                              ('Unused',                    'u1'),
+                              ('Batt_ReplaceTime',          '>u4'),
+                              ('Batt_TotalSampleCnt',       '>u4'),
+                              ('Batt_VoltCal',              '>f4', (3,)),
+                              ('PTi_CalUnits',              'u1', (8,)),
+                              ('PTi_Cal',                   '>f4', (3,)),
+                              ('PTx_CalUnits',              'u1', (4,)),
+                              ('PTx_Cal',                   '>f4', (2,)),
+                              ('Checksum',                  '>u4')])
+
+# single-shot part at the start of the normal and intensive samples, 8 bytes after the sample type
+Dtype_Sample_Single = np.dtype([('StartTime',       '>u4'),       # Sample start time (sec since 1970)
+                                ('BatteryVoltage',  '>f4')])      # Battery Voltage [V]
+
+Size_Type = 4
+Size_Checksum = 4
+
+# headers of the sample types, the lower 4 bits of the normal and intensive types are the sensors present
+SampleHeaders = [MPESS_Struct.SAMPLE_TYPE_INFO.to_bytes(4, 'big'),
+                 MPESS_Struct.SAMPLE_TYPE_NORMAL.to_bytes(4, 'big')[:3],
+                 MPESS_Struct.SAMPLE_TYPE_INTENSIVE.to_bytes(4, 'big')[:3]]
+
+# netCDF variables (type, dimensions), a variable is created when the first sample with it is decoded
+NetCDF_Variables = {'burst':        (np.int32,      ('TIME',)),
+                    'battery':      (np.float32,    ('TIME',)),
+                    'millisec':     (np.int32,      ('TIME',)),
+                    'accel':        (np.float32,    ('TIME', 'vector')),
+                    'gyro':         (np.float32,    ('TIME', 'vector')),
+                    'mag':          (np.float32,    ('TIME', 'vector')),
+                    'orientation':  (np.float32,    ('TIME', 'matrix')),
+                    'load':         (np.float32,    ('TIME',)),
+                    'pressure':     (np.double,     ('TIME',))}
+NetCDF_BlockRows = 360000       # rows decoded before writing to the netCDF file
+NetCDF_ChunkRows = 36000        # rows in a netCDF chunk (1 hour at 10 sps)
+
+DaysSince1950 = 7305            # 1970-01-01 in days since 1950-01-01
+
+
+# ------------------------------------------------------------------------------
+def Dtype_Sample_Record(SensorsPresent, Intensive):
+    # recursive part of the sample, the fields depend on the sensors present
+    fields = []
+    if Intensive:
+        fields.append(('SamplesToFollow', '>u4'))
+    if SensorsPresent & MPESS_Struct.SNS_MASK_LT:                   # Line Tension
+        fields.append(('LineTension', '>f4'))
+    if SensorsPresent & MPESS_Struct.SNS_MASK_IMU:                  # IMU (TimeStampMs+Accelerometer+Gyro+Magnetometer+OrientationMatrix)
+        fields.extend([('IMU_TimeStampMs', '>u4'),
+                       ('IMU_Acc', '>f4', (3,)),
+                       ('IMU_Gyro', '>f4', (3,)),
+                       ('IMU_Magn', '>f4', (3,)),
+                       ('IMU_OM', '>f4', (9,))])
+    if Intensive and SensorsPresent & MPESS_Struct.SNS_MASK_PT:     # Pressure (normal samples have a single pressure at the end)
+        fields.append(('Pressure', '>f4'))
+
+    return np.dtype(fields)
+
+
+# ------------------------------------------------------------------------------
+def ExtractAllSamples(deployment_file, file_Info, writer_CSV, dataset):
     time_start = datetime.datetime.now()
     NrOfErrors = 0
-    df = pd.DataFrame()
 
     # create CSV header
     if Flag_CreateCSV:
         HeaderList = ['Time (UTC)', 'Battery Voltage [V]', 'Pressure [dbarA]', 'LineTension [kg]',
-                      'IMU_TimeStamp [ms]',  
+                      'IMU_TimeStamp [ms]',
                       'IMU_AccX [g]',       'IMU_AccY [g]',     'IMU_AccZ [g]',
-                      'IMU_GyroX [rad/s]',  'IMU_GyroY [rad/s]','IMU_GyroZ [rad/s]', 
-                      'IMU_MagnX [Gauss]',  'IMU_MagnY [Gauss]','IMU_MagnZ [Gauss]', 
-                      'IMU_OM_M11',         'IMU_OM_M12',       'IMU_OM_M13', 
-                      'IMU_OM_M21',         'IMU_OM_M22',       'IMU_OM_M23', 
+                      'IMU_GyroX [rad/s]',  'IMU_GyroY [rad/s]','IMU_GyroZ [rad/s]',
+                      'IMU_MagnX [Gauss]',  'IMU_MagnY [Gauss]','IMU_MagnZ [Gauss]',
+                      'IMU_OM_M11',         'IMU_OM_M12',       'IMU_OM_M13',
+                      'IMU_OM_M21',         'IMU_OM_M22',       'IMU_OM_M23',
                       'IMU_OM_M31',         'IMU_OM_M32',       'IMU_OM_M33'  ]
         writer_CSV.writerow(HeaderList)
 
     # extract data
     SmpNr = 0
-    Flag_AllDone = False
-    while not Flag_AllDone:
-
-        # read sensor type
-        (SampleType, Flag_AllDone, BytesDeleted) = ScanForNextSampleType(deployment_file)
-        if BytesDeleted:
-            DebugString = 'Currupted Data Deleted (%u Bytes)' % BytesDeleted
-            file_Info.write(DebugString + '\r\n')
-            print(DebugString)
-
-        # process sample
-        if not Flag_AllDone:
+    BurstNr = 0
+    Blocks = []
+    BlockRows = 0
+    if os.fstat(deployment_file.fileno()).st_size == 0:
+        return 0
+
+    with mmap.mmap(deployment_file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        pos = 0
+        while pos is not None:
+
+            # find the next sample
+            (SampleType, SamplePos) = ScanForNextSampleType(mm, pos)
+            BytesDeleted = (len(mm) if SamplePos is None else SamplePos) - pos
+            if BytesDeleted:
+                DebugString = 'Currupted Data Deleted (%u Bytes)' % BytesDeleted
+                file_Info.write(DebugString + '\r\n')
+                print(DebugString)
+            if SamplePos is None:
+                break
 
             SmpNr += 1
-            #            if SmpNr==5:  Flag_AllDone=True
+            Block = None
 
             # -------------------------
             # Noraml Sample
             if (SampleType & 0xFFFFFFF0) == MPESS_Struct.SAMPLE_TYPE_NORMAL:
                 DebugString = 'Smp %u - Normal Sample ' % SmpNr
-                (FlagOk, InfoString, df_n) = ProcessSample_Normal(deployment_file, writer_CSV)
+                (FlagOk, InfoString, pos, Block) = ProcessSample_Normal(mm, SamplePos, SampleType & 0x0F)
                 if FlagOk == True:
                     DebugString += 'Ok'
-                    df = df.append(df_n)
                 else:
                     NrOfErrors += 1
                     DebugString += InfoString
-                file_Info.write(DebugString + '\r\n')
-                print(DebugString)
 
             # -------------------------
             # Intensive Sample
             elif (SampleType & 0xFFFFFFF0) == MPESS_Struct.SAMPLE_TYPE_INTENSIVE:
                 DebugString = 'Smp %u - Intensive Sample ' % SmpNr
-                (FlagOk, InfoString, df_i) = ProcessSample_Intensive(deployment_file, writer_CSV)
+                (FlagOk, InfoString, pos, Block) = ProcessSample_Intensive(mm, SamplePos, SampleType & 0x0F)
                 if FlagOk == True:
                     DebugString += 'Ok'
-                    df = df.append(df_i)
                 else:
                     NrOfErrors += 1
                     DebugString += InfoString
-                file_Info.write(DebugString + '\r\n')
-                print(DebugString)
 
             # -------------------------
             # Info
-            elif SampleType == MPESS_Struct.SAMPLE_TYPE_INFO:
+            else:
                 DebugString = 'Smp %u - Info Sample ' % SmpNr
-                (FlagOk, InfoString) = ProcessSample_Info(deployment_file)
+                (FlagOk, InfoString, pos) = ProcessSample_Info(mm, SamplePos)
                 if (FlagOk):
                     DebugString += 'Ok \r\n'
                     DebugString += InfoString
                 if FlagOk == False:
                     NrOfErrors += 1
                     DebugString += InfoString
-                file_Info.write(DebugString + '\r\n')
-                print(DebugString)
 
-            # -------------------------
-            # unknown sample type
-            else:
-                DebugString = 'Smp %u - Unknown Sample Type (0x%08X)\r\n' % (SmpNr, SampleType)
-                file_Info.write(DebugString + '\r\n')
-                print(DebugString)
-                Flag_AllDone = True
+            file_Info.write(DebugString + '\r\n')
+            print(DebugString)
+
+            # save the decoded data
+            if Block is not None:
+                Block['burst'] = np.full(len(Block['TIME']), BurstNr, dtype=np.int32)
+                BurstNr += 1
+                if Flag_CreateCSV:
+                    WriteCSV(writer_CSV, Block)
+                if Flag_CreateNetCDF:
+                    Blocks.append(Block)
+                    BlockRows += len(Block['TIME'])
+                    if BlockRows >= NetCDF_BlockRows:
+                        WriteNetCDF(dataset, Blocks)
+                        Blocks = []
+                        BlockRows = 0
+
+    if Flag_CreateNetCDF:
+        WriteNetCDF(dataset, Blocks)
 
     # extraction info
     DebugString = '\r\nProcess time = %s\r\n' % (datetime.datetime.now() - time_start)
@@ -184,509 +277,251 @@ def ExtractAllSamples(deployment_file, file_Info, writer_CSV):
         DebugString += 'No errors detected\r\n'
     print(DebugString)
     file_Info.write(DebugString + '\r\n')
-    return df
+    return SmpNr
 
 
 # ------------------------------------------------------------------------------
-def ScanForNextSampleType(deployment_file):
-    BytesDeleted = 0
-    while True:
-
-        # read the next 4 bytes
-        TypeBuffer = deployment_file.read(4)
-        if len(TypeBuffer) == 0:
-            return (0, True, BytesDeleted)
-        elif len(TypeBuffer) < 4:
-            BytesDeleted += len(TypeBuffer)
-            return (0, False, BytesDeleted)
-
-        # conver buffer to SampleType
-        SampleType = struct.unpack('>L', TypeBuffer[:4])[0]
-        #        print('%08X' %SampleType)
-        if ((SampleType & 0xFFFFFFF0) == MPESS_Struct.SAMPLE_TYPE_NORMAL) or \
-                ((SampleType & 0xFFFFFFF0) == MPESS_Struct.SAMPLE_TYPE_INTENSIVE) or \
-                (SampleType == MPESS_Struct.SAMPLE_TYPE_INFO):
-            deployment_file.seek(-4, 1)  # move file pointer 4 characters back from the current position
-            return (SampleType, False, BytesDeleted)
+def IsSampleType(SampleType):
+    return ((SampleType & 0xFFFFFFF0) == MPESS_Struct.SAMPLE_TYPE_NORMAL) or \
+           ((SampleType & 0xFFFFFFF0) == MPESS_Struct.SAMPLE_TYPE_INTENSIVE) or \
+           (SampleType == MPESS_Struct.SAMPLE_TYPE_INFO)
 
-        else:
-            deployment_file.seek(-3, 1)  # move file pointer 3 characters back from the current position
-            BytesDeleted += 1
 
+# ------------------------------------------------------------------------------
+def ScanForNextSampleType(mm, pos):
+    # returns the sample type and position of the next sample at or after pos, or (0, None) at the end of the file
+
+    # the next sample usually follows the last one
+    if pos + Size_Type <= len(mm):
+        SampleType = int.from_bytes(mm[pos:pos + Size_Type], 'big')
+        if IsSampleType(SampleType):
+            return (SampleType, pos)
+
+    # otherwise search for the first header of any type
+    SamplePos = None
+    for header in SampleHeaders:
+        found = mm.find(header, pos)
+        # the normal and intensive headers are only 3 bytes, the last byte has the sensors present
+        while found >= 0 and (found + Size_Type > len(mm) or not IsSampleType(int.from_bytes(mm[found:found + Size_Type], 'big'))):
+            found = mm.find(header, found + 1)
+        if found >= 0 and (SamplePos is None or found < SamplePos):
+            SamplePos = found
+
+    if SamplePos is None:
+        return (0, None)
+
+    return (int.from_bytes(mm[SamplePos:SamplePos + Size_Type], 'big'), SamplePos)
 
-#            if BytesDeleted==20:
-#                while True:
-#                    continue
 
 # ------------------------------------------------------------------------------
-def ProcessSample_Intensive(deployment_file, writer_CSV):
-    data_lists = []
-    InfoString = ''
+def SampleBlock(Single, Records, Times):
+    # arrays of each netCDF variable for the rows of a sample, the battery voltage is on the first row
+    Block = {'TIME': Times}
+
+    Block['battery'] = np.full(len(Times), np.nan, dtype=np.float32)
+    if len(Times):
+        Block['battery'][0] = Single['BatteryVoltage']
+
+    n = len(Records)
+    if 'LineTension' in Records.dtype.names:
+        Block['load'] = np.full(len(Times), np.nan, dtype=np.float32)
+        Block['load'][:n] = Records['LineTension']
+    if 'IMU_TimeStampMs' in Records.dtype.names:
+        Block['millisec'] = np.ma.masked_all(len(Times), dtype=np.int32)
+        Block['millisec'][:n] = Records['IMU_TimeStampMs']
+        for name, field, width in (('accel', 'IMU_Acc', 3), ('gyro', 'IMU_Gyro', 3), ('mag', 'IMU_Magn', 3), ('orientation', 'IMU_OM', 9)):
+            Block[name] = np.full((len(Times), width), np.nan, dtype=np.float32)
+            Block[name][:n] = Records[field]
+    if 'Pressure' in Records.dtype.names:
+        Block['pressure'] = Records['Pressure'].astype(np.double)
+
+    return Block
 
-    # ------------------------------
-    # type
-    TypeStr = deployment_file.read(4)
-    CalcChecksum = zlib.crc32(TypeStr, 0x00000000) & 0xFFFFFFFF
+
+# ------------------------------------------------------------------------------
+def ProcessSample_Intensive(mm, pos, SensorsPresent):
+    InfoString = ''
 
     # ------------------------------
     # read single-shot part of sample
-    SensorsPresent = (TypeStr[3])
-    sample_size = ctypes.sizeof(MPESS_Struct.Struct_Sample_Single)
-
-    i = 0
-    if Flag_CreateNetCDF:
-        dataset = Dataset('MPESS.nc', 'w', format='NETCDF4_CLASSIC')
-        dataset.filename = bin_path_filename
-
-        # create dimensions
-        time = dataset.createDimension('TIME', None)
-        v = dataset.createDimension('vector', 3)
-        mat = dataset.createDimension('matrix', 3 * 3)
-
-        # create variables
-        times = dataset.createVariable('TIME', np.float64, ('TIME',))
-
-        times.units = 'days since 1950-01-01 00:00:00'
-        times.calendar = 'gregorian'
-
-        timems = dataset.createVariable('millisec', np.int32, ('TIME',))
-        burst = dataset.createVariable('burst', np.int16, ('TIME',))
-
-        accel = dataset.createVariable('accel', np.float32, ('TIME', 'vector',))
-        mag = dataset.createVariable('mag', np.float32, ('TIME', 'vector',))
-        gyro = dataset.createVariable('gyro', np.float32, ('TIME', 'vector',))
-
-        orient = dataset.createVariable('orientation', np.float32, ('TIME', 'matrix',))
-
-        if SensorsPresent & MPESS_Struct.SNS_MASK_LT:
-            load = dataset.createVariable('load', np.float32, ('TIME',))
-        if SensorsPresent & MPESS_Struct.SNS_MASK_PT:
-            pres = dataset.createVariable('pressure', np.double, ('TIME',))
-
-    class SampleUnion(ctypes.Union):  # must fill blocks of 4 bytes
-        _fields_ = [("Data", MPESS_Struct.Struct_Sample_Single),
-                    ("Buffer", ctypes.c_uint8 * sample_size)]
-
-    UN = SampleUnion()
-    sample_buffer = deployment_file.read(sample_size)
-    if len(sample_buffer) != sample_size:  # incorrect file size
-        InfoString += 'Missing Sample Data (%u bytes)' % (sample_size - len(sample_buffer))
-        return (False, InfoString, pd.DataFrame())
-    CalcChecksum = zlib.crc32(sample_buffer, CalcChecksum) & 0xFFFFFFFF
-    for sample_byte_index in range(sample_size):
-        UN.Buffer[sample_byte_index] = (sample_buffer[sample_byte_index])
-    DateTimeUtc = datetime.datetime.fromtimestamp(UN.Data.StartTime)
-                                                  #tz=pytz.UTC)  # convert utc seconds to utc date and time
-    data = {}
-    #data['Time'] = DateTimeUtc.astimezone(TimezoneLocal)
-    data['Time'] = DateTimeUtc
-    data['BatteryVoltage'] = UN.Data.BatteryVoltage
-    if SensorsPresent & MPESS_Struct.SNS_MASK_IMU:
-        data['IMU_TimeStampMs'] = np.NaN
-        data['IMU_AccX']        = np.NaN
-        data['IMU_AccY']        = np.NaN
-        data['IMU_AccZ']        = np.NaN
-        data['IMU_GyroX']       = np.NaN
-        data['IMU_GyroY']       = np.NaN
-        data['IMU_GyroZ']       = np.NaN
-        data['IMU_MagnX']       = np.NaN
-        data['IMU_MagnY']       = np.NaN
-        data['IMU_MagnZ']       = np.NaN
-        data['IMU_OM_M11']      = np.NaN
-        data['IMU_OM_M12']      = np.NaN
-        data['IMU_OM_M13']      = np.NaN
-        data['IMU_OM_M21']      = np.NaN
-        data['IMU_OM_M22']      = np.NaN
-        data['IMU_OM_M23']      = np.NaN
-        data['IMU_OM_M31']      = np.NaN
-        data['IMU_OM_M32']      = np.NaN
-        data['IMU_OM_M33']      = np.NaN
-    if SensorsPresent & MPESS_Struct.SNS_MASK_LT:
-        data['LineTension'] = np.NaN
-    if SensorsPresent & MPESS_Struct.SNS_MASK_PT:
-        data['Pressure'] = np.NaN
-    data_lists.append(data)  # append
-    if Flag_CreateCSV:
-        writer_CSV.writerow(
-            (DateTimeUtc.strftime('%Y/%m/%d %H:%M:%S'), '%.1f' % data['BatteryVoltage'], '', '', '', '', '', ''))
+    single_pos = pos + Size_Type
+    if single_pos + Dtype_Sample_Single.itemsize > len(mm):  # incorrect file size
+        InfoString += 'Missing Sample Data (%u bytes)' % (single_pos + Dtype_Sample_Single.itemsize - len(mm))
+        return (False, InfoString, None, None)
+    Single = np.frombuffer(mm, dtype=Dtype_Sample_Single, count=1, offset=single_pos)[0].copy()
 
     # ------------------------------
-    # read recursive part of sample
-    sample_size = 4                                                                 # SamplesToFollow
-    if SensorsPresent & MPESS_Struct.SNS_MASK_LT:   sample_size += 4                # Line Tension
-    if SensorsPresent & MPESS_Struct.SNS_MASK_IMU:  sample_size += 4*(1+3+3+3+9)    # IMU (TimeStampMs+Accelerometer+Gyro+Magnetometer+OrientationMatrix)
-    if SensorsPresent & MPESS_Struct.SNS_MASK_PT:   sample_size += 4                # Pressure
-    TimeDelta = datetime.timedelta(seconds=1 / MPESS_Struct.sample_frequency)
-    while True:
-
-        # read from file
-        sample_buffer = deployment_file.read(sample_size)
-        if len(sample_buffer) != sample_size:  # incorrect file size
-            InfoString += 'Missing Sample Data (%u bytes)' % (sample_size - len(sample_buffer))
-            return (False, InfoString, pd.DataFrame())
-        CalcChecksum = zlib.crc32(sample_buffer, CalcChecksum) & 0xFFFFFFFF
-
-        # create dict from data
-        data = {}
-        #data['Time'] = DateTimeUtc.astimezone(TimezoneLocal)
-        data['Time'] = DateTimeUtc
-        data['BatteryVoltage'] = np.NaN
-        SamplesToFollow = struct.unpack('>L', sample_buffer[0:4])[0]  # read data into union
-        sample_buffer = sample_buffer[4:]
-        if SensorsPresent & MPESS_Struct.SNS_MASK_LT:  # Line Tension
-            data['LineTension'] = struct.unpack('>f', sample_buffer[0:4])[0]
-            sample_buffer = sample_buffer[4:]
-        if SensorsPresent & MPESS_Struct.SNS_MASK_IMU:  # IMU
-            data['IMU_TimeStampMs'] = struct.unpack('>L', sample_buffer[ 0: 4])[0]
-            data['IMU_AccX']        = struct.unpack('>f', sample_buffer[ 4: 8])[0]
-            data['IMU_AccY']        = struct.unpack('>f', sample_buffer[ 8:12])[0]
-            data['IMU_AccZ']        = struct.unpack('>f', sample_buffer[12:16])[0]
-            data['IMU_GyroX']       = struct.unpack('>f', sample_buffer[16:20])[0]
-            data['IMU_GyroY']       = struct.unpack('>f', sample_buffer[20:24])[0]
-            data['IMU_GyroZ']       = struct.unpack('>f', sample_buffer[24:28])[0]
-            data['IMU_MagnX']       = struct.unpack('>f', sample_buffer[28:32])[0]
-            data['IMU_MagnY']       = struct.unpack('>f', sample_buffer[32:36])[0]
-            data['IMU_MagnZ']       = struct.unpack('>f', sample_buffer[36:40])[0]
-            data['IMU_OM_M11']      = struct.unpack('>f', sample_buffer[40:44])[0]
-            data['IMU_OM_M12']      = struct.unpack('>f', sample_buffer[44:48])[0]
-            data['IMU_OM_M13']      = struct.unpack('>f', sample_buffer[48:52])[0]
-            data['IMU_OM_M21']      = struct.unpack('>f', sample_buffer[52:56])[0]
-            data['IMU_OM_M22']      = struct.unpack('>f', sample_buffer[56:60])[0]
-            data['IMU_OM_M23']      = struct.unpack('>f', sample_buffer[60:64])[0]
-            data['IMU_OM_M31']      = struct.unpack('>f', sample_buffer[64:68])[0]
-            data['IMU_OM_M32']      = struct.unpack('>f', sample_buffer[68:72])[0]
-            data['IMU_OM_M33']      = struct.unpack('>f', sample_buffer[72:76])[0]
-            sample_buffer = sample_buffer[76:]
-        if SensorsPresent & MPESS_Struct.SNS_MASK_PT:  # Pressure
-            data['Pressure'] = struct.unpack('>f', sample_buffer[0:4])[0]
-            sample_buffer = sample_buffer[4:]
-        data_lists.append(data)  # append
-
-        # append to CSV
-        if Flag_CreateCSV:
-            if SensorsPresent & MPESS_Struct.SNS_MASK_LT:
-                StLT = '%.3f' % data['LineTension']
-            else:
-                StLT = ''
-            if SensorsPresent & MPESS_Struct.SNS_MASK_IMU:
-                St_IMU_TimeStampMs  = '%.4f' % data['IMU_TimeStampMs']
-                St_IMU_AccX         = '%.4f' % data['IMU_AccX']
-                St_IMU_AccY         = '%.4f' % data['IMU_AccY']
-                St_IMU_AccZ         = '%.4f' % data['IMU_AccZ']
-                St_IMU_GyroX        = '%.4f' % data['IMU_GyroX']
-                St_IMU_GyroY        = '%.4f' % data['IMU_GyroY']
-                St_IMU_GyroZ        = '%.4f' % data['IMU_GyroZ']
-                St_IMU_MagnX        = '%.4f' % data['IMU_MagnX']
-                St_IMU_MagnY        = '%.4f' % data['IMU_MagnY']
-                St_IMU_MagnZ        = '%.4f' % data['IMU_MagnZ']
-                St_IMU_OM_M11       = '%.4f' % data['IMU_OM_M11']
-                St_IMU_OM_M12       = '%.4f' % data['IMU_OM_M12']
-                St_IMU_OM_M13       = '%.4f' % data['IMU_OM_M13']
-                St_IMU_OM_M21       = '%.4f' % data['IMU_OM_M21']
-                St_IMU_OM_M22       = '%.4f' % data['IMU_OM_M22']
-                St_IMU_OM_M23       = '%.4f' % data['IMU_OM_M23']
-                St_IMU_OM_M31       = '%.4f' % data['IMU_OM_M31']
-                St_IMU_OM_M32       = '%.4f' % data['IMU_OM_M32']
-                St_IMU_OM_M33       = '%.4f' % data['IMU_OM_M33']
-            else:
-                St_IMU_TimeStampMs  = ''
-                St_IMU_AccX         = ''
-                St_IMU_AccY         = ''
-                St_IMU_AccZ         = ''
-                St_IMU_GyroX        = ''
-                St_IMU_GyroY        = ''
-                St_IMU_GyroZ        = ''
-                St_IMU_MagnX        = ''
-                St_IMU_MagnY        = ''
-                St_IMU_MagnZ        = ''
-                St_IMU_OM_M11       = ''
-                St_IMU_OM_M12       = ''
-                St_IMU_OM_M13       = ''
-                St_IMU_OM_M21       = ''
-                St_IMU_OM_M22       = ''
-                St_IMU_OM_M23       = ''
-                St_IMU_OM_M31       = ''
-                St_IMU_OM_M32       = ''
-                St_IMU_OM_M33       = ''
-            if SensorsPresent & MPESS_Struct.SNS_MASK_PT:
-                StPt = '%.3f' % data['Pressure']
-            else:
-                StPt = ''
-            RowCSV = [  DateTimeUtc.strftime('%Y/%m/%d %H:%M:%S.%f')[:-5], 
-                        '', StPt, StLT,
-                        St_IMU_TimeStampMs, 
-                        St_IMU_AccX,    St_IMU_AccY,    St_IMU_AccZ, 
-                        St_IMU_GyroX,   St_IMU_GyroY,   St_IMU_GyroZ, 
-                        St_IMU_MagnX,   St_IMU_MagnY,   St_IMU_MagnZ, 
-                        St_IMU_OM_M11,  St_IMU_OM_M12,  St_IMU_OM_M13, 
-                        St_IMU_OM_M21,  St_IMU_OM_M22,  St_IMU_OM_M23, 
-                        St_IMU_OM_M31,  St_IMU_OM_M32,  St_IMU_OM_M33  ]
-            writer_CSV.writerow(RowCSV)
-
-        if Flag_CreateNetCDF:
-            times[i] = date2num(DateTimeUtc, units=times.units, calendar=times.calendar)
-            accel[i, 0] = data['IMU_AccX']
-            accel[i, 1] = data['IMU_AccY']
-            accel[i, 2] = data['IMU_AccZ']
-
-            gyro[i, 0] = data['IMU_GyroX']
-            gyro[i, 1] = data['IMU_GyroY']
-            gyro[i, 2] = data['IMU_GyroZ']
-
-            mag[i, 0] = data['IMU_MagnX']
-            mag[i, 1] = data['IMU_MagnY']
-            mag[i, 2] = data['IMU_MagnZ']
-
-            orient[i, 0] = data['IMU_OM_M11']
-            orient[i, 1] = data['IMU_OM_M12']
-            orient[i, 2] = data['IMU_OM_M13']
-            orient[i, 3] = data['IMU_OM_M21']
-            orient[i, 4] = data['IMU_OM_M22']
-            orient[i, 5] = data['IMU_OM_M23']
-            orient[i, 6] = data['IMU_OM_M31']
-            orient[i, 7] = data['IMU_OM_M32']
-            orient[i, 8] = data['IMU_OM_M33']
-
-            timems[i] = data['IMU_TimeStampMs']
-            burst[i] = 0
-
-            if SensorsPresent & MPESS_Struct.SNS_MASK_LT:
-                load[i] = data['LineTension']
-            if SensorsPresent & MPESS_Struct.SNS_MASK_PT:  # Pressure
-                pres[i] = data['Pressure']
-
-            i = i + 1
-
-        # all done
-        if SamplesToFollow == 0:
-            break
-
-        # increse timestamp
-        DateTimeUtc += TimeDelta
-
-    if Flag_CreateNetCDF:
-        dataset.close()
+    # read recursive part of sample, until SamplesToFollow is zero
+    Dtype_Record = Dtype_Sample_Record(SensorsPresent, True)
+    rec_pos = single_pos + Dtype_Sample_Single.itemsize
+    n_avail = (len(mm) - rec_pos) // Dtype_Record.itemsize
+    if n_avail == 0:
+        InfoString += 'Missing Sample Data (%u bytes)' % (rec_pos + Dtype_Record.itemsize - len(mm))
+        return (False, InfoString, None, None)
+    Records = np.frombuffer(mm, dtype=Dtype_Record, count=n_avail, offset=rec_pos)
+    SamplesToFollow = Records['SamplesToFollow']
+
+    # the first record counts the records to follow, only search the rest of the file if that is wrong
+    n_first = int(SamplesToFollow[0]) + 1
+    End = np.flatnonzero(SamplesToFollow[:min(n_first, n_avail)] == 0)
+    if len(End) == 0:
+        End = np.flatnonzero(SamplesToFollow == 0)
+    if len(End) == 0:  # incorrect file size
+        InfoString += 'Missing Sample Data (%u bytes)' % (rec_pos + (n_avail + 1) * Dtype_Record.itemsize - len(mm))
+        return (False, InfoString, None, None)
+    n = End[0] + 1
+    Records = Records[:n].copy()
 
     # ------------------------------
     # check checksum
-    sample_buffer = deployment_file.read(4)
-    if len(sample_buffer) != 4:  # incorrect file size
-        InfoString += 'Missing Sample Data (%u bytes)' % (4 - len(sample_buffer))
-        return (False, InfoString, pd.DataFrame())
-    SmpChecksum = struct.unpack('>L', sample_buffer)[0]
+    crc_pos = rec_pos + n * Dtype_Record.itemsize
+    if crc_pos + Size_Checksum > len(mm):  # incorrect file size
+        InfoString += 'Missing Sample Data (%u bytes)' % (crc_pos + Size_Checksum - len(mm))
+        return (False, InfoString, None, None)
+    SmpChecksum = int.from_bytes(mm[crc_pos:crc_pos + Size_Checksum], 'big')
+    CalcChecksum = zlib.crc32(memoryview(mm)[pos:crc_pos]) & 0xFFFFFFFF
     if (SmpChecksum != CalcChecksum):
         InfoString += 'Checksum Error'
-        return (False, InfoString, pd.DataFrame())
+        return (False, InfoString, crc_pos + Size_Checksum, None)
+
+    # sample times, at the sample frequency from the start time
+    Times = Single['StartTime'] + np.arange(n) / MPESS_Struct.sample_frequency
 
-    # convert list to data frame
-    return (True, InfoString, pd.DataFrame(data_lists).set_index('Time'))
+    return (True, InfoString, crc_pos + Size_Checksum, SampleBlock(Single, Records, Times))
 
 
 # ------------------------------------------------------------------------------
-def ProcessSample_Normal(deployment_file, writer_CSV):
-    global NrOfSamplesPerStop
-    data_lists = []
+def ProcessSample_Normal(mm, pos, SensorsPresent):
     InfoString = ''
 
     # ------------------------------
-    # check checksum
-    sample_buffer = deployment_file.read(4)
-    SensorsPresent = ord(sample_buffer[3])
-    #    SensorsPresent = MPESS_Struct.SNS_MASK_IMU | MPESS_Struct.SNS_MASK_PT
-    sample_size_single = ctypes.sizeof(MPESS_Struct.Struct_Sample_Single)
-    sample_size_rec = 0
-    if SensorsPresent & MPESS_Struct.SNS_MASK_LT:   sample_size_rec += 4            # Line Tension
-    if SensorsPresent & MPESS_Struct.SNS_MASK_IMU:  sample_size_rec += 4*(1+3+3+3+9)    # IMU (TimeStampMs+Accelerometer+Gyro+Magnetometer+OrientationMatrix)
+    # the sample size is fixed by the number of samples per stop from the info sample
+    Dtype_Record = Dtype_Sample_Record(SensorsPresent, False)
     sample_size_single2 = 0
     if SensorsPresent & MPESS_Struct.SNS_MASK_PT:   sample_size_single2 += 4
-    sample_size = 4 + sample_size_single + NrOfSamplesPerStop * sample_size_rec + sample_size_single2 + 4
-    sample_buffer += deployment_file.read(sample_size - 4)
-    if len(sample_buffer) != sample_size:  # incorrect file size
-        InfoString += 'Missing Data (%u bytes missing)' % (sample_size - len(sample_buffer))
-        deployment_file.seek(-(len(sample_buffer) - 1),1)  # move file pointer backwards up to just after sample type bytes
-        return (False, InfoString, pd.DataFrame())
-    SmpChecksum = struct.unpack('>L', sample_buffer[-4:])[0]
-    CalcChecksum = zlib.crc32(sample_buffer[:-4], 0x00000000) & 0xFFFFFFFF
+    sample_size = Size_Type + Dtype_Sample_Single.itemsize + NrOfSamplesPerStop * Dtype_Record.itemsize + sample_size_single2 + Size_Checksum
+    if pos + sample_size > len(mm):  # incorrect file size
+        InfoString += 'Missing Data (%u bytes missing)' % (pos + sample_size - len(mm))
+        return (False, InfoString, pos + 1, None)  # move up to just after sample type first byte
+
+    # ------------------------------
+    # check checksum
+    crc_pos = pos + sample_size - Size_Checksum
+    SmpChecksum = int.from_bytes(mm[crc_pos:crc_pos + Size_Checksum], 'big')
+    CalcChecksum = zlib.crc32(memoryview(mm)[pos:crc_pos]) & 0xFFFFFFFF
     if (SmpChecksum != CalcChecksum):
         InfoString += 'Checksum Error'
-        deployment_file.seek(-(sample_size - 4), 1)  # move file pointer backwards up to just after sample type bytes
-        return (False, InfoString, pd.DataFrame())
+        return (False, InfoString, pos + Size_Type, None)  # move up to just after sample type bytes
 
     # ------------------------------
-    # process first single-shot part of sample
-    class SampleUnion(ctypes.Union):  # must fill blocks of 4 bytes
-        _fields_ = [("Data", MPESS_Struct.Struct_Sample_Single),
-                    ("Buffer", ctypes.c_uint8 * sample_size)]
-
-    UN = SampleUnion()
-    for sample_byte_index in range(sample_size_single):
-        UN.Buffer[sample_byte_index] = ord(sample_buffer[4 + sample_byte_index])
-    sample_buffer = sample_buffer[4 + sample_size_single:]
-    DateTimeUtc = datetime.datetime.fromtimestamp(UN.Data.StartTime, tz=pytz.UTC)  # convert utc seconds to utc date and time
-    data = {}
-    #data['Time'] = DateTimeUtc.astimezone(TimezoneLocal)
-    data['Time'] = DateTimeUtc
-    data['BatteryVoltage'] = UN.Data.BatteryVoltage
-    if SensorsPresent & MPESS_Struct.SNS_MASK_IMU:
-        data['IMU_TimeStampMs'] = np.NaN
-        data['IMU_AccX']        = np.NaN
-        data['IMU_AccY']        = np.NaN
-        data['IMU_AccZ']        = np.NaN
-        data['IMU_GyroX']       = np.NaN
-        data['IMU_GyroY']       = np.NaN
-        data['IMU_GyroZ']       = np.NaN
-        data['IMU_MagnX']       = np.NaN
-        data['IMU_MagnY']       = np.NaN
-        data['IMU_MagnZ']       = np.NaN
-        data['IMU_OM_M11']      = np.NaN
-        data['IMU_OM_M12']      = np.NaN
-        data['IMU_OM_M13']      = np.NaN
-        data['IMU_OM_M21']      = np.NaN
-        data['IMU_OM_M22']      = np.NaN
-        data['IMU_OM_M23']      = np.NaN
-        data['IMU_OM_M31']      = np.NaN
-        data['IMU_OM_M32']      = np.NaN
-        data['IMU_OM_M33']      = np.NaN
-    if SensorsPresent & MPESS_Struct.SNS_MASK_LT:
-        data['LineTension'] = np.NaN
+    # single-shot part and recursive part of sample
+    single_pos = pos + Size_Type
+    Single = np.frombuffer(mm, dtype=Dtype_Sample_Single, count=1, offset=single_pos)[0].copy()
+    rec_pos = single_pos + Dtype_Sample_Single.itemsize
+    Records = np.frombuffer(mm, dtype=Dtype_Record, count=NrOfSamplesPerStop, offset=rec_pos).copy()
+
+    # sample times, at the sample frequency from the start time, the single pressure is read after the last sample
+    n = NrOfSamplesPerStop
     if SensorsPresent & MPESS_Struct.SNS_MASK_PT:
-        data['Pressure'] = np.NaN
-    data_lists.append(data)  # append
-    if Flag_CreateCSV:
-        writer_CSV.writerow(
-            (DateTimeUtc.strftime('%Y/%m/%d %H:%M:%S'), '%.1f' % data['BatteryVoltage'], '', '', '', '', '', ''))
+        Times = Single['StartTime'] + np.arange(n + 1) / MPESS_Struct.sample_frequency
+    else:
+        Times = Single['StartTime'] + np.arange(n) / MPESS_Struct.sample_frequency
 
-    # ------------------------------
-    # read recursive part of sample
-    TimeDelta = datetime.timedelta(seconds=1 / MPESS_Struct.sample_frequency)
-    for i in range(NrOfSamplesPerStop):
-
-        # create dict from data
-        data = {}
-        #data['Time'] = DateTimeUtc.astimezone(TimezoneLocal)
-        data['Time'] = DateTimeUtc
-        data['BatteryVoltage'] = np.NaN
-        if SensorsPresent & MPESS_Struct.SNS_MASK_LT:  # Line Tension
-            data['LineTension'] = struct.unpack('>f', sample_buffer[0:4])[0]
-            sample_buffer = sample_buffer[4:]
-        if SensorsPresent & MPESS_Struct.SNS_MASK_IMU:  # IMU
-            data['IMU_TimeStampMs'] = struct.unpack('>L', sample_buffer[ 0: 4])[0]
-            data['IMU_AccX']        = struct.unpack('>f', sample_buffer[ 4: 8])[0]
-            data['IMU_AccY']        = struct.unpack('>f', sample_buffer[ 8:12])[0]
-            data['IMU_AccZ']        = struct.unpack('>f', sample_buffer[12:16])[0]
-            data['IMU_GyroX']       = struct.unpack('>f', sample_buffer[16:20])[0]
-            data['IMU_GyroY']       = struct.unpack('>f', sample_buffer[20:24])[0]
-            data['IMU_GyroZ']       = struct.unpack('>f', sample_buffer[24:28])[0]
-            data['IMU_MagnX']       = struct.unpack('>f', sample_buffer[28:32])[0]
-            data['IMU_MagnY']       = struct.unpack('>f', sample_buffer[32:36])[0]
-            data['IMU_MagnZ']       = struct.unpack('>f', sample_buffer[36:40])[0]
-            data['IMU_OM_M11']      = struct.unpack('>f', sample_buffer[40:44])[0]
-            data['IMU_OM_M12']      = struct.unpack('>f', sample_buffer[44:48])[0]
-            data['IMU_OM_M13']      = struct.unpack('>f', sample_buffer[48:52])[0]
-            data['IMU_OM_M21']      = struct.unpack('>f', sample_buffer[52:56])[0]
-            data['IMU_OM_M22']      = struct.unpack('>f', sample_buffer[56:60])[0]
-            data['IMU_OM_M23']      = struct.unpack('>f', sample_buffer[60:64])[0]
-            data['IMU_OM_M31']      = struct.unpack('>f', sample_buffer[64:68])[0]
-            data['IMU_OM_M32']      = struct.unpack('>f', sample_buffer[68:72])[0]
-            data['IMU_OM_M33']      = struct.unpack('>f', sample_buffer[72:76])[0]
-            sample_buffer = sample_buffer[76:]
-        if SensorsPresent & MPESS_Struct.SNS_MASK_PT:
-            data['Pressure'] = np.NaN
-        data_lists.append(data)  # append
-
-        # append to CSV
-        if Flag_CreateCSV:
-            if SensorsPresent & MPESS_Struct.SNS_MASK_LT:
-                StLT = '%.3f' % data['LineTension']
-            else:
-                StLT = ''
-            if SensorsPresent & MPESS_Struct.SNS_MASK_IMU:
-                St_IMU_TimeStampMs  = '%.4f' % data['IMU_TimeStampMs']
-                St_IMU_AccX         = '%.4f' % data['IMU_AccX']
-                St_IMU_AccY         = '%.4f' % data['IMU_AccY']
-                St_IMU_AccZ         = '%.4f' % data['IMU_AccZ']
-                St_IMU_GyroX        = '%.4f' % data['IMU_GyroX']
-                St_IMU_GyroY        = '%.4f' % data['IMU_GyroY']
-                St_IMU_GyroZ        = '%.4f' % data['IMU_GyroZ']
-                St_IMU_MagnX        = '%.4f' % data['IMU_MagnX']
-                St_IMU_MagnY        = '%.4f' % data['IMU_MagnY']
-                St_IMU_MagnZ        = '%.4f' % data['IMU_MagnZ']
-                St_IMU_OM_M11       = '%.4f' % data['IMU_OM_M11']
-                St_IMU_OM_M12       = '%.4f' % data['IMU_OM_M12']
-                St_IMU_OM_M13       = '%.4f' % data['IMU_OM_M13']
-                St_IMU_OM_M21       = '%.4f' % data['IMU_OM_M21']
-                St_IMU_OM_M22       = '%.4f' % data['IMU_OM_M22']
-                St_IMU_OM_M23       = '%.4f' % data['IMU_OM_M23']
-                St_IMU_OM_M31       = '%.4f' % data['IMU_OM_M31']
-                St_IMU_OM_M32       = '%.4f' % data['IMU_OM_M32']
-                St_IMU_OM_M33       = '%.4f' % data['IMU_OM_M33']
-            else:
-                St_IMU_TimeStampMs  = ''
-                St_IMU_AccX         = ''
-                St_IMU_AccY         = ''
-                St_IMU_AccZ         = ''
-                St_IMU_GyroX        = ''
-                St_IMU_GyroY        = ''
-                St_IMU_GyroZ        = ''
-                St_IMU_MagnX        = ''
-                St_IMU_MagnY        = ''
-                St_IMU_MagnZ        = ''
-                St_IMU_OM_M11       = ''
-                St_IMU_OM_M12       = ''
-                St_IMU_OM_M13       = ''
-                St_IMU_OM_M21       = ''
-                St_IMU_OM_M22       = ''
-                St_IMU_OM_M23       = ''
-                St_IMU_OM_M31       = ''
-                St_IMU_OM_M32       = ''
-                St_IMU_OM_M33       = ''
-            RowCSV = [  DateTimeUtc.strftime('%Y/%m/%d %H:%M:%S.%f')[:-5], 
-                        '', '', StLT,
-                        St_IMU_TimeStampMs, 
-                        St_IMU_AccX,    St_IMU_AccY,    St_IMU_AccZ, 
-                        St_IMU_GyroX,   St_IMU_GyroY,   St_IMU_GyroZ, 
-                        St_IMU_MagnX,   St_IMU_MagnY,   St_IMU_MagnZ, 
-                        St_IMU_OM_M11,  St_IMU_OM_M12,  St_IMU_OM_M13, 
-                        St_IMU_OM_M21,  St_IMU_OM_M22,  St_IMU_OM_M23, 
-                        St_IMU_OM_M31,  St_IMU_OM_M32,  St_IMU_OM_M33  ]
-            writer_CSV.writerow(RowCSV)
-
-
-        # increse timestamp
-        DateTimeUtc += TimeDelta
+    Block = SampleBlock(Single, Records, Times)
 
     # ------------------------------
     # read single pressure
     if SensorsPresent & MPESS_Struct.SNS_MASK_PT:
-        data = {}
-        #data['Time'] = DateTimeUtc.astimezone(TimezoneLocal)
-        data['Time'] = DateTimeUtc
-        data['BatteryVoltage'] = np.NaN
-        if SensorsPresent & MPESS_Struct.SNS_MASK_IMU:
-            data['IMU_Q0'] = np.NaN
-            data['IMU_Q1'] = np.NaN
-            data['IMU_Q2'] = np.NaN
-            data['IMU_Q3'] = np.NaN
-        if SensorsPresent & MPESS_Struct.SNS_MASK_LT:
-            data['LineTension'] = np.NaN
-        data['Pressure'] = struct.unpack('>f', sample_buffer[:4])[0]
-        data_lists.append(data)  # append
-        if Flag_CreateCSV:
-            if SensorsPresent & MPESS_Struct.SNS_MASK_PT:
-                StPt = '%.3f' % data['Pressure']
-            else:
-                StPt = ''
-            writer_CSV.writerow((DateTimeUtc.strftime('%Y/%m/%d %H:%M:%S.%f')[:-5], '', StPt, '', '', '', '', ''))
-        sample_buffer = sample_buffer[4:]
+        Block['pressure'] = np.full(len(Times), np.nan)
+        Block['pressure'][-1] = np.frombuffer(mm, dtype='>f4', count=1, offset=crc_pos - 4)[0]
 
-    # ------------------------------
-    # convert list to data frame
-    return (True, InfoString, pd.DataFrame(data_lists).set_index('Time'))
+    return (True, InfoString, crc_pos + Size_Checksum, Block)
+
+
+# ------------------------------------------------------------------------------
+def WriteCSV(writer_CSV, Block):
+    # write the rows of a sample, a row with the battery voltage then a row for each sample
+    n = len(Block['TIME'])
+    Empty = [''] * n
+
+    def Column(name, fmt, index=None):
+        if name not in Block:
+            return Empty
+        values = Block[name] if index is None else Block[name][:, index]
+        return ['' if v is None or v != v else fmt % v for v in np.ma.filled(values.astype(np.double), np.nan).tolist()]
+
+    # time to 1/10 sec
+    Times = np.datetime64(0, 'ms') + np.round(Block['TIME'] * 1000).astype('timedelta64[ms]')
+    TimeStrs = np.char.replace(np.char.replace(np.datetime_as_string(Times, unit='ms'), '-', '/'), 'T', ' ')
+
+    writer_CSV.writerow((TimeStrs[0][:19], '%.1f' % Block['battery'][0], '', '', '', '', '', ''))
+
+    Columns = [[t[:21] for t in TimeStrs.tolist()], Empty, Column('pressure', '%.3f'), Column('load', '%.3f'),
+               Column('millisec', '%.4f')]
+    for name, width in (('accel', 3), ('gyro', 3), ('mag', 3), ('orientation', 9)):
+        Columns.extend([Column(name, '%.4f', i) for i in range(width)])
 
+    writer_CSV.writerows(zip(*Columns))
 
 
 # ------------------------------------------------------------------------------
-def ProcessSample_Info(deployment_file):
+def CreateNetCDF(filename):
+    dataset = Dataset(filename, 'w', format='NETCDF4_CLASSIC')
+    dataset.filename = bin_path_filename
+
+    # create dimensions
+    dataset.createDimension('TIME', None)
+    dataset.createDimension('vector', 3)
+    dataset.createDimension('matrix', 3 * 3)
+
+    # create variables
+    times = dataset.createVariable('TIME', np.float64, ('TIME',), zlib=True, chunksizes=(NetCDF_ChunkRows,))
+
+    times.units = 'days since 1950-01-01 00:00:00'
+    times.calendar = 'gregorian'
+
+    return dataset
+
+
+# ------------------------------------------------------------------------------
+def WriteNetCDF(dataset, Blocks):
+    # append the rows of the decoded samples to the netCDF file, variables missing from a sample are filled
+    if len(Blocks) == 0:
+        return
+
+    times = dataset.variables['TIME']
+    start = len(times)
+    rows = sum([len(Block['TIME']) for Block in Blocks])
+    times[start:start + rows] = np.concatenate([Block['TIME'] for Block in Blocks]) / 86400 + DaysSince1950
+
+    for name, (dtype, dims) in NetCDF_Variables.items():
+        if not any([name in Block for Block in Blocks]):
+            continue
+
+        if name not in dataset.variables:
+            fill_value = np.nan if np.issubdtype(dtype, np.floating) else None
+            shape = tuple([len(dataset.dimensions[d]) for d in dims[1:]])
+            var = dataset.createVariable(name, dtype, dims, fill_value=fill_value, zlib=True, chunksizes=(NetCDF_ChunkRows,) + shape)
+            if name == 'pressure' and PressureUnits:
+                var.units = PressureUnits
+            if name == 'load' and LineTensionUnits:
+                var.units = LineTensionUnits
+        var = dataset.variables[name]
+
+        data = np.ma.masked_all((rows,) + var.shape[1:], dtype=dtype)
+        row = 0
+        for Block in Blocks:
+            n = len(Block['TIME'])
+            if name in Block:
+                data[row:row + n] = Block[name]
+            row += n
+        var[start:start + rows] = data
+
+    print('netCDF rows written', start + rows)
+
+
+# ------------------------------------------------------------------------------
+def ProcessSample_Info(mm, pos):
     global NrOfSamplesPerStop
     global PressureUnits
     global LineTensionUnits
@@ -694,101 +529,115 @@ def ProcessSample_Info(deployment_file):
 
     # ------------------------------
     # discard SampleType
-    deployment_file.seek(4, 1)
+    info_pos = pos + Size_Type
 
     # ------------------------------
     # read info sample structure
-    sample_size = ctypes.sizeof(MPESS_Struct.Struct_Sample_Info)
-
-    class SampleUnion(ctypes.Union):  # must fill blocks of 4 bytes
-        _fields_ = [("Data", MPESS_Struct.Struct_Sample_Info),
-                    ("Buffer", ctypes.c_uint8 * sample_size)]
-
-    UN = SampleUnion()
-    sample_buffer = deployment_file.read(sample_size)
-    if len(sample_buffer) != sample_size:  # incorrect file size
+    sample_size = Dtype_Sample_Info.itemsize
+    if info_pos + sample_size > len(mm):  # incorrect file size
         InfoString += 'Missing Data'
-        return (False, InfoString)
-    for sample_byte_index in range(sample_size):
-        UN.Buffer[sample_byte_index] = (sample_buffer[sample_byte_index])
+        return (False, InfoString, None)
+    Info = np.frombuffer(mm, dtype=Dtype_Sample_Info, count=1, offset=info_pos)[0].copy()
 
-        # ------------------------------
+    # ------------------------------
     # check checksum
-    CalcChecksum = zlib.crc32(sample_buffer[:-4], 0x00000000) & 0xFFFFFFFF
-    if (UN.Data.Checksum != CalcChecksum):
+    CalcChecksum = zlib.crc32(memoryview(mm)[info_pos:info_pos + sample_size - Size_Checksum]) & 0xFFFFFFFF
+    if (Info['Checksum'] != CalcChecksum):
         InfoString += 'Checksum Error'
-        return (False, InfoString)
+        return (False, InfoString, info_pos + sample_size)
 
     # ------------------------------
-    NrOfSamplesPerStop = UN.Data.Dep_Norm_NrOfSamples
+    NrOfSamplesPerStop = int(Info['Dep_Norm_NrOfSamples'])
 
     # ------------------------------
     InfoString += '---------------------------------------------------\r\n'
     InfoString += 'Logger Info:\r\n'
-    InfoString += '  Unit Number   = %u\r\n' % UN.Data.Sys_UnitNumber
-    InfoString += '  Serial Number = 0x%08lX\r\n' % UN.Data.Sys_SerialNumber
+    InfoString += '  Unit Number   = %u\r\n' % Info['Sys_UnitNumber']
+    InfoString += '  Serial Number = 0x%08lX\r\n' % Info['Sys_SerialNumber']
 
     InfoString += 'Time:\r\n'
-    if (UN.Data.RTC_LastTimeSync > 0):
-        InfoString += '  Last time synced = ' + datetime.datetime.utcfromtimestamp(UN.Data.RTC_LastTimeSync).strftime(
+    if (Info['RTC_LastTimeSync'] > 0):
+        InfoString += '  Last time synced = ' + datetime.datetime.utcfromtimestamp(Info['RTC_LastTimeSync']).strftime(
             '%Y/%m/%d %H:%M:%S') + ' (UTC)\r\n'
     else:
         InfoString += '  Time has not been set before\r\n'
 
     InfoString += 'Deployment:\r\n'
-    InfoString += '  Deployment Start Time   = ' + datetime.datetime.utcfromtimestamp(UN.Data.Dep_StartTime).strftime(
+    InfoString += '  Deployment Start Time   = ' + datetime.datetime.utcfromtimestamp(Info['Dep_StartTime']).strftime(
         '%Y/%m/%d %H:%M:%S') + ' (UTC)\r\n'
-    if (UN.Data.Dep_StopTime == 0):
+    if (Info['Dep_StopTime'] == 0):
         InfoString += '  Deployment Stop Time    = unknown\r\n'
     else:
         InfoString += '  Deployment Stop Time    = ' + datetime.datetime.utcfromtimestamp(
-            UN.Data.Dep_StopTime).strftime('%Y/%m/%d %H:%M:%S') + ' (UTC)\r\n'
+            Info['Dep_StopTime']).strftime('%Y/%m/%d %H:%M:%S') + ' (UTC)\r\n'
     InfoString += '  Intensive Sampling Time = %u min @ %.0fsps (%lu Samples)\r\n' % (
-    UN.Data.Dep_Int_NrOfSamples / MPESS_Struct.sample_frequency / 60, MPESS_Struct.sample_frequency,
-    UN.Data.Dep_Int_NrOfSamples)
+    Info['Dep_Int_NrOfSamples'] / MPESS_Struct.sample_frequency / 60, MPESS_Struct.sample_frequency,
+    Info['Dep_Int_NrOfSamples'])
     InfoString += '  Normal Sampling Time    = %u min @ %.0fsps (%lu Sample)\r\n' % (
-    UN.Data.Dep_Norm_NrOfSamples / MPESS_Struct.sample_frequency / 60, MPESS_Struct.sample_frequency,
-    UN.Data.Dep_Norm_NrOfSamples)
-    InfoString += '  Sampling Interval       = %u min\r\n' % (UN.Data.Dep_Norm_SampleInterval / 60)
+    Info['Dep_Norm_NrOfSamples'] / MPESS_Struct.sample_frequency / 60, MPESS_Struct.sample_frequency,
+    Info['Dep_Norm_NrOfSamples'])
+    InfoString += '  Sampling Interval       = %u min\r\n' % (Info['Dep_Norm_SampleInterval'] / 60)
 
     InfoString += 'Battery:\r\n'
-    if (UN.Data.Batt_ReplaceTime == 0):
+    if (Info['Batt_ReplaceTime'] == 0):
         InfoString += '  Battery replace time    = unknown'
     else:
         InfoString += '  Battery replace time    = ' + datetime.datetime.utcfromtimestamp(
-            UN.Data.Batt_ReplaceTime).strftime('%Y/%m/%d %H:%M:%S') + ' (UTC)\r\n'
+            Info['Batt_ReplaceTime']).strftime('%Y/%m/%d %H:%M:%S') + ' (UTC)\r\n'
 
     InfoString += 'Sensors:\r\n'
     SensorsPresentString = '  Sensors Present: '
-    if UN.Data.Sns_SensorsPresent & 0b111 == 0: SensorsPresentString += 'None, '
-    if UN.Data.Sns_SensorsPresent & 0b100:      SensorsPresentString += 'IMU, '
-    if UN.Data.Sns_SensorsPresent & 0b010:      SensorsPresentString += 'Line Tension, '
-    if UN.Data.Sns_SensorsPresent & 0b001:      SensorsPresentString += 'Pressure, '
+    if Info['Sns_SensorsPresent'] & 0b111 == 0: SensorsPresentString += 'None, '
+    if Info['Sns_SensorsPresent'] & 0b100:      SensorsPresentString += 'IMU, '
+    if Info['Sns_SensorsPresent'] & 0b010:      SensorsPresentString += 'Line Tension, '
+    if Info['Sns_SensorsPresent'] & 0b001:      SensorsPresentString += 'Pressure, '
     InfoString += SensorsPresentString[:-2] + '\r\n'
-    if UN.Data.Sns_SensorsPresent & 0b100:  # IMU
-        if UN.Data.Sns_ModelIMU == MPESS_Struct.SNS_IMU_3DM_GX3_25:
+    if Info['Sns_SensorsPresent'] & 0b100:  # IMU
+        if Info['Sns_ModelIMU'] == MPESS_Struct.SNS_IMU_3DM_GX3_25:
             InfoString += '  IMU Model = Microstrain 3DM-GX3-25\r\n'
-        elif UN.Data.Sns_ModelIMU == MPESS_Struct.SNS_IMU_3DM_GX4_25:
+        elif Info['Sns_ModelIMU'] == MPESS_Struct.SNS_IMU_3DM_GX4_25:
             InfoString += '  IMU Model = Microstrain 3DM-GX4-25\r\n'
         else:
             InfoString += '  IMU Model = Unknown\r\n'
-    if UN.Data.Sns_SensorsPresent & 0b001:  # pressure
-        PressureUnits = ''
-        index = 0
-        while (index < 8) and (UN.Data.PTi_CalUnits[index] != 0):
-            PressureUnits += chr(UN.Data.PTi_CalUnits[index])
-            index += 1
+    if Info['Sns_SensorsPresent'] & 0b001:  # pressure
+        PressureUnits = bytes(Info['PTi_CalUnits']).split(b'\0')[0].decode('ascii', errors='replace')
         InfoString += '  Pressure Transducer Units = ' + PressureUnits + '\r\n'
-    if UN.Data.Sns_SensorsPresent & 0b010:  # Line Tension
-        LineTensionUnits = ''
-        index = 0
-        while (index < 4) and (UN.Data.PTx_CalUnits[index] != 0):
-            LineTensionUnits += chr(UN.Data.PTx_CalUnits[index])
-            index += 1
+    if Info['Sns_SensorsPresent'] & 0b010:  # Line Tension
+        LineTensionUnits = bytes(Info['PTx_CalUnits']).split(b'\0')[0].decode('ascii', errors='replace')
         InfoString += '  Line Tension Units = ' + LineTensionUnits + '\r\n'
 
     InfoString += '---------------------------------------------------\r\n'
-    return (True, InfoString)
+    return (True, InfoString, info_pos + sample_size)
+
+
+# ------------------------------------------------------------------------------
+def ReadDataFrame(filename):
+    # data frame of the netCDF file, with the columns used for plotting
+    dataset = Dataset(filename, 'r')
+
+    times = dataset.variables['TIME']
+    df = pd.DataFrame(index=pd.to_datetime((times[:] - DaysSince1950) * 86400, unit='s'))
+    if 'battery' in dataset.variables:
+        df['BatteryVoltage'] = np.ma.filled(dataset.variables['battery'][:], np.nan)
+    if 'pressure' in dataset.variables:
+        df['Pressure'] = np.ma.filled(dataset.variables['pressure'][:], np.nan)
+    if 'load' in dataset.variables:
+        df['LineTension'] = np.ma.filled(dataset.variables['load'][:], np.nan)
+    if 'millisec' in dataset.variables:
+        df['IMU_TimeStampMs'] = np.ma.filled(dataset.variables['millisec'][:].astype(np.double), np.nan)
+        for name, columns in (('accel', ['IMU_AccX', 'IMU_AccY', 'IMU_AccZ']),
+                              ('gyro', ['IMU_GyroX', 'IMU_GyroY', 'IMU_GyroZ']),
+                              ('mag', ['IMU_MagnX', 'IMU_MagnY', 'IMU_MagnZ']),
+                              ('orientation', ['IMU_OM_M11', 'IMU_OM_M12', 'IMU_OM_M13',
+                                               'IMU_OM_M21', 'IMU_OM_M22', 'IMU_OM_M23',
+                                               'IMU_OM_M31', 'IMU_OM_M32', 'IMU_OM_M33'])):
+            data = np.ma.filled(dataset.variables[name][:], np.nan)
+            for i, column in enumerate(columns):
+                df[column] = data[:, i]
+
+    dataset.close()
+
+    return df
 
 
 # ------------------------------------------------------------------------------
@@ -1024,24 +873,32 @@ else:
     writer_CSV = []
     if Flag_CreateCSV:
         FilenameCSV = DeploymentFileName.rsplit('.', 1)[0] + '.csv'
-        file_CSV = open(os.path.join(DeploymentFilePath, FilenameCSV), 'wt')
+        file_CSV = open(os.path.join(DeploymentFilePath, FilenameCSV), 'wt', newline='')
         writer_CSV = csv.writer(file_CSV, delimiter=',')
 
+    # create netCDF file
+    dataset = None
+    if Flag_CreateNetCDF:
+        FilenameNetCDF = os.path.join(DeploymentFilePath, DeploymentFileName.rsplit('.', 1)[0] + '.nc')
+        dataset = CreateNetCDF(FilenameNetCDF)
+
     # create info Sample file
     FilenameInfo = DeploymentFileName.rsplit('Data', 1)[0] + 'Info.txt'
     file_Info = open(os.path.join(DeploymentFilePath, FilenameInfo), 'wt')
 
     # extract data
-    df = ExtractAllSamples(deployment_file, file_Info, writer_CSV)
+    ExtractAllSamples(deployment_file, file_Info, writer_CSV, dataset)
 
     # close open files
     deployment_file.close()
     file_Info.close()
     if Flag_CreateCSV:
         file_CSV.close()
+    if Flag_CreateNetCDF:
+        dataset.close()
 
     # plot deployemnt data
     if Flag_PlotData:
         time_start = datetime.datetime.now()
-        PlotDeploymentData(df)
+        PlotDeploymentData(ReadDataFrame(FilenameNetCDF))
         print ('Plot time = %s' % (datetime.datetime.now() - time_start))
@@ -30,7 +30,12 @@ from os import listdir, walk
 
 import re
 import os
+import io
 import zipfile
+import contextlib
+import concurrent.futures
+import itertools
+import traceback
 
 first_line_expr   = r"^TRIAXYS BUOY DATA REPORT"
 raw_first_line_expr = r"^Sample"
@@ -49,171 +54,212 @@ version_expr      = r"^VERSION.*=\s*(\S*)"
 
 times = []
 
+# frequencies of the FREQ dimension, the spectra from each file are matched to these
+spec_freq = np.arange(0, 0.005 * 129, 0.005)
 
-def parse_dir_spec(output_name, file):
+# most TIME rows written to a variable in one slab
+write_block = 1024
 
-    # TRIAXYS BUOY DATA REPORT - TAS04811
-    # VERSION = 5b.02.08
-    # TYPE    = DIRECTIONAL SPECTRUM
-    # DATE    = 2018 Feb 09 04:00(UTC)
-    # NUMBER OF FREQUENCIES              =     129
-    # INITIAL FREQUENCY (Hz)             =   0.000
-    # FREQUENCY SPACING (Hz)             =   0.005
-    # RESOLVABLE FREQUENCY RANGE (Hz)    =   0.030  TO  0.455
-    # NUMBER OF DIRECTIONS               =     121
-    # DIRECTION SPACING (DEG)            =     3.0
-    # COLUMNS = 0.00 TO 360.00 DEG
-    # ROWS    = 0.00 TO   0.64 Hz
+# the TriAXYS processor writes a file for each product every (half hourly) sample. The ingest reads each file to
+# arrays (in a pool of worker processes with --jobs N), then writes each product to the netCDF file once, sorted on
+# TIME, rather than opening the netCDF file and searching the TIME variable for every file
 
-    data_line = 0
-    first = True
+report_exprs = [('num_frequencies', num_freq_expr), ('num_dir', num_dir_expr), ('num_points', num_points_expr),
+                ('freq_space', freq_space_expr), ('dir_space', dir_space_expr), ('version', version_expr)]
 
-    ds = Dataset(output_name, 'a')
+
+def read_report(file, data_expr):
+    # read a TriAXYS BUOY DATA REPORT file, returns the header values (as strings) and the data lines matching data_expr
+
+    header = {}
+    data = []
 
     with open(file, 'r', errors='ignore') as fp:
         line = fp.readline()
         matchObj = re.match(first_line_expr, line)
         if not matchObj:
-            print("Not a TriAXYS file !")
-            exit(-1)
+            raise ValueError("Not a TriAXYS file ! " + file)
 
-        cnt = 1
-        while line:
+        for line in fp:
+            # header lines start with a letter, data lines with a number or a space
+            if not line[:1].isalpha():
+                matchObj = re.match(data_expr, line)
+                if matchObj:
+                    data.append(matchObj)
+                continue
 
             matchObj = re.match(date_expr, line)
             if matchObj:
-                # print("date_expr:matchObj.group() : ", matchObj.group())
-                # print("date_expr:matchObj.group(1) : ", matchObj.group(1))
-                # print("date_expr:matchObj.group(2) : ", matchObj.group(2))
-                ts = datetime.datetime.strptime(matchObj.group(1), "%Y %b %d %H:%M")
-                print("timestamp ", ts)
-            matchObj = re.match(num_freq_expr, line)
-            if matchObj:
-                # print("num_freq_expr:matchObj.group() : ", matchObj.group())
-                # print("num_freq_expr:matchObj.group(1) : ", matchObj.group(1))
-                num_frequencies = int(matchObj.group(1))
-            matchObj = re.match(num_dir_expr, line)
-            if matchObj:
-                # print("num_dir_expr:matchObj.group() : ", matchObj.group())
-                # print("num_dir_expr:matchObj.group(1) : ", matchObj.group(1))
-                num_dir = int(matchObj.group(1))
-            matchObj = re.match(ini_freq_expr, line)
-            if matchObj:
-                # print("ini_freq_expr:matchObj.group() : ", matchObj.group())
-                # print("ini_freq_expr:matchObj.group(1) : ", matchObj.group(1))
-                pass
-            matchObj = re.match(freq_space_expr, line)
-            if matchObj:
-                # print("freq_space_expr:matchObj.group() : ", matchObj.group())
-                # print("freq_space_expr:matchObj.group(1) : ", matchObj.group(1))
-                freq_space = float(matchObj.group(1))
-            matchObj = re.match(dir_space_expr, line)
-            if matchObj:
-                # print("dir_space_expr:matchObj.group() : ", matchObj.group())
-                # print("dir_space_expr:matchObj.group(1) : ", matchObj.group(1))
-                dir_space = float(matchObj.group(1))
+                header['ts'] = datetime.datetime.strptime(matchObj.group(1), "%Y %b %d %H:%M")
+                print("timestamp ", header['ts'])
+            for key, expr in report_exprs:
+                matchObj = re.match(expr, line)
+                if matchObj:
+                    header[key] = matchObj.group(1)
             matchObj = re.match(res_freq_range, line)
             if matchObj:
-                # print("res_freq_range:matchObj.group() : ", matchObj.group())
-                # print("res_freq_range:matchObj.group(1) : ", matchObj.group(1))
-                resolution_low = matchObj.group(1)
-                resolution_high = matchObj.group(2)
-            matchObj = re.match(version_expr, line)
-            if matchObj:
-                # print("freq_space_expr:matchObj.group() : ", matchObj.group())
-                # print("freq_space_expr:matchObj.group(1) : ", matchObj.group(1))
-                version = matchObj.group(1)
-                pass
-            matchObj = re.match(non_dir_line_expr, line)
-            if matchObj:
-                if first:
-                    times_num = ds.variables["TIME"]
-                    times = num2date(times_num[:], units=times_num.units, calendar=times_num.calendar)
-
-                    # create dimensions
-                    # print("dimensions ", ds.dimensions)
-                    if "FREQ" not in ds.dimensions:
-                        freq_dim = ds.createDimension("FREQ", num_frequencies)
-                        # print(freq_dim)
-                    if "DIR" not in ds.dimensions:
-                        freq_dim = ds.createDimension("DIR", num_dir)
-
-                    # create variables if needed
-                    if "DIR_SPEC" not in ds.variables:
-                        ncVarOut = ds.createVariable("DIR_SPEC", "f4", ("TIME", "FREQ", "DIR"), fill_value=np.nan)  # fill_value=nan otherwise defaults to max
-                        ncVarOut.units = "m^2/Hz"
-                        ncVarOut.comment = "from directional spectrum processed file"
-                        ncVarOut.comment_processing_version = version
-                    else:
-                        ncVarOut = ds.variables["DIR_SPEC"]
-
-                    # TODO: use these are a mask on DIR_SPEC rather than creating new variables
-                    if "DIR_SPEC_RES_LOW" not in ds.variables:
-                        dir_spec_low = ds.createVariable("DIR_SPEC_RES_LOW", "f4", ("TIME"), fill_value=np.nan, zlib=True)  # fill_value=nan otherwise defaults to max
-                        dir_spec_low.units = "Hz"
-                        dir_spec_low.comment = "directional spectra range low"
-                    else:
-                        dir_spec_low = ds.variables["DIR_SPEC_RES_LOW"]
-                    if "DIR_SPEC_RES_HI" not in ds.variables:
-                        dir_spec_hi = ds.createVariable("DIR_SPEC_RES_HI", "f4", ("TIME"), fill_value=np.nan, zlib=True)  # fill_value=nan otherwise defaults to max
-                        dir_spec_hi.units = "Hz"
-                        dir_spec_hi.comment = "directional spectra range high"
-                    else:
-                        dir_spec_hi = ds.variables["DIR_SPEC_RES_HI"]
-
-                    # create coordinate variable values
-                    if "FREQ" not in ds.variables:
-                        freq_var = ds.createVariable("FREQ", "f4", ("FREQ"), fill_value=None)  # no fill value for dimensions
-                        freq_var.units = "Hz"
-                        freq_var.comment = "specra frequency"
-                        f = np.arange(0, freq_space * num_frequencies, freq_space)
-                        print("f shape ", f.shape)
-                        freq_var[:] = f
-                    else:
-                        freq_var = ds.variables["FREQ"]
-
-                    if "DIR_SPEC" not in ds.variables:
-                        dir_var = ds.createVariable("DIR_SPEC", "f4", ("DIR_SPEC"), fill_value=None)  # no fill value for dimensions
-                        dir_var.units = "Hz"
-                        dir_var.comment = "specra direction"
-                        d = np.arange(0, dir_space * num_dir, dir_space)
-                        print("d shape ", d.shape)
-                        dir_var[:] = d
-                    else:
-                        dir_var = ds.variables["DIR_SPEC"]
-
-                    # print (ncVarOut)
-                    first = False
-
-                    data_out = np.zeros((num_frequencies, num_dir))
-                    data_out.fill(np.nan)
-
-                    time_idx = np.where(times == ts)
-                    print("time index", time_idx, time_idx[0].shape)
-
-                # print("data_line_expr:matchObj.group() : ", matchObj.group())
-                # print("data_line_expr:matchObj.group(1) : ", matchObj.group(1))
-                # print("data_line_expr:matchObj.group(2) : ", matchObj.group(2))
-                j = 0
-                for x in line[1:].split(" "):
-                    # print(data_line, j, x)
-                    data_out[data_line, j] = float(x)
-                    j += 1
-                data_line += 1
-
-            line = fp.readline()
-            cnt += 1
+                header['resolution'] = (matchObj.group(1), matchObj.group(2))
 
-        # if time index found, write data to netCDF file
-        if time_idx[0].shape[0] > 0:
-            ncVarOut[time_idx[0], :, :] = data_out
-            dir_spec_low[time_idx[0]] = float(resolution_low)
-            dir_spec_hi[time_idx[0]] = float(resolution_high)
+    if not data:
+        print("no data in file", file)
 
-    ds.close()
+    return header, data
 
 
-def parse_raw(output_name, file):
+def freq_match(file_freq, data):
+    # place the data from a file on the FREQ dimension, matching frequencies in mHz. Need to be careful that the
+    # frequencies (which are floats) match (need to be the same type, not single and float)
+
+    xy, x_ind, y_ind = np.intersect1d(np.rint(file_freq*1000), np.rint(spec_freq*1000), return_indices=True)
+
+    d0 = np.full((len(spec_freq), ) + data.shape[1:], np.nan, dtype=np.float32)
+    d0[y_ind] = data[x_ind]
+
+    return d0
+
+
+def file_times(ds):
+    # the TIME variable as datetimes
+    times_num = ds.variables["TIME"]
+
+    return num2date(times_num[:], units=times_num.units, calendar=times_num.calendar, only_use_cftime_datetimes=False, only_use_python_datetimes=True)
+
+
+def time_index(times):
+    # map each timestamp to its TIME indices
+    index = {}
+    for i, t in enumerate(times):
+        index.setdefault(t, []).append(i)
+
+    return index
+
+
+def time_rows(results, times):
+    # find the TIME index of each result, where files have the same timestamp the last file read is used,
+    # returns the sorted TIME indices and the result for each
+    index = time_index(times)
+
+    rows = {}
+    for r in results:
+        for i in index.get(r['ts'], []):
+            rows[i] = r
+
+    idx = np.array(sorted(rows), dtype=np.int64)
+    print("time index", len(results), "files", len(idx), "times")
+
+    return idx, [rows[i] for i in idx]
+
+
+def put_rows(var, idx, rows):
+    # write rows[k] to var[idx[k]], idx is sorted. Writes a slab for each run of consecutive TIME indices,
+    # short rows are padded with nan
+
+    breaks = np.flatnonzero(np.diff(idx) != 1) + 1
+    for start, end in zip(np.r_[0, breaks], np.r_[breaks, len(idx)]):
+        for s in range(start, end, write_block):
+            e = min(s + write_block, end)
+            block = np.full((e - s, ) + var.shape[1:], np.nan, dtype=var.dtype)
+            for k in range(s, e):
+                block[(k - s, ) + tuple(slice(0, n) for n in np.shape(rows[k]))] = rows[k]
+            var[idx[s]:idx[e - 1] + 1] = block
+
+
+def read_dir_spec(file):
+
+    # TRIAXYS BUOY DATA REPORT - TAS04811
+    # VERSION = 5b.02.08
+    # TYPE    = DIRECTIONAL SPECTRUM
+    # DATE    = 2018 Feb 09 04:00(UTC)
+    # NUMBER OF FREQUENCIES              =     129
+    # INITIAL FREQUENCY (Hz)             =   0.000
+    # FREQUENCY SPACING (Hz)             =   0.005
+    # RESOLVABLE FREQUENCY RANGE (Hz)    =   0.030  TO  0.455
+    # NUMBER OF DIRECTIONS               =     121
+    # DIRECTION SPACING (DEG)            =     3.0
+    # COLUMNS = 0.00 TO 360.00 DEG
+    # ROWS    = 0.00 TO   0.64 Hz
+
+    header, lines = read_report(file, non_dir_line_expr)
+    if not lines:
+        return None
+
+    num_frequencies = int(header['num_frequencies'])
+    num_dir = int(header['num_dir'])
+
+    data_out = np.full((num_frequencies, num_dir), np.nan, dtype=np.float32)
+    for data_line, matchObj in enumerate(lines):
+        row = [float(x) for x in matchObj.string[1:].split(" ")]
+        data_out[data_line, :len(row)] = row
+
+    return {'ts': header['ts'], 'version': header['version'], 'num_frequencies': num_frequencies, 'num_dir': num_dir,
+            'freq_space': float(header['freq_space']), 'dir_space': float(header['dir_space']),
+            'resolution': (float(header['resolution'][0]), float(header['resolution'][1])), 'spec': data_out}
+
+
+def write_dir_spec(ds, results):
+
+    first = results[0]
+
+    # create dimensions
+    # print("dimensions ", ds.dimensions)
+    if "FREQ" not in ds.dimensions:
+        freq_dim = ds.createDimension("FREQ", first['num_frequencies'])
+        # print(freq_dim)
+    if "DIR" not in ds.dimensions:
+        freq_dim = ds.createDimension("DIR", first['num_dir'])
+
+    # create variables if needed
+    if "DIR_SPEC" not in ds.variables:
+        ncVarOut = ds.createVariable("DIR_SPEC", "f4", ("TIME", "FREQ", "DIR"), fill_value=np.nan)  # fill_value=nan otherwise defaults to max
+        ncVarOut.units = "m^2/Hz"
+        ncVarOut.comment = "from directional spectrum processed file"
+        ncVarOut.comment_processing_version = first['version']
+    else:
+        ncVarOut = ds.variables["DIR_SPEC"]
+
+    # TODO: use these are a mask on DIR_SPEC rather than creating new variables
+    if "DIR_SPEC_RES_LOW" not in ds.variables:
+        dir_spec_low = ds.createVariable("DIR_SPEC_RES_LOW", "f4", ("TIME"), fill_value=np.nan, zlib=True)  # fill_value=nan otherwise defaults to max
+        dir_spec_low.units = "Hz"
+        dir_spec_low.comment = "directional spectra range low"
+    else:
+        dir_spec_low = ds.variables["DIR_SPEC_RES_LOW"]
+    if "DIR_SPEC_RES_HI" not in ds.variables:
+        dir_spec_hi = ds.createVariable("DIR_SPEC_RES_HI", "f4", ("TIME"), fill_value=np.nan, zlib=True)  # fill_value=nan otherwise defaults to max
+        dir_spec_hi.units = "Hz"
+        dir_spec_hi.comment = "directional spectra range high"
+    else:
+        dir_spec_hi = ds.variables["DIR_SPEC_RES_HI"]
+
+    # create coordinate variable values
+    if "FREQ" not in ds.variables:
+        freq_var = ds.createVariable("FREQ", "f4", ("FREQ"), fill_value=None)  # no fill value for dimensions
+        freq_var.units = "Hz"
+        freq_var.comment = "specra frequency"
+        f = np.arange(0, first['freq_space'] * first['num_frequencies'], first['freq_space'])
+        print("f shape ", f.shape)
+        freq_var[:] = f
+    else:
+        freq_var = ds.variables["FREQ"]
+
+    if "DIR_SPEC" not in ds.variables:
+        dir_var = ds.createVariable("DIR_SPEC", "f4", ("DIR_SPEC"), fill_value=None)  # no fill value for dimensions
+        dir_var.units = "Hz"
+        dir_var.comment = "specra direction"
+        d = np.arange(0, first['dir_space'] * first['num_dir'], first['dir_space'])
+        print("d shape ", d.shape)
+        dir_var[:] = d
+    else:
+        dir_var = ds.variables["DIR_SPEC"]
+
+    # write data for the files with a time index to the netCDF file
+    idx, rows = time_rows(results, file_times(ds))
+    put_rows(ncVarOut, idx, [r['spec'] for r in rows])
+    put_rows(dir_spec_low, idx, [r['resolution'][0] for r in rows])
+    put_rows(dir_spec_hi, idx, [r['resolution'][1] for r in rows])
+
+
+def read_raw(file):
     # Sample,Comp(deg),Ax(m/s^2),Ay(m/s^2),Az(m/s^2),Rx(deg/s),Ry(deg/s),Rz(deg/s)
     # 1,55,0.135378,0.060822,-9.804115,4.218758,3.515633,5.781258
     # 2,55,0.135378,0.059841,-9.807058,4.218758,3.531258,5.765633
@@ -227,89 +273,77 @@ def parse_raw(output_name, file):
     data_out = np.zeros((4800, 8))
     data_out.fill(np.nan)
 
-    data_line = 0
-    first = True
-
-    ds = Dataset(output_name, 'a')
-
     with open(file, 'r', errors='ignore') as fp:
         line = fp.readline()
         matchObj = re.match(raw_first_line_expr, line)
         if not matchObj:
-            print("Not a TriAXYS file !")
-            exit(-1)
-        line = fp.readline()
+            raise ValueError("Not a TriAXYS file ! " + file)
 
         cnt = 0
-        while line:
+        for line in fp:
             line_split = line.split(",")
             # print("RAW split len", len(line_split))
             if len(line_split) > 8:
                 break
 
-            j = 0
-            for x in line_split:
-                # print(cnt, j, x)
-                data_out[cnt, j] = float(x)
-                j += 1
-
-            line = fp.readline()
+            data_out[cnt, :len(line_split)] = [float(x) for x in line_split]
             cnt += 1
 
-        num_samples = cnt
-        num_samples = 4800 ## TODO: Hack as number of samples changes
-        print("raw total samples", num_samples)
+    print("raw total samples", cnt)
 
-        ts = datetime.datetime.strptime(line_split[0], "%y%m%d%H%M")
+    ts = datetime.datetime.strptime(line_split[0], "%y%m%d%H%M")
 
-        print("raw timestamp", ts)
+    print("raw timestamp", ts)
 
-        times_num = ds.variables["TIME"]
-        times = num2date(times_num[:], units=times_num.units, calendar=times_num.calendar)
-        time_idx = np.where(times == ts)
-        print("time index", time_idx, time_idx[0].shape)
+    return {'ts': ts, 'compass': data_out[:, 1].astype(np.float32), 'accel': data_out[:, 2:5].astype(np.float32),
+            'gyro': data_out[:, 5:8].astype(np.float32)}
 
-        # if time index found, write data to netCDF file
-        if time_idx[0].shape[0] > 0:
 
-            # create dimensions
-            # print("dimensions ", ds.dimensions)
-            if "RAW_SAMPLE" not in ds.dimensions:
-                freq_dim = ds.createDimension("RAW_SAMPLE", num_samples)
-                # print(freq_dim)
-            if "RAW_VECTOR" not in ds.dimensions:
-                freq_dim = ds.createDimension("RAW_VECTOR", 3)
+def write_raw(ds, results):
 
-            # create variables if needed
-            if "ACCEL" not in ds.variables:
-                accel_var = ds.createVariable("ACCEL", "f4", ("TIME", "RAW_SAMPLE", "RAW_VECTOR"), fill_value=np.nan)  # fill_value=nan otherwise defaults to max
-                accel_var.units = "m/s^2"
-                accel_var.comment = "raw acceleration, x y z"
-            else:
-                accel_var = ds.variables["ACCEL"]
+    num_samples = 4800 ## TODO: Hack as number of samples changes
 
-            if "GYRO" not in ds.variables:
-                gyro_var = ds.createVariable("GYRO", "f4", ("TIME", "RAW_SAMPLE", "RAW_VECTOR"), fill_value=np.nan)  # fill_value=nan otherwise defaults to max
-                gyro_var.units = "rad/s"
-                gyro_var.comment = "raw gyroscope measurement, x y z"
-            else:
-                gyro_var = ds.variables["GYRO"]
+    idx, rows = time_rows(results, file_times(ds))
 
-            if "COMPASS" not in ds.variables:
-                comp_var = ds.createVariable("COMPASS", "f4", ("TIME", "RAW_SAMPLE"), fill_value=np.nan)  # fill_value=nan otherwise defaults to max
-                comp_var.units = "degrees"
-                comp_var.comment = "compass direction"
-            else:
-                comp_var = ds.variables["COMPASS"]
+    # if time index found, write data to netCDF file
+    if len(idx) > 0:
 
-            comp_var[time_idx[0], :] = data_out[:, 1]
-            accel_var[time_idx[0], :, :] = data_out[:, 2:5]
-            gyro_var[time_idx[0], :, :] = data_out[:, 5:8]
+        # create dimensions
+        # print("dimensions ", ds.dimensions)
+        if "RAW_SAMPLE" not in ds.dimensions:
+            freq_dim = ds.createDimension("RAW_SAMPLE", num_samples)
+            # print(freq_dim)
+        if "RAW_VECTOR" not in ds.dimensions:
+            freq_dim = ds.createDimension("RAW_VECTOR", 3)
 
-    ds.close()
+        # create variables if needed
+        if "ACCEL" not in ds.variables:
+            accel_var = ds.createVariable("ACCEL", "f4", ("TIME", "RAW_SAMPLE", "RAW_VECTOR"), fill_value=np.nan)  # fill_value=nan otherwise defaults to max
+            accel_var.units = "m/s^2"
+            accel_var.comment = "raw acceleration, x y z"
+        else:
+            accel_var = ds.variables["ACCEL"]
 
+        if "GYRO" not in ds.variables:
+            gyro_var = ds.createVariable("GYRO", "f4", ("TIME", "RAW_SAMPLE", "RAW_VECTOR"), fill_value=np.nan)  # fill_value=nan otherwise defaults to max
+            gyro_var.units = "rad/s"
+            gyro_var.comment = "raw gyroscope measurement, x y z"
+        else:
+            gyro_var = ds.variables["GYRO"]
 
-def parse_non_dir_spec(output_name, file):
+        if "COMPASS" not in ds.variables:
+            comp_var = ds.createVariable("COMPASS", "f4", ("TIME", "RAW_SAMPLE"), fill_value=np.nan)  # fill_value=nan otherwise defaults to max
+            comp_var.units = "degrees"
+            comp_var.comment = "compass direction"
+        else:
+            comp_var = ds.variables["COMPASS"]
+
+        put_rows(comp_var, idx, [r['compass'] for r in rows])
+        put_rows(accel_var, idx, [r['accel'] for r in rows])
+        put_rows(gyro_var, idx, [r['gyro'] for r in rows])
+
+
+def read_non_dir_spec(file):
     # TRIAXYS BUOY DATA REPORT - TAS04811
     # VERSION = 5b.02.08
     # TYPE    = NON-DIRECTIONAL SPECTRUM
@@ -323,108 +357,47 @@ def parse_non_dir_spec(output_name, file):
     # 0.005  0.0000000E+00
     # 0.010  0.0000000E+00
 
-    data_line = 0
-    first = True
+    header, lines = read_report(file, data_line_expr)
+    if not lines:
+        return None
 
-    ds = Dataset(output_name, 'a')
+    data_out = np.zeros((int(header['num_frequencies']), 2))
+    data_out.fill(np.nan)
+    for data_line, matchObj in enumerate(lines):
+        data_out[data_line, 1] = float(matchObj.group(2))
+        data_out[data_line, 0] = float(matchObj.group(1))
 
-    with open(file, 'r', errors='ignore') as fp:
-        line = fp.readline()
-        matchObj = re.match(first_line_expr, line)
-        if not matchObj:
-            print("Not a TriAXYS file !")
-            exit(-1)
+    return {'ts': header['ts'], 'version': header['version'], 'spec': freq_match(data_out[:, 0], data_out[:, 1])}
 
-        cnt = 1
-        while line:
 
-            matchObj = re.match(date_expr, line)
-            if matchObj:
-                # print("date_expr:matchObj.group() : ", matchObj.group())
-                # print("date_expr:matchObj.group(1) : ", matchObj.group(1))
-                # print("date_expr:matchObj.group(2) : ", matchObj.group(2))
-                ts = datetime.datetime.strptime(matchObj.group(1), "%Y %b %d %H:%M")
-                print("timestamp ", ts)
-            matchObj = re.match(num_freq_expr, line)
-            if matchObj:
-                # print("num_freq_expr:matchObj.group() : ", matchObj.group())
-                # print("num_freq_expr:matchObj.group(1) : ", matchObj.group(1))
-                num_frequencies = int(matchObj.group(1))
-            matchObj = re.match(ini_freq_expr, line)
-            if matchObj:
-                # print("ini_freq_expr:matchObj.group() : ", matchObj.group())
-                # print("ini_freq_expr:matchObj.group(1) : ", matchObj.group(1))
-                pass
-            matchObj = re.match(freq_space_expr, line)
-            if matchObj:
-                # print("freq_space_expr:matchObj.group() : ", matchObj.group())
-                # print("freq_space_expr:matchObj.group(1) : ", matchObj.group(1))
-                pass
-            matchObj = re.match(version_expr, line)
-            if matchObj:
-                # print("freq_space_expr:matchObj.group() : ", matchObj.group())
-                # print("freq_space_expr:matchObj.group(1) : ", matchObj.group(1))
-                version = matchObj.group(1)
-                pass
-            matchObj = re.match(data_line_expr, line)
-            if matchObj:
-                if first:
-                    times_num = ds.variables["TIME"]
-                    times = num2date(times_num[:], units=times_num.units, calendar=times_num.calendar)
-                    # print("dimensions ", ds.dimensions)
-                    if "FREQ" not in ds.dimensions:
-                        freq_dim = ds.createDimension("FREQ", 129)
-                        # print(freq_dim)
-
-                    if "NON_DIR_SPEC" not in ds.variables:
-                        ncVarOut = ds.createVariable("NON_DIR_SPEC", "f4", ("TIME", "FREQ"), fill_value=np.nan, zlib=True)  # fill_value=nan otherwise defaults to max
-                        ncVarOut.units = "m^2/Hz"
-                        ncVarOut.comment = "from non-directional spectrum processed file"
-                        ncVarOut.comment_processing_version = version
-                    else:
-                        ncVarOut = ds.variables["NON_DIR_SPEC"]
-
-                    freq = np.arange(0, 0.005 * 129, 0.005)
-                    if "FREQ" not in ds.variables:
-                        freq_var = ds.createVariable("FREQ", "f4", ("FREQ"), fill_value=None)  # fill_value=nan otherwise defaults to max
-                        freq_var.units = "Hz"
-                        freq_var.comment = "frequency"
-                        freq_var[:] = freq
-                    else:
-                        freq_var = ds.variables["FREQ"]
-
-                    # print (ncVarOut)
-                    first = False
-
-                    data_out = np.zeros((num_frequencies, 2))
-                    data_out.fill(np.nan)
-
-                    time_idx = np.where(times == ts)
-                    print("time index", time_idx, time_idx[0].shape)
-
-                # print("data_line_expr:matchObj.group() : ", matchObj.group())
-                # print("data_line_expr:matchObj.group(1) : ", matchObj.group(1))
-                # print("data_line_expr:matchObj.group(2) : ", matchObj.group(2))
-                data_out[data_line, 1] = float(matchObj.group(2))
-                data_out[data_line, 0] = float(matchObj.group(1))
-                data_line += 1
-
-            line = fp.readline()
-            cnt += 1
+def write_non_dir_spec(ds, results):
 
-        xy, x_ind, y_ind = np.intersect1d(np.rint(data_out[:, 0]*1000), np.rint(freq*1000), return_indices=True)
-        print('freq overlap', xy)
+    # print("dimensions ", ds.dimensions)
+    if "FREQ" not in ds.dimensions:
+        freq_dim = ds.createDimension("FREQ", 129)
+        # print(freq_dim)
 
-        d0 = np.zeros(129)
-        if time_idx[0].shape[0] > 0:
-            d0.fill(np.nan)
-            d0[y_ind] = data_out[x_ind, 1]
-            ncVarOut[time_idx[0], :] = d0
+    if "NON_DIR_SPEC" not in ds.variables:
+        ncVarOut = ds.createVariable("NON_DIR_SPEC", "f4", ("TIME", "FREQ"), fill_value=np.nan, zlib=True)  # fill_value=nan otherwise defaults to max
+        ncVarOut.units = "m^2/Hz"
+        ncVarOut.comment = "from non-directional spectrum processed file"
+        ncVarOut.comment_processing_version = results[0]['version']
+    else:
+        ncVarOut = ds.variables["NON_DIR_SPEC"]
 
-    ds.close()
+    if "FREQ" not in ds.variables:
+        freq_var = ds.createVariable("FREQ", "f4", ("FREQ"), fill_value=None)  # fill_value=nan otherwise defaults to max
+        freq_var.units = "Hz"
+        freq_var.comment = "frequency"
+        freq_var[:] = spec_freq
+    else:
+        freq_var = ds.variables["FREQ"]
 
+    idx, rows = time_rows(results, file_times(ds))
+    put_rows(ncVarOut, idx, [r['spec'] for r in rows])
 
-def parse_mean_dir(output_name, file):
+
+def read_mean_dir(file):
     # TRIAXYS BUOY DATA REPORT
     # VERSION = 5b.02.08
     # TYPE    = MEAN DIRECTION
@@ -444,149 +417,72 @@ def parse_mean_dir(output_name, file):
     # 0.040  0.5643119E-05    339.83     34.62
     # 0.045  0.3431466E-05    326.11     34.49
 
-    data_line = 0
-    first = True
+    header, lines = read_report(file, data4_line_expr)
+    if not lines:
+        return None
 
-    ds = Dataset(output_name, 'a')
-
-    with open(file, 'r', errors='ignore') as fp:
-        line = fp.readline()
-        matchObj = re.match(first_line_expr, line)
-        if not matchObj:
-            print("Not a TriAXYS file !")
-            exit(-1)
-
-        cnt = 1
-        while line:
-
-            matchObj = re.match(date_expr, line)
-            if matchObj:
-                # print("date_expr:matchObj.group() : ", matchObj.group())
-                # print("date_expr:matchObj.group(1) : ", matchObj.group(1))
-                # print("date_expr:matchObj.group(2) : ", matchObj.group(2))
-                ts = datetime.datetime.strptime(matchObj.group(1), "%Y %b %d %H:%M")
-                print("timestamp ", ts)
-            matchObj = re.match(num_freq_expr, line)
-            if matchObj:
-                # print("num_freq_expr:matchObj.group() : ", matchObj.group())
-                # print("num_freq_expr:matchObj.group(1) : ", matchObj.group(1))
-                num_frequencies = int(matchObj.group(1))
-            matchObj = re.match(ini_freq_expr, line)
-            if matchObj:
-                # print("ini_freq_expr:matchObj.group() : ", matchObj.group())
-                # print("ini_freq_expr:matchObj.group(1) : ", matchObj.group(1))
-                init_freq = float(matchObj.group(1))
-                pass
-            matchObj = re.match(freq_space_expr, line)
-            if matchObj:
-                # print("freq_space_expr:matchObj.group() : ", matchObj.group())
-                # print("freq_space_expr:matchObj.group(1) : ", matchObj.group(1))
-                pass
-            matchObj = re.match(version_expr, line)
-            if matchObj:
-                # print("freq_space_expr:matchObj.group() : ", matchObj.group())
-                # print("freq_space_expr:matchObj.group(1) : ", matchObj.group(1))
-                version = matchObj.group(1)
-                pass
-            matchObj = re.match(data4_line_expr, line)
-            if matchObj:
-                if first:
-                    times_num = ds.variables["TIME"]
-                    times = num2date(times_num[:], units=times_num.units, calendar=times_num.calendar)
-                    # print("dimensions ", ds.dimensions)
-                    if "FREQ" not in ds.dimensions:
-                        freq_dim = ds.createDimension("FREQ", 129)
-                    else:
-                        freq_dim = ds.dimensions['FREQ']
-                    # print(freq_dim)
-
-                    if "MEAN_DENSITY" not in ds.variables:
-                        ncVarOut_d = ds.createVariable("MEAN_DENSITY", "f4", ("TIME", "FREQ"), fill_value=np.nan, zlib=True)  # fill_value=nan otherwise defaults to max
-                        ncVarOut_d.units = "m^2/Hz"
-                        ncVarOut_d.comment = "spectral density"
-                        ncVarOut_d.comment_processing_version = version
-                    else:
-                        ncVarOut_d = ds.variables["MEAN_DENSITY"]
-                    if "MEAN_DIR" not in ds.variables:
-                        ncVarOut = ds.createVariable("MEAN_DIR", "f4", ("TIME", "FREQ"), fill_value=np.nan, zlib=True)  # fill_value=nan otherwise defaults to max
-                        ncVarOut.units = "degrees"
-                        ncVarOut.comment = "mean direction"
-                        ncVarOut.comment_processing_version = version
-                    else:
-                        ncVarOut = ds.variables["MEAN_DIR"]
-
-                    if "MEAN_DIR_SPREAD" not in ds.variables:
-                        ncVarOut_s = ds.createVariable("MEAN_DIR_SPREAD", "f4", ("TIME", "FREQ"), fill_value=np.nan, zlib=True)  # fill_value=nan otherwise defaults to max
-                        ncVarOut_s.units = "degrees"
-                        ncVarOut_s.comment = "mean direction spread"
-                        ncVarOut_s.comment_processing_version = version
-                    else:
-                        ncVarOut_s = ds.variables["MEAN_DIR_SPREAD"]
-
-                    freq = np.arange(0, 0.005 * 129, 0.005)
-                    if "FREQ" not in ds.variables:
-                        freq_var = ds.createVariable("FREQ", "f4", ("FREQ"), fill_value=None)  # fill_value=nan otherwise defaults to max
-                        freq_var.units = "Hz"
-                        freq_var.comment = "frequency"
-                        freq_var[:] = freq
-
-                    else:
-                        freq_var = ds.variables["FREQ"]
-
-                    # print (ncVarOut)
-                    first = False
-
-                    data_out = np.zeros((num_frequencies, 4))
-                    data_out.fill(np.nan)
-
-                    time_idx = np.where(times == ts)
-                    print("time index", time_idx, time_idx[0].shape)
-
-                # print("data_line_expr:matchObj.group() : ", matchObj.group())
-                # print("data_line_expr:matchObj.group(1) : ", matchObj.group(1))
-                # print("data_line_expr:matchObj.group(2) : ", matchObj.group(2))
-                data_out[data_line, 1] = float(matchObj.group(2))
-                data_out[data_line, 2] = float(matchObj.group(3))
-                data_out[data_line, 3] = float(matchObj.group(4))
-                data_out[data_line, 0] = float(matchObj.group(1))
-                data_line += 1
-
-            line = fp.readline()
-            cnt += 1
-
-        # match frequencies from file with ones in netCDF FREQ variable, need to be careful that
-        # frequences (which are floats) match (need to be the same type, not single and float)
-
-        #print('freq dim', freq)
-        #print('freq read', data_out[:, 0])
-
-        xy, x_ind, y_ind = np.intersect1d(np.rint(data_out[:, 0]*1000), np.rint(freq*1000), return_indices=True)
-
-        #print('freq overlap', xy)
-        #print('freq overlap x_ind', x_ind)
-        #print('freq overlap y_ind', y_ind)
-
-        #print('shape ncVarOut', ncVarOut[:].shape)
-        #print('shape data_out', data_out.shape)
-
-        #print('data_out', data_out[x_ind, 1])
-
-        d0 = np.zeros(129)
-        if time_idx[0].shape[0] > 0:
-            d0.fill(np.nan)
-            d0[y_ind] = data_out[x_ind, 1]
-            ncVarOut_d[time_idx[0], :] = d0
-            d0.fill(np.nan)
-            d0[y_ind] = data_out[x_ind, 2]
-            ncVarOut[time_idx[0], :] = d0
-            d0.fill(np.nan)
-            d0[y_ind] = data_out[x_ind, 3]
-            ncVarOut_s[time_idx[0], :] = d0
-
-    ds.close()
-
-
-def parse_heave(output_name, file):
+    data_out = np.zeros((int(header['num_frequencies']), 4))
+    data_out.fill(np.nan)
+    for data_line, matchObj in enumerate(lines):
+        data_out[data_line, 1] = float(matchObj.group(2))
+        data_out[data_line, 2] = float(matchObj.group(3))
+        data_out[data_line, 3] = float(matchObj.group(4))
+        data_out[data_line, 0] = float(matchObj.group(1))
+
+    # density, direction, spread on the FREQ dimension
+    return {'ts': header['ts'], 'version': header['version'], 'spec': freq_match(data_out[:, 0], data_out[:, 1:4])}
+
+
+def write_mean_dir(ds, results):
+
+    version = results[0]['version']
+
+    # print("dimensions ", ds.dimensions)
+    if "FREQ" not in ds.dimensions:
+        freq_dim = ds.createDimension("FREQ", 129)
+    else:
+        freq_dim = ds.dimensions['FREQ']
+    # print(freq_dim)
+
+    if "MEAN_DENSITY" not in ds.variables:
+        ncVarOut_d = ds.createVariable("MEAN_DENSITY", "f4", ("TIME", "FREQ"), fill_value=np.nan, zlib=True)  # fill_value=nan otherwise defaults to max
+        ncVarOut_d.units = "m^2/Hz"
+        ncVarOut_d.comment = "spectral density"
+        ncVarOut_d.comment_processing_version = version
+    else:
+        ncVarOut_d = ds.variables["MEAN_DENSITY"]
+    if "MEAN_DIR" not in ds.variables:
+        ncVarOut = ds.createVariable("MEAN_DIR", "f4", ("TIME", "FREQ"), fill_value=np.nan, zlib=True)  # fill_value=nan otherwise defaults to max
+        ncVarOut.units = "degrees"
+        ncVarOut.comment = "mean direction"
+        ncVarOut.comment_processing_version = version
+    else:
+        ncVarOut = ds.variables["MEAN_DIR"]
+
+    if "MEAN_DIR_SPREAD" not in ds.variables:
+        ncVarOut_s = ds.createVariable("MEAN_DIR_SPREAD", "f4", ("TIME", "FREQ"), fill_value=np.nan, zlib=True)  # fill_value=nan otherwise defaults to max
+        ncVarOut_s.units = "degrees"
+        ncVarOut_s.comment = "mean direction spread"
+        ncVarOut_s.comment_processing_version = version
+    else:
+        ncVarOut_s = ds.variables["MEAN_DIR_SPREAD"]
+
+    if "FREQ" not in ds.variables:
+        freq_var = ds.createVariable("FREQ", "f4", ("FREQ"), fill_value=None)  # fill_value=nan otherwise defaults to max
+        freq_var.units = "Hz"
+        freq_var.comment = "frequency"
+        freq_var[:] = spec_freq
+
+    else:
+        freq_var = ds.variables["FREQ"]
+
+    idx, rows = time_rows(results, file_times(ds))
+    put_rows(ncVarOut_d, idx, [r['spec'][:, 0] for r in rows])
+    put_rows(ncVarOut, idx, [r['spec'][:, 1] for r in rows])
+    put_rows(ncVarOut_s, idx, [r['spec'][:, 2] for r in rows])
+
+
+def read_heave(file):
     # TRIAXYS·BUOY·DATA·REPORT·-·TAS04811¶
     # VERSION→=·6a.02.08¶
     # TYPE→   =·HNE¶
@@ -605,101 +501,56 @@ def parse_heave(output_name, file):
     # ··63.29···0.00···0.00···0.00¶
     # ··64.07···0.00···0.00···0.00¶
 
-    data_line = 0
-    first = True
+    header, lines = read_report(file, data4_line_expr)
+    if not lines:
+        return None
 
-    ds = Dataset(output_name, 'a')
+    data_out = np.array([[float(matchObj.group(k)) for k in range(1, 5)] for matchObj in lines])
 
-    with open(file, 'r', errors='ignore') as fp:
-        line = fp.readline()
-        matchObj = re.match(first_line_expr, line)
-        if not matchObj:
-            print("Not a TriAXYS file !")
-            exit(-1)
+    # sample time, and up (heave), north, east
+    return {'ts': header['ts'], 'version': header['version'], 'num_points': int(header['num_points']),
+            'sample_time': data_out[:, 0], 'data': data_out[:, 1:4].astype(np.float32)}
 
-        cnt = 1
-        while line:
 
-            matchObj = re.match(date_expr, line)
-            if matchObj:
-                # print("date_expr:matchObj.group() : ", matchObj.group())
-                # print("date_expr:matchObj.group(1) : ", matchObj.group(1))
-                # print("date_expr:matchObj.group(2) : ", matchObj.group(2))
-                ts = datetime.datetime.strptime(matchObj.group(1), "%Y %b %d %H:%M")
-                print("timestamp ", ts)
-            matchObj = re.match(num_points_expr, line)
-            if matchObj:
-                # print("num_freq_expr:matchObj.group() : ", matchObj.group())
-                # print("num_freq_expr:matchObj.group(1) : ", matchObj.group(1))
-                num_points = int(matchObj.group(1))
-                num_points = 1382 # TODO: HACK hard coded, some files are different number of samples
-            matchObj = re.match(version_expr, line)
-            if matchObj:
-                # print("freq_space_expr:matchObj.group() : ", matchObj.group())
-                # print("freq_space_expr:matchObj.group(1) : ", matchObj.group(1))
-                version = matchObj.group(1)
+def write_heave(ds, results):
 
-            matchObj = re.match(data4_line_expr, line)
-            if matchObj:
-                if first:
-                    times_num = ds.variables["TIME"]
-                    times = num2date(times_num[:], units=times_num.units, calendar=times_num.calendar)
-                    # print("dimensions ", ds.dimensions)
-                    if "UVH_SAMPLE" not in ds.dimensions:
-                        sample_dim = ds.createDimension("UVH_SAMPLE", num_points)
-                        # print(freq_dim)
-                    if "UVH_VECTOR" not in ds.dimensions:
-                        heave_vector_dim = ds.createDimension("UVH_VECTOR", 3)
-
-                    if "UVH" not in ds.variables:
-                        ncVarOut = ds.createVariable("UVH", "f4", ("TIME", "UVH_SAMPLE", "UVH_VECTOR"), fill_value=np.nan)  # fill_value=nan otherwise defaults to max
-                        ncVarOut.units = "m"
-                        ncVarOut.comment = "from heave processed file, up (heave), north, east"
-                        ncVarOut.comment_processing_version = version
-                    else:
-                        ncVarOut = ds.variables["UVH"]
-
-                    if "UVH_SAMPLE" not in ds.variables:
-                        sample_t_var = ds.createVariable("UVH_SAMPLE", "f4", ("UVH_SAMPLE"), fill_value=None)  # fill_value=nan otherwise defaults to max
-                        sample_t_var.units = "s"
-                        sample_t_var.comment = "heave sample time"
-                    else:
-                        sample_t_var = ds.variables["UVH_SAMPLE"]
-                        num_points = sample_t_var.shape[0]
-
-                    # print (ncVarOut)
-                    first = False
-                    cnt = 0
-
-                    data_out = np.zeros((num_points, 3))
-                    data_out.fill(np.nan)
-                    sample_time_out = np.zeros((num_points))
-                    sample_time_out.fill(np.nan)
-
-                    time_idx = np.where(times == ts)
-                    print("time index", time_idx, time_idx[0].shape)
-
-                # print("data_line_expr:matchObj.group() : ", matchObj.group())
-                # print("data_line_expr:matchObj.group(1) : ", matchObj.group(1))
-                # print("data_line_expr:matchObj.group(2) : ", matchObj.group(2))
-                sample_time_out[data_line] = float(matchObj.group(1))
-
-                data_out[data_line, 0] = float(matchObj.group(2))
-                data_out[data_line, 1] = float(matchObj.group(3))
-                data_out[data_line, 2] = float(matchObj.group(4))
-                data_line += 1
-
-            line = fp.readline()
-
-        if time_idx[0].shape[0] > 0:
-            ncVarOut[time_idx[0], :] = data_out
-
-        sample_t_var[:] = sample_time_out
+    num_points = 1382 # TODO: HACK hard coded, some files are different number of samples
 
-    ds.close()
+    # print("dimensions ", ds.dimensions)
+    if "UVH_SAMPLE" not in ds.dimensions:
+        sample_dim = ds.createDimension("UVH_SAMPLE", num_points)
+        # print(freq_dim)
+    if "UVH_VECTOR" not in ds.dimensions:
+        heave_vector_dim = ds.createDimension("UVH_VECTOR", 3)
 
+    if "UVH" not in ds.variables:
+        ncVarOut = ds.createVariable("UVH", "f4", ("TIME", "UVH_SAMPLE", "UVH_VECTOR"), fill_value=np.nan)  # fill_value=nan otherwise defaults to max
+        ncVarOut.units = "m"
+        ncVarOut.comment = "from heave processed file, up (heave), north, east"
+        ncVarOut.comment_processing_version = results[0]['version']
+    else:
+        ncVarOut = ds.variables["UVH"]
 
-def parse_velocity(output_name, file):
+    if "UVH_SAMPLE" not in ds.variables:
+        sample_t_var = ds.createVariable("UVH_SAMPLE", "f4", ("UVH_SAMPLE"), fill_value=None)  # fill_value=nan otherwise defaults to max
+        sample_t_var.units = "s"
+        sample_t_var.comment = "heave sample time"
+    else:
+        sample_t_var = ds.variables["UVH_SAMPLE"]
+        num_points = sample_t_var.shape[0]
+
+    idx, rows = time_rows(results, file_times(ds))
+    put_rows(ncVarOut, idx, [r['data'] for r in rows])
+
+    # sample times from the last file
+    sample_time_out = np.zeros((num_points))
+    sample_time_out.fill(np.nan)
+    sample_time_out[:len(results[-1]['sample_time'])] = results[-1]['sample_time']
+
+    sample_t_var[:] = sample_time_out
+
+
+def read_velocity(file):
     # TRIAXYS BUOY DATA REPORT - TAS04811
     # VERSION = 6a.02.08
     # TYPE    = UVH
@@ -714,100 +565,49 @@ def parse_velocity(output_name, file):
     # 59.98   0.00   0.00   0.00
     # 60.12   0.00   0.00   0.00
 
-    data_line = 0
-    first = True
+    # same layout as the heave file
+    return read_heave(file)
 
-    ds = Dataset(output_name, 'a')
 
-    with open(file, 'r', errors='ignore') as fp:
-        line = fp.readline()
-        matchObj = re.match(first_line_expr, line)
-        if not matchObj:
-            print("Not a TriAXYS file !")
-            exit(-1)
+def write_velocity(ds, results):
 
-        cnt = 1
-        while line:
+    num_points = results[0]['num_points']
 
-            matchObj = re.match(date_expr, line)
-            if matchObj:
-                # print("date_expr:matchObj.group() : ", matchObj.group())
-                # print("date_expr:matchObj.group(1) : ", matchObj.group(1))
-                # print("date_expr:matchObj.group(2) : ", matchObj.group(2))
-                ts = datetime.datetime.strptime(matchObj.group(1), "%Y %b %d %H:%M")
-                print("timestamp ", ts)
-            matchObj = re.match(num_points_expr, line)
-            if matchObj:
-                # print("num_freq_expr:matchObj.group() : ", matchObj.group())
-                # print("num_freq_expr:matchObj.group(1) : ", matchObj.group(1))
-                num_points = int(matchObj.group(1))
-            matchObj = re.match(version_expr, line)
-            if matchObj:
-                # print("freq_space_expr:matchObj.group() : ", matchObj.group())
-                # print("freq_space_expr:matchObj.group(1) : ", matchObj.group(1))
-                version = matchObj.group(1)
+    # print("dimensions ", ds.dimensions)
+    if "HNE_SAMPLE" not in ds.dimensions:
+        velocity_sample_dim = ds.createDimension("HNE_SAMPLE", num_points)
+        # print(freq_dim)
+    if "HNE_VECTOR" not in ds.dimensions:
+        velocity_sample_dim = ds.createDimension("HNE_VECTOR", 3)
 
-            matchObj = re.match(data4_line_expr, line)
-            if matchObj:
-                if first:
-                    times_num = ds.variables["TIME"]
-                    times = num2date(times_num[:], units=times_num.units, calendar=times_num.calendar)
-                    # print("dimensions ", ds.dimensions)
-                    if "HNE_SAMPLE" not in ds.dimensions:
-                        velocity_sample_dim = ds.createDimension("HNE_SAMPLE", num_points)
-                        # print(freq_dim)
-                    if "HNE_VECTOR" not in ds.dimensions:
-                        velocity_sample_dim = ds.createDimension("HNE_VECTOR", 3)
-
-                    if "HNE" not in ds.variables:
-                        ncVarOut = ds.createVariable("HNE", "f4", ("TIME", "HNE_SAMPLE", "HNE_VECTOR"), fill_value=np.nan)  # fill_value=nan otherwise defaults to max
-                        ncVarOut.units = "m"
-                        ncVarOut.comment = "from velocity file processed file, heave, velocity north, velocity east"
-                        ncVarOut.comment_processing_version = version
-                    else:
-                        ncVarOut = ds.variables["HNE"]
-
-                    if "HNE_SAMPLE" not in ds.variables:
-                        sample_t_var = ds.createVariable("HNE_SAMPLE", "f4", ("HNE_SAMPLE"), fill_value=None)  # fill_value=nan otherwise defaults to max
-                        sample_t_var.units = "s"
-                        sample_t_var.comment = "HNE sample time"
-                    else:
-                        sample_t_var = ds.variables["HNE_SAMPLE"]
-                        num_points = sample_t_var.shape[0]
-
-                    # print (ncVarOut)
-                    first = False
-                    cnt = 0
-
-                    data_out = np.zeros((num_points, 3))
-                    data_out.fill(np.nan)
-                    sample_time_out = np.zeros((num_points))
-                    sample_time_out.fill(np.nan)
-
-                    time_idx = np.where(times == ts)
-                    print("time index", time_idx, time_idx[0].shape)
-
-                # print("data_line_expr:matchObj.group() : ", matchObj.group())
-                # print("data_line_expr:matchObj.group(1) : ", matchObj.group(1))
-                # print("data_line_expr:matchObj.group(2) : ", matchObj.group(2))
-                sample_time_out[data_line] = float(matchObj.group(1))
-
-                data_out[data_line, 0] = float(matchObj.group(2))
-                data_out[data_line, 1] = float(matchObj.group(3))
-                data_out[data_line, 2] = float(matchObj.group(4))
-                data_line += 1
-
-            line = fp.readline()
-
-        if time_idx[0].shape[0] > 0:
-            ncVarOut[time_idx[0], :] = data_out
-
-        sample_t_var[:] = sample_time_out
+    if "HNE" not in ds.variables:
+        ncVarOut = ds.createVariable("HNE", "f4", ("TIME", "HNE_SAMPLE", "HNE_VECTOR"), fill_value=np.nan)  # fill_value=nan otherwise defaults to max
+        ncVarOut.units = "m"
+        ncVarOut.comment = "from velocity file processed file, heave, velocity north, velocity east"
+        ncVarOut.comment_processing_version = results[0]['version']
+    else:
+        ncVarOut = ds.variables["HNE"]
 
-    ds.close()
+    if "HNE_SAMPLE" not in ds.variables:
+        sample_t_var = ds.createVariable("HNE_SAMPLE", "f4", ("HNE_SAMPLE"), fill_value=None)  # fill_value=nan otherwise defaults to max
+        sample_t_var.units = "s"
+        sample_t_var.comment = "HNE sample time"
+    else:
+        sample_t_var = ds.variables["HNE_SAMPLE"]
+        num_points = sample_t_var.shape[0]
 
+    idx, rows = time_rows(results, file_times(ds))
+    put_rows(ncVarOut, idx, [r['data'] for r in rows])
 
-def parse_fourier(output_name, file):
+    # sample times from the last file
+    sample_time_out = np.zeros((num_points))
+    sample_time_out.fill(np.nan)
+    sample_time_out[:len(results[-1]['sample_time'])] = results[-1]['sample_time']
+
+    sample_t_var[:] = sample_time_out
+
+
+def read_fourier(file):
     # TRIAXYS BUOY DATA REPORT
     # VERSION = 5b.02.08
     # TYPE    = FOURIER COEFFICIENTS
@@ -828,120 +628,90 @@ def parse_fourier(output_name, file):
     # 0.050  0.5766423E-01  0.4027935E-01  0.4134434E+00  0.4250077E+00
     # 0.055  0.9941293E-01  0.6338648E-01  0.4903382E+00  0.3010178E+00
 
-    data_line = 0
-    first = True
+    header, lines = read_report(file, data4_line_expr)
+    if not lines:
+        return None
+
+    data_out = np.zeros((int(header['num_frequencies']), 5))
+    data_out.fill(np.nan)
+    for data_line, matchObj in enumerate(lines):
+        data_out[data_line, 0] = float(matchObj.group(1))
+        data_out[data_line, 1] = float(matchObj.group(2))
+        data_out[data_line, 2] = float(matchObj.group(3))
+        data_out[data_line, 3] = float(matchObj.group(4))
+        data_out[data_line, 4] = float(matchObj.group(4))
+
+    return {'ts': header['ts'], 'version': header['version'], 'spec': freq_match(data_out[:, 0], data_out[:, 1:5])}
+
+
+def write_fourier(ds, results):
+
+    # print("dimensions ", ds.dimensions)
+    if "FREQ" not in ds.dimensions:
+        freq_dim = ds.createDimension("FREQ", 129)
+    else:
+        freq_dim = ds.dimensions['FREQ']
+    # print(freq_dim)
+    if "FOURIER_COEFF" not in ds.dimensions:
+        coeff_dim = ds.createDimension("FOURIER_COEFF", 4)
+
+    if "FOURIER_SPEC" not in ds.variables:
+        ncVarOut = ds.createVariable("FOURIER_SPEC", "f4", ("TIME", "FREQ", "FOURIER_COEFF"), fill_value=np.nan, zlib=True)  # fill_value=nan otherwise defaults to max
+        ncVarOut.units = "m^2/Hz"
+        ncVarOut.comment = "fourier coefficents, a1, b1, a2, b2"
+        ncVarOut.comment_processing_version = results[0]['version']
+    else:
+        ncVarOut = ds.variables["FOURIER_SPEC"]
+
+    if "FREQ" not in ds.variables:
+        freq_var = ds.createVariable("FREQ", "f4", ("FREQ"), fill_value=None)
+        freq_var.units = "Hz"
+        freq_var.comment = "frequency"
+        freq_var[:] = spec_freq
+    else:
+        freq_var = ds.variables["FREQ"]
+
+    idx, rows = time_rows(results, file_times(ds))
+    put_rows(ncVarOut, idx, [r['spec'] for r in rows])
+
+
+def write_file(output_name, writer, result):
+    # write the arrays read from one file to the netCDF file
+    if result is None:
+        return
 
     ds = Dataset(output_name, 'a')
+    writer(ds, [result])
+    ds.close()
 
-    with open(file, 'r', errors='ignore') as fp:
-        line = fp.readline()
-        matchObj = re.match(first_line_expr, line)
-        if not matchObj:
-            print("Not a TriAXYS file !")
-            exit(-1)
 
-        cnt = 1
-        while line:
+def parse_dir_spec(output_name, file):
+    write_file(output_name, write_dir_spec, read_dir_spec(file))
 
-            matchObj = re.match(date_expr, line)
-            if matchObj:
-                # print("date_expr:matchObj.group() : ", matchObj.group())
-                # print("date_expr:matchObj.group(1) : ", matchObj.group(1))
-                # print("date_expr:matchObj.group(2) : ", matchObj.group(2))
-                ts = datetime.datetime.strptime(matchObj.group(1), "%Y %b %d %H:%M")
-                print("timestamp ", ts)
-            matchObj = re.match(num_freq_expr, line)
-            if matchObj:
-                # print("num_freq_expr:matchObj.group() : ", matchObj.group())
-                # print("num_freq_expr:matchObj.group(1) : ", matchObj.group(1))
-                num_frequencies = int(matchObj.group(1))
-            matchObj = re.match(ini_freq_expr, line)
-            if matchObj:
-                # print("ini_freq_expr:matchObj.group() : ", matchObj.group())
-                # print("ini_freq_expr:matchObj.group(1) : ", matchObj.group(1))
-                pass
-            matchObj = re.match(freq_space_expr, line)
-            if matchObj:
-                # print("freq_space_expr:matchObj.group() : ", matchObj.group())
-                # print("freq_space_expr:matchObj.group(1) : ", matchObj.group(1))
-                pass
-            matchObj = re.match(version_expr, line)
-            if matchObj:
-                # print("freq_space_expr:matchObj.group() : ", matchObj.group())
-                # print("freq_space_expr:matchObj.group(1) : ", matchObj.group(1))
-                version = matchObj.group(1)
-                pass
-            matchObj = re.match(data4_line_expr, line)
-            if matchObj:
-                if first:
-                    times_num = ds.variables["TIME"]
-                    times = num2date(times_num[:], units=times_num.units, calendar=times_num.calendar)
-                    # print("dimensions ", ds.dimensions)
-                    if "FREQ" not in ds.dimensions:
-                        freq_dim = ds.createDimension("FREQ", 129)
-                    else:
-                        freq_dim = ds.dimensions['FREQ']
-                    # print(freq_dim)
-                    if "FOURIER_COEFF" not in ds.dimensions:
-                        coeff_dim = ds.createDimension("FOURIER_COEFF", 4)
-
-                    if "FOURIER_SPEC" not in ds.variables:
-                        ncVarOut = ds.createVariable("FOURIER_SPEC", "f4", ("TIME", "FREQ", "FOURIER_COEFF"), fill_value=np.nan, zlib=True)  # fill_value=nan otherwise defaults to max
-                        ncVarOut.units = "m^2/Hz"
-                        ncVarOut.comment = "fourier coefficents, a1, b1, a2, b2"
-                        ncVarOut.comment_processing_version = version
-                    else:
-                        ncVarOut = ds.variables["FOURIER_SPEC"]
-
-                    freq = np.arange(0, 0.005 * 129, 0.005)
-                    if "FREQ" not in ds.variables:
-                        freq_var = ds.createVariable("FREQ", "f4", ("FREQ"), fill_value=None)
-                        freq_var.units = "Hz"
-                        freq_var.comment = "frequency"
-                        freq_var[:] = freq
-                    else:
-                        freq_var = ds.variables["FREQ"]
-
-                    # print (ncVarOut)
-                    first = False
-
-                    data_out = np.zeros((num_frequencies, 5))
-                    data_out.fill(np.nan)
-
-                    time_idx = np.where(times == ts)
-                    print("time index", time_idx, time_idx[0].shape)
-
-                # print("data_line_expr:matchObj.group() : ", matchObj.group())
-                # print("data_line_expr:matchObj.group(1) : ", matchObj.group(1))
-                # print("data_line_expr:matchObj.group(2) : ", matchObj.group(2))
-                data_out[data_line, 0] = float(matchObj.group(1))
-                data_out[data_line, 1] = float(matchObj.group(2))
-                data_out[data_line, 2] = float(matchObj.group(3))
-                data_out[data_line, 3] = float(matchObj.group(4))
-                data_out[data_line, 4] = float(matchObj.group(4))
-
-                data_line += 1
-
-            line = fp.readline()
-            cnt += 1
 
-        xy, x_ind, y_ind = np.intersect1d(np.rint(data_out[:, 0]*1000), np.rint(freq*1000), return_indices=True)
-        #print('freq overlap', xy)
-        #print('freq overlap x_ind', x_ind)
-        #print('freq overlap y_ind', y_ind)
+def parse_raw(output_name, file):
+    write_file(output_name, write_raw, read_raw(file))
 
-        #print('shape ncVarOut', ncVarOut[:].shape)
-        #print('shape data_out', data_out.shape)
 
-        #print('data_out', data_out[x_ind, 1])
+def parse_non_dir_spec(output_name, file):
+    write_file(output_name, write_non_dir_spec, read_non_dir_spec(file))
 
-        d0 = np.zeros((129, 4))
-        if time_idx[0].shape[0] > 0:
-            d0.fill(np.nan)
-            d0[y_ind, :] = data_out[x_ind, 1:5]
-            ncVarOut[time_idx[0], :] = d0
 
-    ds.close()
+def parse_mean_dir(output_name, file):
+    write_file(output_name, write_mean_dir, read_mean_dir(file))
+
+
+def parse_heave(output_name, file):
+    write_file(output_name, write_heave, read_heave(file))
+
+
+def parse_velocity(output_name, file):
+    write_file(output_name, write_velocity, read_velocity(file))
+
+
+def parse_fourier(output_name, file):
+    write_file(output_name, write_fourier, read_fourier(file))
+
 
 wave_params = {}
 
@@ -1055,36 +825,18 @@ def parse_summary(output_name, file):
 
                 data[x] = float(odata[time_idx][var])
                 x += 1
-                ncVarOut[:] = data
-                ncVarOut.units = v['units']
-                if 'comment' in v:
-                    ncVarOut.comment = v['comment']
-
-    ncOut.close()
-
-    return number_samples_read
 
+            ncVarOut[:] = data
+            ncVarOut.units = v['units']
+            if 'comment' in v:
+                ncVarOut.comment = v['comment']
 
-def parse_wave_time(output_name, file):
-
-    with open(file, newline='') as csvfile:
-        reader = csv.DictReader(csvfile, delimiter='\t')
-        if 'Year' not in reader.fieldnames:
-            return
-
-        for row in reader:
-            #print(row)
-            times.append(datetime.datetime.strptime(row['Year']+' '+row['MonthDay']+' '+row['Time'], "%Y %m%d %H%M%S"))
-
-    number_samples_read = len(times)
-    print("time samples read ", number_samples_read)
+    ncOut.close()
 
     return number_samples_read
 
 
-def parse_wave(output_name, file):
-
-    ncOut = Dataset(output_name, 'a')
+def read_wave(file):
 
     wave_time = []
     odata = []
@@ -1092,7 +844,7 @@ def parse_wave(output_name, file):
     with open(file, newline='') as csvfile:
         reader = csv.DictReader(csvfile, delimiter='\t')
         if 'Year' not in reader.fieldnames:
-            return
+            return None
 
         for row in reader:
             #print(row)
@@ -1102,43 +854,138 @@ def parse_wave(output_name, file):
     number_samples_read = len(wave_time)
     print("sampled read ", number_samples_read)
 
+    # the values of each wave parameter column
+    columns = {}
     for var in odata[0]:
-        print('var', var, 'value', odata[0][var])
         if var in wave_params:
+            columns[var] = [float(row[var]) for row in odata]
+
+    return {'times': wave_time, 'columns': columns}
+
+
+def write_wave(ds, results):
+
+    # the WAVE files give the timestamps, so are matched to the times read, not to the TIME variable
+    index = time_index(times)
+
+    values = {}
+    for r in results:
+        for var in r['columns']:
             v = wave_params[var]
-            print("Variable %s (%s)" % (v['var_name'], v['units']))
             varName = v['var_name']
-            if varName not in ncOut.variables:
-                ncVarOut = ncOut.createVariable(varName, "f4", ("TIME",), fill_value=np.nan, zlib=True)  # fill_value=nan otherwise defaults to max
-            else:
-                ncVarOut = ncOut.variables[varName]
+            if varName not in values:
+                values[varName] = (v, {})
 
-            for sample in range(0, number_samples_read):
-                print(wave_time[sample])
-                ts = wave_time[sample]
-                time_idx = np.where(np.array(times) == ts)
-                print("time index", time_idx, time_idx[0].shape)
-                ncVarOut[time_idx[0]] = float(odata[sample][var])
+            for ts, value in zip(r['times'], r['columns'][var]):
+                for i in index.get(ts, []):
+                    values[varName][1][i] = value
 
-            ncVarOut.units = v['units']
-            if 'comment' in v:
-                ncVarOut.comment = v['comment']
+    for varName, (v, var_values) in values.items():
+        print("Variable %s (%s)" % (varName, v['units']))
+        if varName not in ds.variables:
+            ncVarOut = ds.createVariable(varName, "f4", ("TIME",), fill_value=np.nan, zlib=True)  # fill_value=nan otherwise defaults to max
+        else:
+            ncVarOut = ds.variables[varName]
 
+        idx = np.array(sorted(var_values), dtype=np.int64)
+        put_rows(ncVarOut, idx, [var_values[i] for i in idx])
 
-    ncOut.close()
+        ncVarOut.units = v['units']
+        if 'comment' in v:
+            ncVarOut.comment = v['comment']
 
 
-def parse_triaxys(files):
+def parse_wave(output_name, file):
+    write_file(output_name, write_wave, read_wave(file))
+
+
+# the product name, reader and writer for each file extension, the raw products are only included with --raw
+products = {'.WAVE': ('WAVE', read_wave, write_wave),
+            '.DIRSPEC': ('DIRSPEC', read_dir_spec, write_dir_spec),
+            '.NONDIRSPEC': ('NONDIR SPEC', read_non_dir_spec, write_non_dir_spec),
+            '.MEANDIR': ('MEAN DIR', read_mean_dir, write_mean_dir)}
+raw_products = {'.RAW': ('RAW', read_raw, write_raw),
+                '.HNE': ('Heave', read_heave, write_heave),
+                '.UVH': ('Heave, Velocity', read_velocity, write_velocity),
+                '.FOURIER': ('FOURIER', read_fourier, write_fourier)}
+
+
+def read_file(filepath, inc_raw):
+    # read the arrays from one file, returns the file extension (the product) and the arrays,
+    # or None if the file is not a product file
+
+    ext = os.path.splitext(filepath)[1]
+    if ext in products:
+        product, reader, writer = products[ext]
+    elif inc_raw and ext in raw_products:
+        product, reader, writer = raw_products[ext]
+    else:
+        return None, None
+
+    print(filepath)
+    print(product)
+
+    return ext, reader(filepath)
+
+
+def read_file_logged(filepath, inc_raw):
+    # run read_file collecting the log, so the output from files read in parallel is not interleaved,
+    # an exception is returned (as the traceback) rather than raised so one bad file does not stop the ingest
+
+    log = io.StringIO()
+    error = None
+    ext, result = None, None
+    with contextlib.redirect_stdout(log), contextlib.redirect_stderr(log):
+        try:
+            ext, result = read_file(filepath, inc_raw)
+        except Exception:
+            error = traceback.format_exc()
+
+    return ext, result, error, log.getvalue()
+
+
+def read_files(filelist, inc_raw, jobs=1):
+    # read each file, with jobs > 1 the files are read in a pool of worker processes. Returns the arrays from each
+    # file, in file order, for each product (in the order the products were first found), and the failed files
+
+    results = {}
+    failed = []
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) if jobs > 1 else contextlib.nullcontext() as pool:
+        if pool:
+            # lots of small files, send them to the workers in chunks
+            chunksize = max(1, min(64, len(filelist) // (jobs * 4)))
+            read = pool.map(read_file_logged, filelist, itertools.repeat(inc_raw), chunksize=chunksize)
+        else:
+            read = map(read_file_logged, filelist, itertools.repeat(inc_raw))
+
+        # map returns the results in the order the files were given, print each files log as a block
+        for filepath, (ext, result, error, log) in zip(filelist, read):
+            print(log, end='')
+            if error:
+                print(error)
+                failed.append(filepath)
+            elif result is not None:
+                results.setdefault(ext, []).append(result)
+
+    return results, failed
+
+
+def parse_triaxys(files, jobs=1):
     output_name = "TriAXYS.nc"
 
     inc_raw = True
 
     # create a list of files, scanning any directories
     filelist = []
-    for file in files:
+    args = iter(files)
+    for file in args:
         if file == '--raw':
             inc_raw = True
             output_name = "TriAXYS-incRAW.nc"
+        if file == '--jobs':
+            jobs = int(next(args))
+            continue
         if isfile(file):
             filelist.append(file)
         elif isdir(file):
@@ -1170,17 +1017,19 @@ def parse_triaxys(files):
     #     for f in filelist:
     #         print('zip file, filename', f)
 
-    # parse the Summary or WAVE files to get the timestamps
+    # parse the Summary files to get the timestamps
     for filepath in filelist:
-        print(filepath)
-
         # we either get a Summary file (SOFS-2 processor, 3.00.0005) or a .WAVE file (SOFS-4 onwards processor, 4.01.000)
         if filepath.endswith('Summary.txt') or filepath.endswith('Summary-Sort.txt'):
+            print(filepath)
             parse_summary(output_name, filepath)
 
-        elif filepath.endswith('.WAVE'):
-            print("WAVE read times")
-            parse_wave_time(output_name, filepath)
+    # read each product file, the WAVE files give the timestamps
+    product_results, failed = read_files(filelist, inc_raw, jobs)
+
+    for r in product_results.get('.WAVE', []):
+        times.extend(r['times'])
+        print("time samples read ", len(times))
 
     times.sort()
 
@@ -1190,6 +1039,7 @@ def parse_triaxys(files):
     # build the netCDF file
     #
     ncOut = Dataset(output_name, 'a')
+    ncTimesOut = ncOut.variables["TIME"]
 
     instrument_model = 'TriAXYS'
     instrument_serialnumber = '04811'
@@ -1219,42 +1069,18 @@ def parse_triaxys(files):
 
     # TODO make this able to take zip files
 
-    # parse each file
-    for filepath in filelist:
-        print(filepath)
+    # write each product, all files of a product at once
+    for ext, results in product_results.items():
+        product, reader, writer = products.get(ext) or raw_products[ext]
+        print(product, "files", len(results))
+        writer(ncOut, results)
 
-        if filepath.endswith('.WAVE'):
-            print("WAVE")
-            parse_wave(output_name, filepath)
-
-        elif filepath.endswith('.DIRSPEC'):
-            print("DIRSPEC")
-            parse_dir_spec(output_name, filepath)
-
-        elif filepath.endswith('.NONDIRSPEC'):
-            print("NONDIR SPEC")
-            parse_non_dir_spec(output_name, filepath)
-
-        elif filepath.endswith('.MEANDIR'):
-            print("MEAN DIR")
-            parse_mean_dir(output_name, filepath)
-
-        if inc_raw:
-            if filepath.endswith('.RAW'):
-                print("RAW")
-                parse_raw(output_name, filepath)
-
-            elif filepath.endswith('.HNE'):
-                print("Heave")
-                parse_heave(output_name, filepath)
-
-            elif filepath.endswith('.UVH'):
-                print("Heave, Velocity")
-                parse_velocity(output_name, filepath)
+    ncOut.close()
 
-            elif filepath.endswith('.FOURIER'):
-                print("FOURIER")
-                parse_fourier(output_name, filepath)
+    if failed:
+        print('failed files')
+        for f in failed:
+            print('  ', f)
 
     return output_name
 
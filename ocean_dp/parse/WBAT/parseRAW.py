@@ -1,3 +1,4 @@
+import hashlib
 import os
 import struct
 import sys
@@ -22,6 +23,61 @@ def unpack_float(d, data_type):
 size_tuple_set = list()
 datagroup = None
 
+ping_block = 16  # pings buffered for each ensemble group before writing them to the netCDF file
+chunk_bytes = 1024 * 1024  # size of (uncompressed) chunks of the sample variables
+
+param_cache = {}  # parsed parameter group xml, by content hash
+group_state = {}  # content hash of the parameters and filters last written to each ensemble group
+ping_buffers = {}  # pings waiting to be written, for each ensemble group
+
+
+def parse_parameters(par_xml):
+    # parse the parameter group xml, the parameters only change when the echosounder is reconfigured, so keep the
+    # parsed values by the hash of the xml, returns the hash and the values to add to the ensemble group
+    key = hashlib.sha1(par_xml.encode('utf-8')).hexdigest()
+    if key not in param_cache:
+        channel = xmltodict.parse(par_xml)['Parameter']['Channel']
+        params = {}
+        params['FrequencyStart'] = float(channel['@FrequencyStart'])
+        params['FrequencyEnd'] = float(channel['@FrequencyEnd'])
+        params['PulseDuration'] = float(channel['@PulseDuration'])
+        params['SampleInterval'] = float(channel['@SampleInterval'])
+        params['NumberSamplesPerPulse'] = float(channel['@PulseDuration'])/float(channel['@SampleInterval'])
+        params['TransmitPower'] = float(channel['@TransmitPower'])
+        params['Slope'] = float(channel['@Slope'])
+        params['ChannelID'] = channel['@ChannelID']
+        param_cache[key] = params
+
+    return key, param_cache[key]
+
+
+def sample_chunks(n_samples, n_sectors):
+    # chunk shape for a (TIME, samples, SECTORS, COMPLEX) float32 variable, a block of pings in each chunk
+    n_time = max(1, min(ping_block, chunk_bytes // (n_samples * n_sectors * 2 * 4)))
+
+    return [n_time, n_samples, n_sectors, 2]
+
+
+def flush_pings(datagroup):
+    # write the buffered pings of an ensemble group, one slab for each variable
+    buffer = ping_buffers.get(datagroup.name)
+    if not buffer or len(buffer['time']) == 0:
+        return
+
+    n = len(buffer['time'])
+    time_var = datagroup.variables['TIME']
+    i = time_var.size
+    print('  write pings', datagroup.name, i, n)
+
+    time_var[i:i + n] = buffer['time']
+    datagroup.variables['SAMPLE'][i:i + n] = np.stack(buffer['samples'])
+    datagroup.variables['TX_V_SAMPLES'][i:i + n] = np.stack(buffer['tx_v'])
+    datagroup.variables['TX_I_SAMPLES'][i:i + n] = np.stack(buffer['tx_i'])
+
+    for v in buffer.values():
+        v.clear()
+
+
 def parseRAW(file, dataset, summary_file):
 
     print('file name', file)
@@ -138,12 +194,12 @@ def parseRAW(file, dataset, summary_file):
                     times.calendar = 'gregorian'
 
             time_var = datagroup.variables['TIME']
-            raw_samples = time_var.size
-            #print('raw_samples', raw_samples)
 
             #print('  RAW3: size, tuples', sample_size_n, size_tuple_set)
 
-            samples = struct.unpack('<' + str(data_samples * count * 2) + 'f', d[pos:])
+            # complex samples, (samples, sectors) complex64, as float32 (samples, sectors, real/imaginary)
+            samples = np.frombuffer(d, dtype='<c8', count=count * data_samples, offset=pos)
+            samples = samples.view('<f4').reshape([count, data_samples, 2])
 
             #for i in range(0, 5, 2):
             #    print('  samples', i, samples[i], samples[i+1])
@@ -153,90 +209,78 @@ def parseRAW(file, dataset, summary_file):
 
             if 'SAMPLES' not in datagroup.dimensions:
                 samples_dim = datagroup.createDimension('SAMPLES', count)
-                samples_var = datagroup.createVariable('SAMPLE', np.float64, ('TIME', 'SAMPLES', 'SECTORS', 'COMPLEX'), fill_value=np.nan)
-            else:
-                samples_var = datagroup.variables['SAMPLE']
-
-            # parse parameter group XML
-            ordered_dict = xmltodict.parse(par_xml)
-            #print('ordered_dict', ordered_dict)
-            NumberSamplesPerPulse = float(ordered_dict['Parameter']['Channel']['@PulseDuration'])/float(ordered_dict['Parameter']['Channel']['@SampleInterval'])
-            datagroup.FrequencyStart = float(ordered_dict['Parameter']['Channel']['@FrequencyStart'])
-            datagroup.FrequencyEnd = float(ordered_dict['Parameter']['Channel']['@FrequencyEnd'])
-            datagroup.PulseDuration = float(ordered_dict['Parameter']['Channel']['@PulseDuration'])
-            datagroup.SampleInterval = float(ordered_dict['Parameter']['Channel']['@SampleInterval'])
-            datagroup.NumberSamplesPerPulse = NumberSamplesPerPulse
-            datagroup.TransmitPower = float(ordered_dict['Parameter']['Channel']['@TransmitPower'])
-            datagroup.Slope = float(ordered_dict['Parameter']['Channel']['@Slope'])
-            datagroup.ChannelID = ordered_dict['Parameter']['Channel']['@ChannelID']
+                datagroup.createVariable('SAMPLE', np.float32, ('TIME', 'SAMPLES', 'SECTORS', 'COMPLEX'), fill_value=np.nan,
+                                         zlib=True, shuffle=True, chunksizes=sample_chunks(count, data_samples))
+
+            # parse parameter group XML, (once for each different parameter group)
+            param_key, params = parse_parameters(par_xml)
+            NumberSamplesPerPulse = params['NumberSamplesPerPulse']
 
             ns = int(np.ceil(NumberSamplesPerPulse))+18
 
             if 'TX_SAMPLES' not in datagroup.dimensions:
                 datagroup.createDimension('TX_SAMPLES', ns)
-                tx_v_samples_var = datagroup.createVariable('TX_V_SAMPLES', np.float32, ('TIME', 'TX_SAMPLES', 'SECTORS', 'COMPLEX'), fill_value=np.nan)
-                tx_i_samples_var = datagroup.createVariable('TX_I_SAMPLES', np.float32, ('TIME', 'TX_SAMPLES', 'SECTORS', 'COMPLEX'), fill_value=np.nan)
-            else:
-                tx_v_samples_var = datagroup.variables['TX_V_SAMPLES']
-                tx_i_samples_var = datagroup.variables['TX_I_SAMPLES']
+                datagroup.createVariable('TX_V_SAMPLES', np.float32, ('TIME', 'TX_SAMPLES', 'SECTORS', 'COMPLEX'), fill_value=np.nan,
+                                         zlib=True, shuffle=True, chunksizes=sample_chunks(ns, data_samples))
+                datagroup.createVariable('TX_I_SAMPLES', np.float32, ('TIME', 'TX_SAMPLES', 'SECTORS', 'COMPLEX'), fill_value=np.nan,
+                                         zlib=True, shuffle=True, chunksizes=sample_chunks(ns, data_samples))
 
             fx1 = filters1[channel_id]
             fx2 = filters2[channel_id]
 
-            datagroup.filter_stage1_no_of_coeff = np.int32(fx1[0])
-            datagroup.filter_stage2_no_of_coeff = np.int32(fx2[0])
+            # only update the group parameters and filters when they change
+            state = (param_key, fx1[3], fx2[3])
+            if group_state.get(datagroup.name) != state:
+                group_state[datagroup.name] = state
 
-            datagroup.filter_stage1_decimation_factor = np.int32(fx1[1])
-            datagroup.filter_stage2_decimation_factor = np.int32(fx2[1])
+                for name in params:
+                    datagroup.setncattr(name, params[name])
 
-            # if N1 is not None and N2 is not None:
-            #     total_filter_delay = (N1/2/D1 + N2/2) / D2
-            #     print('   total filter delay', total_filter_delay)
+                datagroup.filter_stage1_no_of_coeff = np.int32(fx1[0])
+                datagroup.filter_stage2_no_of_coeff = np.int32(fx2[0])
 
-            if 'FILTER1' not in datagroup.dimensions:
-                filter_dim = datagroup.createDimension('FILTER1', fx1[0])
-                filter1_var = datagroup.createVariable('FILTER1', np.float64, ('FILTER1',), fill_value=np.nan)
-            else:
-                filter1_var = datagroup.variables['FILTER1']
+                datagroup.filter_stage1_decimation_factor = np.int32(fx1[1])
+                datagroup.filter_stage2_decimation_factor = np.int32(fx2[1])
 
-            #print('  FILTER1: ', filter1_var, len(fx1[2]))
-            filter1_var[:] = fx1[2]
+                # if N1 is not None and N2 is not None:
+                #     total_filter_delay = (N1/2/D1 + N2/2) / D2
+                #     print('   total filter delay', total_filter_delay)
 
-            if 'FILTER2' not in datagroup.dimensions:
-                filter_dim = datagroup.createDimension('FILTER2', fx2[0])
-                filter2_var = datagroup.createVariable('FILTER2', np.float64, ('FILTER2',), fill_value=np.nan)
-            else:
-                filter2_var = datagroup.variables['FILTER2']
+                if 'FILTER1' not in datagroup.dimensions:
+                    filter_dim = datagroup.createDimension('FILTER1', fx1[0])
+                    filter1_var = datagroup.createVariable('FILTER1', np.float64, ('FILTER1',), fill_value=np.nan)
+                else:
+                    filter1_var = datagroup.variables['FILTER1']
 
-            #print('  FILTER2: ', filter2_var, len(fx2[2]))
-            filter2_var[:] = fx2[2]
+                #print('  FILTER1: ', filter1_var, len(fx1[2]))
+                filter1_var[:] = fx1[2]
 
-            time_var[raw_samples] = date2num(dt, time_var.units, time_var.calendar)
+                if 'FILTER2' not in datagroup.dimensions:
+                    filter_dim = datagroup.createDimension('FILTER2', fx2[0])
+                    filter2_var = datagroup.createVariable('FILTER2', np.float64, ('FILTER2',), fill_value=np.nan)
+                else:
+                    filter2_var = datagroup.variables['FILTER2']
 
-            samples_var[raw_samples] = samples
+                #print('  FILTER2: ', filter2_var, len(fx2[2]))
+                filter2_var[:] = fx2[2]
 
             # extract the transmit measurements
-            #  tx voltage and tx current are packed in the 32 bit as 16 bit floating points
-            tx_v = np.zeros(ns * data_samples * 2, dtype=np.float32)
-            tx_i = np.zeros(ns * data_samples * 2, dtype=np.float32)
-            for i in range(ns):
-                for j in range(data_samples):
-                    for k in range(2):
-                        #print(i, j, k, samples[k + j * 2 + i * data_samples])
-                        s = samples[k + j * 2 + i * data_samples * 2]
-                        packed_float = struct.pack('>f', s)
-                        padded_float = packed_float[0:2] + b'\00\00' + packed_float[2:4] + b'\00\00'
-                        floats32 = struct.unpack('>ff', padded_float)
-                        tx_v[k + j * 2 + i * data_samples * 2] = floats32[0]
-                        tx_i[k + j * 2 + i * data_samples * 2] = floats32[1]
-                        #tx_i_samples_var[raw_samples][i][j][k] = floats32[1]
-                        #print(tx_v)
-                        #print(raw_samples, i, j, k, s, floats32[0], floats32[1], tx_v_samples_var[raw_samples][i][j][k], tx_i_samples_var[raw_samples][i][j][k])
-
-            tx_v_samples_var[raw_samples] = tx_v
-            tx_i_samples_var[raw_samples] = tx_i
-            #print(tx_v_samples_var[:])
-            raw_samples += 1
+            #  tx voltage and tx current are packed in the 32 bit as 16 bit floating points, the top 16 bits of a float32
+            tx_bits = samples[:ns].view(np.uint32)
+            tx_v = (tx_bits & 0xffff0000).view(np.float32)
+            tx_i = (tx_bits << 16).view(np.float32)
+
+            # buffer the ping, write a block of pings at once
+            if datagroup.name not in ping_buffers:
+                ping_buffers[datagroup.name] = {'time': [], 'samples': [], 'tx_v': [], 'tx_i': []}
+            buffer = ping_buffers[datagroup.name]
+            buffer['time'].append(date2num(dt, time_var.units, time_var.calendar))
+            buffer['samples'].append(samples)
+            buffer['tx_v'].append(tx_v)
+            buffer['tx_i'].append(tx_i)
+            if len(buffer['time']) >= ping_block:
+                flush_pings(datagroup)
+
             samples_in_file += 1
 
         # extract the filters
@@ -254,24 +298,26 @@ def parseRAW(file, dataset, summary_file):
                 D2 = decimation_factor
                 filter_coeff2 = np.zeros((N2,))
             pos = 136
-            for i in range(0, no_of_coeff):
-                if stage == 1:
-                    fc1, = struct.unpack('<f', d[pos:pos + 4])
-                    filter_coeff1[i] = fc1
-                if stage == 2:
-                    fc2, = struct.unpack('<f', d[pos:pos + 4])
-                    filter_coeff2[i] = fc2
-                pos += 4
-                #print('    filter', i, 'coeff', filter_coeff)
             if stage == 1:
-                filters1[channel_id] = (N1, D1, filter_coeff1)
+                filter_coeff1[:] = np.frombuffer(d, dtype='<f4', count=no_of_coeff, offset=pos)
             if stage == 2:
-                filters2[channel_id] = (N2, D2, filter_coeff2)
+                filter_coeff2[:] = np.frombuffer(d, dtype='<f4', count=no_of_coeff, offset=pos)
+            #print('    filter', 'coeff', filter_coeff)
+
+            # with the content hash of the filter, to know when it changes
+            if stage == 1:
+                filters1[channel_id] = (N1, D1, filter_coeff1, hashlib.sha1(d).hexdigest())
+            if stage == 2:
+                filters2[channel_id] = (N2, D2, filter_coeff2, hashlib.sha1(d).hexdigest())
 
         hdr_data = f.read(hdr_len)
 
         print(' len_next', len(hdr_data))
 
+    # write the pings left in the buffers
+    for name in ping_buffers:
+        flush_pings(dataset.groups[name])
+
     summary_file.write(',first_time,' + str(first_time) + ',last_time,' + str(dt) + ',samples_in_file,' + str(samples_in_file) + ',' + note + '\n')
 
     print()
@@ -28,7 +28,6 @@ import numpy as np
 import os
 import re
 
-import struct
 from collections import namedtuple
 
 # source file must have 'timek' column for time
@@ -92,6 +91,55 @@ def create_nc_var(d_array, imu_times, name_name, imu_array, nc_var, done_ind, im
 
     nc_var[:] = d_array
 
+# bytes that are not part of a string, everything except printable ascii
+not_text = bytes([b for b in range(256) if b < 0x20 or b >= 128])
+
+
+def imu_candidates(buf):
+    # position of each IMU stabQ packet sync byte (0x0c) in the file, and if the checksum of the packet after it is good,
+    # the checksum is 12 (the sync byte) plus the first 14 big endian shorts of the packet
+    cands = np.flatnonzero(buf == 0x0c)
+    ok = np.zeros(len(cands), dtype=bool)
+
+    full = cands + 31 <= len(buf)
+    if np.any(full):
+        words = buf[cands[full, None] + np.arange(1, 31)].view('>u2')
+        ok[full] = ((12 + words[:, :14].sum(axis=1, dtype=np.uint32)) & 0xffff) == words[:, 14]
+
+    return cands, ok
+
+
+def packet_run(packet_ok, c, step):
+    # number of good packets back to back, starting with the packet at c, packet_ok is true at the start of each good packet
+    k = 1
+    while True:
+        idx = c + step * np.arange(k, k + 4096)
+        idx = idx[idx + step <= len(packet_ok)]
+        stop = np.flatnonzero(~packet_ok[idx])
+        if len(stop) > 0:
+            return k + stop[0]
+        if len(idx) < 4096:
+            return k + len(idx)
+        k += 4096
+
+
+def split_strings(text, xs):
+    # split the bytes between packets into strings at each CR, keeping only the printable characters,
+    # returns the strings completed and the start of the next string (or None)
+    parts = text.split(b'\r')
+    strings = []
+    for part in parts[:-1]:
+        part = (xs or b'') + part.translate(None, not_text)
+        if part:
+            strings.append(part.decode('ascii'))
+        xs = None
+
+    part = parts[-1].translate(None, not_text)
+    if part:
+        xs = (xs or b'') + part
+
+    return strings, xs
+
 # TODO make this able to take zip files
 
 def datalogger(outputName, files):
@@ -105,11 +153,20 @@ def datalogger(outputName, files):
                    'Load': 15,
                    }
 
-    scale = [1/ 8192.0, 1/ 8192.0, 1/ 8192.0, 1/ 8192.0,
+    scale = np.array([1/ 8192.0, 1/ 8192.0, 1/ 8192.0, 1/ 8192.0,
              1/ (32768000.0 / 2000), 1/ (32768000.0 / 2000), 1/ (32768000.0 / 2000),
              9.81/ (32768000.0 / 8500), 9.81/ (32768000.0 / 8500), 9.81/ (32768000.0 / 8500),
              1 / (32768000.0 / 10000), 1 / (32768000.0 / 10000), 1 / (32768000.0 / 10000),
-             0.2, 1, 1]
+             0.2, 1, 1])
+
+    # packet after the sync byte, '>4h3h3h3hHHf' with the load, the first 15 values without
+    imu_dtype = np.dtype({'names': list(decode_dict), 'formats': ['>i2'] * 13 + ['>u2', '>u2', '>f4']})
+    imu_dtype_no_load = np.dtype({'names': list(decode_dict)[:15], 'formats': ['>i2'] * 13 + ['>u2', '>u2']})
+
+    accel_idx = [decode_dict['AccelX'], decode_dict['AccelY'], decode_dict['AccelZ']]
+    quat_idx = [decode_dict['StabQ0'], decode_dict['StabQ1'], decode_dict['StabQ2'], decode_dict['StabQ3']]
+    mag_idx = [decode_dict['MagFieldX'], decode_dict['MagFieldY'], decode_dict['MagFieldZ']]
+    gyro_idx = [decode_dict['CompAngleRateX'], decode_dict['CompAngleRateY'], decode_dict['CompAngleRateZ']]
 
     start_data = re.compile(r'(\d{4}\-\d{2}\-\d{2} \d{2}:\d{2}:\d{2}) \*\*\*\*\*\* START RAW MRU DATA \*\*\*\*\*\*')
     end_data = re.compile(r'(\d{4}\-\d{2}\-\d{2} \d{2}:\d{2}:\d{2}) \*\*\*\*\*\* END DATA \*\*\*\*\*\*')
@@ -161,239 +218,237 @@ def datalogger(outputName, files):
             start_time = datetime.strptime(matchobj.group(1), "%Y-%m-%dT%H%M%S")
             print('file name timestamp', start_time)
 
-        with open(file, "rb") as f:
-            byte = f.read(1)
-            while byte != b"":
-                if byte[0] == 0x0c:  # start of IMU stabQ packet
-                    pos = f.tell()
+        # read the whole file, find the IMU packets and check all the checksums at once, then walk through the file,
+        # strings between the packets are decoded one at a time, a run of packets back to back is decoded together
+
+        buf = np.fromfile(file, dtype=np.uint8)
+        n = len(buf)
+
+        (cands, cands_ok) = imu_candidates(buf)
+        packet_ok = np.zeros(n, dtype=bool)
+        packet_ok[cands[cands_ok]] = True
+
+        pos = 0
+        while pos < n:
+            ci = np.searchsorted(cands, pos)
+            c = cands[ci] if ci < len(cands) else n
+
+            # strings before the next packet
+            (strings, xs) = split_strings(buf[pos:c].tobytes(), xs)
+            for s in strings:
+                #print('string', len(s), ' :', s)
+
+                data_time = None
+
+                # check for start of data
+                matchobj = start_data.match(s)
+                if matchobj:
+                    if sample > 0:  # save the sample data if we had some before the START_DATA
+                        #print('** START, saving IMU sample data', start_time, sample)
+                        imu_array.append({'time': start_time, 'accel': accel_samples, 'q': quat_samples, 'mag': mag_samples, 'gyro': gyro_samples, 'load': load_samples})
+                        sample = 0
+
+                    data_time = datetime.strptime(matchobj.group(1), "%Y-%m-%d %H:%M:%S")
+                    if data_time > datetime(2030,1,1):
+                        data_time = data_time - timedelta(seconds=810989538)
+
+                    #print('start_data time ', data_time)
+                    start_time = data_time
+
+                # check for end data
+                matchobj = end_data.match(s)
+                if matchobj:
+                    #print('end data ', sample, 'last sample idx', samples_read)
+                    if sample > 0:  # save the sample data
+                        #print('end of IMU sample data', start_time, sample)
+                        imu_array.append({'time': start_time, 'accel': accel_samples, 'q': quat_samples, 'mag': mag_samples, 'gyro': gyro_samples, 'load': load_samples})
+                        sample = 0
+
+                # check for done
+                matchobj = done_str.match(s)
+                if matchobj:
+                    data_time = datetime.strptime(matchobj.group(1), "%Y-%m-%d %H:%M:%S")
+                    if data_time > datetime(2030,1,1):
+                        data_time = data_time - timedelta(seconds=810989538)
+
+                    #print('done time ', data_time)
+                    start_time = data_time
+
+                    # split the done string, extract name=value paris, for names in nameMap add to done_array
+                    split = re.split(" ,| ", matchobj.group(2))
+                    #print(split)
+                    done_dict = {'time': data_time}
+                    for i in split:
+                        nv = i.split('=')
+                        name = nv[0]
+                        if name in nameMap:
+                            try:
+                                value = float(nv[1])
+                            except (ValueError, IndexError):
+                                value = np.nan
+                            done_dict.update({nameMap[name]: value})
+
+                    done_array.append(done_dict)
+
+                # check for gps fix
+                gps = None
+                matchobj = gps_fix.match(s)
+                if matchobj:
+                    data_time = datetime.strptime(matchobj.group(1), "%Y-%m-%d %H:%M:%S")
+                    if data_time > datetime(2030,1,1):
+                        data_time = data_time - timedelta(seconds=810989538)
+
+                    #print('gps fix time ', data_time)
+                    gps_array.append({'time': data_time, 'lon': float(matchobj.group(4))*-1, 'lat': float(matchobj.group(3))})
+
+                matchobj = gps_fix2.match(s)
+                if matchobj:
+                    data_time = datetime.strptime(matchobj.group(1), "%Y-%m-%d %H:%M:%S")
+                    if data_time > datetime(2030,1,1):
+                        data_time = data_time - timedelta(seconds=810989538)
+
+                    #print('gps fix time ', data_time)
+                    gps_array.append({'time': data_time, 'lon': float(matchobj.group(4))*-1, 'lat': float(matchobj.group(3))})
+
+                matchobj = gps_rmc.match(s)
+                if matchobj:
+                    data_time = datetime.strptime(matchobj.group(1), "%Y-%m-%d %H:%M:%S")
+                    if data_time > datetime(2030,1,1):
+                        data_time = data_time - timedelta(seconds=810989538)
+
+                    rmc_split = matchobj.group(2).split(',')
+                    #print('rmc split', rmc_split)
+                    if rmc_split[2] == 'A':
+                        try:
+                            lat_dm = float(rmc_split[3])
+                            lat_ns = rmc_split[4]
+                            lon_dm = float(rmc_split[5])
+                            lon_ew = rmc_split[6]
+
+                            lat = gps_dm_degree(lat_dm, lat_ns)
+                            lon = gps_dm_degree(lon_dm, lon_ew)
+
+                            data_time_rmc = datetime.strptime(rmc_split[9] + ' ' + rmc_split[1] + '000', "%d%m%y %H%M%S.%f")
+                            #print('rmc time ', data_time, data_time_rmc)
+
+                            rmc_array.append({'time': data_time, 'gps_time': data_time_rmc, 'lat': lat, 'lon': lon})
+                        except ValueError:
+                            pass
+
+                # check for serial number
+                matchobj = sn.match(s)
+                if matchobj:
+                    instrument_serial_number = matchobj.group(2)
+
+                matchobj = sn_imu2.match(s)
+                if matchobj:
+                    instrument_imu_serial_number = matchobj.group(2)
+                else:
+                    matchobj = sn_imu.match(s)
+                    if matchobj:
+                        instrument_imu_serial_number = matchobj.group(2)
+
+                matchobj = sn_imu_hex.match(s)
+                if matchobj:
+                    instrument_imu_serial_number = str(int(matchobj.group(2), base=16))
+
+                matchobj = wave_raw_str.match(s)
+                if matchobj:
+                    size_wave_file = int(matchobj.group(2))
+                    #print("wave file size", size_wave_file)
+                    if size_wave_file < (3072 * (30+4)):
+                        have_load = False
+                    else:
+                        have_load = True
+
+            if c >= n:
+                break
+
+            # start of IMU stabQ packet
+            p_len = 30
+            if have_load:
+                p_len = p_len + 4
+
+            if c + 1 + p_len > n:
+                print(file, 'short packet', sample)
+                break
+
+            if not cands_ok[ci]:
+                print(file, 'bad checksum', c + 1 + p_len)
+                pos = c + 2
+                continue
+
+            # check sum ok, decode the packets, and scale each value in the packet
+            k = packet_run(packet_ok, c, p_len + 1)
+            dtype = imu_dtype if have_load else imu_dtype_no_load
+            packets = buf[c + 1 + (p_len + 1) * np.arange(k)[:, None] + np.arange(p_len)].view(dtype)[:, 0]
+            decode_scale = np.stack([packets[name].astype(np.float64) for name in dtype.names], axis=1) * scale[:len(dtype.names)]
+            timer = decode_scale[:, decode_dict['Timer']]
+            pos = c + (p_len + 1) * k
+
+            j = 0
+            while j < k:
+                samples_read += 1
+
+                # save data to arrays, packets while the IMU timer follows the sample number are saved together
+                if 0 < sample < 3072:
+                    m = min(k - j, 3072 - sample)
+                    # find the sample index from the IMU timer, need to detect missed samples in the record
+                    sample_t = ((timer[j:j + m] - t0) * 5 + 0.5).astype(np.int64)
+                    miss = np.flatnonzero(sample_t != sample + np.arange(m))
+                    if len(miss) > 0:
+                        m = miss[0]
+                    if m > 0:
+                        accel_samples[sample:sample + m] = decode_scale[j:j + m][:, accel_idx]
+                        quat_samples[sample:sample + m] = decode_scale[j:j + m][:, quat_idx]
+                        mag_samples[sample:sample + m] = decode_scale[j:j + m][:, mag_idx]
+                        gyro_samples[sample:sample + m] = decode_scale[j:j + m][:, gyro_idx]
+                        if have_load:
+                            load_samples[sample:sample + m] = decode_scale[j:j + m, decode_dict['Load']]
+
+                        samples_read += m - 1
+                        sample += m
+                        j += m
+                        continue
+
+                # one packet at a time, at the start of the record, or a missed sample
+                if sample == 0:
+                    accel_samples = np.full([3072, 3], np.nan)
+                    mag_samples = np.full([3072, 3], np.nan)
+                    gyro_samples = np.full([3072, 3], np.nan)
+                    quat_samples = np.full([3072, 4], np.nan)
+
+                    load_samples = np.full([3072], np.nan)
+
+                    samples_read = 0
+
+                if sample < 3072:
+                    accel_samples[sample] = decode_scale[j, accel_idx]
+                    quat_samples[sample] = decode_scale[j, quat_idx]
+                    mag_samples[sample] = decode_scale[j, mag_idx]
+                    gyro_samples[sample] = decode_scale[j, gyro_idx]
 
-                    p_len = 30
                     if have_load:
-                        p_len = p_len + 4
-
-                    packet = f.read(p_len)
-                    if len(packet) == p_len:
-                        # check the checksum
-                        decode_s = struct.unpack('>15H', packet[0:30])
-                        cksum = 12
-                        for i in range(0, 14):
-                            cksum = cksum + decode_s[i]
-                        cksum = cksum & 0xffff
-                        if cksum == decode_s[14]:
-                            # check sum ok, decode the packet
-                            samples_read += 1
-
-                            if have_load:
-                                decode = struct.unpack('>4h3h3h3hHHf', packet)
-                            else:
-                                decode = struct.unpack('>4h3h3h3hHH', packet)
-
-                            # scale each value in the packet
-                            decode_scale = []
-                            for x in range(0,len(decode)):
-                                d = decode[x] * scale[x]
-                                decode_scale.append(d)
-
-                            # print decoded data as dict
-                            #decode_d = dict(zip(decode_dict, decode))
-                            #print('decode timer', decode_d['Timer'], 'sample', sample)
-
-                            # save data to arrays
-                            if sample == 0:
-                                accel_samples = np.full([3072, 3], np.nan)
-                                mag_samples = np.full([3072, 3], np.nan)
-                                gyro_samples = np.full([3072, 3], np.nan)
-                                quat_samples = np.full([3072, 4], np.nan)
-
-                                load_samples = np.full([3072], np.nan)
-
-                                samples_read = 0
-
-                            if sample < 3072:
-                                accel_samples[sample, 0] = decode_scale[decode_dict['AccelX']]
-                                accel_samples[sample, 1] = decode_scale[decode_dict['AccelY']]
-                                accel_samples[sample, 2] = decode_scale[decode_dict['AccelZ']]
-
-                                quat_samples[sample, 0] = decode_scale[decode_dict['StabQ0']]
-                                quat_samples[sample, 1] = decode_scale[decode_dict['StabQ1']]
-                                quat_samples[sample, 2] = decode_scale[decode_dict['StabQ2']]
-                                quat_samples[sample, 3] = decode_scale[decode_dict['StabQ3']]
-
-                                mag_samples[sample, 0] = decode_scale[decode_dict['MagFieldX']]
-                                mag_samples[sample, 1] = decode_scale[decode_dict['MagFieldY']]
-                                mag_samples[sample, 2] = decode_scale[decode_dict['MagFieldZ']]
-
-                                gyro_samples[sample, 0] = decode_scale[decode_dict['CompAngleRateX']]
-                                gyro_samples[sample, 1] = decode_scale[decode_dict['CompAngleRateY']]
-                                gyro_samples[sample, 2] = decode_scale[decode_dict['CompAngleRateZ']]
-
-                                if have_load:
-                                    load_samples[sample] = decode_scale[decode_dict['Load']]
-
-                                #print('IMU sample',sample,  accel_samples[sample, 2], gyro_samples[sample, 2])
-
-                                # find the sample index from the IMU timer, need to detect missed samples in the record
-                                if sample == 0:
-                                    t0 = int(decode_scale[decode_dict['Timer']] * 5)/5
-
-                                sample_t = int((decode_scale[decode_dict['Timer']] - t0) * 5 + 0.5)
-                                if (sample_t - sample) != 0:
-                                    print('re-sync time sample', sample, 'sample_t', sample_t, 'first time', t0, 'timer', decode_scale[decode_dict['Timer']], 'timer since sample 0', (decode_scale[decode_dict["Timer"]] - t0) * 5)
-
-                                sample = sample_t
-
-                                sample += 1
-
-                            else:
-                                sample = 0
-
-                        else:
-                            print(file, 'bad checksum', f.tell())
-                            f.seek(pos+1)
-                    else:
-                        print(file, 'short packet', sample)
-
-                elif (byte[0] >= 0x20) and (byte[0] < 128):  # start of string
-                    if xs is None:
-                        xs = bytearray()
-                        #print('start of string', f.tell())
-                    xs.append(byte[0])
-
-                elif (xs is not None) and (byte[0] == 13):
-
-                        s = xs.decode('ascii')
-                        xs = None
-
-                        #print('string', len(s), ' :', s)
-
-                        data_time = None
-
-                        # check for start of data
-                        matchobj = start_data.match(s)
-                        if matchobj:
-                            if sample > 0:  # save the sample data if we had some before the START_DATA
-                                #print('** START, saving IMU sample data', start_time, sample)
-                                imu_array.append({'time': start_time, 'accel': accel_samples, 'q': quat_samples, 'mag': mag_samples, 'gyro': gyro_samples, 'load': load_samples})
-                                sample = 0
-
-                            data_time = datetime.strptime(matchobj.group(1), "%Y-%m-%d %H:%M:%S")
-                            if data_time > datetime(2030,1,1):
-                                data_time = data_time - timedelta(seconds=810989538)
-
-                            #print('start_data time ', data_time)
-                            start_time = data_time
-
-                        # check for end data
-                        matchobj = end_data.match(s)
-                        if matchobj:
-                            #print('end data ', sample, 'last sample idx', samples_read)
-                            if sample > 0:  # save the sample data
-                                #print('end of IMU sample data', start_time, sample)
-                                imu_array.append({'time': start_time, 'accel': accel_samples, 'q': quat_samples, 'mag': mag_samples, 'gyro': gyro_samples, 'load': load_samples})
-                                sample = 0
-
-                        # check for done
-                        matchobj = done_str.match(s)
-                        if matchobj:
-                            data_time = datetime.strptime(matchobj.group(1), "%Y-%m-%d %H:%M:%S")
-                            if data_time > datetime(2030,1,1):
-                                data_time = data_time - timedelta(seconds=810989538)
-
-                            #print('done time ', data_time)
-                            start_time = data_time
-
-                            # split the done string, extract name=value paris, for names in nameMap add to done_array
-                            split = re.split(" ,| ", matchobj.group(2))
-                            #print(split)
-                            done_dict = {'time': data_time}
-                            for i in split:
-                                nv = i.split('=')
-                                name = nv[0]
-                                if name in nameMap:
-                                    try:
-                                        value = float(nv[1])
-                                    except (ValueError, IndexError):
-                                        value = np.nan
-                                    done_dict.update({nameMap[name]: value})
-
-                            done_array.append(done_dict)
-
-                        # check for gps fix
-                        gps = None
-                        matchobj = gps_fix.match(s)
-                        if matchobj:
-                            data_time = datetime.strptime(matchobj.group(1), "%Y-%m-%d %H:%M:%S")
-                            if data_time > datetime(2030,1,1):
-                                data_time = data_time - timedelta(seconds=810989538)
-
-                            #print('gps fix time ', data_time)
-                            gps_array.append({'time': data_time, 'lon': float(matchobj.group(4))*-1, 'lat': float(matchobj.group(3))})
-
-                        matchobj = gps_fix2.match(s)
-                        if matchobj:
-                            data_time = datetime.strptime(matchobj.group(1), "%Y-%m-%d %H:%M:%S")
-                            if data_time > datetime(2030,1,1):
-                                data_time = data_time - timedelta(seconds=810989538)
-
-                            #print('gps fix time ', data_time)
-                            gps_array.append({'time': data_time, 'lon': float(matchobj.group(4))*-1, 'lat': float(matchobj.group(3))})
-
-                        matchobj = gps_rmc.match(s)
-                        if matchobj:
-                            data_time = datetime.strptime(matchobj.group(1), "%Y-%m-%d %H:%M:%S")
-                            if data_time > datetime(2030,1,1):
-                                data_time = data_time - timedelta(seconds=810989538)
-
-                            rmc_split = matchobj.group(2).split(',')
-                            #print('rmc split', rmc_split)
-                            if rmc_split[2] == 'A':
-                                try:
-                                    lat_dm = float(rmc_split[3])
-                                    lat_ns = rmc_split[4]
-                                    lon_dm = float(rmc_split[5])
-                                    lon_ew = rmc_split[6]
-
-                                    lat = gps_dm_degree(lat_dm, lat_ns)
-                                    lon = gps_dm_degree(lon_dm, lon_ew)
-
-                                    data_time_rmc = datetime.strptime(rmc_split[9] + ' ' + rmc_split[1] + '000', "%d%m%y %H%M%S.%f")
-                                    #print('rmc time ', data_time, data_time_rmc)
-
-                                    rmc_array.append({'time': data_time, 'gps_time': data_time_rmc, 'lat': lat, 'lon': lon})
-                                except ValueError:
-                                    pass
-
-                        # check for serial number
-                        matchobj = sn.match(s)
-                        if matchobj:
-                            instrument_serial_number = matchobj.group(2)
-
-                        matchobj = sn_imu2.match(s)
-                        if matchobj:
-                            instrument_imu_serial_number = matchobj.group(2)
-                        else:
-                            matchobj = sn_imu.match(s)
-                            if matchobj:
-                                instrument_imu_serial_number = matchobj.group(2)
-
-                        matchobj = sn_imu_hex.match(s)
-                        if matchobj:
-                            instrument_imu_serial_number = str(int(matchobj.group(2), base=16))
-
-                        matchobj = wave_raw_str.match(s)
-                        if matchobj:
-                            size_wave_file = int(matchobj.group(2))
-                            #print("wave file size", size_wave_file)
-                            if size_wave_file < (3072 * (30+4)):
-                                have_load = False
-                            else:
-                                have_load = True
-                else:
-                    #print(file, 'junk ', byte[0], 'at', f.tell())
+                        load_samples[sample] = decode_scale[j, decode_dict['Load']]
 
-                    pass
+                    #print('IMU sample',sample,  accel_samples[sample, 2], gyro_samples[sample, 2])
+
+                    # find the sample index from the IMU timer, need to detect missed samples in the record
+                    if sample == 0:
+                        t0 = int(timer[j] * 5)/5
 
-                byte = f.read(1)
+                    sample_t = int((timer[j] - t0) * 5 + 0.5)
+                    if (sample_t - sample) != 0:
+                        print('re-sync time sample', sample, 'sample_t', sample_t, 'first time', t0, 'timer', timer[j], 'timer since sample 0', (timer[j] - t0) * 5)
+
+                    sample = sample_t
+
+                    sample += 1
+
+                else:
+                    sample = 0
+
+                j += 1
 
         # add the last record if we did not get a START_DATA
         if sample > 0:
@@ -31,7 +31,9 @@ import struct
 from si_prefix import si_format
 
 import ctypes
-from array import array
+import mmap
+
+from ocean_dp.parse.packet_index import load_index, save_index
 
 # nortek data codes (these are in hex) from 'system integrator manual october 2017'
 #  0 User Configuration
@@ -164,6 +166,10 @@ coord_system = None
 
 coord_systems = ['ENU', 'XYZ', 'BEAM']
 
+scan_chunk = 16 * 1024 * 1024  # bytes searched for packets at a time
+max_packet_bytes = 2 * 0xffff  # packet size is a 16 bit count of words
+decode_chunk = 4 * 1024 * 1024  # bytes of packets gathered at a time when decoding
+
 
 def create_netCDF_var(ncfile, name, type, comment, units, dims):
 
@@ -220,9 +226,220 @@ def bcd_time_to_datetime(bcd):
     return dt
 
 
-def build_vector_system_data(ncOut, binary_file, pkt_pos_list, pkt_len, pkt_id, d, unpack):
+def bcd_times(bcd):
+    # bcd_time_to_datetime() and date2num() for an array of bcd times, returns days since 1950-01-01,
+    # NaN for any bcd time that is not a valid date
+    b = np.frombuffer(np.ascontiguousarray(bcd).tobytes(), dtype=np.uint8).reshape(-1, 6).astype(np.int64)
+    y = ((b >> 4) * 10) + (b & 0xf)
+    (minute, second, day, hour, year, month) = y.T
+
+    month_start = (((year + 2000 - 1970) * 12) + month - 1).astype('datetime64[M]')
+    date = month_start.astype('datetime64[D]') + (day - 1).astype('timedelta64[D]')
+    valid = (month >= 1) & (month <= 12) & (day >= 1) & (date.astype('datetime64[M]') == month_start)
+    valid &= (hour < 24) & (minute < 60) & (second < 60)
+
+    days = (date - np.datetime64('1950-01-01', 'D')).astype(np.float64) + ((hour * 3600) + (minute * 60) + second) / 86400
+    days[~valid] = np.nan
+    if not np.all(valid):
+        print('bad bcd time', np.count_nonzero(~valid), 'samples')
+
+    return days
+
+
+def map_file(binary_file):
+    # map the file into memory as an array of bytes, the packet scan and decode use views of this array
+    if os.fstat(binary_file.fileno()).st_size == 0:
+        return np.zeros(0, dtype=np.uint8)
+
+    return np.frombuffer(mmap.mmap(binary_file.fileno(), 0, access=mmap.ACCESS_READ), dtype=np.uint8)
+
+
+def word_sums(buf, start, end):
+    # running sum of the 16 bit words in buf[start:end], starting on an even byte, and on an odd byte,
+    # the sum of any run of words is then one subtraction, modulo 2^32 keeps the low 16 bits of the checksum
+    sums = []
+    for offset in (start, start + 1):
+        n_words = max(end - offset, 0) // 2
+        s = np.zeros(n_words + 1, dtype=np.uint32)
+        np.cumsum(buf[offset:offset + n_words * 2].view('<u2'), dtype=np.uint32, out=s[1:])
+        sums.append(s)
+
+    return sums
+
+
+def scan_chunk_packets(buf, c0, c1):
+    # find the sync bytes in buf[c0:c1], for each return the position, packet id, packet length in bytes (including
+    # the sync, id, size and checksum), if the packet runs past the end of the file (stop), and if the checksum is good
+    n = len(buf)
+    p = c0 + np.flatnonzero(buf[c0:c1] == 0xa5)
+
+    ids = np.zeros(len(p), dtype=np.uint8)
+    has_id = p + 1 < n
+    ids[has_id] = buf[p[has_id] + 1]
+
+    size = np.zeros(len(p), dtype=np.int64)
+    has_size = p + 3 < n
+    size[has_size] = buf[p[has_size] + 2] + (buf[p[has_size] + 3].astype(np.int64) << 8)
+    size[ids == 16] = 12  # Vector Velocity Data is fixed size, 24 bytes, and has no size word
+    length = size * 2
+
+    stop = ~has_id | (length <= 4) | (p + length > n)
+
+    good = np.zeros(len(p), dtype=bool)
+    c = np.flatnonzero(~stop)
+    if len(c) > 0:
+        sums = word_sums(buf, c0, min(n, c1 + max_packet_bytes))
+
+        # the checksum is 0xb58c plus the sum of all the words in the packet, except the checksum word at the end
+        o = p[c] - c0
+        k0 = o // 2
+        k1 = k0 + (length[c] // 2) - 1
+        checksum = np.zeros(len(c), dtype=np.uint32)
+        for parity in (0, 1):
+            m = (o % 2) == parity
+            checksum[m] = sums[parity][k1[m]] - sums[parity][k0[m]]
+
+        end = p[c] + length[c]
+        good[c] = ((checksum.astype(np.int64) + 0xb58c) & 0xffff) == (buf[end - 2] + (buf[end - 1].astype(np.int64) << 8))
+
+    return p, ids, length, stop, good
+
+
+def scan_packets(buf):
+    # find all the packets in the file, this gives the same packets as reading the file a packet at a time,
+    # a packet starts with the sync byte and must have a good checksum, after a good packet the search
+    # continues after it, otherwise from the next byte. The search stops at a packet that runs past the end of
+    # the file, or after more than 10 checksum errors
+    # returns the id, start and length (bytes) of each packet, and the position of each checksum error
+    n = len(buf)
+    chunks = [scan_chunk_packets(buf, c0, min(c0 + scan_chunk, n)) for c0 in range(0, n, scan_chunk)]
+    if len(chunks) == 0:
+        return np.zeros(0, dtype=np.uint8), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+    (p, ids, length, stop, good) = [np.concatenate(x) for x in zip(*chunks)]
+
+    # follow the good packets, each one to the first good packet after its end, sync bytes inside a packet are skipped
+    valid = np.flatnonzero(good)
+    next_valid = np.searchsorted(p[valid], p[valid] + length[valid]).tolist()
+    chain = []
+    i = 0
+    while i < len(next_valid):
+        chain.append(i)
+        i = next_valid[i]
+    pkts = valid[np.array(chain, dtype=np.int64)]
+    starts = p[pkts]
+    ends = starts + length[pkts]
+
+    # sync bytes not inside a packet, where the search would have found a checksum error, or stopped
+    bad = np.flatnonzero(~good)
+    k = np.searchsorted(starts, p[bad], side='right') - 1
+    bad = bad[(k < 0) | (p[bad] >= ends[np.maximum(k, 0)])]
+
+    end_pos = n
+    if np.any(stop[bad]):
+        end_pos = p[bad[stop[bad]][0]]
+    errors = bad[~stop[bad]]
+    if len(errors) > 10:
+        end_pos = min(end_pos, p[errors[10]])
+    errors = p[errors[p[errors] <= end_pos]]
+
+    for e in errors:
+        print("check sum error ", e)
+    if len(errors) > 10:
+        print("too many errors, maybe not a nortek file")
+
+    keep = starts < end_pos
+
+    return ids[pkts[keep]], starts[keep], length[pkts[keep]], errors
+
+
+def index_packets(filepath, buf, reindex=False):
+    # the packets in the file, from the packet index saved by an earlier run if it is still valid, otherwise scan
+    # the file and save the index, returns the same as scan_packets()
+    index = None
+    if not reindex:
+        index = load_index(filepath, 'nortek')
+
+    if index is None:
+        (ids, starts, lengths, errors) = scan_packets(buf)
+
+        # the id and length of the packet with the checksum error
+        error_ids = buf[errors + 1]
+        error_lengths = np.where(error_ids == 16, 24, 2 * (buf[errors + 2] + (buf[errors + 3].astype(np.int64) << 8)))
+
+        order = np.argsort(np.concatenate((starts, errors)), kind='stable')
+        index = {'type': np.concatenate((ids, error_ids))[order],
+                 'offset': np.concatenate((starts, errors))[order],
+                 'length': np.concatenate((lengths, error_lengths))[order],
+                 'checksum_ok': np.concatenate((np.ones(len(ids), dtype=bool), np.zeros(len(errors), dtype=bool)))[order]}
+        save_index(filepath, 'nortek', **index)
+
+    ok = index['checksum_ok']
+
+    return index['type'][ok], index['offset'][ok], index['length'][ok], index['offset'][~ok]
+
+
+packet_types = {'b': 'i1', 'B': 'u1', 'h': '<i2', 'H': '<u2', 'i': '<i4', 'I': '<u4', 'l': '<i4', 'L': '<u4', 'f': '<f4', 'd': '<f8'}
+
+
+def packet_dtype(unpack):
+    # numpy structured type for a (little endian) struct format, with a field for each value struct.unpack()
+    # returns, named f0, f1, ..., so the key index in the decoder dict is also the field number
+    formats = []
+    for count, code in re.findall(r'(\d*)([a-zA-Z])', unpack):
+        count = int(count) if count else 1
+        if code == 's':
+            formats.append('S' + str(count))
+        else:
+            formats.extend([packet_types[code]] * count)
+
+    return np.dtype({'names': ['f' + str(i) for i in range(len(formats))], 'formats': formats})
+
+
+def decode_packets(buf, pkt_pos_list, unpack, pkt_bytes):
+    # decode all the packets at the positions in pkt_pos_list, a block of packets is gathered from the file at a time
+    dt = packet_dtype(unpack)
+    if dt.itemsize != pkt_bytes:
+        raise struct.error('unpack requires a buffer of ' + str(dt.itemsize) + ' bytes')
+
+    pkt_pos_list = np.asarray(pkt_pos_list, dtype=np.int64)
+    pkt = np.empty(len(pkt_pos_list), dtype=dt)
+    offsets = np.arange(pkt_bytes)
+    block = max(decode_chunk // max(pkt_bytes, 1), 1)
+    for i in range(0, len(pkt_pos_list), block):
+        pos = pkt_pos_list[i:i + block]
+        pkt[i:i + len(pos)] = buf[pos[:, None] + offsets].view(dt)[:, 0]
+
+    return pkt
+
+
+def packet_field(pkt, i):
+    return pkt['f' + str(i)]
+
+
+def packet_fields(pkt, i, n):
+    # n values starting at field i, as a [packets, n] array
+    return np.stack([pkt['f' + str(i + j)] for j in range(n)], axis=-1)
+
+
+def packet_pressure(pkt, msb_id, lsw_id):
+    return ((packet_field(pkt, msb_id).astype(np.int64) * 65536) + packet_field(pkt, lsw_id)) * 0.001
+
+
+def burst_samples(header_pos, data_pos, number_data_samples, last_pos):
+    # the header each data packet follows (its burst), and the sample number in the burst,
+    # returns these for the packets used, and the mask of packets used, packets after number_data_samples in a burst,
+    # before the first header, and for the last header at or after last_pos are not used
+    burst = np.searchsorted(header_pos, data_pos, side='right') - 1
+    sample = np.arange(len(burst)) - np.searchsorted(burst, burst)
+    use = (burst >= 0) & (sample < number_data_samples)
+    use &= (burst < len(header_pos) - 1) | (data_pos < last_pos)
+
+    return burst[use], sample[use], use
+
+
+def build_vector_system_data(ncOut, buf, pkt_pos_list, pkt_len, pkt_id, d, unpack):
     time_start = datetime.datetime.now()
-    time_id = d['time_bcd']
 
     number_sys_samples = len(pkt_pos_list)
 
@@ -231,7 +448,6 @@ def build_vector_system_data(ncOut, binary_file, pkt_pos_list, pkt_len, pkt_id,
     ncSysTimesOut.long_name = "system data time"
     ncSysTimesOut.units = "days since 1950-01-01 00:00:00 UTC"
     ncSysTimesOut.calendar = "gregorian"
-    times_array = np.zeros([number_sys_samples])
 
     # TODO: check head_config for magnetometer, tilt and pressure sensor
     head = create_netCDF_var(ncOut, "HEADING_MAG", "f4", "heading magnetic", "degrees", ("SYS_TIME",))
@@ -244,45 +460,29 @@ def build_vector_system_data(ncOut, binary_file, pkt_pos_list, pkt_len, pkt_id,
     status = create_netCDF_var(ncOut, "STATUS", "i1", "status", "1", ("SYS_TIME",))
 
     var_list = []
-    var_list.append((head, d['head'], 10, np.empty([number_sys_samples], dtype=np.float32)))
-    var_list.append((pitch, d['pitch'], 10, np.empty([number_sys_samples], dtype=np.float32)))
-    var_list.append((roll, d['roll'], 10, np.empty([number_sys_samples], dtype=np.float32)))
-    var_list.append((bat, d['battery'], 10, np.empty([number_sys_samples], dtype=np.float32)))
-    var_list.append((itemp, d['temp'], 100, np.empty([number_sys_samples], dtype=np.float32)))
-    var_list.append((sspeed, d['soundSpd'], 10, np.empty([number_sys_samples], dtype=np.float32)))
-
-    var_list.append((error, d['error'], 10, np.empty([number_sys_samples], dtype=np.int8)))
-    var_list.append((status, d['status'], 10, np.empty([number_sys_samples], dtype=np.int8)))
-
-    # NaN fill any float variables
-    for v in var_list:
-        if v[3].dtype == 'float32':
-            v[3][:] = np.NaN
-
-    sample = 0
-    while sample < number_sys_samples:
-        binary_file.seek(pkt_pos_list[sample])
-        packet_data = binary_file.read(pkt_len[pkt_id] * 2 - 4)
-        packetDecode = struct.unpack(unpack, packet_data)
-
-        dt = bcd_time_to_datetime(packetDecode[time_id])
-        times_array[sample] = date2num(dt, calendar='gregorian', units="days since 1950-01-01 00:00:00 UTC")
+    var_list.append((head, d['head'], 10, np.float32))
+    var_list.append((pitch, d['pitch'], 10, np.float32))
+    var_list.append((roll, d['roll'], 10, np.float32))
+    var_list.append((bat, d['battery'], 10, np.float32))
+    var_list.append((itemp, d['temp'], 100, np.float32))
+    var_list.append((sspeed, d['soundSpd'], 10, np.float32))
 
-        for v in var_list:
-            v[3][sample] = packetDecode[v[1]] / v[2]
+    var_list.append((error, d['error'], 10, np.int8))
+    var_list.append((status, d['status'], 10, np.int8))
 
-        sample += 1
+    pkt = decode_packets(buf, pkt_pos_list, unpack, pkt_len[pkt_id] * 2 - 4)
+    times_array = bcd_times(packet_field(pkt, d['time_bcd']))
 
     print('read-data took', datetime.datetime.now() - time_start)
 
     ncSysTimesOut[:] = times_array
     for v in var_list:
-        v[0][:] = v[3]
+        v[0][:] = (packet_field(pkt, v[1]) / v[2]).astype(v[3])
 
     return
 
 
-def build_aquaprohr_data(ncOut, binary_file, pkt_pos_list, pkt_len, pkt_id, d, unpack, beams, cells):
+def build_aquaprohr_data(ncOut, buf, pkt_pos_list, pkt_len, pkt_id, d, unpack, beams, cells):
     time_start = datetime.datetime.now()
 
     number_samples = len(pkt_pos_list)
@@ -293,10 +493,6 @@ def build_aquaprohr_data(ncOut, binary_file, pkt_pos_list, pkt_len, pkt_id, d, u
     ncTimesOut.units = "days since 1950-01-01 00:00:00 UTC"
     ncTimesOut.calendar = "gregorian"
     ncTimesOut.axis = "T"
-    times_array = np.zeros([number_samples])
-
-    pres_array = np.empty([number_samples])
-    pres_array[:] = np.NaN
 
     print('HR pro, number beams, cells, cooridnate', beams, cells, coord_system)
     ncOut.createDimension("CELL", cells)
@@ -330,71 +526,42 @@ def build_aquaprohr_data(ncOut, binary_file, pkt_pos_list, pkt_len, pkt_id, d, u
     absci2 = create_netCDF_var(ncOut, "ABSIC2", "i2", "amplitude beam 2", "counts", ("TIME", "CELL"))
     absci3 = create_netCDF_var(ncOut, "ABSIC3", "i2", "amplitude beam 3", "counts", ("TIME", "CELL"))
 
-    sample = 0
-    time_id = d['time_bcd']
-    pred_msb_id = d['presMSB']
-    pred_lsb_id = d['presLSW']
-
     imu_vec_list = []
-    imu_vec_list.append((vel1, d['vel[0]'], 1000, np.empty([number_samples, cells], dtype=np.float32)))
-    imu_vec_list.append((vel2, d['vel[' + str(cells) + ']'], 1000, np.empty([number_samples, cells], dtype=np.float32)))
-    imu_vec_list.append(
-        (vel3, d['vel[' + str(cells * 2) + ']'], 1000, np.empty([number_samples, cells], dtype=np.float32)))
+    imu_vec_list.append((vel1, d['vel[0]'], 1000, np.float32))
+    imu_vec_list.append((vel2, d['vel[' + str(cells) + ']'], 1000, np.float32))
+    imu_vec_list.append((vel3, d['vel[' + str(cells * 2) + ']'], 1000, np.float32))
 
     var_list = []
-    var_list.append((head, d['head'], 10, np.empty([number_samples], dtype=np.float32)))
-    var_list.append((pitch, d['pitch'], 10, np.empty([number_samples], dtype=np.float32)))
-    var_list.append((roll, d['roll'], 10, np.empty([number_samples], dtype=np.float32)))
-    var_list.append((bat, d['battery'], 10, np.empty([number_samples], dtype=np.float32)))
-    var_list.append((itemp, d['temp'], 100, np.empty([number_samples], dtype=np.float32)))
-    var_list.append((sspeed, d['soundSpd'], 10, np.empty([number_samples], dtype=np.float32)))
-    var_list.append((analog1, d['AnaIn1'], 1, np.empty([number_samples], dtype=np.float32)))
-    var_list.append((analog2, d['AnaIn2'], 1, np.empty([number_samples], dtype=np.float32)))
-
-    imu_vec_list.append((absci1, d['amp[0]'], 1, np.zeros([number_samples, cells], dtype=int)))
-    imu_vec_list.append((absci2, d['amp[' + str(cells) + ']'], 1, np.zeros([number_samples, cells], dtype=int)))
-    imu_vec_list.append((absci3, d['amp[' + str(cells * 2) + ']'], 1, np.zeros([number_samples, cells], dtype=int)))
-
-    # NaN fill any float variables
-    for v in var_list:
-        if v[3].dtype == 'float32':
-            v[3][:] = np.NaN
-    for v in imu_vec_list:
-        if v[3].dtype == 'float32':
-            v[3][:] = np.NaN
-
-    while sample < len(pkt_pos_list):
-        binary_file.seek(pkt_pos_list[sample])
-        packet_data = binary_file.read(pkt_len[pkt_id] * 2 - 4)
-        packetDecode = struct.unpack(unpack, packet_data)
-
-        dt = bcd_time_to_datetime(packetDecode[time_id])
-        times_array[sample] = date2num(dt, calendar='gregorian', units="days since 1950-01-01 00:00:00 UTC")
-
-        for v in var_list:
-            v[3][sample] = packetDecode[v[1]] / v[2]
-        for v in imu_vec_list:
-            for i in range(cells):
-                v[3][sample, i] = packetDecode[v[1] + i] / v[2]
-
-        pres_array[sample] = ((packetDecode[pred_msb_id] * 65536) + packetDecode[pred_lsb_id]) * 0.001
-
-        sample += 1
+    var_list.append((head, d['head'], 10, np.float32))
+    var_list.append((pitch, d['pitch'], 10, np.float32))
+    var_list.append((roll, d['roll'], 10, np.float32))
+    var_list.append((bat, d['battery'], 10, np.float32))
+    var_list.append((itemp, d['temp'], 100, np.float32))
+    var_list.append((sspeed, d['soundSpd'], 10, np.float32))
+    var_list.append((analog1, d['AnaIn1'], 1, np.float32))
+    var_list.append((analog2, d['AnaIn2'], 1, np.float32))
+
+    imu_vec_list.append((absci1, d['amp[0]'], 1, int))
+    imu_vec_list.append((absci2, d['amp[' + str(cells) + ']'], 1, int))
+    imu_vec_list.append((absci3, d['amp[' + str(cells * 2) + ']'], 1, int))
+
+    pkt = decode_packets(buf, pkt_pos_list, unpack, pkt_len[pkt_id] * 2 - 4)
+    times_array = bcd_times(packet_field(pkt, d['time_bcd']))
 
     print('read-data took', datetime.datetime.now() - time_start)
 
     ncTimesOut[:] = times_array
     for v in var_list:
-        v[0][:] = v[3]
+        v[0][:] = (packet_field(pkt, v[1]) / v[2]).astype(v[3])
     for v in imu_vec_list:
-        print('saving', v[0].name, 'shape', v[3].shape)
-        v[0][:, :] = v[3]
-    pres[:] = pres_array
+        print('saving', v[0].name, 'shape', (number_samples, cells))
+        v[0][:, :] = (packet_fields(pkt, v[1], cells) / v[2]).astype(v[3])
+    pres[:] = packet_pressure(pkt, d['presMSB'], d['presLSW'])
 
     return ncTimesOut
 
 
-def build_aquadopp_data(ncOut, binary_file, pkt_pos_list, pkt_len, pkt_id, d, unpack):
+def build_aquadopp_data(ncOut, buf, pkt_pos_list, pkt_len, pkt_id, d, unpack):
     time_start = datetime.datetime.now()
 
     number_samples = len(pkt_pos_list)
@@ -405,10 +572,6 @@ def build_aquadopp_data(ncOut, binary_file, pkt_pos_list, pkt_len, pkt_id, d, un
     ncTimesOut.units = "days since 1950-01-01 00:00:00 UTC"
     ncTimesOut.calendar = "gregorian"
     ncTimesOut.axis = "T"
-    times_array = np.zeros([number_samples])
-
-    pres_array = np.empty([number_samples], dtype=np.float32)
-    pres_array[:] = np.NaN
 
     if coord_system == 2:
         vel1 = create_netCDF_var(ncOut, "VEL_B1", "f4", "velocity beam 1", "m/s", ("TIME",))
@@ -446,61 +609,41 @@ def build_aquadopp_data(ncOut, binary_file, pkt_pos_list, pkt_len, pkt_id, d, un
     error.comment = '0: compass, 1:measurement data, 2: sensor data, 3: tag bit, 4: flash, 6: serial CT sensor error'
     status.comment = '0: orientation (0 = up, 1 = down), 1: scaling (0=mm/s, 1=0.1 m/s), 2: pitch (0=ok, 1=out of range), 3: roll, 4,5: wake state, 6,7: power'
 
-    sample = 0
-    time_id = d['time_bcd']
-    pred_msb_id = d['presMSB']
-    pred_lsb_id = d['presLSW']
-
     var_list = []
-    var_list.append((vel1, d['vel_b1'], 1000, np.empty([number_samples], dtype=np.float32)))
-    var_list.append((vel2, d['vel_b2'], 1000, np.empty([number_samples], dtype=np.float32)))
-    var_list.append((vel3, d['vel_b3'], 1000, np.empty([number_samples], dtype=np.float32)))
-    var_list.append((head, d['head'], 10, np.empty([number_samples], dtype=np.float32)))
-    var_list.append((pitch, d['pitch'], 10, np.empty([number_samples], dtype=np.float32)))
-    var_list.append((roll, d['roll'], 10, np.empty([number_samples], dtype=np.float32)))
-    var_list.append((bat, d['battery'], 10, np.empty([number_samples], dtype=np.float32)))
-    var_list.append((itemp, d['temp'], 100, np.empty([number_samples], dtype=np.float32)))
-    var_list.append((sspeed, d['soundSpd_Anain2'], 10, np.empty([number_samples], dtype=np.float32)))
-    var_list.append((absci1, d['amp1'], 1, np.zeros([number_samples], dtype=int)))
-    var_list.append((absci2, d['amp2'], 1, np.zeros([number_samples], dtype=int)))
-    var_list.append((absci3, d['amp3'], 1, np.zeros([number_samples], dtype=int)))
+    var_list.append((vel1, d['vel_b1'], 1000, np.float32))
+    var_list.append((vel2, d['vel_b2'], 1000, np.float32))
+    var_list.append((vel3, d['vel_b3'], 1000, np.float32))
+    var_list.append((head, d['head'], 10, np.float32))
+    var_list.append((pitch, d['pitch'], 10, np.float32))
+    var_list.append((roll, d['roll'], 10, np.float32))
+    var_list.append((bat, d['battery'], 10, np.float32))
+    var_list.append((itemp, d['temp'], 100, np.float32))
+    var_list.append((sspeed, d['soundSpd_Anain2'], 10, np.float32))
+    var_list.append((absci1, d['amp1'], 1, int))
+    var_list.append((absci2, d['amp2'], 1, int))
+    var_list.append((absci3, d['amp3'], 1, int))
     if pkt_id == 129:
-        var_list.append((mag_x, d['mag_x'], 1, np.empty([number_samples], dtype=np.float32)))
-        var_list.append((mag_y, d['mag_y'], 1, np.empty([number_samples], dtype=np.float32)))
-        var_list.append((mag_z, d['mag_z'], 1, np.empty([number_samples], dtype=np.float32)))
-
-    var_list.append((error, d['error'], 1, np.zeros([number_samples], dtype=int)))
-    var_list.append((status, d['status'], 1, np.zeros([number_samples], dtype=int)))
-
-    # NaN fill any float variables
-    for v in var_list:
-        if v[3].dtype == 'float32':
-            v[3][:] = np.NaN
-
-    while sample < len(pkt_pos_list):
-        binary_file.seek(pkt_pos_list[sample])
-        packet_data = binary_file.read(pkt_len[pkt_id] * 2 - 4)
-        packetDecode = struct.unpack(unpack, packet_data)
+        var_list.append((mag_x, d['mag_x'], 1, np.float32))
+        var_list.append((mag_y, d['mag_y'], 1, np.float32))
+        var_list.append((mag_z, d['mag_z'], 1, np.float32))
 
-        dt = bcd_time_to_datetime(packetDecode[time_id])
-        times_array[sample] = date2num(dt, calendar='gregorian', units="days since 1950-01-01 00:00:00 UTC")
-        for v in var_list:
-            v[3][sample] = packetDecode[v[1]] / v[2]
-        pres_array[sample] = ((packetDecode[pred_msb_id] * 65536) + packetDecode[pred_lsb_id]) * 0.001
+    var_list.append((error, d['error'], 1, int))
+    var_list.append((status, d['status'], 1, int))
 
-        sample += 1
+    pkt = decode_packets(buf, pkt_pos_list, unpack, pkt_len[pkt_id] * 2 - 4)
+    times_array = bcd_times(packet_field(pkt, d['time_bcd']))
 
     print('read-data took', datetime.datetime.now() - time_start)
 
     ncTimesOut[:] = times_array
     for v in var_list:
-        v[0][:] = v[3]
-    pres[:] = pres_array
+        v[0][:] = (packet_field(pkt, v[1]) / v[2]).astype(v[3])
+    pres[:] = packet_pressure(pkt, d['presMSB'], d['presLSW']).astype(np.float32)
 
     return ncTimesOut
 
 
-def build_vector_velocity_data(ncOut, binary_file, pkt_pos, pkt_pos_list, pkt_len, pkt_id, d, unpack, number_data_samples):
+def build_vector_velocity_data(ncOut, buf, pkt_pos, pkt_pos_list, pkt_len, pkt_id, d, unpack, number_data_samples):
     time_start = datetime.datetime.now()
 
     number_samples = len(pkt_pos_list)
@@ -513,10 +656,6 @@ def build_vector_velocity_data(ncOut, binary_file, pkt_pos, pkt_pos_list, pkt_le
     ncTimesOut.calendar = "gregorian"
     ncTimesOut.axis = "T"
 
-    times_array = np.zeros([number_samples])
-
-    time_id = d['time_bcd']
-
     noise1 = create_netCDF_var(ncOut, "NOISE1", "i1", "noise amplitude beam 1", "counts", ("TIME",))
     noise2 = create_netCDF_var(ncOut, "NOISE2", "i1", "noise amplitude beam 2", "counts", ("TIME",))
     noise3 = create_netCDF_var(ncOut, "NOISE3", "i1", "noise amplitude beam 3", "counts", ("TIME",))
@@ -526,13 +665,13 @@ def build_vector_velocity_data(ncOut, binary_file, pkt_pos, pkt_pos_list, pkt_le
     corr3 = create_netCDF_var(ncOut, "CORR3", "i1", "noise correlation beam 1", "counts", ("TIME",))
 
     var_list = []
-    var_list.append((noise1, d['noise1'], 1, np.zeros([number_samples], dtype=np.int8)))
-    var_list.append((noise2, d['noise2'], 1, np.zeros([number_samples], dtype=np.int8)))
-    var_list.append((noise3, d['noise3'], 1, np.zeros([number_samples], dtype=np.int8)))
+    var_list.append((noise1, d['noise1'], 1, np.int8))
+    var_list.append((noise2, d['noise2'], 1, np.int8))
+    var_list.append((noise3, d['noise3'], 1, np.int8))
 
-    var_list.append((corr1, d['corr1'], 1, np.zeros([number_samples], dtype=np.int8)))
-    var_list.append((corr2, d['corr2'], 1, np.zeros([number_samples], dtype=np.int8)))
-    var_list.append((corr3, d['corr3'], 1, np.zeros([number_samples], dtype=np.int8)))
+    var_list.append((corr1, d['corr1'], 1, np.int8))
+    var_list.append((corr2, d['corr2'], 1, np.int8))
+    var_list.append((corr3, d['corr3'], 1, np.int8))
 
     ncOut.createDimension("BURST", number_data_samples)
 
@@ -552,8 +691,8 @@ def build_vector_velocity_data(ncOut, binary_file, pkt_pos, pkt_pos_list, pkt_le
     ana1 = create_netCDF_var(ncOut, "ANALOG1", "f4", "pres", "dbar", ("TIME", "BURST"))
     ana2 = create_netCDF_var(ncOut, "ANALOG2", "f4", "pres", "dbar", ("TIME", "BURST"))
 
+    # number of headers (bursts) decoded and written at a time
     cache_samples = 1000
-    cache_sample = 0
 
     # deal with IMU packets
     has_IMU = False
@@ -572,10 +711,7 @@ def build_vector_velocity_data(ncOut, binary_file, pkt_pos, pkt_pos_list, pkt_le
 
         vid_keys = packet_decoder[packet_id['Vector With IMU']]['keys']
 
-        binary_file.seek(pkt_pos[packet_id['Vector With IMU']][0])
-        vid_packet_data = binary_file.read(2)
-        vid_packetDecode = struct.unpack("<BB", vid_packet_data)
-        AHRS_id = vid_packetDecode[1]
+        AHRS_id = buf[pkt_pos[packet_id['Vector With IMU']][0] + 1]
         print('AHRS_id', hex(AHRS_id))
 
         has_orient = False
@@ -589,183 +725,104 @@ def build_vector_velocity_data(ncOut, binary_file, pkt_pos, pkt_pos_list, pkt_le
 
         vid_d = dict(zip(vid_keys, range(len(vid_keys))))
 
-    pres_array = np.empty([number_samples, number_data_samples], dtype=np.float32)
-    ana1_array = np.empty([number_samples, number_data_samples], dtype=np.float32)
-    ana2_array = np.empty([number_samples, number_data_samples], dtype=np.float32)
-
-    pres_array[:] = np.NaN
-    ana1_array[:] = np.NaN
-    ana2_array[:] = np.NaN
-
-    time_id = d['time_bcd']
     vvd_keys = packet_decoder[packet_id['Vector Velocity Data']]['keys']
     vvd_d = dict(zip(vvd_keys, range(len(vvd_keys))))
+    vvd_unpack = packet_decoder[packet_id['Vector Velocity Data']]['unpack']
+    vvd_len = pkt_len.get(packet_id['Vector Velocity Data'], 13) * 2 - 4
 
-    pres_msb_id = vvd_d['presMSB']
-    pres_lsb_id = vvd_d['presLSW']
-    ana1_id = vvd_d['AnaIn1']
-    ana2_msb_id = vvd_d['AnaIn2MSB']
-    ana2_lsb_id = vvd_d['AnaIn2LSB']
+    vvd_pos = pkt_pos.get(packet_id['Vector Velocity Data'], np.zeros(0, dtype=np.int64))
 
     vec_list = []
-    vec_list.append({'netCDF': vel1, 'ids': [vvd_d['vel1']], 'scale': 0.001, 'array': np.empty([cache_samples, number_data_samples], dtype=np.float32)})
-    vec_list.append({'netCDF': vel2, 'ids': [vvd_d['vel2']], 'scale': 0.001, 'array': np.empty([cache_samples, number_data_samples], dtype=np.float32)})
-    vec_list.append({'netCDF': vel3, 'ids': [vvd_d['vel3']], 'scale': 0.001, 'array': np.empty([cache_samples, number_data_samples], dtype=np.float32)})
+    vec_list.append({'netCDF': vel1, 'ids': [vvd_d['vel1']], 'scale': 0.001})
+    vec_list.append({'netCDF': vel2, 'ids': [vvd_d['vel2']], 'scale': 0.001})
+    vec_list.append({'netCDF': vel3, 'ids': [vvd_d['vel3']], 'scale': 0.001})
 
-    vec_list.append({'netCDF': amp1, 'ids': [vvd_d['amp1']], 'scale': 1, 'array': np.empty([cache_samples, number_data_samples], dtype=np.int8)})
-    vec_list.append({'netCDF': amp2, 'ids': [vvd_d['amp2']], 'scale': 1, 'array': np.empty([cache_samples, number_data_samples], dtype=np.int8)})
-    vec_list.append({'netCDF': amp3, 'ids': [vvd_d['amp3']], 'scale': 1, 'array': np.empty([cache_samples, number_data_samples], dtype=np.int8)})
+    vec_list.append({'netCDF': amp1, 'ids': [vvd_d['amp1']], 'scale': 1})
+    vec_list.append({'netCDF': amp2, 'ids': [vvd_d['amp2']], 'scale': 1})
+    vec_list.append({'netCDF': amp3, 'ids': [vvd_d['amp3']], 'scale': 1})
 
-    vec_list.append({'netCDF': corr1, 'ids': [vvd_d['corr1']], 'scale': 1, 'array': np.empty([cache_samples, number_data_samples], dtype=np.int8)})
-    vec_list.append({'netCDF': corr2, 'ids': [vvd_d['corr2']], 'scale': 1, 'array': np.empty([cache_samples, number_data_samples], dtype=np.int8)})
-    vec_list.append({'netCDF': corr3, 'ids': [vvd_d['corr3']], 'scale': 1, 'array': np.empty([cache_samples, number_data_samples], dtype=np.int8)})
-
-    for v in vec_list:
-        if v['array'].dtype == 'float32':
-            v['array'][:] = np.NaN
+    vec_list.append({'netCDF': corr1, 'ids': [vvd_d['corr1']], 'scale': 1})
+    vec_list.append({'netCDF': corr2, 'ids': [vvd_d['corr2']], 'scale': 1})
+    vec_list.append({'netCDF': corr3, 'ids': [vvd_d['corr3']], 'scale': 1})
 
     if has_IMU:
-        imu_vec_list = []
-        imu_vec_list.append({'netCDF': accel, 'ids': [vid_d['accelX'], vid_d['accelY'], vid_d['accelZ']], 'scale': 9.81, 'array': np.empty([cache_samples, number_data_samples, 3], dtype=np.float32)})
-        imu_vec_list.append(
-            {'netCDF': ang_rate, 'ids': [vid_d['angRateX'], vid_d['angRateY'], vid_d['angRateZ']], 'scale': 1.0,
-             'array': np.empty([cache_samples, number_data_samples, 3], dtype=np.float32)})
+        vid_pos = pkt_pos[packet_id['Vector With IMU']]
 
-        imu_vec_list.append(
-            {'netCDF': mag, 'ids': [vid_d['angRateX'], vid_d['MagX'], vid_d['MagX']], 'scale': 1.0,
-             'array': np.empty([cache_samples, number_data_samples, 3], dtype=np.float32)})
+        imu_vec_list = []
+        imu_vec_list.append({'netCDF': accel, 'ids': [vid_d['accelX'], vid_d['accelY'], vid_d['accelZ']], 'scale': 9.81})
+        imu_vec_list.append({'netCDF': ang_rate, 'ids': [vid_d['angRateX'], vid_d['angRateY'], vid_d['angRateZ']], 'scale': 1.0})
+        imu_vec_list.append({'netCDF': mag, 'ids': [vid_d['MagX'], vid_d['MagY'], vid_d['MagZ']], 'scale': 1.0})
 
         if has_orient:
             imu_vec_list.append(
                 {'netCDF': orient,
                  'ids': [vid_d['M11'], vid_d['M12'], vid_d['M13'], vid_d['M21'], vid_d['M22'], vid_d['M23'], vid_d['M31'], vid_d['M32'], vid_d['M33']],
-                 'scale': 1.0,
-                 'array': np.empty([cache_samples, number_data_samples, 9], dtype=np.float32)})
-
-        # fill all imu vector data with NaNs
-        for v in imu_vec_list:
-            if v['array'].dtype == 'float32':
-                v['array'][:] = np.NaN
-    sample = 0
-    cache_sample_start = 0
-
-    vvd_pkt_n = 0
-    vid_pkt_n = 0
-
-    while sample < len(pkt_pos_list):
-        binary_file.seek(pkt_pos_list[sample])
-        packet_data = binary_file.read(pkt_len[pkt_id] * 2 - 4)
-        packetDecode = struct.unpack(unpack, packet_data)
+                 'scale': 1.0})
 
-        dt = bcd_time_to_datetime(packetDecode[time_id])
-
-        times_array[sample] = date2num(dt, calendar='gregorian', units="days since 1950-01-01 00:00:00 UTC")
-
-        for v in var_list:
-            v[3][sample] = packetDecode[v[1]] / v[2]
-
-        # loop through 'Vector Velocity Data' and 'Vector with IMU' data for this system data
-        vvd_pos = pkt_pos[packet_id['Vector Velocity Data']]
-        if (sample + 1) < len(pkt_pos_list):
-            last_pos = pkt_pos_list[sample + 1]
-        else:
+    pkt = decode_packets(buf, pkt_pos_list, unpack, pkt_len[pkt_id] * 2 - 4)
+    ncTimesOut[:] = bcd_times(packet_field(pkt, d['time_bcd']))
+    for v in var_list:
+        v[0][:] = (packet_field(pkt, v[1]) / v[2]).astype(v[3])
+
+    # 'Vector Velocity Data' and 'Vector with IMU' packets belong to the header before them, the packets for the last
+    # header must be before the last 'Vector Velocity Data' packet, decode and write a block of headers at a time
+    vvd_used = 0
+    for sample in range(0, number_samples, cache_samples):
+        sample_end = min(sample + cache_samples, number_samples)
+        header_pos = pkt_pos_list[sample:sample_end]
+        n = len(header_pos)
+        if sample_end < number_samples:
+            last_pos = pkt_pos_list[sample_end]
+        elif len(vvd_pos) > 0:
             last_pos = vvd_pos[-1]
+        else:
+            last_pos = 0
 
-        vvd_unpack = packet_decoder[packet_id['Vector Velocity Data']]['unpack']
-        vvd_len = pkt_len[packet_id['Vector Velocity Data']] * 2 - 4
-        vvd_sample = 0
-        # skip to the next position after this 'Vector Velocity Data Header'
-        while vvd_pos[vvd_pkt_n] < pkt_pos_list[sample]:
-            print('skipping packet', vvd_pkt_n)
-            vvd_pkt_n += 1
-
-        while vvd_sample < number_data_samples and vvd_pkt_n < len(vvd_pos) and vvd_pos[vvd_pkt_n] < last_pos:
-            binary_file.seek(vvd_pos[vvd_pkt_n])
-            packet_data = binary_file.read(vvd_len)
-            packetDecode = struct.unpack(vvd_unpack, packet_data)
+        i0 = np.searchsorted(vvd_pos, header_pos[0])
+        i1 = np.searchsorted(vvd_pos, last_pos) if sample_end < number_samples else len(vvd_pos)
+        (burst, burst_sample, use) = burst_samples(header_pos, vvd_pos[i0:i1], number_data_samples, last_pos)
+        vvd_used += len(burst)
+        vvd = decode_packets(buf, vvd_pos[i0:i1][use], vvd_unpack, vvd_len)
 
-            # print('vector velocity sample', sample, vvd_sample, packetDecode[1], vvd_sample)
+        pres_array = np.full([n, number_data_samples], np.nan, dtype=np.float32)
+        pres_array[burst, burst_sample] = packet_pressure(vvd, vvd_d['presMSB'], vvd_d['presLSW'])
+        pres[sample:sample_end] = pres_array
 
-            pres_array[sample, vvd_sample] = ((packetDecode[pres_msb_id] * 65536) + packetDecode[pres_lsb_id]) * 0.001
-            ana1_array[sample, vvd_sample] = packetDecode[ana1_id]
-            ana2_array[sample, vvd_sample] = (packetDecode[ana2_msb_id] * 256) + packetDecode[ana2_lsb_id]
+        ana1_array = np.full([n, number_data_samples], np.nan, dtype=np.float32)
+        ana1_array[burst, burst_sample] = packet_field(vvd, vvd_d['AnaIn1'])
+        ana1[sample:sample_end] = ana1_array
 
-            for v in vec_list:
-                v['array'][cache_sample, vvd_sample] = packetDecode[v['ids'][0]] * v['scale']
+        ana2_array = np.full([n, number_data_samples], np.nan, dtype=np.float32)
+        ana2_array[burst, burst_sample] = (packet_field(vvd, vvd_d['AnaIn2MSB']).astype(np.int64) * 256) + packet_field(vvd, vvd_d['AnaIn2LSB'])
+        ana2[sample:sample_end] = ana2_array
 
-            vvd_sample += 1
-            vvd_pkt_n += 1
+        for v in vec_list:
+            array = np.full([n, number_data_samples], np.nan, dtype=np.float32)
+            array[burst, burst_sample] = packet_field(vvd, v['ids'][0]) * v['scale']
+            v['netCDF'][sample:sample_end] = array
 
         if has_IMU:
-            vid_pos = pkt_pos[packet_id['Vector With IMU']]
-            if (sample + 1) < len(pkt_pos_list):
-                last_pos = pkt_pos_list[sample + 1]
-            else:
-                last_pos = vvd_pos[-1]
-
-            vid_len = pkt_len[packet_id['Vector With IMU']] * 2 - 4
-            vid_sample = 0
-            # skip to the next position after this 'Vector Velocity Data Header'
-            while vid_pos[vid_pkt_n] < pkt_pos_list[sample]:
-                print('skipping packet', vid_pkt_n)
-                vid_pkt_n += 1
-
-            while vid_sample < number_data_samples and vid_pkt_n < len(vid_pos) and vid_pos[vid_pkt_n] < last_pos:
-                binary_file.seek(vid_pos[vid_pkt_n])
-                packet_data = binary_file.read(vid_len)
-                packetDecode = struct.unpack(vid_unpack, packet_data)
-
-                # print('vector IMU sample', sample, vid_sample, packetDecode[1], vid_sample)
-
-                for v in imu_vec_list:
-                    for i in range(len(v['ids'])):
-                        v['array'][cache_sample, vid_sample, i] = packetDecode[v['ids'][i]] * v['scale']
-
-                vid_sample += 1
-                vid_pkt_n += 1
-
-        cache_sample += 1
-        if cache_sample >= cache_samples:
-            print('write cache samples', sample, cache_sample_start, cache_sample, 'pres', pres_array[cache_sample_start, 0])
-            for v in vec_list:
-                v['netCDF'][cache_sample_start:cache_sample_start + cache_sample] = v['array']
-                if v['array'].dtype == 'float32':
-                    v['array'][:] = np.NaN
+            i0 = np.searchsorted(vid_pos, header_pos[0])
+            i1 = np.searchsorted(vid_pos, last_pos) if sample_end < number_samples else len(vid_pos)
+            (burst, burst_sample, use) = burst_samples(header_pos, vid_pos[i0:i1], number_data_samples, last_pos)
+            vid = decode_packets(buf, vid_pos[i0:i1][use], vid_unpack, vid_len)
 
             for v in imu_vec_list:
-                v['netCDF'][cache_sample_start:cache_sample_start + cache_sample] = v['array']
-                if v['array'].dtype == 'float32':
-                    v['array'][:] = np.NaN
+                array = np.full([n, number_data_samples, len(v['ids'])], np.nan, dtype=np.float32)
+                array[burst, burst_sample] = np.stack([packet_field(vid, i).astype(np.float64) * v['scale'] for i in v['ids']], axis=-1)
+                v['netCDF'][sample:sample_end] = array
 
-            cache_sample = 0
-            cache_sample_start = sample
+        print('write samples', sample, sample_end)
 
-        sample += 1
+    if vvd_used < len(vvd_pos):
+        print('skipped packets', len(vvd_pos) - vvd_used)
 
     print('read-data took', datetime.datetime.now() - time_start)
 
-    # save data to netCDF file variable
-    ncTimesOut[:] = times_array
-    for v in var_list:
-        v[0][:] = v[3]
-
-    pres[:] = pres_array
-    ana1[:] = ana1_array
-    ana2[:] = ana2_array
-
-    print('post write cache samples', cache_sample)
-
-    for v in vec_list:
-        v['netCDF'][cache_sample_start:cache_sample_start + cache_sample, :] = v['array'][0:cache_sample, :]
-
-    if has_IMU:
-        for v in imu_vec_list:
-            v['netCDF'][cache_sample_start:cache_sample_start + cache_sample, :, :] = v['array'][0:cache_sample, :, :]
-
     return ncTimesOut
 
 
-def build_aquapro_data(ncOut, binary_file, pkt_pos_list, pkt_len, pkt_id, d, unpack, number_bins):
+def build_aquapro_data(ncOut, buf, pkt_pos_list, pkt_len, pkt_id, d, unpack, number_bins):
     time_start = datetime.datetime.now()
 
     number_samples = len(pkt_pos_list)
@@ -775,10 +832,6 @@ def build_aquapro_data(ncOut, binary_file, pkt_pos_list, pkt_len, pkt_id, d, unp
     ncTimesOut.units = "days since 1950-01-01 00:00:00 UTC"
     ncTimesOut.calendar = "gregorian"
     ncTimesOut.axis = "T"
-    times_array = np.zeros([number_samples])
-
-    pres_array = np.empty([number_samples], dtype=np.float32)
-    pres_array[:] = np.NaN
 
     ncOut.createDimension("CELL", number_bins)
 
@@ -809,68 +862,40 @@ def build_aquapro_data(ncOut, binary_file, pkt_pos_list, pkt_len, pkt_id, d, unp
     absci2 = create_netCDF_var(ncOut, "ABSIC2", "i2", "amplitude beam 2", "counts", ("TIME", "CELL"))
     absci3 = create_netCDF_var(ncOut, "ABSIC3", "i2", "amplitude beam 3", "counts", ("TIME", "CELL"))
 
-    sample = 0
-    time_id = d['time_bcd']
-    pred_msb_id = d['presMSB']
-    pred_lsb_id = d['presLSW']
-
     imu_vec_list = []
-    imu_vec_list.append((vel1, d['vel_b1[0]'], 1000, np.empty([number_samples, number_bins], dtype=np.float32)))
-    imu_vec_list.append((vel2, d['vel_b2[0]'], 1000, np.empty([number_samples, number_bins], dtype=np.float32)))
-    imu_vec_list.append((vel3, d['vel_b3[0]'], 1000, np.empty([number_samples, number_bins], dtype=np.float32)))
+    imu_vec_list.append((vel1, d['vel_b1[0]'], 1000, np.float32))
+    imu_vec_list.append((vel2, d['vel_b2[0]'], 1000, np.float32))
+    imu_vec_list.append((vel3, d['vel_b3[0]'], 1000, np.float32))
 
     var_list = []
-    var_list.append((head, d['head'], 10, np.empty([number_samples], dtype=np.float32)))
-    var_list.append((pitch, d['pitch'], 10, np.empty([number_samples], dtype=np.float32)))
-    var_list.append((roll, d['roll'], 10, np.empty([number_samples], dtype=np.float32)))
-    var_list.append((bat, d['battery'], 10, np.empty([number_samples], dtype=np.float32)))
-    var_list.append((itemp, d['temp'], 100, np.empty([number_samples], dtype=np.float32)))
-    var_list.append((sspeed, d['soundSpd_Anain2'], 10, np.empty([number_samples], dtype=np.float32)))
-    var_list.append((analog1, d['AnaIn1'], 1, np.empty([number_samples], dtype=np.float32)))
-
-    imu_vec_list.append((absci1, d['amp1[0]'], 1, np.zeros([number_samples, number_bins], dtype=int)))
-    imu_vec_list.append((absci2, d['amp2[0]'], 1, np.zeros([number_samples, number_bins], dtype=int)))
-    imu_vec_list.append((absci3, d['amp3[0]'], 1, np.zeros([number_samples, number_bins], dtype=int)))
-
-    # NaN fill any float variables
-    for v in var_list:
-        if v[3].dtype == 'float32':
-            v[3][:] = np.NaN
-    for v in imu_vec_list:
-        if v[3].dtype == 'float32':
-            v[3][:] = np.NaN
-
-    while sample < len(pkt_pos_list):
-        binary_file.seek(pkt_pos_list[sample])
-        packet_data = binary_file.read(pkt_len[pkt_id] * 2 - 4)
-        packetDecode = struct.unpack(unpack, packet_data)
-
-        dt = bcd_time_to_datetime(packetDecode[time_id])
-        times_array[sample] = date2num(dt, calendar='gregorian', units="days since 1950-01-01 00:00:00 UTC")
-
-        for v in var_list:
-            v[3][sample] = packetDecode[v[1]] / v[2]
-        for v in imu_vec_list:
-            for i in range(number_bins):
-                v[3][sample, i] = packetDecode[v[1] + i] / v[2]
+    var_list.append((head, d['head'], 10, np.float32))
+    var_list.append((pitch, d['pitch'], 10, np.float32))
+    var_list.append((roll, d['roll'], 10, np.float32))
+    var_list.append((bat, d['battery'], 10, np.float32))
+    var_list.append((itemp, d['temp'], 100, np.float32))
+    var_list.append((sspeed, d['soundSpd_Anain2'], 10, np.float32))
+    var_list.append((analog1, d['AnaIn1'], 1, np.float32))
 
-        pres_array[sample] = ((packetDecode[pred_msb_id] * 65536) + packetDecode[pred_lsb_id]) * 0.001
+    imu_vec_list.append((absci1, d['amp1[0]'], 1, int))
+    imu_vec_list.append((absci2, d['amp2[0]'], 1, int))
+    imu_vec_list.append((absci3, d['amp3[0]'], 1, int))
 
-        sample += 1
+    pkt = decode_packets(buf, pkt_pos_list, unpack, pkt_len[pkt_id] * 2 - 4)
+    times_array = bcd_times(packet_field(pkt, d['time_bcd']))
 
     print('read-data took', datetime.datetime.now() - time_start)
 
     ncTimesOut[:] = times_array
     for v in var_list:
-        v[0][:] = v[3]
+        v[0][:] = (packet_field(pkt, v[1]) / v[2]).astype(v[3])
     for v in imu_vec_list:
-        v[0][:] = v[3]
-    pres[:] = pres_array
+        v[0][:] = (packet_fields(pkt, v[1], number_bins) / v[2]).astype(v[3])
+    pres[:] = packet_pressure(pkt, d['presMSB'], d['presLSW']).astype(np.float32)
 
     return ncTimesOut
 
 
-def build_wave_data(ncOut, binary_file, pkt_pos, pkt_pos_list, pkt_len, pkt_id, d, unpack, wave_cells):
+def build_wave_data(ncOut, buf, pkt_pos, pkt_pos_list, pkt_len, pkt_id, d, unpack, wave_cells):
     time_start = datetime.datetime.now()
 
     wave_samples = len(pkt_pos_list)
@@ -885,9 +910,6 @@ def build_wave_data(ncOut, binary_file, pkt_pos, pkt_pos_list, pkt_len, pkt_id,
     nc_wave_times.units = "days since 1950-01-01 00:00:00 UTC"
     nc_wave_times.calendar = "gregorian"
     nc_wave_times.axis = "T"
-    times_array = np.zeros([wave_samples])
-
-    time_id = d['time_bcd']
 
     # TODO: check head_config for magnetometer, tilt and pressure sensor
     head = create_netCDF_var(ncOut, "WAVE_HEADING_MAG", "f4", "heading magnetic", "degrees", ("WAVE_TIME",))
@@ -899,11 +921,11 @@ def build_wave_data(ncOut, binary_file, pkt_pos, pkt_pos_list, pkt_len, pkt_id,
     wave_pres = create_netCDF_var(ncOut, "WAVE_PRES", "f4", "pres", "dbar", ("WAVE_TIME", "WAVE_CELL"))
 
     var_list = []
-    var_list.append({'netCDF': head, 'ids': [d['heading']], 'scale': 0.1, 'array': np.empty([wave_samples], dtype=np.float32)})
-    var_list.append({'netCDF': pitch, 'ids': [d['pitch']], 'scale': 0.1,  'array': np.empty([wave_samples], dtype=np.float32)})
-    var_list.append({'netCDF': roll, 'ids': [d['roll']], 'scale': 0.1, 'array': np.empty([wave_samples], dtype=np.float32)})
-    var_list.append({'netCDF': bat, 'ids': [d['battery']], 'scale': 0.1, 'array': np.empty([wave_samples], dtype=np.float32)})
-    var_list.append({'netCDF': itemp, 'ids': [d['temperature']], 'scale': 0.01,'array': np.empty([wave_samples], dtype=np.float32)})
+    var_list.append({'netCDF': head, 'ids': [d['heading']], 'scale': 0.1})
+    var_list.append({'netCDF': pitch, 'ids': [d['pitch']], 'scale': 0.1})
+    var_list.append({'netCDF': roll, 'ids': [d['roll']], 'scale': 0.1})
+    var_list.append({'netCDF': bat, 'ids': [d['battery']], 'scale': 0.1})
+    var_list.append({'netCDF': itemp, 'ids': [d['temperature']], 'scale': 0.01})
 
     # vector data
     w_vel1 = create_netCDF_var(ncOut, "WAVE_VELOCITY1", "f4", "wave sample velocity", "m/s", ("WAVE_TIME", "WAVE_CELL"))
@@ -914,76 +936,38 @@ def build_wave_data(ncOut, binary_file, pkt_pos, pkt_pos_list, pkt_len, pkt_id,
     wave_d = dict(zip(wave_keys, range(len(wave_keys))))
 
     vec_list = []
-    vec_list.append({'netCDF': wave_pres, 'ids': [wave_d['pressure']], 'scale': 0.001, 'array': np.empty([wave_samples, wave_cells], dtype=np.float32)})
-    vec_list.append({'netCDF': w_vel1, 'ids': [wave_d['vel1']], 'scale': 0.001, 'array': np.empty([wave_samples, wave_cells], dtype=np.float32)})
-    vec_list.append({'netCDF': w_vel2, 'ids': [wave_d['vel2']], 'scale': 0.001, 'array': np.empty([wave_samples, wave_cells], dtype=np.float32)})
-    vec_list.append({'netCDF': w_vel3, 'ids': [wave_d['vel3']], 'scale': 0.001, 'array': np.empty([wave_samples, wave_cells], dtype=np.float32)})
-
-    for v in var_list:
-        if v['array'].dtype == 'float32':
-            v['array'][:] = np.NaN
-    for v in vec_list:
-        if v['array'].dtype == 'float32':
-            v['array'][:] = np.NaN
-
-    # process all the wave packets
-    wave_pkt_n = 0
-    sample = 0
-    while sample < wave_samples:
-        binary_file.seek(pkt_pos_list[sample])
-        packet_data = binary_file.read(pkt_len[pkt_id] * 2 - 4)
-        packetDecode = struct.unpack(unpack, packet_data)
-        # print(dict(zip(keys, packetDecode)))
-
-        dt = bcd_time_to_datetime(packetDecode[time_id])
-        times_array[sample] = date2num(dt, calendar='gregorian',
-                                       units="days since 1950-01-01 00:00:00 UTC")
-        for v in var_list:
-            v['array'][sample] = packetDecode[v['ids'][0]] * v['scale']
-
-        # loop through 'AWAC Wave Data'
-        wave_pos = pkt_pos[packet_id['AWAC Wave Data']]
-        if (sample + 1) < len(pkt_pos_list):
-            last_pos = pkt_pos_list[sample + 1]
-        else:
-            last_pos = wave_pos[-1]
+    vec_list.append({'netCDF': wave_pres, 'ids': [wave_d['pressure']], 'scale': 0.001})
+    vec_list.append({'netCDF': w_vel1, 'ids': [wave_d['vel1']], 'scale': 0.001})
+    vec_list.append({'netCDF': w_vel2, 'ids': [wave_d['vel2']], 'scale': 0.001})
+    vec_list.append({'netCDF': w_vel3, 'ids': [wave_d['vel3']], 'scale': 0.001})
 
-        wave_unpack = packet_decoder[packet_id['AWAC Wave Data']]['unpack']
-        wave_len = pkt_len[packet_id['AWAC Wave Data']] * 2 - 4
-        wave_sample = 0
-        # skip to the next position after this wave data header
-        while wave_pos[wave_pkt_n] < pkt_pos_list[sample]:
-            print('skipping packet', wave_pkt_n)
-            wave_pkt_n += 1
-        # process all save samples, for all wave_calls, till we get past the next data header, or we run out of same samples
-        while wave_sample < wave_cells and wave_pkt_n < len(wave_pos) and wave_pos[
-            wave_pkt_n] < last_pos:
-            binary_file.seek(wave_pos[wave_pkt_n])
-            packet_data = binary_file.read(wave_len)
-            packetDecode = struct.unpack(wave_unpack, packet_data)
+    pkt = decode_packets(buf, pkt_pos_list, unpack, pkt_len[pkt_id] * 2 - 4)
+    times_array = bcd_times(packet_field(pkt, d['time_bcd']))
 
-            # print('wave sample', sample, wave_sample)
+    # 'AWAC Wave Data' packets belong to the header before them, the packets for the last header must be before
+    # the last wave data packet
+    wave_pos = pkt_pos.get(packet_id['AWAC Wave Data'], np.zeros(0, dtype=np.int64))
+    wave_unpack = packet_decoder[packet_id['AWAC Wave Data']]['unpack']
+    wave_len = pkt_len.get(packet_id['AWAC Wave Data'], 12) * 2 - 4
 
-            for v in vec_list:
-                v['array'][sample, wave_sample] = packetDecode[v['ids'][0]] * v['scale']
-
-            wave_sample += 1
-            wave_pkt_n += 1
-
-        sample += 1
+    last_pos = wave_pos[-1] if len(wave_pos) > 0 else 0
+    (burst, burst_sample, use) = burst_samples(pkt_pos_list, wave_pos, wave_cells, last_pos)
+    wave = decode_packets(buf, wave_pos[use], wave_unpack, wave_len)
 
     print('read-data took', datetime.datetime.now() - time_start)
 
     nc_wave_times[:] = times_array
     for v in var_list:
-        v['netCDF'][:] = v['array']
+        v['netCDF'][:] = (packet_field(pkt, v['ids'][0]) * v['scale']).astype(np.float32)
     for v in vec_list:
-        v['netCDF'][:] = v['array']
+        array = np.full([wave_samples, wave_cells], np.nan, dtype=np.float32)
+        array[burst, burst_sample] = packet_field(wave, v['ids'][0]) * v['scale']
+        v['netCDF'][:] = array
 
     return
 
 
-def build_aquadopp_diag_data(ncOut, binary_file, pkt_pos_list, pkt_len, pkt_id, d, unpack):
+def build_aquadopp_diag_data(ncOut, buf, pkt_pos_list, pkt_len, pkt_id, d, unpack):
     time_start = datetime.datetime.now()
 
     number_samples = len(pkt_pos_list)
@@ -994,11 +978,6 @@ def build_aquadopp_diag_data(ncOut, binary_file, pkt_pos_list, pkt_len, pkt_id,
     ncTimesOut.units = "days since 1950-01-01 00:00:00 UTC"
     ncTimesOut.calendar = "gregorian"
 
-    times_array = np.zeros([number_samples])
-
-    pres_array = np.empty([number_samples], dtype=np.float32)
-    pres_array[:] = np.NaN
-
     if coord_system == 2:
         vel1 = create_netCDF_var(ncOut, "VEL_B1_DIAG", "f4", "velocity beam 1", "m/s", ("TIME_DIAG",))
         vel2 = create_netCDF_var(ncOut, "VEL_B2_DIAG", "f4", "velocity beam 2", "m/s", ("TIME_DIAG",))
@@ -1025,62 +1004,38 @@ def build_aquadopp_diag_data(ncOut, binary_file, pkt_pos_list, pkt_len, pkt_id,
     error = create_netCDF_var(ncOut, "ERROR_DIAG", "i2", "error code", "1", ("TIME_DIAG",))
     status = create_netCDF_var(ncOut, "STATUS_DIAG", "i2", "status code", "1", ("TIME_DIAG",))
 
-    sample = 0
-    time_id = d['time_bcd']
-    pred_msb_id = d['presMSB']
-    pred_lsb_id = d['presLSW']
-
     var_list = []
-    var_list.append((vel1, d['vel_b1'], 1000, np.empty([number_samples], dtype=np.float32)))
-    var_list.append((vel2, d['vel_b2'], 1000, np.empty([number_samples], dtype=np.float32)))
-    var_list.append((vel3, d['vel_b3'], 1000, np.empty([number_samples], dtype=np.float32)))
-    var_list.append((head, d['head'], 10, np.empty([number_samples], dtype=np.float32)))
-    var_list.append((pitch, d['pitch'], 10, np.empty([number_samples], dtype=np.float32)))
-    var_list.append((roll, d['roll'], 10, np.empty([number_samples], dtype=np.float32)))
-    var_list.append((bat, d['battery'], 10, np.empty([number_samples], dtype=np.float32)))
-    var_list.append((absci1, d['amp1'], 1, np.zeros([number_samples], dtype=int)))
-    var_list.append((absci2, d['amp2'], 1, np.zeros([number_samples], dtype=int)))
-    var_list.append((absci3, d['amp3'], 1, np.zeros([number_samples], dtype=int)))
-
-    var_list.append((error, d['error'], 1, np.zeros([number_samples], dtype=int)))
-    var_list.append((status, d['status'], 1, np.zeros([number_samples], dtype=int)))
-
-    # NaN fill any float variables
-    for v in var_list:
-        if v[3].dtype == 'float32':
-            v[3][:] = np.NaN
-
-    while sample < len(pkt_pos_list):
-        binary_file.seek(pkt_pos_list[sample])
-        packet_data = binary_file.read(pkt_len[pkt_id] * 2 - 4)
-        packetDecode = struct.unpack(unpack, packet_data)
-
-        dt = bcd_time_to_datetime(packetDecode[time_id])
-        times_array[sample] = date2num(dt, calendar='gregorian', units="days since 1950-01-01 00:00:00 UTC")
-        for v in var_list:
-            v[3][sample] = packetDecode[v[1]] / v[2]
-        pres_array[sample] = ((packetDecode[pred_msb_id] * 65536) + packetDecode[pred_lsb_id]) * 0.001
-
-        sample += 1
+    var_list.append((vel1, d['vel_b1'], 1000, np.float32))
+    var_list.append((vel2, d['vel_b2'], 1000, np.float32))
+    var_list.append((vel3, d['vel_b3'], 1000, np.float32))
+    var_list.append((head, d['head'], 10, np.float32))
+    var_list.append((pitch, d['pitch'], 10, np.float32))
+    var_list.append((roll, d['roll'], 10, np.float32))
+    var_list.append((bat, d['battery'], 10, np.float32))
+    var_list.append((absci1, d['amp1'], 1, int))
+    var_list.append((absci2, d['amp2'], 1, int))
+    var_list.append((absci3, d['amp3'], 1, int))
+
+    var_list.append((error, d['error'], 1, int))
+    var_list.append((status, d['status'], 1, int))
+
+    pkt = decode_packets(buf, pkt_pos_list, unpack, pkt_len[pkt_id] * 2 - 4)
+    times_array = bcd_times(packet_field(pkt, d['time_bcd']))
 
     print('read-data took', datetime.datetime.now() - time_start)
 
     ncTimesOut[:] = times_array
     for v in var_list:
-        v[0][:] = v[3]
-    pres[:] = pres_array
+        v[0][:] = (packet_field(pkt, v[1]) / v[2]).astype(v[3])
+    pres[:] = packet_pressure(pkt, d['presMSB'], d['presLSW']).astype(np.float32)
 
     return
 
 
-def parse_file(files, include_diag):
+def parse_file(files, include_diag, reindex=False):
 
     output_files = []
     for filepath in files:
-        checksum_errors = 0
-        no_sync = 0
-        pkts_read = 0
-        file_size = os.path.getsize(filepath)
         time_start = datetime.datetime.now()
 
         # sample_count = 0
@@ -1125,81 +1080,32 @@ def parse_file(files, include_diag):
         attribute_list = []
 
         with open(filepath, "rb") as binary_file:
-            current_pos_pkt_start = binary_file.tell()
-            data = binary_file.read(2)
-            #print('tell', bad_ck_pos)
-
-            while data:
-                # print("sync : ", data[0])
-
-                if data[0] == 0xa5:  # sync
-                    checksum = 0xb58c
-                    id = data[1]
-                    #print('id_data, id', data, id)
-                    checksum += 0xa5 + (id << 8)
-                    #print("id = ", id)
-                    if id == 16: # Vector Velocity Data is fixed size
-                        pkt_size = 13 # pkt is 24 bytes, 12 words, less the extra 2 we need as we read packet_size*2-4
-                    else:
-                        size_data = binary_file.read(2)
-                        pkt_size = (size_data[1] << 8) + size_data[0]
-                        checksum += pkt_size
-
-                    packet_data_start = binary_file.tell()
-                    packet_data = binary_file.read(pkt_size*2 - 4)  # size in words, less the 4 we already read
-                    if len(packet_data) != (pkt_size*2 - 4):  # did not read enough
-                        break
-
-                    #print("id =", id, "len =", len(packet_data), pkt_size*2)
-
-                    # calculate the checksum
-                    for pkt_id in range(0, len(packet_data)-2, 2):
-                        checksum += (packet_data[pkt_id+1] << 8) + packet_data[pkt_id]
-
-                    # check check sum
-                    if checksum & 0xffff == (packet_data[-1] << 8) + packet_data[-2]:
-                        pkts_read += 1
-                        if (pkts_read % 100000) == 0:
-                            print('packets', pkts_read, id, 'file remaining', file_size - binary_file.tell())
-                            for pkt_id in pkt_count:
-                                print('id=', pkt_id, "'"+packet_decoder[pkt_id]['name']+"'", 'count=', pkt_count[pkt_id])
-
-                        if id in pkt_count:
-                            pkt_count[id] += 1
-                            pkt_pos[id].append(packet_data_start)
-                        else:
-                            pkt_count[id] = 1
-                            pkt_pos[id] = array("L", [packet_data_start])
-                            pkt_len[id] = pkt_size
-                    else:
-                        print("check sum error ", current_pos_pkt_start, checksum & 0xffff, (packet_data[-1] << 8) + packet_data[-2])
-                        checksum_errors += 1
-                        if checksum_errors > 10:
-                            print("too many errors, maybe not a nortek file")
-                            break
-                        binary_file.seek(current_pos_pkt_start + 1, os.SEEK_SET)  # seek back to before packet
-
+            buf = map_file(binary_file)
+
+            # find all the packets, then index the packet data (after the sync, id and size) by packet id,
+            # in the order each id is first seen
+            (ids, starts, lengths, errors) = index_packets(filepath, buf, reindex)
+            checksum_errors = len(errors)
+            pkts_read = len(ids)
+
+            (first_ids, first) = np.unique(ids, return_index=True)
+            for i in np.argsort(first):
+                id = int(first_ids[i])
+                if id == 16:  # Vector Velocity Data is fixed size, and has no size word
+                    pkt_pos[id] = starts[ids == id] + 2
+                    pkt_len[id] = 13  # pkt is 24 bytes, 12 words, plus the extra 2 as we read packet_size*2-4
                 else:
-                    binary_file.seek(current_pos_pkt_start+1, os.SEEK_SET)  # seek back to before packet
-                    no_sync += 1
-                    #print('no sync', data[0], bad_ck_pos)
-                    #if no_sync > 1000:
-                    #    print("no sync found in first 1000 bytes, maybe not a nortek file")
-                    #    break
-
-                current_pos_pkt_start = binary_file.tell()
-                data = binary_file.read(2)
-                #print('tell', bad_ck_pos)
-
-            #
-            # print('samples', sample_count)
-            #
+                    pkt_pos[id] = starts[ids == id] + 4
+                    pkt_len[id] = int(lengths[first[i]]) // 2
+                pkt_count[id] = len(pkt_pos[id])
+                print('id=', id, "'"+packet_decoder[id]['name']+"'", 'count=', pkt_count[id])
+
             print()
             print('read took', datetime.datetime.now() - time_start)
 
             time_start = datetime.datetime.now()
 
-            print('total packets', pkts_read, id)
+            print('total packets', pkts_read, 'checksum errors', checksum_errors)
             number_beams = 0
 
             # look though all packet types, decode each type to arrays and save to netCDF variables
@@ -1209,8 +1115,7 @@ def parse_file(files, include_diag):
                 unpack = packet_decoder[pkt_id]['unpack']
                 keys = packet_decoder[pkt_id]['keys']
 
-                binary_file.seek(pkt_pos_list[0])
-                packet_data = binary_file.read(pkt_len[pkt_id]*2-4)
+                packet_data = buf[pkt_pos_list[0]:pkt_pos_list[0] + pkt_len[pkt_id]*2-4].tobytes()
 
                 # deal with the variable length packets, format the decoder
                 if packet_id['Aquadopp Profiler Velocity Data'] == pkt_id:
@@ -1300,18 +1205,18 @@ def parse_file(files, include_diag):
                     # add global attributes
                     instrument_model = 'Aquadopp ' + si_format(head_frequency*1000, precision=0) + 'Hz'
 
-                    ncTimesOut = build_aquadopp_data(ncOut, binary_file, pkt_pos_list, pkt_len, pkt_id, d, unpack)
+                    ncTimesOut = build_aquadopp_data(ncOut, buf, pkt_pos_list, pkt_len, pkt_id, d, unpack)
 
                 if packet_id['Aquadopp Velocity Data inc Mag'] == pkt_id:
                     # add global attributes
                     instrument_model = 'Aquadopp ' + si_format(head_frequency*1000, precision=0) + 'Hz'
 
-                    ncTimesOut = build_aquadopp_data(ncOut, binary_file, pkt_pos_list, pkt_len, pkt_id, d, unpack)
+                    ncTimesOut = build_aquadopp_data(ncOut, buf, pkt_pos_list, pkt_len, pkt_id, d, unpack)
 
                 if include_diag:
                     if packet_id['Aquadopp Diagnostics Data'] == pkt_id:
 
-                        build_aquadopp_diag_data(ncOut, binary_file, pkt_pos_list, pkt_len, pkt_id, d, unpack)
+                        build_aquadopp_diag_data(ncOut, buf, pkt_pos_list, pkt_len, pkt_id, d, unpack)
 
                 if packet_id['Aquadopp Diagnostics Data Header'] == pkt_id:
                     diag_records = packetDecode[d['records']]
@@ -1323,10 +1228,10 @@ def parse_file(files, include_diag):
                     instrument_model = 'Vector ' + si_format(head_frequency*1000, precision=0) + 'Hz'
                     number_data_samples = packetDecode[d['NRecords']]
 
-                    ncTimesOut = build_vector_velocity_data(ncOut, binary_file, pkt_pos, pkt_pos_list, pkt_len, pkt_id, d, unpack, number_data_samples)
+                    ncTimesOut = build_vector_velocity_data(ncOut, buf, pkt_pos, pkt_pos_list, pkt_len, pkt_id, d, unpack, number_data_samples)
 
                 if packet_id['Vector System Data'] == pkt_id:
-                    build_vector_system_data(ncOut, binary_file, pkt_pos_list, pkt_len, pkt_id, d, unpack)
+                    build_vector_system_data(ncOut, buf, pkt_pos_list, pkt_len, pkt_id, d, unpack)
 
                 if packet_id['Vector Velocity Data'] == pkt_id:
                     velocity_data_samples = len(pkt_pos_list)
@@ -1335,18 +1240,18 @@ def parse_file(files, include_diag):
                     # add global attributes
                     instrument_model = 'AquaProHR ' + si_format(head_frequency*1000, precision=0) + 'Hz'
 
-                    ncTimesOut = build_aquaprohr_data(ncOut, binary_file, pkt_pos_list, pkt_len, pkt_id, d, unpack, beams, cells)
+                    ncTimesOut = build_aquaprohr_data(ncOut, buf, pkt_pos_list, pkt_len, pkt_id, d, unpack, beams, cells)
 
                 if packet_id['Aquadopp Profiler Velocity Data'] == pkt_id:
                     # add global attributes
                     instrument_model = 'AquaPro ' + si_format(head_frequency*1000, precision=0) + 'Hz'
 
-                    ncTimesOut = build_aquapro_data(ncOut, binary_file, pkt_pos_list, pkt_len, pkt_id, d, unpack, number_bins)
+                    ncTimesOut = build_aquapro_data(ncOut, buf, pkt_pos_list, pkt_len, pkt_id, d, unpack, number_bins)
 
                 if packet_id['AWAC wave Data Header'] == pkt_id:
                     wave_cells = packetDecode[d['NRecords']]
 
-                    build_wave_data(ncOut, binary_file, pkt_pos, pkt_pos_list, pkt_len, pkt_id, d, unpack, wave_cells)
+                    build_wave_data(ncOut, buf, pkt_pos, pkt_pos_list, pkt_len, pkt_id, d, unpack, wave_cells)
 
                 # copy in all attribues from the list
                 for att in packet_decode2netCDF:
@@ -1405,11 +1310,14 @@ if __name__ == "__main__":
 
     files = []
     include_diag = False
+    reindex = False
     for f in sys.argv[1:]:
         if f == '-include-diag':
             include_diag = True
+        elif f == '--reindex':
+            reindex = True
         else:
             files.extend(glob.glob(f))
 
-    parse_file(files, include_diag)
+    parse_file(files, include_diag, reindex)
 
@@ -0,0 +1,95 @@
+#!/usr/bin/python3
+
+# packet_index
+# Copyright (C) 2026 Peter Jansen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import hashlib
+import os
+
+import numpy as np
+
+# packet index file, saved next to a raw binary file so a later run can skip the scan of the file
+#
+# the index has arrays of the packet type, offset (bytes from the start of the file), length (bytes) and
+# checksum status (checksum_ok) of each packet found. It is keyed on the file size, modification time, and a hash
+# of the start and end of the file, if any of these change the index is stale and the file is scanned again
+#
+# the kind (eg 'nortek', 'rdi') is saved in the index, so an index from a different parser is not used
+
+index_version = 1
+hash_bytes = 1024 * 1024  # bytes hashed from the start and end of the file
+
+
+def index_name(filepath):
+    return filepath + '.pktidx.npz'
+
+
+def file_key(filepath):
+    st = os.stat(filepath)
+
+    h = hashlib.sha1()
+    with open(filepath, 'rb') as f:
+        h.update(f.read(hash_bytes))
+        if st.st_size > hash_bytes:
+            f.seek(max(st.st_size - hash_bytes, hash_bytes))
+            h.update(f.read(hash_bytes))
+
+    return {'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'hash': h.hexdigest()}
+
+
+def load_index(filepath, kind):
+    # return the index arrays as a dict, or None if there is no index, or the index is stale
+    name = index_name(filepath)
+    if not os.path.exists(name):
+        return None
+
+    key = file_key(filepath)
+    try:
+        with np.load(name) as idx:
+            saved = {'kind': str(idx['kind']), 'version': int(idx['version']),
+                     'size': int(idx['size']), 'mtime_ns': int(idx['mtime_ns']), 'hash': str(idx['hash'])}
+            if saved != dict(key, kind=kind, version=index_version):
+                print('stale packet index', name)
+                return None
+
+            index = {k: idx[k] for k in ('type', 'offset', 'length', 'checksum_ok')}
+    except (OSError, ValueError, KeyError) as e:
+        print('can not read packet index', name, e)
+        return None
+
+    print('using packet index', name, 'packets', np.count_nonzero(index['checksum_ok']))
+
+    return index
+
+
+def save_index(filepath, kind, type, offset, length, checksum_ok):
+    # write the index to a temporary file and rename it, so a partly written index is never used
+    name = index_name(filepath)
+    key = file_key(filepath)
+    try:
+        with open(name + '.tmp', 'wb') as f:
+            np.savez(f, kind=kind, version=index_version, size=key['size'], mtime_ns=key['mtime_ns'], hash=key['hash'],
+                     type=np.asarray(type, dtype=np.uint8), offset=np.asarray(offset, dtype=np.int64),
+                     length=np.asarray(length, dtype=np.int64), checksum_ok=np.asarray(checksum_ok, dtype=bool))
+        os.replace(name + '.tmp', name)
+    except OSError as e:
+        print('can not write packet index', name, e)
+        return None
+
+    print('saved packet index', name)
+
+    return name
+
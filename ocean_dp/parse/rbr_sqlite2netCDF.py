@@ -19,6 +19,7 @@
 import sys
 import re
 import os
+import itertools
 
 from datetime import datetime, UTC
 
@@ -67,6 +68,18 @@ unitMap["C"] = "degrees_Celsius"
 unitMap["Degrees_C"] = "degrees_Celsius"
 unitMap["uMol/m2/s"] = "umol/m^2/s"
 
+# values read from the data table at a time
+chunk_values = 1024 * 1024
+
+
+def records_to_array(records, n_columns):
+    # rows of the data table as a float array, fromiter is used unless there are NULL values
+    try:
+        return np.fromiter(itertools.chain.from_iterable(records), dtype=float, count=len(records) * n_columns).reshape(-1, n_columns)
+    except TypeError:
+        return np.array(records, dtype=float)
+
+
 def parse(file):
 
     filepath = file[0]
@@ -193,38 +206,31 @@ def parse(file):
 
     cur.execute(sql)
     regionCasts = cur.fetchall()
-    profiles = []
     mid_idx = -1
-    for regionCast in regionCasts:
-        profile_start_time = datetime.fromtimestamp(regionCast[0] / 1000, tz=pytz.UTC)
-        if mid_idx == -1:
-            # do profiles start with upcast first or downcast first
-            if regionCast[0] == regionCast[1]:
-                mid_idx = 2
-            else:
-                mid_idx = 1
-        up_start_time = datetime.fromtimestamp(regionCast[mid_idx] / 1000, tz=pytz.UTC)
-        profile_end_time = datetime.fromtimestamp(regionCast[5] / 1000, tz=pytz.UTC)
-        p = (profile_start_time, up_start_time, profile_end_time)
-        profiles.append(p)
-        print('profile region', regionCast)
+    if regionCasts:
+        # do profiles start with upcast first or downcast first
+        if regionCasts[0][0] == regionCasts[0][1]:
+            mid_idx = 2
+        else:
+            mid_idx = 1
+    print('profile regions', len(regionCasts))
 
     print('is up first, mid_idx', mid_idx)
-    # fetch the data
+    # the data table columns, tstamp then a column for each channel
     cur = conn.cursor()
-    cur.execute('SELECT * FROM data') # downsample100 has smaller data table
+    cur.execute('SELECT * FROM data LIMIT 0') # downsample100 has smaller data table
 
-    # build the variables needed
+    # build the variables needed, only the channels with a variable are read from the data table
     #print(cur.description)
     data_channels = []
-    i = 0
+    columns = [cur.description[0][0]]
     for channel_desc in cur.description:
         #print('data header', channel_desc)
         matchObj = re.match("channel(\d*)", channel_desc[0])
         if matchObj:
             id = matchObj.group(1)
             ch = channel_list[int(id)]
-            print('channel id', id, ch, i)
+            print('channel id', id, ch, len(columns))
             var_name = ch['shortName']
             if var_name in nameMap:
                 var_name = nameMap[var_name]
@@ -242,97 +248,90 @@ def parse(file):
                     if ch['serialID'] != 'None':
                         nc_var_out.sensor_serial_number = ch['serialID']
 
-                data_channels.append([i, ch, nc_var_out])
+                data_channels.append([len(columns), ch, nc_var_out])
+                columns.append(channel_desc[0])
 
-        i = i + 1
+    if has_direction:
+        ncVarProfile = ncOut.createVariable("PROFILE", "i", ("TIME",), zlib=True, fill_value=-1)
+        ncVarProfile.comment = 'profile number'
+        ncVarProfile_sample = ncOut.createVariable("PROFILE_SAMPLE", "i", ("TIME",), zlib=True)
+        ncVarProfile_sample.comment = 'profile sample +ve for up part and -ve down down part of profile'
+
+    # profile start, mid (up or down start), and end times (ms since 1970), the index of the first sample at or after
+    # each is found as the data is read
+    profile_ms = np.array([[rc[0], rc[mid_idx], rc[5]] for rc in regionCasts], dtype=np.int64).reshape(-1, 3)
+    profile_idx = np.full(profile_ms.shape, -1, dtype=np.int64)
+    t_max = None
+
+    # times outside 2000-01-01 to 2100-01-01 are marked with the min/max values
+    t_min_valid = date2num(datetime(2000, 1, 1), units=ncTimesOut.units, calendar=ncTimesOut.calendar)
+    t_max_valid = date2num(datetime(2100, 1, 1), units=ncTimesOut.units, calendar=ncTimesOut.calendar)
+
+    # read data table into netCDF variables, in chunks of about chunk_values values so the memory used does not
+    # depend on the length of the record
+    cur.execute('SELECT ' + ', '.join(columns) + ' FROM data')
+    cur.arraysize = max(1024, chunk_values // len(columns))
+    print('array size', cur.arraysize)
 
-    # read data table into netCDF variables
     sample = 0
-    cur.arraysize = 1024*1024
     records = cur.fetchmany()
-    print('fetch records=', len(records), 'sample number=', sample)
-    print('array size', cur.arraysize, len(records))
-    data = numpy.array(records, dtype=float)
-
     while len(records) > 0:
-        #timestamp = datetime.fromtimestamp(data[:, 0] / 1000, tz=timezone.utc)
-        #print(timestamp, records)
-        #print(data[:, 0].shape)
-        #ncTimesOut[sample:sample+len(records)] = data[:, 0]/1000/24/3600 - t0 # date2num(timestamp, units=ncTimesOut.units, calendar=ncTimesOut.calendar)
-        
-        ncTimesOut[sample:sample + len(records)] = data[:, 0]/1000/24/3600-t0
+        print('fetch records=', len(records), 'sample number=', sample)
+        data = records_to_array(records, len(columns))
+        n = len(records)
 
-        print('data', data[0, :], ncTimesOut[sample])
+        # the first sample at or after each profile time, from the running maximum of the timestamps
+        ms = data[:, 0].astype(np.int64)
+        run_max = np.maximum.accumulate(ms)
+        if t_max is not None:
+            run_max = np.maximum(run_max, t_max)
+        t_max = run_max[-1]
+        found = (profile_idx < 0) & (profile_ms <= t_max)
+        profile_idx[found] = sample + np.searchsorted(run_max, profile_ms[found], side='left')
+
+        times = data[:, 0]/1000/24/3600-t0
+        print('data', data[0, :], times[0])
+
+        ncTimesOut[sample:sample + n] = np.clip(times, t_min_valid, t_max_valid)
 
         for channel_desc in data_channels:
-            channel_desc[2][sample:sample+len(records)] = data[:, channel_desc[0]]
+            channel_desc[2][sample:sample + n] = data[:, channel_desc[0]]
 
-        sample = sample + len(records)
+        if has_direction:
+            ncVarProfile_sample[sample:sample + n] = np.zeros(n, dtype=np.int32)
 
-        records = cur.fetchmany()
-        print('fetch records=', len(records), 'sample number=', sample)
-        data = numpy.array(records, dtype=float)
+        sample = sample + n
 
-        # some feedback
-        #sample = sample + len(records)
-        #if (sample % 1000) == 0:
-        #    print(sample, timestamp)
-        #if sample > 1024*1024:
-        #    break
+        records = cur.fetchmany()
 
     conn.close()
 
-    # this is slow, must be a better implementation
     print('marking profile samples')
-    times = np.array(ncTimesOut[:])
 
     if has_direction:
-        ncVarProfile = ncOut.createVariable("PROFILE", "i", ("TIME",), zlib=True, fill_value=-1)
-        ncVarProfile.comment = 'profile number'
-        ncVarProfile_sample = ncOut.createVariable("PROFILE_SAMPLE", "i", ("TIME",), zlib=True)
-        ncVarProfile_sample.comment = 'profile sample +ve for up part and -ve down down part of profile'
-        ncVarProfile_sample[:] = 0
-
         profile_n = 0
-        for profile in profiles:
-            profile_t_start = date2num(profile[0], units=ncTimesOut.units, calendar=ncTimesOut.calendar)
-            up_t_start = date2num(profile[1], units=ncTimesOut.units, calendar=ncTimesOut.calendar)
-            profile_t_end = date2num(profile[2], units=ncTimesOut.units, calendar=ncTimesOut.calendar)
-
-            idx_s = np.where(times >= profile_t_start)
-            print(profile_n, 'index of first profile start', idx_s[0][0])
-            idx_mid = np.where(times >= up_t_start)
-            print(profile_n, 'index of first profile mid', idx_mid[0][0])
-            idx_e = np.where(times >= profile_t_end)
-            print(profile_n, 'index of first profile end', idx_e[0][0])
-
-            ncVarProfile[idx_s[0][0]:idx_e[0][0]] = profile_n
+        for idx_s, idx_mid, idx_e in profile_idx:
+            print(profile_n, 'index of first profile start', idx_s)
+            print(profile_n, 'index of first profile mid', idx_mid)
+            print(profile_n, 'index of first profile end', idx_e)
+            if idx_e < 0:
+                print(profile_n, 'profile end after the last sample')
+                break
+
+            ncVarProfile[idx_s:idx_e] = profile_n
             if mid_idx == 2:
                 # up first
-                ncVarProfile_sample[idx_s[0][0]:idx_mid[0][0]] = np.arange(1, (idx_mid[0][0] - idx_s[0][0]) + 1)
-                ncVarProfile_sample[idx_mid[0][0]:idx_e[0][0]] = np.arange(1, (idx_e[0][0] - idx_mid[0][0]) + 1) * -1
+                ncVarProfile_sample[idx_s:idx_mid] = np.arange(1, (idx_mid - idx_s) + 1)
+                ncVarProfile_sample[idx_mid:idx_e] = np.arange(1, (idx_e - idx_mid) + 1) * -1
             else:
                 # down first
-                ncVarProfile_sample[idx_s[0][0]:idx_mid[0][0]] = np.arange(1, (idx_mid[0][0] - idx_s[0][0]) + 1) * -1
-                ncVarProfile_sample[idx_mid[0][0]:idx_e[0][0]] = np.arange(1, (idx_e[0][0] - idx_mid[0][0]) + 1)
+                ncVarProfile_sample[idx_s:idx_mid] = np.arange(1, (idx_mid - idx_s) + 1) * -1
+                ncVarProfile_sample[idx_mid:idx_e] = np.arange(1, (idx_e - idx_mid) + 1)
 
             profile_n += 1
 
-
-    # up_t_start = date2num(cast_up[cast_up_n][1], units=ncTimesOut.units, calendar=ncTimesOut.calendar)
-    # up_t_end = date2num(cast_up[cast_up_n][2], units=ncTimesOut.units, calendar=ncTimesOut.calendar)
-    # down_t_start = date2num(cast_down[cast_down_n][1], units=ncTimesOut.units, calendar=ncTimesOut.calendar)
-    # down_t_end = date2num(cast_down[cast_down_n][2], units=ncTimesOut.units, calendar=ncTimesOut.calendar)
-
-    #for i in range(1, len(ncTimesOut)):
-    #    print(i, ncVarProfile[i], ncVarProfile_sample[i], ncTimesOut[i], data_channels[2][2][i])
-
     print('time range', ncTimesOut[0], 'to', ncTimesOut[-1])
 
-    # mark any invalid times with max/min values
-    ncTimesOut[ncTimesOut[:] < date2num(datetime(2000, 1, 1), units=ncTimesOut.units, calendar=ncTimesOut.calendar)] = date2num(datetime(2000, 1, 1), units=ncTimesOut.units, calendar=ncTimesOut.calendar)
-    ncTimesOut[ncTimesOut[:] >= date2num(datetime(2100, 1, 1), units=ncTimesOut.units, calendar=ncTimesOut.calendar)] = date2num(datetime(2100, 1, 1), units=ncTimesOut.units, calendar=ncTimesOut.calendar)
-
     # save metadata to netCDF file
     ncOut.setncattr("time_coverage_start", num2date(ncTimesOut[0], units=ncTimesOut.units, calendar=ncTimesOut.calendar).strftime(ncTimeFormat))
     ncOut.setncattr("time_coverage_end", num2date(ncTimesOut[-1], units=ncTimesOut.units, calendar=ncTimesOut.calendar).strftime(ncTimeFormat))
@@ -17,14 +17,16 @@
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 
 import sys
+import os
+import mmap
 
 import datetime
 from datetime import UTC
-from netCDF4 import num2date, date2num
 from netCDF4 import Dataset
 import numpy as np
-import struct
-import traceback
+import re
+
+from ocean_dp.parse.packet_index import load_index, save_index
 
 header_decoder = {'keys': ['spare', 'dataTypes'],
                   'unpack': "<BB"}
@@ -67,8 +69,127 @@ volt_scale_system[3] = [380667, 11451]
 volt_scale_system[4] = [253765, 11451]
 volt_scale_system[5] = [253765, 11451]
 
+ensemble_block = 1024  # ensembles decoded and written to the netCDF file at a time, the same as the TIME chunk size
+
+struct_types = {'b': 'i1', 'B': 'u1', 'h': '<i2', 'H': '<u2', 'i': '<i4', 'I': '<u4', 'l': '<i4', 'L': '<u4', 'q': '<i8', 'Q': '<u8'}
+
+
+def struct_dtype(decoder):
+    # numpy structured type for the (little endian) struct format of a decoder, with the decoder keys as the field names
+    formats = []
+    for count, code in re.findall(r'(\d*)([a-zA-Z])', decoder['unpack']):
+        formats.extend([struct_types[code]] * (int(count) if count else 1))
+
+    return np.dtype({'names': decoder['keys'], 'formats': formats})
+
+
+fixed_dtype = struct_dtype(fixed_decoder)
+variable_dtype = struct_dtype(variable_decoder)
+
+# scale for the transmit voltage and current, for each system frequency
+volt_scale = np.array([volt_scale_system.get(i, [np.nan, np.nan]) for i in range(8)])
+
+
+def rdi_scan(mm, buf):
+    # find the ensembles in the file, the same as reading the file 2 bytes at a time looking for the header id (0x7f7f),
+    # after an ensemble the search continues after its checksum (good or not)
+    # returns the start and length (not including the checksum) of each ensemble, and if the checksum is good
+    n = len(buf)
+    starts = []
+    lengths = []
+    pos = 0
+    while True:
+        i = mm.find(b'\x7f\x7f', pos)
+        while i >= 0 and (i - pos) % 2 != 0:
+            i = mm.find(b'\x7f\x7f', i + 1)
+        if i < 0 or i + 4 > n:
+            break
+
+        ensemble_len = int(buf[i + 2]) + (int(buf[i + 3]) << 8)
+        if ensemble_len < 4 or i + ensemble_len + 2 > n:
+            print("checksum error")
+            break
+
+        starts.append(i)
+        lengths.append(ensemble_len)
+        pos = i + ensemble_len + 2
+
+    starts = np.array(starts, dtype=np.int64)
+    lengths = np.array(lengths, dtype=np.int64)
+
+    # checksum is the sum of the bytes in the ensemble, modulo 65536
+    checksum_ok = np.zeros(len(starts), dtype=bool)
+    if len(starts) > 0:
+        ends = starts + lengths
+        sums = np.add.reduceat(buf, np.stack((starts, ends), axis=-1).ravel(), dtype=np.uint64)[::2]
+        checksum_ok = (sums % 65536) == (buf[ends] + (buf[ends + 1].astype(np.uint64) << 8))
+
+    return starts, lengths, checksum_ok
+
+
+def rdi_index(filepath, mm, buf, reindex=False):
+    # the ensembles in the file, from the packet index saved by an earlier run if it is still valid, otherwise scan
+    # the file and save the index
+    index = None
+    if not reindex:
+        index = load_index(filepath, 'rdi')
+
+    if index is None:
+        (starts, lengths, checksum_ok) = rdi_scan(mm, buf)
+        index = {'type': np.full(len(starts), 0x7f, dtype=np.uint8), 'offset': starts, 'length': lengths, 'checksum_ok': checksum_ok}
+        save_index(filepath, 'rdi', **index)
+
+    print('ensembles', len(index['offset']), 'checksum errors', np.count_nonzero(~index['checksum_ok']))
+
+    return index
+
+
+def u16(buf, pos):
+    # little endian unsigned 16 bit value at each position
+    return buf[pos] + (buf[pos + 1].astype(np.int64) << 8)
+
+
+def data_type_positions(buf, starts, lengths):
+    # file position of the data (after the id) of each data type in the ensembles, from the data type offsets after
+    # the ensemble header, returns a dict of data type id to an array of the position, -1 where the ensemble does not have it
+    ends = starts + lengths
+    n_types = buf[starts + 5].astype(np.int64)
+
+    positions = {}
+    for k in range(int(n_types.max(initial=0))):
+        addr_pos = starts + 6 + 2 * k
+        has = (k < n_types) & (addr_pos + 2 <= ends)
+        type_pos = starts + u16(buf, np.where(has, addr_pos, 0))
+        has &= (type_pos >= starts + 4) & (type_pos + 2 <= ends)
+        ens_type = u16(buf, np.where(has, type_pos, 0))
+        for t in np.unique(ens_type[has]).tolist():
+            if t not in positions:
+                positions[t] = np.full(len(starts), -1, dtype=np.int64)
+            sel = has & (ens_type == t)
+            positions[t][sel] = type_pos[sel] + 2
+
+    return positions
+
+
+def gather(buf, pos, ends, size):
+    # the size bytes at each position (>= 0), returns the ensemble (row) numbers and an array of bytes, one row each
+    has = pos >= 0
+    short = has & (pos + size > ends)
+    if np.any(short):
+        print('data type past end of ensemble', np.count_nonzero(short), 'file parse error, maybe truncated, building file anyway')
+    rows = np.flatnonzero(has & ~short)
+
+    return rows, buf[pos[rows, None] + np.arange(size)]
+
+
+def carry_forward(values, has, last):
+    # the value from the last ensemble that had one, starting with the last value from the previous block
+    idx = np.maximum.accumulate(np.where(has, np.arange(len(has)), -1))
+
+    return np.where(idx >= 0, values[np.maximum(idx, 0)], last)
+
 
-def rdi_parse(files):
+def rdi_parse(files, reindex=False):
     filepath = files[0]
     ts_start = None
 
@@ -130,210 +251,184 @@ def rdi_parse(files):
     var_sspeed.units = 'm/s'
 
     cellDim = None
+    num_cells = None
+    num_beams = None
+    fixed_decoded = None
+    last_cells = -1
+    last_beams = -1
+    last_inst = 0
+    ts = None
 
-    # loop over file, adding data to netCDF file for each ensemble
+    # loop over file, decoding a block of ensembles at a time, and adding the block to the netCDF file
 
     with open(filepath, "rb") as binary_file:
-        data = binary_file.read(2)
-        while data:
-            print()
-            # print("hdr ", data)
-            if data == b'\x7f\x7f':
-                sum = 0
-                for hdr_ens_n in data:
-                    sum += hdr_ens_n
-
-                data = binary_file.read(2)
-                (ensemble_len,) = struct.unpack("<H", data)
-
-                for hdr_ens_n in data:
-                    sum += hdr_ens_n
-
-                #print("ensemble pos", binary_file.tell(), "length", ensemble_len)
-                ensemble = binary_file.read(ensemble_len-4)
-                for hdr_ens_n in ensemble:
-                    sum += hdr_ens_n
-
-                sum = sum % 65536
-                cksum_data = binary_file.read(2)
-                if len(cksum_data) != 2:
-                    print("checksum error")
-                    continue
-                (cksum,) = struct.unpack("<H", cksum_data)
-                #print("checksum ", cksum, sum)
-
-                if cksum == sum:
-                    header = struct.unpack(header_decoder["unpack"], ensemble[0:2])
-                    header_decoded = dict(zip(header_decoder['keys'], header))
-                    #print("header ", header_decoded)
-
-                    hdr_addr = 2
-                    addrs = [0 for x in range(0, header_decoded["dataTypes"])]
-                    for hdr_ens_n in range(0, header_decoded["dataTypes"]):
-                        addr_data = ensemble[hdr_addr:hdr_addr + 2]
-                        addrs[hdr_ens_n] = struct.unpack("<H", addr_data)[0]
-                        #print("data type", hdr_ens_n, "addr", addrs[hdr_ens_n])
-                        hdr_addr += 2
-
-                        ens_pos = addrs[hdr_ens_n] - 4
-                        ens_type = ensemble[ens_pos:ens_pos+2]
-                        #print(hdr_addr, ens_pos, "ens type ", ens_type, 'total len', ensemble_len - 6)
-
-                        try:
-                            if ens_type == b'\x00\x00':  # fixed header
-                                data = ensemble[ens_pos+2:ens_pos+59]
-                                fixed = struct.unpack(fixed_decoder["unpack"], data)
-                                fixed_decoded = dict(zip(fixed_decoder['keys'], fixed))
-                                #print("fixed ", fixed_decoded)
-                                
-                                coord_sys = (fixed_decoded['coord_trans'] >> 3) & 0x03
-                                ncOut.data_coordinates = inst_coords_decoder[coord_sys]
-
-                                num_cells = fixed_decoded['num_cells']
-                                num_beams = fixed_decoded['num_beam']
-
-                                print('fixed header, num_cells', num_cells)
-
-                                # know how big a cell is now, create the cell based variables
-                                if 'CELL' not in ncOut.dimensions:
-                                    #cellDim = ncOut.createDimension("CELL")
-                                    cellDim = ncOut.createDimension("CELL", num_cells)
-                                    # create cell variables, one for each beam, generic names until we know the coordinates
-                                    var_vel1 = ncOut.createVariable("V1", "f4", ("TIME", "CELL"), zlib=True, chunksizes=[1024, num_cells])
-                                    var_vel1.units = 'm/s'
-                                    var_vel1.valid_max = 20
-                                    var_vel1.valid_min = -20
-                                    var_vel2 = ncOut.createVariable("V2", "f4", ("TIME", "CELL"), zlib=True, chunksizes=[1024, num_cells])
-                                    var_vel2.units = 'm/s'
-                                    var_vel2.valid_max = 20
-                                    var_vel2.valid_min = -20
-                                    var_vel3 = ncOut.createVariable("V3", "f4", ("TIME", "CELL"), zlib=True, chunksizes=[1024, num_cells])
-                                    var_vel3.units = 'm/s'
-                                    var_vel3.valid_max = 20
-                                    var_vel3.valid_min = -20
-                                    var_vel4 = ncOut.createVariable("V4", "f4", ("TIME", "CELL"), zlib=True, chunksizes=[1024, num_cells])
-                                    var_vel4.units = 'm/s'
-                                    var_vel4.valid_max = 20
-                                    var_vel4.valid_min = -20
-
-                                    # beam_dim = ncOut.createDimension("BEAM", 4)
-                                    # field_dim = ncOut.createDimension("FIELD", 4)
-                                    var_corr1 = ncOut.createVariable("CORR_MAG1", "u1", ("TIME", "CELL"), zlib=True, chunksizes=[1024, num_cells])
-                                    var_corr2 = ncOut.createVariable("CORR_MAG2", "u1", ("TIME", "CELL"), zlib=True, chunksizes=[1024, num_cells])
-                                    var_corr3 = ncOut.createVariable("CORR_MAG3", "u1", ("TIME", "CELL"), zlib=True, chunksizes=[1024, num_cells])
-                                    var_corr4 = ncOut.createVariable("CORR_MAG4", "u1", ("TIME", "CELL"), zlib=True, chunksizes=[1024, num_cells])
-
-                                    var_echo_int1 = ncOut.createVariable("ECHO_INT1", "f4", ("TIME", "CELL"), zlib=True, chunksizes=[1024, num_cells])
-                                    var_echo_int2 = ncOut.createVariable("ECHO_INT2", "f4", ("TIME", "CELL"), zlib=True, chunksizes=[1024, num_cells])
-                                    var_echo_int3 = ncOut.createVariable("ECHO_INT3", "f4", ("TIME", "CELL"), zlib=True, chunksizes=[1024, num_cells])
-                                    var_echo_int4 = ncOut.createVariable("ECHO_INT4", "f4", ("TIME", "CELL"), zlib=True, chunksizes=[1024, num_cells])
-
-                                    var_per_good1 = ncOut.createVariable("PCT_GOOD1", "u1", ("TIME", "CELL"), zlib=True, chunksizes=[1024, num_cells])
-                                    var_per_good2 = ncOut.createVariable("PCT_GOOD2", "u1", ("TIME", "CELL"), zlib=True, chunksizes=[1024, num_cells])
-                                    var_per_good3 = ncOut.createVariable("PCT_GOOD3", "u1", ("TIME", "CELL"), zlib=True, chunksizes=[1024, num_cells])
-                                    var_per_good4 = ncOut.createVariable("PCT_GOOD4", "u1", ("TIME", "CELL"), zlib=True, chunksizes=[1024, num_cells])
-
-                                    var_status1 = ncOut.createVariable("STATUS1", "u1", ("TIME", "CELL"), zlib=True, chunksizes=[1024, num_cells])
-                                    var_status2 = ncOut.createVariable("STATUS2", "u1", ("TIME", "CELL"), zlib=True, chunksizes=[1024, num_cells])
-                                    var_status3 = ncOut.createVariable("STATUS3", "u1", ("TIME", "CELL"), zlib=True, chunksizes=[1024, num_cells])
-                                    var_status4 = ncOut.createVariable("STATUS4", "u1", ("TIME", "CELL"), zlib=True, chunksizes=[1024, num_cells])
-
-                                inst_system = fixed_decoded['sysConfig'] & 0x7
-                                inst_system_text = inst_system_decoder[inst_system][0]
-                                #print("system ", inst_system_text)
-
-                            elif ens_type == b'\x80\x00':  # variable header
-                                data = ensemble[ens_pos+2:ens_pos+65]
-                                variable = struct.unpack(variable_decoder["unpack"], data)
-                                variable_decoded = dict(zip(variable_decoder['keys'], variable))
-                                #print("variable header ", variable_decoded)
-
-                                # ts = datetime.datetime(year=variable_decoded['rtc_cen']*100 + variable_decoded['rtc_year'],
-                                #                        month=variable_decoded['rtc_month'], day=variable_decoded['rtc_day'],
-                                #                        hour=variable_decoded['rtc_hour'], minute=variable_decoded['rtc_min'],
-                                #                        second=variable_decoded['rtc_sec'],
-                                #                        microsecond=variable_decoded['rtc_hsec']*1000*10)
-
-                                ts = datetime.datetime(year=2000 + variable_decoded['year'],
-                                                       month=variable_decoded['month'], day=variable_decoded['day'],
-                                                       hour=variable_decoded['hour'], minute=variable_decoded['minute'],
-                                                       second=variable_decoded['second'],
-                                                       microsecond=variable_decoded['hsec']*1000*10)
-
-                                print("ts = ", ts)
-                                if not ts_start:
-                                    ts_start = ts
-
-                                ncTimesOut[number_ensambles_read] = date2num(ts, calendar=ncTimesOut.calendar, units=ncTimesOut.units)
-
-                                var_head[number_ensambles_read] = variable_decoded['heading']*0.01
-                                var_pitch[number_ensambles_read] = variable_decoded['pitch']*0.01
-                                var_roll[number_ensambles_read] = variable_decoded['roll']*0.01
-                                var_temp[number_ensambles_read] = variable_decoded['temperature']*0.01
-
-                                var_press[number_ensambles_read] = variable_decoded['pressure']/1000
-                                var_press_v[number_ensambles_read] = variable_decoded['press_variance']/1000
-                                var_txv[number_ensambles_read] = variable_decoded['adc1']*volt_scale_system[inst_system][0]/1000000
-                                var_txi[number_ensambles_read] = variable_decoded['adc0']*volt_scale_system[inst_system][1]/1000000
-                                var_sspeed[number_ensambles_read] = variable_decoded['speed_of_sound']
-
-                            elif ens_type == b'\x00\x01':  # velocity data
-                                data = ensemble[ens_pos+2:ens_pos + 2 + (num_beams * 2) * num_cells]
-                                velocity = np.array(struct.unpack("<%dh" % (num_beams*num_cells), data))
-                                #print("velocity shape ", velocity.shape)
-                                v = velocity.reshape([num_cells, num_beams])
-                                #print(var_vel1, number_ensambles_read, v.shape)
-                                var_vel1[number_ensambles_read, :] = v[:, 0] / 1000
-                                var_vel2[number_ensambles_read, :] = v[:, 1] / 1000
-                                var_vel3[number_ensambles_read, :] = v[:, 2] / 1000
-                                var_vel4[number_ensambles_read, :] = v[:, 3] / 1000
-
-                                #print("var vel shape ", var_vel1.shape)
-                            elif ens_type == b'\x00\x02':  # correlation mag
-                                data = ensemble[ens_pos+2:ens_pos + 2 + num_beams * num_cells]
-                                np_corr = np.array(struct.unpack("<%dB" % (num_beams*num_cells), data)).reshape([num_cells, num_beams])
-                                #print('size corr', len(np_corr))
-                                if len(np_corr) > 0:
-                                    var_corr1[number_ensambles_read, :] = np_corr[:, 0]
-                                    var_corr2[number_ensambles_read, :] = np_corr[:, 1]
-                                    var_corr3[number_ensambles_read, :] = np_corr[:, 2]
-                                    var_corr4[number_ensambles_read, :] = np_corr[:, 3]
-                            elif ens_type == b'\x00\x03':  # echo intensity
-                                data = ensemble[ens_pos+2:ens_pos + 2 + num_beams * num_cells]
-                                np_echo_int = np.array(struct.unpack("<%dB" % (num_beams*num_cells), data)).reshape([num_cells, num_beams])
-                                var_echo_int1[number_ensambles_read, :] = np_echo_int[:, 0] * 0.45
-                                var_echo_int2[number_ensambles_read, :] = np_echo_int[:, 1] * 0.45
-                                var_echo_int3[number_ensambles_read, :] = np_echo_int[:, 2] * 0.45
-                                var_echo_int4[number_ensambles_read, :] = np_echo_int[:, 3] * 0.45
-                            elif ens_type == b'\x00\x04':  # percent good
-                                data = ensemble[ens_pos+2:ens_pos + 2 + num_beams * num_cells]
-                                np_pg = np.array(struct.unpack("<%dB" % (4*num_cells), data)).reshape([num_cells, 4])
-                                var_per_good1[number_ensambles_read, :] = np_pg[:, 0]
-                                var_per_good2[number_ensambles_read, :] = np_pg[:, 1]
-                                var_per_good3[number_ensambles_read, :] = np_pg[:, 2]
-                                var_per_good4[number_ensambles_read, :] = np_pg[:, 3]
-                            elif ens_type == b'\x00\x05':  # status data
-                                data = ensemble[ens_pos+2:ens_pos + 2 + num_beams * num_cells]
-                                print(len(ensemble), num_beams*num_cells)
-                                np_status = np.array(struct.unpack("<%db" % (num_beams*num_cells), data)).reshape([num_cells, num_beams])
-                                var_status1[number_ensambles_read, :] = np_status[:, 0]
-                                var_status2[number_ensambles_read, :] = np_status[:, 1]
-                                var_status3[number_ensambles_read, :] = np_status[:, 2]
-                                var_status4[number_ensambles_read, :] = np_status[:, 3]
-                            else:
-                                print('unknown ens_type', ens_type[0], ens_type[1], 'hdr ens n', hdr_ens_n)
-                        except struct.error as e:
-                            print(num_cells, len(ensemble), num_beams * num_cells)
-                            print(e)
-                            traceback.print_exc(limit=2, file=sys.stdout)
-                            print('file parse error, maybe truncated, building file anyway')
-                            pass
-
-                    if number_ensambles_read % 1000 == 0:
-                        print("number ensambles read ", number_ensambles_read)
-                    number_ensambles_read += 1
-
-            data = binary_file.read(2)
+        mm = mmap.mmap(binary_file.fileno(), 0, access=mmap.ACCESS_READ)
+        buf = np.frombuffer(mm, dtype=np.uint8)
+
+        index = rdi_index(filepath, mm, buf, reindex)
+        ok = index['checksum_ok']
+        ensemble_starts = index['offset'][ok]
+        ensemble_lengths = index['length'][ok]
+
+        for block_start in range(0, len(ensemble_starts), ensemble_block):
+            starts = ensemble_starts[block_start:block_start + ensemble_block]
+            ends = starts + ensemble_lengths[block_start:block_start + ensemble_block]
+            n = len(starts)
+            block = slice(number_ensambles_read, number_ensambles_read + n)
+
+            positions = data_type_positions(buf, starts, ends - starts)
+            for t in positions:
+                if t not in (0x0000, 0x0080, 0x0100, 0x0200, 0x0300, 0x0400, 0x0500):
+                    print('unknown ens_type', t & 0xff, t >> 8, 'ensembles', np.count_nonzero(positions[t] >= 0))
+            no_type = np.full(n, -1, dtype=np.int64)
+
+            # fixed header
+            (rows, data) = gather(buf, positions.get(0x0000, no_type), ends, fixed_dtype.itemsize)
+            fixed = np.zeros(n, dtype=fixed_dtype)
+            fixed[rows] = data.view(fixed_dtype)[:, 0]
+            has_fixed = np.zeros(n, dtype=bool)
+            has_fixed[rows] = True
+
+            if len(rows) > 0:
+                fixed_decoded = {k: fixed[rows[-1]][k].item() for k in fixed_decoder['keys']}
+                #print("fixed ", fixed_decoded)
+
+                coord_sys = (fixed_decoded['coord_trans'] >> 3) & 0x03
+                ncOut.data_coordinates = inst_coords_decoder[coord_sys]
+
+                inst_system = fixed_decoded['sysConfig'] & 0x7
+                inst_system_text = inst_system_decoder[inst_system][0]
+                #print("system ", inst_system_text)
+
+            # know how big a cell is now, create the cell based variables
+            if cellDim is None and len(rows) > 0:
+                num_cells = int(fixed[rows[0]]['num_cells'])
+                num_beams = int(fixed[rows[0]]['num_beam'])
+
+                print('fixed header, num_cells', num_cells)
+
+                #cellDim = ncOut.createDimension("CELL")
+                cellDim = ncOut.createDimension("CELL", num_cells)
+                # create cell variables, one for each beam, generic names until we know the coordinates
+                var_vel1 = ncOut.createVariable("V1", "f4", ("TIME", "CELL"), zlib=True, chunksizes=[1024, num_cells])
+                var_vel1.units = 'm/s'
+                var_vel1.valid_max = 20
+                var_vel1.valid_min = -20
+                var_vel2 = ncOut.createVariable("V2", "f4", ("TIME", "CELL"), zlib=True, chunksizes=[1024, num_cells])
+                var_vel2.units = 'm/s'
+                var_vel2.valid_max = 20
+                var_vel2.valid_min = -20
+                var_vel3 = ncOut.createVariable("V3", "f4", ("TIME", "CELL"), zlib=True, chunksizes=[1024, num_cells])
+                var_vel3.units = 'm/s'
+                var_vel3.valid_max = 20
+                var_vel3.valid_min = -20
+                var_vel4 = ncOut.createVariable("V4", "f4", ("TIME", "CELL"), zlib=True, chunksizes=[1024, num_cells])
+                var_vel4.units = 'm/s'
+                var_vel4.valid_max = 20
+                var_vel4.valid_min = -20
+
+                # beam_dim = ncOut.createDimension("BEAM", 4)
+                # field_dim = ncOut.createDimension("FIELD", 4)
+                var_corr1 = ncOut.createVariable("CORR_MAG1", "u1", ("TIME", "CELL"), zlib=True, chunksizes=[1024, num_cells])
+                var_corr2 = ncOut.createVariable("CORR_MAG2", "u1", ("TIME", "CELL"), zlib=True, chunksizes=[1024, num_cells])
+                var_corr3 = ncOut.createVariable("CORR_MAG3", "u1", ("TIME", "CELL"), zlib=True, chunksizes=[1024, num_cells])
+                var_corr4 = ncOut.createVariable("CORR_MAG4", "u1", ("TIME", "CELL"), zlib=True, chunksizes=[1024, num_cells])
+
+                var_echo_int1 = ncOut.createVariable("ECHO_INT1", "f4", ("TIME", "CELL"), zlib=True, chunksizes=[1024, num_cells])
+                var_echo_int2 = ncOut.createVariable("ECHO_INT2", "f4", ("TIME", "CELL"), zlib=True, chunksizes=[1024, num_cells])
+                var_echo_int3 = ncOut.createVariable("ECHO_INT3", "f4", ("TIME", "CELL"), zlib=True, chunksizes=[1024, num_cells])
+                var_echo_int4 = ncOut.createVariable("ECHO_INT4", "f4", ("TIME", "CELL"), zlib=True, chunksizes=[1024, num_cells])
+
+                var_per_good1 = ncOut.createVariable("PCT_GOOD1", "u1", ("TIME", "CELL"), zlib=True, chunksizes=[1024, num_cells])
+                var_per_good2 = ncOut.createVariable("PCT_GOOD2", "u1", ("TIME", "CELL"), zlib=True, chunksizes=[1024, num_cells])
+                var_per_good3 = ncOut.createVariable("PCT_GOOD3", "u1", ("TIME", "CELL"), zlib=True, chunksizes=[1024, num_cells])
+                var_per_good4 = ncOut.createVariable("PCT_GOOD4", "u1", ("TIME", "CELL"), zlib=True, chunksizes=[1024, num_cells])
+
+                var_status1 = ncOut.createVariable("STATUS1", "u1", ("TIME", "CELL"), zlib=True, chunksizes=[1024, num_cells])
+                var_status2 = ncOut.createVariable("STATUS2", "u1", ("TIME", "CELL"), zlib=True, chunksizes=[1024, num_cells])
+                var_status3 = ncOut.createVariable("STATUS3", "u1", ("TIME", "CELL"), zlib=True, chunksizes=[1024, num_cells])
+                var_status4 = ncOut.createVariable("STATUS4", "u1", ("TIME", "CELL"), zlib=True, chunksizes=[1024, num_cells])
+
+                # cell variables for each data type, (data type id, number of fields, numpy type, scaling, variables)
+                profile_types = [(0x0100, num_beams, '<i2', lambda x: x / 1000, [var_vel1, var_vel2, var_vel3, var_vel4]),
+                                 (0x0200, num_beams, 'u1', None, [var_corr1, var_corr2, var_corr3, var_corr4]),
+                                 (0x0300, num_beams, 'u1', lambda x: x * 0.45, [var_echo_int1, var_echo_int2, var_echo_int3, var_echo_int4]),
+                                 (0x0400, 4, 'u1', None, [var_per_good1, var_per_good2, var_per_good3, var_per_good4]),
+                                 (0x0500, num_beams, 'i1', None, [var_status1, var_status2, var_status3, var_status4])]
+
+            # the setup of each ensemble, from the last fixed header
+            cells = carry_forward(fixed['num_cells'].astype(np.int64), has_fixed, last_cells)
+            beams = carry_forward(fixed['num_beam'].astype(np.int64), has_fixed, last_beams)
+            inst = carry_forward(fixed['sysConfig'].astype(np.int64) & 0x7, has_fixed, last_inst)
+            (last_cells, last_beams, last_inst) = (cells[-1], beams[-1], inst[-1])
+
+            # variable header
+            (rows, data) = gather(buf, positions.get(0x0080, no_type), ends, variable_dtype.itemsize)
+            variable = data.view(variable_dtype)[:, 0]
+
+            # ts = datetime.datetime(year=variable_decoded['rtc_cen']*100 + variable_decoded['rtc_year'], ...
+
+            # the start of the month, and the number of days in it, to check the day against
+            month_ok = (variable['month'] >= 1) & (variable['month'] <= 12)
+            month_start = (variable['year'].astype(np.int64) + 2000 - 1970).astype('M8[Y]').astype('M8[M]') + np.clip(variable['month'].astype(np.int64) - 1, 0, 11)
+            days_in_month = ((month_start + 1).astype('M8[D]') - month_start.astype('M8[D]')).astype(np.int64)
+
+            valid = month_ok & (variable['day'] >= 1) & (variable['day'] <= days_in_month) & \
+                    (variable['hour'] < 24) & (variable['minute'] < 60) & (variable['second'] < 60) & (variable['hsec'] < 100)
+            if not np.all(valid):
+                print('invalid time, ensembles', np.count_nonzero(~valid))
+            rows = rows[valid]
+            variable = variable[valid]
+            month_start = month_start[valid]
+
+            t = month_start.astype('M8[D]') + (variable['day'].astype(np.int64) - 1)
+            t = t.astype('M8[ms]') + ((variable['hour'].astype(np.int64) * 60 + variable['minute']) * 60 + variable['second']) * 1000 + variable['hsec'].astype(np.int64) * 10
+
+            if len(rows) > 0:
+                if not ts_start:
+                    ts_start = t[0].astype(datetime.datetime)
+                ts = t[-1].astype(datetime.datetime)
+
+                time = np.ma.masked_all(n, dtype=np.float64)
+                time[rows] = (t - np.datetime64('1950-01-01')) / np.timedelta64(1, 'D')
+                ncTimesOut[block] = time
+
+                for (var, values) in ((var_head, variable['heading'] * 0.01),
+                                      (var_pitch, variable['pitch'] * 0.01),
+                                      (var_roll, variable['roll'] * 0.01),
+                                      (var_temp, variable['temperature'] * 0.01),
+                                      (var_press, variable['pressure'] / 1000),
+                                      (var_press_v, variable['press_variance'] / 1000),
+                                      (var_txv, variable['adc1'] * volt_scale[inst[rows], 0] / 1000000),
+                                      (var_txi, variable['adc0'] * volt_scale[inst[rows], 1] / 1000000),
+                                      (var_sspeed, variable['speed_of_sound'])):
+                    v = np.ma.masked_all(n, dtype=np.float32)
+                    v[rows] = values
+                    var[block] = v
+
+            # cell data, velocity, correlation mag, echo intensity, percent good, status
+            if cellDim is not None:
+                same_setup = (cells == num_cells) & (beams == num_beams)
+                if not np.all(same_setup):
+                    print('ensembles with a different number of cells or beams, not decoded', np.count_nonzero(~same_setup))
+
+                for (ens_type, n_fields, dtype, scale, variables) in profile_types:
+                    pos = np.where(same_setup, positions.get(ens_type, no_type), -1)
+                    if not np.any(pos >= 0):
+                        continue
+
+                    (rows, data) = gather(buf, pos, ends, n_fields * num_cells * np.dtype(dtype).itemsize)
+                    values = data.view(dtype).reshape([len(rows), num_cells, n_fields])
+                    if scale is not None:
+                        values = scale(values)
+
+                    for (field, var) in enumerate(variables[:n_fields]):
+                        v = np.ma.masked_all((n, num_cells), dtype=var.dtype)
+                        v[rows] = values[:, :, field]
+                        var[block, :] = v
+
+            number_ensambles_read += n
+            print("number ensambles read ", number_ensambles_read)
 
     print("file start time ", ts_start)
     print("file end time   ", ts)
@@ -398,4 +493,5 @@ def rdi_parse(files):
 
 
 if __name__ == "__main__":
-    rdi_parse(sys.argv[1:])
+    reindex = '--reindex' in sys.argv[1:]
+    rdi_parse([f for f in sys.argv[1:] if f != '--reindex'], reindex)
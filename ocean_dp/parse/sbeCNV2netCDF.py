@@ -19,6 +19,7 @@
 import sys
 import re
 import os
+import itertools
 
 from datetime import datetime, timedelta, UTC
 from cftime import num2date, date2num
@@ -105,51 +106,105 @@ calMap["PAR"] = ('PAR_BiosphericalLicorChelseaSensor', 0)
 calMap["WETCDOM"] = ('FluoroWetlabCDOM_Sensor', 0)
 calMap["FLECOAFL"] = ('FluoroWetlabECO_AFL_FL_Sensor', 0)
 
-# search expressions within file
+# search expressions within file, compiled once, lines starting with * or # are only checked against the expressions
+# with that prefix, expressions for xml tags (starting .*<) only against lines with a <
 
-first_line_expr = r"\* Sea-Bird (.*) Data File:"
+first_line_expr = re.compile(r"\* Sea-Bird (.*) Data File:")
 
-hardware_expr = r"\* <HardwareData DeviceType='(\S+)' SerialNumber='(\S+)'>"
-name_expr = r"# name (?P<number>\d+) = (?P<param>.*):\s*(?P<text>.*)"
-end_expr = r"\*END\*"
-sampleExpr = r"\* sample interval = (\d+) seconds"
-startTimeExpr = r"# start_time = ([^\[]*)"
-intervalExpr = r"# interval = (\S+): (\S+)"
-firmwareDateExpr = r"\*.*<FirmwareDate>(.*)<\/FirmwareDate>"
-firmwareVerExpr = r"\*.*<FirmwareVersion>(.*)<\/FirmwareVersion>"
-mfgDateExpr = r"\*.*<MfgDate>(.*)<\/MfgDate>"
+hardware_expr = re.compile(r"\* <HardwareData DeviceType='(\S+)' SerialNumber='(\S+)'>")
+name_expr = re.compile(r"# name (?P<number>\d+) = (?P<param>.*):\s*(?P<text>.*)")
+end_expr = re.compile(r"\*END\*")
+sampleExpr = re.compile(r"\* sample interval = (\d+) seconds")
+startTimeExpr = re.compile(r"# start_time = ([^\[]*)")
+intervalExpr = re.compile(r"# interval = (\S+): (\S+)")
+firmwareDateExpr = re.compile(r"\*.*<FirmwareDate>(.*)<\/FirmwareDate>")
+firmwareVerExpr = re.compile(r"\*.*<FirmwareVersion>(.*)<\/FirmwareVersion>")
+mfgDateExpr = re.compile(r"\*.*<MfgDate>(.*)<\/MfgDate>")
 
-name_units = r"(?P<name>[^\[]*)\[(?P<units>.*?)\].*$"
+name_units = re.compile(r"(?P<name>[^\[]*)\[(?P<units>.*?)\].*$")
 
-nvalues_expr = r"# nvalues =\s*(\d+)"
-nquant_expr = r"# nquan = (\d+)"
+nvalues_expr = re.compile(r"# nvalues =\s*(\d+)")
+nquant_expr = re.compile(r"# nquan = (\d+)")
 
-use_expr = r".*<(Use.*)>(.?)<\/\1>"
-equa_group = r".*<(.*) equation=\"(\d+)\" >"
+use_expr = re.compile(r".*<(Use.*)>(.?)<\/\1>")
+equa_group = re.compile(r".*<(.*) equation=\"(\d+)\" >")
 
-sensor_start = r".*<sensor Channel=\"(.*)\" >"
-sensor_end = r".*</sensor(.*)>"
-sensor_type = r".*<(.*) SensorID=\"(.*)\" >"
-sensor_cal_type_name = r"#.*<!--\s([^,]*),\s(.*)\s-->"
+sensor_start = re.compile(r".*<sensor Channel=\"(.*)\" >")
+sensor_end = re.compile(r".*</sensor(.*)>")
+sensor_type = re.compile(r".*<(.*) SensorID=\"(.*)\" >")
+sensor_cal_type_name = re.compile(r"#.*<!--\s([^,]*),\s(.*)\s-->")
 
-comment = r"<!--(.+?)-->"
-tag = r".*<(.+?)>(.+)<\/\1>|.*<(.+=.*)>"
-cal_tag = r".*<(?P<tag>.+?)>(?P<value>.+)<\/(?P=tag)>"
+comment = re.compile(r"<!--(.+?)-->")
+tag = re.compile(r".*<(.+?)>(.+)<\/\1>|.*<(.+=.*)>")
+cal_tag = re.compile(r".*<(?P<tag>.+?)>(?P<value>.+)<\/(?P=tag)>")
 
-instr_exp = r"\* Sea-Bird.?(\S+)"
-sn_expr = r"\* (SBE.*)\s+V\s+(\S+)\s+SERIAL NO. (\S*)"
-sn2_6_expr = r"\* Temperature SN = (\S*)"
-sn39_expr = r"\* SerialNumber: (\S*)"
+instr_exp = re.compile(r"\* Sea-Bird.?(\S+)")
+sn_expr = re.compile(r"\* (SBE.*)\s+V\s+(\S+)\s+SERIAL NO. (\S*)")
+sn2_6_expr = re.compile(r"\* Temperature SN = (\S*)")
+sn39_expr = re.compile(r"\* SerialNumber: (\S*)")
 
-cast_exp = r"\* cast\s+(.*$)"
+cast_exp = re.compile(r"\* cast\s+(.*$)")
 
-cal_expr          = r"\* ((\S*).*):\s*(.*)"
-cal_val_expr      = r"\*\s*(\S*) = ([0-9e+-\.]*)"
+cal_expr          = re.compile(r"\* ((\S*).*):\s*(.*)")
+cal_val_expr      = re.compile(r"\*\s*(\S*) = ([0-9e+-\.]*)")
+
+dat_cnv_start = re.compile(r"# </Sensors>")
+dat_cnv_end = re.compile(r"# file_type = ascii")
+advance_pri_cond = re.compile(r"\* advance primary conductivity\s*(\S*)\s* seconds")
+advance_sec_cond = re.compile(r"\* advance secondary conductivity\s*(\S*)\s* seconds")
+
+#
+# read the data section
+#
+
+data_chunk = 100000  # lines of the data section read at a time
+
+
+def read_lines(lines, cols, line_no):
+    # convert the lines one at a time, reporting any bad lines, returns an array with a row for each good line, and the
+    # number of bad lines
+    rows = []
+    bad = 0
+    for n, line in enumerate(lines):
+        lineSplit = line.split()
+        if not lineSplit:
+            continue
+        try:
+            rows.append([float(lineSplit[c]) for c in cols])
+        except (ValueError, IndexError):
+            print('bad line', line_no + n, ':', line.strip())
+            bad += 1
+
+    return np.array(rows, dtype=np.float64).reshape(-1, len(cols)), bad
+
+
+def read_data(fp, cols, line_no):
+    # read the data section (the lines after *END*), a chunk of lines at a time, each chunk converted with np.loadtxt
+    # into an array of the columns used, any chunk with a bad line is converted a line at a time to find the bad lines
+    chunks = []
+    bad = 0
+    while True:
+        lines = list(itertools.islice(fp, data_chunk))
+        if not lines:
+            break
+
+        try:
+            chunks.append(np.loadtxt(lines, usecols=cols, ndmin=2, dtype=np.float64, comments=None))
+        except ValueError:
+            (chunk, chunk_bad) = read_lines(lines, cols, line_no)
+            chunks.append(chunk)
+            bad += chunk_bad
+
+        line_no += len(lines)
+
+    if bad > 0:
+        print('**** WARNING bad lines', bad)
+
+    if not chunks:
+        return np.zeros((0, len(cols)))
+
+    return np.concatenate(chunks)
 
-dat_cnv_start = r"# </Sensors>"
-dat_cnv_end = r"# file_type = ascii"
-advance_pri_cond = r"\* advance primary conductivity\s*(\S*)\s* seconds"
-advance_sec_cond = r"\* advance secondary conductivity\s*(\S*)\s* seconds"
 
 #
 # parse the file
@@ -162,12 +217,11 @@ def parse(files):
 
     for filepath in files:
 
-        hdr = True
-        dataLine = 0
         name = []
         text = []
-        number_samples_read = 0
+        number_samples = None
         nVars = 0
+        nVariables = 0
 
         use_eqn = None
         eqn = None
@@ -189,105 +243,105 @@ def parse(files):
 
         with open(filepath, 'r', errors='ignore') as fp:
             line = fp.readline()
-            matchObj = re.match(first_line_expr, line)
+            matchObj = first_line_expr.match(line)
             #if not matchObj:
             #    print("Not a Sea Bird CNV file !")
             #    return None
 
             cnt = 1
             while line:
-                #print("Line {}: {} : {}".format(cnt, dataLine, line.strip()))
+                #print("Line {}: {}".format(cnt, line.strip()))
 
-                if hdr:
+                star = line.startswith('*')
+                pound = line.startswith('#')
+                tagged = '<' in line
 
-                    if data_cnv:
-                        matchObj = re.match(dat_cnv_end, line)
-                        if matchObj:
-                            data_cnv = False
-                        else:
-                            if len(line) > 0:
-                                #print("data cnv line ", line.strip())
-                                data_cnv_lines.append(line)
-
-                    matchObj = re.match(dat_cnv_start, line)
-                    if matchObj:
-                        data_cnv = True
-                        #print("data cnv line start")
-
-                    matchObj = re.match(advance_pri_cond, line)
+                if data_cnv:
+                    matchObj = pound and dat_cnv_end.match(line)
                     if matchObj:
-                        adv_pri = line
-                    matchObj = re.match(advance_sec_cond, line)
+                        data_cnv = False
+                    else:
+                        if len(line) > 0:
+                            #print("data cnv line ", line.strip())
+                            data_cnv_lines.append(line)
+
+                if pound and dat_cnv_start.match(line):
+                    data_cnv = True
+                    #print("data cnv line start")
+
+                if star and advance_pri_cond.match(line):
+                    adv_pri = line
+                if star and advance_sec_cond.match(line):
+                    adv_sec = line
+
+                # deal with sensor tags
+                if sensor:
+                    #print('sensor line', line.strip())
+                    matchObj = star and cal_val_expr.match(line)
                     if matchObj:
-                        adv_sec = line
-
-                    # deal with sensor tags
-                    if sensor:
-                        #print('sensor line', line.strip())
-                        matchObj = re.match(cal_val_expr, line)
-                        if matchObj:
-                            #print("cal_val_expr:matchObj.group() : ", matchObj.group())
-                            #print("cal_val_expr:matchObj.group(1) : ", matchObj.group(1))
-                            cal_param = matchObj.group(1)
-                            cal_value = matchObj.group(2)
+                        #print("cal_val_expr:matchObj.group() : ", matchObj.group())
+                        #print("cal_val_expr:matchObj.group(1) : ", matchObj.group(1))
+                        cal_param = matchObj.group(1)
+                        cal_value = matchObj.group(2)
 
-                            cal_tup = (cal_sensor, cal_param, cal_value, sensor_name, sensor_channel, cal_sensors[cal_sensor])
-                            cal_tags.append(cal_tup)
+                        cal_tup = (cal_sensor, cal_param, cal_value, sensor_name, sensor_channel, cal_sensors[cal_sensor])
+                        cal_tags.append(cal_tup)
 
-                            #cal_tags.append((cal_sensor, cal_param, cal_value))
-                            #print("calibration type %s param %s value %s" % (cal_sensor, cal_param, cal_value))
+                        #cal_tags.append((cal_sensor, cal_param, cal_value))
+                        #print("calibration type %s param %s value %s" % (cal_sensor, cal_param, cal_value))
 
-                        #else:
-                        #    sensor = False
+                    #else:
+                    #    sensor = False
 
-                        matchObj = re.match(sensor_cal_type_name, line.strip())
-                        if matchObj:
-                            #print("sensor_cal_type_name:matchObj.group() : ", matchObj.group())
-                            sensor_name = matchObj.group(2)
+                    matchObj = tagged and sensor_cal_type_name.match(line.strip())
+                    if matchObj:
+                        #print("sensor_cal_type_name:matchObj.group() : ", matchObj.group())
+                        sensor_name = matchObj.group(2)
+
+                    tmatchObj = tagged and cal_tag.match(line)
+                    if tmatchObj:
+                        #print("sensor_tag:matchObj.group() : ", tmatchObj.group())
+                        #print("sensor_tag:matchObj.group(1) : ", tmatchObj.group(1))
+                        #print("sensor_tag:matchObj.group(2) : ", tmatchObj.group(2))
+                        cal_param = tmatchObj.group(1)
+                        cal_value = tmatchObj.group(2)
+                        cal_tup = (cal_sensor, cal_param, cal_value, sensor_name, sensor_channel, cal_sensors[cal_sensor])
+                        #cal_tags.append(cal_tup)
+                        #print('cal_tag', cal_tup)
+                        #print("calibration type %s param %s value %s" % (cal_sensor, cal_param, cal_value))
+
+                    smatchObj = tagged and sensor_type.match(line)
+                    if smatchObj:
+                        #print("sensor_type:matchObj.group() : ", smatchObj.group())
+                        print("sensor_type:matchObj.group(1) : ", smatchObj.group(1))
+                        print("sensor_type:matchObj.group(2) : ", smatchObj.group(2))
+                        cal_sensor = smatchObj.group(1)
+                        if cal_sensor not in cal_sensors:
+                            cal_sensors[cal_sensor] = 0
+                        else:
+                            cal_sensors[cal_sensor] += 1
+                        print('cal_sensors', cal_sensors)
+
+                    if cal_param and cal_sensor and tmatchObj:
+                        add_cal_tag = False
+                        if cal_param == 'G':
+                            eqn = 1
+                        if not use_eqn:
+                            add_cal_tag = True
+                        elif use_eqn == eqn:
+                            add_cal_tag = True
+                        #print("add_cal_tag", add_cal_tag, "eqn", use_eqn, eqn)
+                        if add_cal_tag:
+                            if cal_param != 'SerialNumber' and cal_param != 'CalibrationDate' and cal_param != 'SensorName':
+                                cal_value = float(cal_value)
 
-                        tmatchObj = re.match(cal_tag, line)
-                        if tmatchObj:
-                            #print("sensor_tag:matchObj.group() : ", tmatchObj.group())
-                            #print("sensor_tag:matchObj.group(1) : ", tmatchObj.group(1))
-                            #print("sensor_tag:matchObj.group(2) : ", tmatchObj.group(2))
-                            cal_param = tmatchObj.group(1)
-                            cal_value = tmatchObj.group(2)
                             cal_tup = (cal_sensor, cal_param, cal_value, sensor_name, sensor_channel, cal_sensors[cal_sensor])
-                            #cal_tags.append(cal_tup)
+                            cal_tags.append(cal_tup)
                             #print('cal_tag', cal_tup)
-                            #print("calibration type %s param %s value %s" % (cal_sensor, cal_param, cal_value))
-
-                        smatchObj = re.match(sensor_type, line)
-                        if smatchObj:
-                            #print("sensor_type:matchObj.group() : ", smatchObj.group())
-                            print("sensor_type:matchObj.group(1) : ", smatchObj.group(1))
-                            print("sensor_type:matchObj.group(2) : ", smatchObj.group(2))
-                            cal_sensor = smatchObj.group(1)
-                            if cal_sensor not in cal_sensors:
-                                cal_sensors[cal_sensor] = 0
-                            else:
-                                cal_sensors[cal_sensor] += 1
-                            print('cal_sensors', cal_sensors)
-
-                        if cal_param and cal_sensor and tmatchObj:
-                            add_cal_tag = False
-                            if cal_param == 'G':
-                                eqn = 1
-                            if not use_eqn:
-                                add_cal_tag = True
-                            elif use_eqn == eqn:
-                                add_cal_tag = True
-                            #print("add_cal_tag", add_cal_tag, "eqn", use_eqn, eqn)
-                            if add_cal_tag:
-                                if cal_param != 'SerialNumber' and cal_param != 'CalibrationDate' and cal_param != 'SensorName':
-                                    cal_value = float(cal_value)
-
-                                cal_tup = (cal_sensor, cal_param, cal_value, sensor_name, sensor_channel, cal_sensors[cal_sensor])
-                                cal_tags.append(cal_tup)
-                                #print('cal_tag', cal_tup)
-                                print("channel %d calibration type %s # %d param %s value %s" % (sensor_channel, cal_sensor, cal_sensors[cal_sensor], cal_param, cal_value))
-
-                    matchObj = re.match(sensor_start, line)
+                            print("channel %d calibration type %s # %d param %s value %s" % (sensor_channel, cal_sensor, cal_sensors[cal_sensor], cal_param, cal_value))
+
+                if tagged:
+                    matchObj = sensor_start.match(line)
                     if matchObj:
                         #print("sensor_start:matchObj.group() : ", matchObj.group())
                         print("sensor_start:matchObj.group(1) : ", matchObj.group(1))
@@ -298,70 +352,74 @@ def parse(files):
                         cal_sensor = None
                         eqn = None
 
-                    matchObj = re.match(sensor_end, line)
+                    matchObj = sensor_end.match(line)
                     if matchObj:
                         #print("sensor_end:matchObj.group() : ", matchObj.group())
                         #print("sensor_end:matchObj.group(1) : ", matchObj.group(1))
                         sensor = False
 
-                    # matchObj = re.match(cal_expr, line)
-                    # if matchObj:
-                    #     print("cal_expr:matchObj.group() : ", matchObj.group())
-                    #     #print("cal_expr:matchObj.group(1) : ", matchObj.group(1))
-                    #     sensor = True
-                    #     cal_param = None
-                    #     cal_sensor = matchObj.group(2)
-                    #     cal_tags.append((cal_sensor, "comment", matchObj.group(1) + " " + matchObj.group(3)))
-
-
-                    matchObj = re.match(cast_exp, line)
+                # matchObj = re.match(cal_expr, line)
+                # if matchObj:
+                #     print("cal_expr:matchObj.group() : ", matchObj.group())
+                #     #print("cal_expr:matchObj.group(1) : ", matchObj.group(1))
+                #     sensor = True
+                #     cal_param = None
+                #     cal_sensor = matchObj.group(2)
+                #     cal_tags.append((cal_sensor, "comment", matchObj.group(1) + " " + matchObj.group(3)))
+
+                if star:
+                    matchObj = cast_exp.match(line)
                     if matchObj:
                         #print("cast_exp:matchObj.group() : ", matchObj.group())
                         #print("cast_exp:matchObj.group(1) : ", matchObj.group(1))
                         cast = matchObj.group(1)
 
-                    matchObj = re.match(use_expr, line)
+                if tagged:
+                    matchObj = use_expr.match(line)
                     if matchObj:
                         #print("use_expr:matchObj.group() : ", matchObj.group())
                         #print("use_expr:matchObj.group(1) : ", matchObj.group(1))
                         #print("use_expr:matchObj.group(2) : ", matchObj.group(2))
                         use_eqn = int(matchObj.group(2))
 
-                    matchObj = re.match(startTimeExpr, line)
+                if pound:
+                    matchObj = startTimeExpr.match(line)
                     if matchObj:
                         print("start_time_expr:matchObj.group() : ", matchObj.group())
                         start_time = parser.parse(matchObj.group(1))
                         print("start time ", start_time)
 
-                    matchObj = re.match(equa_group, line)
+                if tagged:
+                    matchObj = equa_group.match(line)
                     if matchObj:
                         #print("equa_group:matchObj.group() : ", matchObj.group())
                         #print("equa_group:matchObj.group(1) : ", matchObj.group(1))
                         #print("equa_group:matchObj.group(2) : ", matchObj.group(2))
                         eqn = matchObj.group(2)
 
-                    matchObj = re.match(instr_exp, line)
+                if star:
+                    matchObj = instr_exp.match(line)
                     if matchObj:
                         #print("instr_exp:matchObj.group() : ", matchObj.group())
                         #print("instr_exp:matchObj.group(1) : ", matchObj.group(1))
                         instrument_model = matchObj.group(1)
 
-                    matchObj = re.match(firmwareDateExpr, line)
+                    matchObj = firmwareDateExpr.match(line)
                     if matchObj:
                         #print("firmware_date:matchObj.group() : ", matchObj.group())
                         firmware_date = matchObj.group(1)
 
-                    matchObj = re.match(firmwareVerExpr, line)
+                    matchObj = firmwareVerExpr.match(line)
                     if matchObj:
                         #print("firmware_date:matchObj.group() : ", matchObj.group())
                         firmware_version = matchObj.group(1)
 
-                    matchObj = re.match(mfgDateExpr, line)
+                    matchObj = mfgDateExpr.match(line)
                     if matchObj:
                         #print("firmware_date:matchObj.group() : ", matchObj.group())
                         mfg_date = matchObj.group(1).strip()
 
-                    matchObj = re.match(hardware_expr, line)
+                    matchObj = hardware_expr.match(line)
                     if matchObj:
                         #print("hardware_expr:matchObj.group() : ", matchObj.group())
                         #print("hardware_expr:matchObj.group(1) : ", matchObj.group(1))
@@ -369,45 +427,46 @@ def parse(files):
                         instrument_model = matchObj.group(1)
                         instrument_serialnumber = matchObj.group(2)
 
-                    matchObj = re.match(sn_expr, line)
+                    matchObj = sn_expr.match(line)
                     if matchObj:
                         #print("sn_expr:matchObj.group() : ", matchObj.group())
                         print("sn_expr:matchObj.group(1) : ", matchObj.group(1))
                         instrument_model = matchObj.group(1)
                         instrument_serialnumber = matchObj.group(3)
 
-                    matchObj = re.match(sn2_6_expr, line)
+                    matchObj = sn2_6_expr.match(line)
                     if matchObj:
                         #print("sn2_6_expr:matchObj.group() : ", matchObj.group())
                         print("sn2_6_expr:matchObj.group(1) : ", matchObj.group(1))
                         instrument_serialnumber = matchObj.group(1)
 
-                    matchObj = re.match(sn39_expr, line)
+                    matchObj = sn39_expr.match(line)
                     if matchObj:
                         #print("sn39_expr:matchObj.group() : ", matchObj.group())
                         print("sn39_expr:matchObj.group(1) : ", matchObj.group(1))
                         instrument_serialnumber = matchObj.group(1)
 
-                    matchObj = re.match(sampleExpr, line)
+                    matchObj = sampleExpr.match(line)
                     if matchObj:
                         #print("sampleExpr:matchObj.group() : ", matchObj.group())
                         #print("sampleExpr:matchObj.group(1) : ", matchObj.group(1))
                         sample_interval = int(matchObj.group(1))
 
-                    matchObj = re.match(intervalExpr, line)
+                if pound:
+                    matchObj = intervalExpr.match(line)
                     if matchObj:
                         print("intervalExpr:matchObj.group() : ", matchObj.group())
                         #print("intervalExpr:matchObj.group(1) : ", matchObj.group(1))
                         #print("intervalExpr:matchObj.group(1) : ", matchObj.group(2))
                         sample_interval = float(matchObj.group(2))
 
-                    matchObj = re.match(nvalues_expr, line)
+                    matchObj = nvalues_expr.match(line)
                     if matchObj:
                         #print("nvalues_expr:matchObj.group() : ", matchObj.group())
                         print("nvalues_expr:matchObj.group(1) : ", matchObj.group(1))
                         number_samples = int(matchObj.group(1))
 
-                    matchObj = re.match(name_expr, line)
+                    matchObj = name_expr.match(line)
                     if matchObj:
                         #print("name_expr:matchObj.group() : ", matchObj.group())
                         #print("name_expr:matchObj.group(1) : ", matchObj.group(1))
@@ -417,7 +476,7 @@ def parse(files):
                         nameN = int(matchObj.group(1))
                         comment = matchObj.group(3)
 
-                        unitObj = re.match(name_units, comment)
+                        unitObj = name_units.match(comment)
                         unit = '1'
                         name_sensor = None
                         if unitObj:
@@ -446,31 +505,15 @@ def parse(files):
                             nVars = nVars + 1
                         print("name {} : {} ncName {} comment {}".format(nameN, varName, ncVarName, comment))
 
-                    matchObj = re.match(end_expr, line)
-                    if matchObj:
-                        hdr = False
-                        nVariables = len(name)
-                        if nVariables < 1:
-                            print('No Variables, exiting')
-                            exit(-1)
-
-                        data = np.zeros((number_samples, nVariables))
-                        data.fill(np.nan)
-                else:
-                    lineSplit = line.split()
-                    #print(data)
-                    splitVarNo = 0
-                    try:
-                        for v in name:
-                            #print("{} : {}".format(i, v))
-                            data[number_samples_read][splitVarNo] = float(lineSplit[v['col']])
-                            splitVarNo = splitVarNo + 1
-                        number_samples_read = number_samples_read + 1
-                    except ValueError:
-                        #print("bad line")
-                        pass
-
-                    dataLine = dataLine + 1
+                if star and end_expr.match(line):
+                    nVariables = len(name)
+                    if nVariables < 1:
+                        print('No Variables, exiting')
+                        exit(-1)
+
+                    # the rest of the file is the data
+                    odata = read_data(fp, [v['col'] for v in name], cnt + 1)
+                    break
 
                 line = fp.readline()
                 cnt += 1
@@ -482,9 +525,10 @@ def parse(files):
             print('No Variables, exiting')
             exit(-1)
 
-        # trim data to what was read
-        odata = data[:number_samples_read]
-        print("nSamples %d samplesRead %d nVariables %d data shape %s read %s" % (number_samples, number_samples_read, nVariables, data.shape, odata.shape))
+        number_samples_read = odata.shape[0]
+        print("nSamples %s samplesRead %d nVariables %d data shape %s" % (number_samples, number_samples_read, nVariables, odata.shape))
+        if number_samples is not None and number_samples != number_samples_read:
+            print('**** WARNING number of samples read', number_samples_read, 'not nvalues', number_samples)
 
         #
         # build the netCDF file
@@ -592,7 +636,7 @@ def parse(files):
             ncTimesOut[:] = [date2num(start_time + timedelta(seconds=x*sample_interval), calendar=ncTimesOut.calendar, units=ncTimesOut.units) for x in range(number_samples_read)]
 
         t_diff = np.diff(ncTimesOut[:])
-        t_diff_min = min(t_diff)
+        t_diff_min = np.min(t_diff)
         if t_diff_min <= 0:
             print('**** WARNING time not-monotonic ** minimum time difference', t_diff_min)
             print('indexes', np.where(t_diff <= 0))
@@ -19,10 +19,13 @@
 from ubxtranslator import core
 from ubxtranslator.predefined import NAV_CLS, ACK_CLS
 
+import io
+import re
 import sys
-import struct
 import pynmea2
 
+import numpy as np
+
 from ubxtranslator.core import Parser
 from ubxtranslator.core import Message, Cls, PadByte, Field, Flag, BitField, RepeatedBlock
 
@@ -201,6 +204,223 @@ NAV_S = Cls(0x01, 'NAV', [
     ])
 ])
 
+# the high volume messages are decoded in bulk, the payload of each message is copied into a numpy structured
+# array (little endian, see the u-blox receiver description). Messages with a repeated block have a header dtype,
+# a block dtype, and the header field with the number of blocks
+
+NAV_PVT = np.dtype([('iTOW', '<u4'), ('year', '<u2'), ('month', 'u1'), ('day', 'u1'), ('hour', 'u1'), ('min', 'u1'), ('sec', 'u1'),
+                    ('valid', 'u1'), ('tAcc', '<u4'), ('nano', '<i4'), ('fixType', 'u1'), ('flags', 'u1'), ('flags2', 'u1'),
+                    ('numSV', 'u1'), ('lon', '<i4'), ('lat', '<i4'), ('height', '<i4'), ('hMSL', '<i4'), ('hAcc', '<u4'),
+                    ('vAcc', '<u4'), ('velN', '<i4'), ('velE', '<i4'), ('velD', '<i4'), ('gSpeed', '<i4'), ('headMot', '<i4'),
+                    ('sAcc', '<u4'), ('headAcc', '<u4'), ('pDOP', '<u2'), ('flags3', 'u1'), ('reserved1', 'u1', (5,)),
+                    ('headVeh', '<i4'), ('magDec', '<i2'), ('magAcc', '<u2')])
+
+NAV_SOL = np.dtype([('iTOW', '<u4'), ('fTOW', '<i4'), ('week', '<i2'), ('gpsFix', 'u1'), ('flags', 'u1'),
+                    ('ecefX', '<i4'), ('ecefY', '<i4'), ('ecefZ', '<i4'), ('pAcc', '<u4'),
+                    ('ecefVX', '<i4'), ('ecefVY', '<i4'), ('ecefVZ', '<i4'), ('sAcc', '<u4'),
+                    ('pDOP', '<u2'), ('reserved1', 'u1'), ('numSV', 'u1'), ('reserved2', 'u1', (4,))])
+
+NAV_TIMEUTC = np.dtype([('iTOW', '<u4'), ('tAcc', '<u4'), ('nano', '<i4'), ('year', '<u2'), ('month', 'u1'), ('day', 'u1'),
+                        ('hour', 'u1'), ('min', 'u1'), ('sec', 'u1'), ('valid', 'u1')])
+
+NAV_STATUS = np.dtype([('iTOW', '<u4'), ('gpsFix', 'u1'), ('flags', 'u1'), ('fixStat', 'u1'), ('flags2', 'u1'),
+                       ('ttff', '<u4'), ('msss', '<u4')])
+
+NAV_HPPOSECEF = np.dtype([('version', 'u1'), ('reserved1', 'u1', (3,)), ('iTOW', '<u4'),
+                          ('ecefX', '<i4'), ('ecefY', '<i4'), ('ecefZ', '<i4'),
+                          ('ecefXHp', 'i1'), ('ecefYHp', 'i1'), ('ecefZHp', 'i1'), ('flags', 'u1'), ('pAcc', '<u4')])
+
+RXM_RAW = np.dtype([('iTOW', '<i4'), ('week', '<i2'), ('numSV', 'u1'), ('reserved1', 'u1')])
+RXM_RAW_BLOCK = np.dtype([('cpMes', '<f8'), ('prMes', '<f8'), ('doMes', '<f4'), ('sv', 'u1'), ('mesQI', 'i1'), ('cno', 'i1'),
+                          ('lli', 'u1')])
+
+RXM_RAWX = np.dtype([('rcvTow', '<f8'), ('week', '<u2'), ('leapS', 'i1'), ('numMeas', 'u1'), ('recStat', 'u1'),
+                     ('version', 'u1'), ('reserved1', 'u1', (2,))])
+RXM_RAWX_BLOCK = np.dtype([('prMes', '<f8'), ('cpMes', '<f8'), ('doMes', '<f4'), ('gnssId', 'u1'), ('svId', 'u1'),
+                           ('sigId', 'u1'), ('freqId', 'u1'), ('locktime', '<u2'), ('cno', 'u1'), ('prStdev', 'u1'),
+                           ('cpStdev', 'u1'), ('doStdev', 'u1'), ('trkStat', 'u1'), ('reserved2', 'u1')])
+
+# (class, id) : (name, dtype, block dtype, number of blocks field)
+bulk_messages = {(0x01, 0x07): ('PVT', NAV_PVT, None, None),
+                 (0x01, 0x06): ('SOL', NAV_SOL, None, None),
+                 (0x01, 0x21): ('TIMEUTC', NAV_TIMEUTC, None, None),
+                 (0x01, 0x03): ('STATUS', NAV_STATUS, None, None),
+                 (0x01, 0x13): ('HPPOSECEF', NAV_HPPOSECEF, None, None),
+                 (0x02, 0x10): ('RAW', RXM_RAW, RXM_RAW_BLOCK, 'numSV'),
+                 (0x02, 0x15): ('RAWX', RXM_RAWX, RXM_RAWX_BLOCK, 'numMeas')}
+
+read_size = 16 * 1024 * 1024  # bytes read from the file at a time
+
+nmea_sentence = re.compile(rb'\$[\x21-\x7e]+\r*\n')
+nmea_max_len = 256
+
+
+def find_messages(b):
+    # find the UBX messages in the uint8 array b, the sync (0xb5 0x62) positions are found together and the
+    # Fletcher checksums of all messages are checked at once from running sums of the buffer
+    #
+    # returns the start, class, id, length, complete (in b) and checksum_ok arrays of each sync found
+
+    n = len(b)
+    start = np.flatnonzero((b[:-1] == 0xb5) & (b[1:] == 0x62))
+
+    # the header and checksum bytes are read for every sync, incomplete ones are read from zero padding past the
+    # end of the buffer, so a buffer ending part way through a header (the tail of a truncated file) can be read
+    bp = np.concatenate([b, np.zeros(8, dtype=np.uint8)])
+
+    # the header (sync, class, id, length) must be in the buffer to know the message length
+    has_header = start + 6 <= n
+    cls = np.where(has_header, bp[start + 2], 0)
+    id = np.where(has_header, bp[start + 3], 0)
+    length = np.where(has_header, bp[start + 4].astype(np.int64) | (bp[start + 5].astype(np.int64) << 8), 0)
+    complete = has_header & (start + 8 + length <= n)
+
+    # running sums, modulo 256, of the bytes and of the running sums. The checksum covers class, id, length and
+    # payload, bytes s to e-1, CK_A = sum(b[s:e]), CK_B = sum of CK_A after each byte
+    c1 = np.cumsum(bp, dtype=np.uint8)
+    c2 = np.cumsum(c1, dtype=np.uint8)
+    s = np.where(complete, start + 2, 2)
+    e = np.where(complete, start + 6 + length, 2)
+    ck_a = (c1[e - 1].astype(np.int64) - c1[s - 1]) & 0xff
+    ck_b = (c2[e - 1].astype(np.int64) - c2[s - 1] - (e - s) * c1[s - 1].astype(np.int64)) & 0xff
+    checksum_ok = complete & (ck_a == bp[e]) & (ck_b == bp[e + 1])
+
+    return start, cls, id, length, complete, checksum_ok
+
+
+def accept_messages(start, length, checksum_ok):
+    # a message with a good checksum is accepted unless it starts inside an earlier accepted message (sync bytes
+    # in the payload). Returns the accepted messages, and the syncs inside an accepted message
+    good = np.flatnonzero(checksum_ok)
+    end = start[good] + 8 + length[good]
+
+    prev_end = np.maximum.accumulate(np.concatenate([[0], end[:-1]]))
+    accepted = np.zeros(len(start), dtype=bool)
+    accepted[good[start[good] >= prev_end]] = True
+
+    inside = in_messages(start, start[accepted], start[accepted] + 8 + length[accepted]) & ~accepted
+
+    return accepted, inside
+
+
+def in_messages(pos, a_start, a_end):
+    # is each position inside one of the (sorted, not overlapping) messages a_start to a_end
+    i = np.searchsorted(a_start, pos, side='right') - 1
+
+    return (i >= 0) & (pos < a_end[np.maximum(i, 0)]) if len(a_start) else np.zeros(np.shape(pos), dtype=bool)
+
+
+def decode_payloads(b, start, dtype, block_dtype=None, count_field=None):
+    # copy the payloads of the messages starting at start into a structured array, and the repeated blocks into
+    # another with the index of the message each block is from
+    idx = start[:, None] + 6 + np.arange(dtype.itemsize)
+    records = b[idx].view(dtype).ravel()
+
+    if block_dtype is None:
+        return records, None, None
+
+    count = records[count_field].astype(np.int64)
+    msg_index = np.repeat(np.arange(len(records)), count)
+    block_start = np.repeat(start + 6 + dtype.itemsize, count)
+    block_start += (np.arange(len(msg_index)) - np.repeat(np.cumsum(count) - count, count)) * block_dtype.itemsize
+    idx = block_start[:, None] + np.arange(block_dtype.itemsize)
+    blocks = b[idx].view(block_dtype).ravel()
+
+    return records, blocks, msg_index
+
+
+def decode_buffer(raw, pos, final):
+    # decode the messages in the bytes raw, which start at file position pos. Returns a dict of the bulk decoded
+    # messages {name: (records, file position of message end, blocks, block message index)}, the frames of the
+    # other messages, the NMEA sentences, the number of UBX checksum errors, and the position to resume from
+    b = np.frombuffer(raw, dtype=np.uint8)
+
+    start, cls, id, length, complete, checksum_ok = find_messages(b)
+    accepted, inside = accept_messages(start, length, checksum_ok)
+    a_start = start[accepted]
+    a_end = a_start + 8 + length[accepted]
+
+    # the next buffer starts at the first message, or NMEA sentence, not complete in this one, and not inside a
+    # message accepted from this one
+    resume = len(raw)
+    if not final:
+        pending = np.flatnonzero(~complete & ~inside)
+        if len(pending):
+            resume = start[pending[0]]
+        if b[-1] == 0xb5 and not in_messages(len(b) - 1, a_start, a_end):
+            resume = min(resume, len(b) - 1)
+        i = raw.rfind(b'$', max(0, len(raw) - nmea_max_len))
+        if i >= 0 and raw.find(b'\n', i) < 0 and not in_messages(i, a_start, a_end):
+            resume = min(resume, i)
+
+    errors = np.count_nonzero(complete & ~checksum_ok & ~inside & (start < resume))
+
+    keep = accepted & (start < resume)
+    start, cls, id, length = start[keep], cls[keep], id[keep], length[keep]
+
+    messages = {}
+    other = []
+    is_bulk = np.zeros(len(start), dtype=bool)
+    for (m_cls, m_id), (name, dtype, block_dtype, count_field) in bulk_messages.items():
+        sel = (cls == m_cls) & (id == m_id)
+        if block_dtype is None:
+            sel &= length == dtype.itemsize
+        else:
+            # the length must match the number of blocks given in the header
+            sel &= length >= dtype.itemsize
+            count = np.zeros(len(start), dtype=np.int64)
+            count[sel] = b[start[sel] + 6 + dtype.fields[count_field][1]]
+            sel &= length == dtype.itemsize + count * block_dtype.itemsize
+        if np.any(sel):
+            records, blocks, msg_index = decode_payloads(b, start[sel], dtype, block_dtype, count_field)
+            messages[name] = (records, pos + start[sel] + 8 + length[sel], blocks, msg_index)
+        is_bulk |= sel
+
+    # the rare messages, the generic parser is used for these
+    for i in np.flatnonzero(~is_bulk):
+        other.append((pos + start[i], raw[start[i]:start[i] + 8 + length[i]]))
+
+    # NMEA sentences, starting at a '$' between the UBX messages
+    nmea = []
+    nmea_end = 0
+    dollar = np.flatnonzero(b[:resume] == 0x24)
+    for i in dollar[~in_messages(dollar, start, start + 8 + length)]:
+        if i < nmea_end:
+            continue
+        m = nmea_sentence.match(raw, i, resume)
+        if m:
+            nmea.append((pos + i, m.group().decode('ascii').strip()))
+            nmea_end = m.end()
+
+    return messages, other, nmea, errors, resume
+
+
+def scan(fn, size=read_size):
+    # read the file in blocks, yielding the decoded messages from each block
+    pos = 0
+    tail = b''
+    with open(fn, "rb") as f:
+        while True:
+            data = f.read(size)
+            final = len(data) == 0
+            raw = tail + data
+            if len(raw) == 0:
+                break
+
+            messages, other, nmea, errors, resume = decode_buffer(raw, pos, final)
+            yield messages, other, nmea, errors
+
+            tail = raw[resume:]
+            pos += resume
+            if final:
+                break
+
+
+def parse_other(parser, frame):
+    # generic, per message, decode for the rare message types
+    return parser.receive_from(io.BytesIO(frame))
+
+
 def parse(ubx_file):
 
     fn = ubx_file[0]
@@ -209,77 +429,37 @@ def parse(ubx_file):
         NAV_CLS, ACK_CLS, RXM, NAV_S
     ])
 
-    sync = False
-    sync_count = 0
-    nmea_hdr = 0
-    nmea = bytearray()
-
+    counts = {}
     ubx_errors = 0
     nmea_errors = 0
 
-    with open(fn, "rb") as f:
-        b = f.read(1)
-        while b:
-            print(f.tell(), hex(b[0]), sync_count, sync, nmea_hdr)
-            if sync_count == 0 and b[0] == 0xb5:
-                sync_count += 1
-            elif sync_count == 1 and b[0] == 0x62:
-                sync_count += 1
-                sync = True
-                f.seek(-2, 1)
-                b = f.read(6)
-                (sync, cl, id, len) = struct.unpack("<HBBH", b)
-                print("sync found bytes, start ", hex(sync), "cl=", cl, "id=", id, "len=", len, ' file pos ', f.tell())
-#                b = f.read(10)
-#                for i in b:
-#                    print(hex(i))
-#                f.seek(-10, 1)
-
-                f.seek(-6, 1)
-            elif sync_count == 0 and nmea_hdr == 0 and b[0] == 0x24:
-                nmea.append(0x24)
-                nmea_hdr = 1
-            elif nmea_hdr >= 1 and (b[0] == 0x0a or b[0] == 0x0d):
-                if b[0] == 0x0a:
-                    nmea_hdr = 0
-                    print(nmea.decode("utf-8"))
-                    try:
-                        msg = pynmea2.parse(nmea.decode("utf-8"))
-                        print("NMEA sentence", msg.sentence_type)
-                    except pynmea2.nmea.ParseError:
-                        print ("NMEA Parse error")
-                        nmea_errors += 1
-                    nmea.clear()
-                else:
-                    nmea_hdr += 1
-            elif nmea_hdr >= 1 and (b[0] > 0x20 and b[0] < 127):
-                    nmea.append(b[0])
-                    nmea_hdr += 1
-            else:
-                sync_count = 0
-                nmea_hdr = 0
-
-            if sync:
-                try:
-                    ppos = f.tell()
-                    cls_name, msg_name, payload = parser.receive_from(f)
-                    print(cls_name, msg_name, payload)
-                except (ValueError, IOError) as err:
-                    print(err, " pos was ", ppos, " now ", f.tell())
-                    f.seek(ppos+1, 0)
-                    if str(err).find("unsuppored") >= 0:
-                        print("unsuported")
-                        f.seek(len+2, 1)
-                    ubx_errors += 1
-
-                #print("sync bytes, start ", hex(sync), "cl=", cl, "id=", id, "len=", len, ' file pos ', f.tell())
-                sync = False
-                sync_count = 0
-
-            b = f.read(1)
+    for messages, other, nmea, errors in scan(fn):
+        ubx_errors += errors
+
+        for name, (records, file_pos, blocks, msg_index) in messages.items():
+            print(name, "messages", len(records), "file pos", file_pos[0], "to", file_pos[-1])
+            counts[name] = counts.get(name, 0) + len(records)
 
+        for file_pos, frame in other:
+            try:
+                cls_name, msg_name, payload = parse_other(parser, frame)
+                print(file_pos, cls_name, msg_name, payload)
+                counts[msg_name] = counts.get(msg_name, 0) + 1
+            except (ValueError, IOError) as err:
+                print(err, " pos was ", file_pos)
+                ubx_errors += 1
+
+        for file_pos, sentence in nmea:
+            print(sentence)
+            try:
+                msg = pynmea2.parse(sentence)
+                print("NMEA sentence", msg.sentence_type)
+            except pynmea2.nmea.ParseError:
+                print ("NMEA Parse error")
+                nmea_errors += 1
+
+    print("messages", counts)
     print("file Errors ", ubx_errors, " nmea ", nmea_errors)
 
 if __name__ == "__main__":
     parse(sys.argv[1:])
-
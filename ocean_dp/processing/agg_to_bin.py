@@ -27,16 +27,28 @@ import matplotlib.pyplot as plt
 
 import sys
 
-time_bin_hours =  1
+time_bin_hours = 1
 pres_bin = 10
 
+# number of observations read at a time
+chunk_size = 1000000
+
+# only data with QC flags at or below this are binned
+qc_in_level = 2
+
+
+# bins are centred on the bin value, works on arrays or single values
 def time2bin(time, time_min, bin_width):
-    return int(np.round(time - time_min + bin_width/2)/bin_width)
+    return np.floor((time - time_min)/bin_width + 0.5).astype(int)
 
 def pres2bin(pres, pres_min, bin_width):
-    return int(np.round(pres - pres_min + bin_width/2)/bin_width)
+    return np.floor((pres - pres_min)/bin_width + 0.5).astype(int)
+
+def read_chunk(var, i0, i1, fill=np.nan):
+    # read observations i0 to i1 of a variable as float64, with masked values replaced by fill
+    return np.ma.filled(np.ma.asarray(var[i0:i1], dtype=np.float64), fill)
 
-def agg_to_bin(netCDFfiles):
+def agg_to_bin(netCDFfiles, time_bin_hours=time_bin_hours, pres_bin=pres_bin):
     ds = Dataset(netCDFfiles[1], 'r')
 
     vs = ds.get_variables_by_attributes(standard_name='sea_water_pressure_due_to_sea_water')
@@ -46,39 +58,52 @@ def agg_to_bin(netCDFfiles):
     #print("number actual depth", len(vs))
 
     pres_var = vs[0]
-    pres = pres_var[:].data
-
-    #plt.plot(pres)
-    #plt.show()
 
     print("Read and convert time")
     time_var = ds.variables["TIME"]
-    #time = num2date(time_var[:], units=time_var.units, calendar=time_var.calendar)
-    #first_hour = time[0].replace(minute=0, second=0, microsecond=0)
 
-    t = time_var[:]
-    hours = t * 24
+    v1_var = ds.variables["TEMP"]
 
-    hours_min = np.min(hours)
-    hours_max = np.max(hours)
+    # use the QC of the variable, and of the pressure used to bin it, if they have it
+    qc_vars = [ds.variables[v.name + "_quality_control"] for v in (v1_var, pres_var) if v.name + "_quality_control" in ds.variables]
+    for qc_var in qc_vars:
+        print('using qc :', qc_var.name, '<=', qc_in_level)
+
+    n_obs = len(time_var)
+
+    # first pass, find the time and pressure range
+    hours_min = np.inf
+    hours_max = -np.inf
+    pres_min = np.inf
+    pres_max = -np.inf
+    for i0 in range(0, n_obs, chunk_size):
+        i1 = min(i0 + chunk_size, n_obs)
+        hours = read_chunk(time_var, i0, i1) * 24
+        pres = read_chunk(pres_var, i0, i1)
+        hours_min = np.fmin.reduce(hours, initial=hours_min)
+        hours_max = np.fmax.reduce(hours, initial=hours_max)
+        pres_min = np.fmin.reduce(pres, initial=pres_min)
+        pres_max = np.fmax.reduce(pres, initial=pres_max)
+
+    # no valid time or pressure, or no pressure in the bins, so nothing to bin
+    if not (np.isfinite(hours_min) and np.isfinite(pres_max) and pres2bin(pres_max, 0, pres_bin) >= 0):
+        print("no data to bin in", netCDFfiles[1], "time min, max", hours_min, hours_max, "pres min, max", pres_min, pres_max)
+        ds.close()
+        return
 
     print("time max, min", hours_max, hours_min)
     print("time max, min", num2date(hours_min/24, units=time_var.units, calendar=time_var.calendar), num2date(hours_max/24, units=time_var.units, calendar=time_var.calendar))
 
-    print('t[0] bin, t[end] bin', time2bin(hours[0], hours_min, time_bin_hours), time2bin(hours[-1], hours_min, time_bin_hours))
-
-    time_bins = hours_min + np.arange(time2bin(hours[0], hours_min, time_bin_hours), time2bin(hours[-1]+1  , hours_min, time_bin_hours), time_bin_hours) * time_bin_hours
+    time_bins = hours_min + np.arange(0, time2bin(hours_max, hours_min, time_bin_hours) + 1) * time_bin_hours
 
     nt_points = len(time_bins)
     print("time bin range ", num2date(time_bins[0]/24, units=time_var.units, calendar=time_var.calendar), num2date(time_bins[-1]/24, units=time_var.units, calendar=time_var.calendar))
 
     # make pressure bins
 
-    pres_min = np.min(pres)
-    pres_max = np.max(pres)
     print("pres min, max", pres_min, pres_max)
 
-    pres_bins = 0 + np.arange(pres2bin(0, 0, pres_bin), pres2bin(pres_max+pres_bin, 0, pres_bin)) * pres_bin
+    pres_bins = 0 + np.arange(0, pres2bin(pres_max, 0, pres_bin) + 1) * pres_bin
 
     print("pres bin range ", pres_bins[0], pres_bins[-1])
 
@@ -86,28 +111,67 @@ def agg_to_bin(netCDFfiles):
 
     print(nt_points, nd_points)
 
-    bin = np.full([nt_points, nd_points], np.nan)
-    count = np.zeros([nt_points, nd_points])
-
-    v1_var = ds.variables["TEMP"]
-    v1 = v1_var[:]
-
-    # TODO: need to get QC variable also
-
-    # bin data, looping over input array
-    for i in range(0, len(v1)):
-        # compute the location of this data point
-        h = time2bin(hours[i], hours_min, 1)
-        d = pres2bin(pres[i], 0, 10)
-        print (i, hours[i], pres[i], v1[i], h, d)
-        if np.isnan(bin[h, d]):
-            bin[h, d] = v1[i]
-        else:
-            bin[h, d] += v1[i]
-        # count number of points
-        count[h, d] += 1
-
-    print("count ", np.sum(count), len(hours))
+    # statistics for each bin, flattened time, pressure bins, the sum of squares is about the first value binned to
+    # keep the variance accurate
+    n_bins = nt_points * nd_points
+    count = np.zeros(n_bins)
+    bin_sum = np.zeros(n_bins)
+    bin_sum2 = np.zeros(n_bins)
+    bin_min = np.full(n_bins, np.inf)
+    bin_max = np.full(n_bins, -np.inf)
+    shift = None
+    n_qc = 0
+    n_outside = 0
+
+    # second pass, bin data a chunk of observations at a time
+    for i0 in range(0, n_obs, chunk_size):
+        i1 = min(i0 + chunk_size, n_obs)
+        hours = read_chunk(time_var, i0, i1) * 24
+        pres = read_chunk(pres_var, i0, i1)
+        v1 = read_chunk(v1_var, i0, i1)
+
+        use = np.isfinite(hours) & np.isfinite(pres) & np.isfinite(v1)
+        for qc_var in qc_vars:
+            qc_ok = read_chunk(qc_var, i0, i1, fill=99) <= qc_in_level
+            n_qc += np.sum(use & ~qc_ok)
+            use &= qc_ok
+
+        # compute the location of each data point
+        h = time2bin(hours[use], hours_min, time_bin_hours)
+        d = pres2bin(pres[use], 0, pres_bin)
+        v1 = v1[use]
+
+        inside = (h >= 0) & (h < nt_points) & (d >= 0) & (d < nd_points)
+        n_outside += np.sum(~inside)
+        idx = h[inside] * nd_points + d[inside]
+        v1 = v1[inside]
+
+        if len(v1) == 0:
+            continue
+        if shift is None:
+            shift = v1[0]
+
+        count += np.bincount(idx, minlength=n_bins)
+        bin_sum += np.bincount(idx, weights=v1, minlength=n_bins)
+        bin_sum2 += np.bincount(idx, weights=(v1 - shift)**2, minlength=n_bins)
+        np.minimum.at(bin_min, idx, v1)
+        np.maximum.at(bin_max, idx, v1)
+
+    print("count ", np.sum(count), n_obs, "qc rejected", n_qc, "outside bins", n_outside)
+
+    # mean, standard deviation, minimum and maximum, nan where there is no data
+    empty = count == 0
+    n = np.where(empty, 1, count)
+    mean = np.where(empty, np.nan, bin_sum / n)
+    var = np.where(empty, np.nan, np.maximum(bin_sum2 / n - (mean - (shift if shift is not None else 0))**2, 0))
+    bin_min[empty] = np.nan
+    bin_max[empty] = np.nan
+
+    stats = {'mean': mean, 'sd': np.sqrt(var), 'count': count, 'min': bin_min, 'max': bin_max}
+    for st in stats:
+        stats[st] = stats[st].reshape(nt_points, nd_points)
+
+    bin = stats['mean']
     only_time = ~np.isnan(bin).all(axis=1)
     only_depth = ~np.isnan(bin).all(axis=0)
     print("axis=0", only_time)
@@ -136,8 +200,22 @@ def agg_to_bin(netCDFfiles):
     nc_var_out = ncOut.createVariable(v1_var.name, "f4", ("TIME", "BIN"), fill_value=np.nan, zlib=True)
     print("shape ", bin.shape, nc_var_out.shape)
 
-    mean = bin/count
-    nc_var_out[:] = mean
+    nc_var_out[:] = stats['mean']
+
+    # the bin statistics
+    aux_vars = []
+    for st, name, comment in (('sd', '_standard_deviation', 'sample bin standard deviation'),
+                              ('min', '_minimum', 'sample bin minimum'),
+                              ('max', '_maximum', 'sample bin maximum'),
+                              ('count', '_number_of_observations', 'number of samples')):
+        nc_aux_out = ncOut.createVariable(v1_var.name + name, "f4", ("TIME", "BIN"), fill_value=np.nan, zlib=True)
+        nc_aux_out.units = '1' if st == 'count' else v1_var.units
+        nc_aux_out.comment = comment
+        nc_aux_out[:] = stats[st]
+        aux_vars.append(v1_var.name + name)
+
+    nc_var_out.ancillary_variables = " ".join(aux_vars)
+    nc_var_out.comment = "mean in %s hour, %s dbar bins, using data with QC flags <= %d" % (time_bin_hours, pres_bin, qc_in_level)
 
     # add some summary metadata
     ncTimeFormat = "%Y-%m-%dT%H:%M:%SZ"
@@ -157,4 +235,14 @@ def agg_to_bin(netCDFfiles):
 
 
 if __name__ == "__main__":
-    agg_to_bin(sys.argv)
+    # agg_to_bin.py [--hours=time bin width] [--pres=pressure bin width] file
+    args = [sys.argv[0]]
+    for f in sys.argv[1:]:
+        if f.startswith('--hours='):
+            time_bin_hours = float(f.replace('--hours=', ''))
+        elif f.startswith('--pres='):
+            pres_bin = float(f.replace('--pres=', ''))
+        else:
+            args.append(f)
+
+    agg_to_bin(args, time_bin_hours, pres_bin)
@@ -18,11 +18,88 @@
 
 from netCDF4 import Dataset, num2date
 import sys
+import os
 import numpy as np
 import oceansdb
-import datetime
 
-def main(netCDFfile):
+# the CARS climatology at the mooring site is extracted once, for each day of year and on a grid of depths, and saved in
+# the cache directory so later runs for the same site do not need to read the database again. The time series is then
+# interpolated (linear in day of year and depth) from this table
+cars_cache_dir = os.path.join(os.path.expanduser('~'), '.cache', 'ocean_dp', 'cars')
+cars_table_version = 1
+cars_doy = np.arange(0, 367)  # day of year, from 0 at the start of 1 Jan, to the end of a leap year
+cars_depth = np.concatenate([np.arange(0, 100, 5), np.arange(100, 500, 10), np.arange(500, 2000, 25), np.arange(2000, 6001, 100)]).astype(float)
+cars_vars = [('TEMP', 'sea_water_temperature'), ('PSAL', 'sea_water_salinity')]
+
+
+def cars_table_name(lat, lon):
+    return os.path.join(cars_cache_dir, 'cars_%.4f_%.4f_v%d.npz' % (lat, lon, cars_table_version))
+
+
+def cars_table(lat, lon):
+    # the mean and std_dev of temperature and salinity on the (day of year, depth) grid at lat, lon, from the cache or
+    # extracted from the database
+    name = cars_table_name(lat, lon)
+    if os.path.exists(name):
+        try:
+            with np.load(name) as table:
+                if np.array_equal(table['doy'], cars_doy) and np.array_equal(table['depth'], cars_depth):
+                    print('using CARS table', name)
+                    return {k: table[k] for k in table.files}
+        except (OSError, ValueError, KeyError) as e:
+            print('can not read CARS table', name, e)
+
+    print('extracting CARS table', lat, lon)
+    db = oceansdb.CARS()
+
+    table = {'doy': cars_doy, 'depth': cars_depth}
+    for var_name, db_name in cars_vars:
+        for stat in ('mean', 'std_dev'):
+            values = np.full((len(cars_doy), len(cars_depth)), np.nan)
+            for i, d in enumerate(cars_doy):
+                values[i, :] = np.ma.filled(np.ma.masked_invalid(np.ma.asarray(
+                    db[db_name].extract(var=stat, doy=d, lat=lat, lon=lon, depth=cars_depth)[stat], dtype=float)).ravel(), np.nan)
+            table[var_name + '_' + stat] = values
+
+    # save to a temporary file and rename, so a partly written table is never used
+    try:
+        os.makedirs(cars_cache_dir, exist_ok=True)
+        with open(name + '.tmp', 'wb') as f:
+            np.savez(f, **table)
+        os.replace(name + '.tmp', name)
+        print('saved CARS table', name)
+    except OSError as e:
+        print('can not write CARS table', name, e)
+
+    return table
+
+
+def interp_table(values, doy, depth):
+    # bilinear interpolation of the table values at each (doy, depth), nan outside the depth grid
+    i = np.clip(np.floor(doy).astype(int), 0, len(cars_doy) - 2)
+    wi = doy - cars_doy[i]
+
+    j = np.clip(np.searchsorted(cars_depth, depth, side='right') - 1, 0, len(cars_depth) - 2)
+    wj = (depth - cars_depth[j]) / (cars_depth[j + 1] - cars_depth[j])
+
+    v = (values[i, j] * (1 - wi) * (1 - wj) + values[i + 1, j] * wi * (1 - wj) +
+         values[i, j + 1] * (1 - wi) * wj + values[i + 1, j + 1] * wi * wj)
+
+    v[(depth < cars_depth[0]) | (depth > cars_depth[-1]) | np.isnan(depth)] = np.nan
+
+    return v
+
+
+def day_of_year(time):
+    # fractional day of year (from 0 at the start of 1 Jan) of each time, to the microsecond as num2date gives
+    epoch = num2date(0, units=time.units, calendar=time.calendar, only_use_cftime_datetimes=False)
+    scale = (num2date(1, units=time.units, calendar=time.calendar, only_use_cftime_datetimes=False) - epoch).total_seconds()
+    t = np.datetime64(epoch.replace(tzinfo=None), 'us') + np.round(np.asarray(time[:], dtype=float) * scale * 1e6).astype('timedelta64[us]')
+
+    return (t - t.astype('datetime64[Y]')) / np.timedelta64(1, 'D')
+
+
+def main(netCDFfile, per_sample=False):
 
     print(netCDFfile)
 
@@ -36,8 +113,7 @@ def main(netCDFfile):
     nom_depth = ds.variables['NOMINAL_DEPTH'][:]
 
     time = ds.variables['TIME']
-    dt = num2date(time[:], units=time.units, calendar=time.calendar)
-    doy = [(x - datetime.datetime(x.year, 1, 1)).total_seconds()/3600/24 for x in dt]
+    doy = day_of_year(time)
 
     if "PRES" in ds.variables:
         depth = ds.variables['PRES'][:]+1
@@ -46,8 +122,6 @@ def main(netCDFfile):
 
     print("netCDF data ", doy[0:2], lat, lon, nom_depth, time.shape)
 
-    db = oceansdb.CARS()
-
     temp_cars = np.zeros((time.shape[0], ))
     temp_cars.fill(np.nan)
     temp_std_cars = np.zeros((time.shape[0], ))
@@ -58,16 +132,30 @@ def main(netCDFfile):
     psal_std_cars = np.zeros((time.shape[0], ))
     psal_std_cars.fill(np.nan)
 
-    for i in range(0, time.shape[0]):
-        #print (i)
-        temp_cars[i] = db['sea_water_temperature'].extract(var='mean', doy=doy[i], lat=lat, lon=lon, depth=depth[i])['mean']
-        temp_std_cars[i] = db['sea_water_temperature'].extract(var='std_dev', doy=doy[i], lat=lat, lon=lon, depth=depth[i])['std_dev']
+    if not per_sample:
+        table = cars_table(float(lat), float(lon))
+        depth_nan = np.ma.filled(np.ma.asarray(depth, dtype=float), np.nan)
 
+        temp_cars[:] = interp_table(table['TEMP_mean'], doy, depth_nan)
+        temp_std_cars[:] = interp_table(table['TEMP_std_dev'], doy, depth_nan)
         if create_psal:
-            psal_cars[i] = db['sea_water_salinity'].extract(var='mean', doy=doy[i], lat=lat, lon=lon, depth=depth[i])['mean']
-            psal_std_cars[i] = db['sea_water_salinity'].extract(var='std_dev', doy=doy[i], lat=lat, lon=lon, depth=depth[i])['std_dev']
+            psal_cars[:] = interp_table(table['PSAL_mean'], doy, depth_nan)
+            psal_std_cars[:] = interp_table(table['PSAL_std_dev'], doy, depth_nan)
+
+        print('CARS temp', temp_cars[0], 'depth', depth[0])
+    else:
+        db = oceansdb.CARS()
+
+        for i in range(0, time.shape[0]):
+            #print (i)
+            temp_cars[i] = db['sea_water_temperature'].extract(var='mean', doy=doy[i], lat=lat, lon=lon, depth=depth[i])['mean']
+            temp_std_cars[i] = db['sea_water_temperature'].extract(var='std_dev', doy=doy[i], lat=lat, lon=lon, depth=depth[i])['std_dev']
+
+            if create_psal:
+                psal_cars[i] = db['sea_water_salinity'].extract(var='mean', doy=doy[i], lat=lat, lon=lon, depth=depth[i])['mean']
+                psal_std_cars[i] = db['sea_water_salinity'].extract(var='std_dev', doy=doy[i], lat=lat, lon=lon, depth=depth[i])['std_dev']
 
-        print(temp_cars[i], depth[i])
+            print(temp_cars[i], depth[i])
 
     # create variables in netCDF file
 
@@ -112,4 +200,4 @@ def main(netCDFfile):
 
 
 if __name__ == "__main__":
-    main(sys.argv[1])
+    main(sys.argv[1], per_sample='--per-sample' in sys.argv[2:])
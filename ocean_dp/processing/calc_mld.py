@@ -12,61 +12,141 @@ import statsmodels.api as sm
 
 np.set_printoptions(linewidth=256)
 
+# mix layer depth criteria, the variable used, the output variable, and either the difference from the first sensor
+# (threshold) or the difference between neighbouring sensors per dbar (gradient) which marks the bottom of the mix layer
+criteria = {'temp': {'var': 'TEMP', 'out': 'MLD', 'threshold': 0.3, 'units': 'degrees_Celsius', 'name': 'temperature'},
+            'density': {'var': 'SIGMA_T0', 'out': 'MLD_DENSITY', 'threshold': 0.03, 'units': 'kg/m^3', 'name': 'potential density'},
+            'temp-gradient': {'var': 'TEMP', 'out': 'MLD_TEMP_GRADIENT', 'gradient': 0.025, 'units': 'degrees_Celsius/dbar', 'name': 'temperature'},
+            'density-gradient': {'var': 'SIGMA_T0', 'out': 'MLD_DENSITY_GRADIENT', 'gradient': 0.01, 'units': 'kg/m^3/dbar', 'name': 'potential density'}}
 
-def mld(files):
+
+def first_true(x):
+    # index of the first True in each column, and if any are True
+    return np.argmax(x, axis=0), np.any(x, axis=0)
+
+
+def last_valid(values):
+    # for each row, the index of the last non nan row at or above it in each column, -1 if there is none
+    rows = np.arange(values.shape[0])[:, None]
+
+    return np.maximum.accumulate(np.where(~np.isnan(values), rows, -1), axis=0)
+
+
+def mld_threshold(values, pres, threshold, interpolate=False):
+    # mix layer depth where values first differ from the first non nan value by more than threshold, all columns at once
+
+    cols = np.arange(values.shape[1])
+
+    first_non_nan, has_values = first_true(~np.isnan(values))
+    diff = np.abs(values[first_non_nan, cols] - values)
+    with np.errstate(invalid='ignore'):
+        idx, exceeds = first_true(diff > threshold)
+
+    if interpolate:
+        # interpolate between the last sensor with data above the difference and the sensor over the threshold
+        above = last_valid(values)[np.maximum(idx - 1, 0), cols]
+        above = np.maximum(above, first_non_nan)
+        d_above = diff[above, cols]
+        d_below = diff[idx, cols]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mld_pres = pres[above, cols] + (threshold - d_above) / (d_below - d_above) * (pres[idx, cols] - pres[above, cols])
+    else:
+        # use the first value which is not nan above the difference of threshold
+        mld_idx = np.maximum(idx - 1, first_non_nan)
+        mld_pres = pres[mld_idx, cols]
+
+    # if no difference is > the limit, use the last one
+    mld_pres = np.where(exceeds, mld_pres, pres[-1, :])
+
+    # no data at this time
+    mld_pres[~has_values] = np.nan
+
+    return mld_pres
+
+
+def mld_gradient(values, pres, gradient, interpolate=False):
+    # mix layer depth where the gradient between a sensor and the sensor with data above it first exceeds gradient
+
+    cols = np.arange(values.shape[1])
+
+    has_values = np.any(~np.isnan(values), axis=0)
+
+    # the sensor above each sensor which has data
+    above = np.vstack([np.full((1, values.shape[1]), -1), last_valid(values)[:-1]])
+    above_idx = np.maximum(above, 0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        # sensors not below the one above them have no gradient
+        dp = pres - pres[above_idx, cols]
+        grad = np.abs(values - values[above_idx, cols]) / np.where(dp > 0, dp, np.nan)
+        idx, exceeds = first_true((above >= 0) & (grad > gradient))
+
+    p_above = pres[above_idx[idx, cols], cols]
+    if interpolate:
+        # the gradient is between the two sensors, use the mid point
+        mld_pres = (p_above + pres[idx, cols]) / 2
+    else:
+        mld_pres = p_above
+
+    # if no gradient is > the limit, use the last one
+    mld_pres = np.where(exceeds, mld_pres, pres[-1, :])
+
+    mld_pres[~has_values] = np.nan
+
+    return mld_pres
+
+
+def mld(files, criterion='temp', limit=None, interpolate=False):
 
     print()
     print(files)
 
-    mix_layer_depth_temp_diff = 0.3
+    c = criteria[criterion]
+    var_name = c['var']
+    method = 'gradient' if 'gradient' in c else 'threshold'
+    if limit is None:
+        limit = c[method]
 
     ds = Dataset(files[0], 'a')
     ds.set_auto_mask(False)
 
+    if var_name not in ds.variables:
+        print('no', var_name, 'variable')
+        ds.close()
+        return
+
     n_depths_var = ds.variables['NOMINAL_DEPTH']
 
-    temp_var = ds.variables['TEMP']
-    temp_idx_var = ds.variables['IDX_TEMP']
+    value_var = ds.variables[var_name]
+    value_idx_var = ds.variables['IDX_' + var_name]
     pres_var = ds.variables['PRES_ALL']
 
-    temp = temp_var[:]
-    pres = pres_var[temp_idx_var]
-    n_depths = n_depths_var[temp_idx_var]
+    values = value_var[:]
+    value_idx = value_idx_var[:]
+    pres = pres_var[value_idx]
+    n_depths = n_depths_var[value_idx]
 
     msk = (n_depths > 15) & (n_depths < 800)
-    print('temp shape', temp.shape)
+    print(var_name, 'shape', values.shape)
 
     n_depth_touse = n_depths[msk]
-    temp_touse = temp[msk, :]
+    values_touse = values[msk, :]
     pres_touse = pres[msk, :]
 
-    print('depth to use', temp_touse.shape, n_depth_touse)
-
-    print('MLD, temp to use shape', temp_touse.shape)
-
-    mld_pres = np.empty(temp_touse.shape[1])
-
-    # for each timestep, calculate the mix layer depth
-    for i in range(temp_touse.shape[1]):
-        first_non_nan = np.where(~np.isnan(temp_touse[:, i]))[0][0]
-        diff = np.abs(temp_touse[first_non_nan, i] - temp_touse[:, i])
-        #print(diff)
-        idx = np.where(diff > mix_layer_depth_temp_diff)
-        #print(len(idx[0]))
-        if len(idx[0]) > 0:
-            #print(n_depth_touse[idx[0][0]])
-            # use the first temp which is not nan above the difference of mix_layer_depth_temp_diff
-            mld_idx = idx[0][0]-1
-            mld_idx = max(mld_idx, first_non_nan)
-            mld_pres[i] = pres_touse[mld_idx, i]
-        else:
-            # if no temperature difference is > the limit, use the last one
-            mld_pres[i] = pres_touse[-1, i]
+    print('depth to use', values_touse.shape, n_depth_touse)
+
+    print('MLD', criterion, limit, 'interpolate', interpolate, 'to use shape', values_touse.shape)
+
+    # calculate the mix layer depth for all timesteps at once
+    if method == 'gradient':
+        mld_pres = mld_gradient(values_touse, pres_touse, limit, interpolate)
+    else:
+        mld_pres = mld_threshold(values_touse, pres_touse, limit, interpolate)
 
-    if 'MLD' not in ds.variables:
-        mld_out_var = ds.createVariable("MLD", 'f4', 'TIME', fill_value=np.nan, zlib=True)
+    out_name = c['out']
+    if out_name not in ds.variables:
+        mld_out_var = ds.createVariable(out_name, 'f4', 'TIME', fill_value=np.nan, zlib=True)
     else:
-        mld_out_var = ds.variables['MLD']
+        mld_out_var = ds.variables[out_name]
 
     mld_out_var[:] = mld_pres
 
@@ -74,7 +154,18 @@ def mld(files):
     mld_out_var.long_name = 'calculated mix layer depth'
     mld_out_var.units = pres_var.units
     mld_out_var.coordinates = 'TIME LONGITUDE LATITUDE'
-    mld_out_var.comment = "calculated using temperature difference of " + str(mix_layer_depth_temp_diff) + " degrees_Celsius to first sensor below 15 m nominal depth"
+    if criterion == 'temp':
+        # the temperature difference comment and history, as existing files have them
+        mld_out_var.comment = "calculated using temperature difference of " + str(limit) + " degrees_Celsius to first sensor below 15 m nominal depth"
+        history = "added mix layer depth, temperature difference = " + str(limit)
+    elif method == 'gradient':
+        mld_out_var.comment = "calculated using " + c['name'] + " gradient of " + str(limit) + " " + c['units'] + " between sensors below 15 m nominal depth"
+        history = "added mix layer depth, " + c['name'] + " gradient = " + str(limit)
+    else:
+        mld_out_var.comment = "calculated using " + c['name'] + " difference of " + str(limit) + " " + c['units'] + " to first sensor below 15 m nominal depth"
+        history = "added mix layer depth, " + c['name'] + " threshold = " + str(limit)
+    if interpolate:
+        mld_out_var.comment += ", interpolated between sensors"
 
     # update the history attribute
     try:
@@ -82,11 +173,27 @@ def mld(files):
     except AttributeError:
         hist = ""
 
-    ds.setncattr('history', hist + datetime.now(UTC).strftime("%Y-%m-%d") + " added mix layer depth, temperature difference = " + str(mix_layer_depth_temp_diff))
+    ds.setncattr('history', hist + datetime.now(UTC).strftime("%Y-%m-%d") + " " + history)
 
     ds.close()
 
 
 if __name__ == "__main__":
 
-    mld(sys.argv[1:])
+    # calc_mld.py [--criterion temp|density|temp-gradient|density-gradient] [--limit value] [--interpolate] file
+    criterion = 'temp'
+    limit = None
+    interpolate = False
+    files = []
+    args = iter(sys.argv[1:])
+    for a in args:
+        if a == '--criterion':
+            criterion = next(args)
+        elif a == '--limit':
+            limit = float(next(args))
+        elif a == '--interpolate':
+            interpolate = True
+        else:
+            files.append(a)
+
+    mld(files, criterion, limit, interpolate)
@@ -8,10 +8,76 @@ from datetime import datetime, timedelta, UTC
 
 import numpy as np
 from scipy.interpolate import interp1d
-from scipy import stats
 
 np.set_printoptions(linewidth=256)
 
+chunk_size = 1000000  # number of samples read from each variable at a time
+
+
+def bin_index(time, bins):
+    # index of the bin each time is in, -1 for times outside the bins
+    # same as scipy.stats.binned_statistic, the last bin includes its right edge
+    idx = np.searchsorted(bins, time, side='right') - 1
+    idx[time == bins[-1]] = len(bins) - 2
+    idx[(idx < 0) | (idx >= len(bins) - 1)] = -1
+
+    return idx
+
+
+class BinStats:
+    # number of samples, mean, M2 (sum of squared differences from the mean) and maximum QC flag in each bin,
+    # updated a chunk of samples at a time by combining the chunk statistics with those so far (Chan et al.)
+    # so the whole variable does not need to be in memory
+
+    def __init__(self, n_bins):
+        self.n = np.zeros(n_bins)
+        self.mean = np.zeros(n_bins)
+        self.m2 = np.zeros(n_bins)
+        self.qc_max = np.full(n_bins, -1, dtype=np.int16)
+        self.n_selected = 0
+
+    def add(self, idx, data, qc):
+        self.n_selected += len(data)
+
+        in_bins = idx >= 0
+        idx = idx[in_bins]
+        data = data[in_bins].astype(np.float64)
+        n_bins = len(self.n)
+
+        n_chunk = np.bincount(idx, minlength=n_bins)
+        has = n_chunk > 0
+
+        mean_chunk = np.zeros(n_bins)
+        mean_chunk[has] = np.bincount(idx, weights=data, minlength=n_bins)[has] / n_chunk[has]
+        m2_chunk = np.bincount(idx, weights=(data - mean_chunk[idx])**2, minlength=n_bins)
+
+        n = self.n + n_chunk
+        delta = mean_chunk[has] - self.mean[has]
+        self.mean[has] += delta * n_chunk[has] / n[has]
+        self.m2[has] += m2_chunk[has] + delta**2 * self.n[has] * n_chunk[has] / n[has]
+        self.n = n
+
+        np.maximum.at(self.qc_max, idx, qc[in_bins])
+
+    def statistic(self):
+        # mean, standard deviation, count and maximum QC, nan (or masked for QC) where there are no samples
+        empty = self.n == 0
+        n = np.where(empty, 1, self.n)
+
+        mean = np.where(empty, np.nan, self.mean)
+        sd = np.where(empty, np.nan, np.sqrt(self.m2 / n))
+        qc_max = np.ma.masked_array(self.qc_max, mask=empty)
+
+        return mean, sd, self.n, qc_max
+
+
+def time_chunk(var, i0, i1):
+    # read samples i0 to i1 along the TIME dimension of a variable, as a 1-D array
+    idx = [slice(None)] * len(var.dimensions)
+    idx[var.dimensions.index('TIME')] = slice(i0, i1)
+
+    return np.asarray(var[tuple(idx)]).reshape(i1 - i0)
+
 
 def down_sample(files, method):
     output_names = []
@@ -57,14 +123,12 @@ def down_sample(files, method):
         # create mask for deployment time
         deployment_msk = (time > num_deploy_start) & (time < num_deploy_end)
 
-        datetime_time = num2date(time, units=var_time.units)
-        datetime_time_deployment = datetime_time[deployment_msk]
         time_deployment = time[deployment_msk]
 
         # use the mid point sample rate, as it may change at start/end
         n_mid = int(len(time_deployment)/2)
-        t_mid0 = datetime_time_deployment[n_mid]
-        t_mid1 = datetime_time_deployment[n_mid+1]
+        t_mid0 = num2date(time_deployment[n_mid], units=var_time.units)
+        t_mid1 = num2date(time_deployment[n_mid+1], units=var_time.units)
 
         sample_rate_mid = t_mid1 - t_mid0
         print('sample rate mid', sample_rate_mid.total_seconds(), '(seconds)')
@@ -173,39 +237,50 @@ def down_sample(files, method):
         print('vars to smooth', z)
 
         qc_in_level = 2
-        for resample_var in sorted(z):
-            qc = np.ones_like(datetime_time)
 
-            var_to_resample_in = ds.variables[resample_var]
+        # find the variables to resample, and their QC variable
+        resample_vars = {}
+        for resample_var in sorted(z):
+            qc_var = None
             if ds.file_version.startswith("Level 1"):
-
                 if resample_var + '_quality_control' in ds.variables:
                     print('using qc : ', resample_var + "_quality_control")
-                    qc = ds.variables[resample_var + "_quality_control"][:]
+                    qc_var = ds.variables[resample_var + "_quality_control"]
                 else:
                     print(resample_var, 'no QC, skipping')
                     continue  # only include variables that have quality_control
 
-            print("var shape", var_to_resample_in.shape, "qc shape:", qc.shape)
-            if any(qc.squeeze()) == 7:  # only include variables which are not interpolated
-                print('only interpolated data, not including in resampled data')
-                continue
+            print("var shape", ds.variables[resample_var].shape, "qc shape:", qc_var.shape if qc_var is not None else None)
+            resample_vars[resample_var] = qc_var
+
+        # the bin for each sample is found once for the file, then the bin statistics for all variables are
+        # accumulated a chunk of samples at a time
+        # interpolated data (QC 7) is never used as it is above qc_in_level
+        idx_bin = bin_index(time, bins)
+        stats = {v: BinStats(len(bins) - 1) for v in resample_vars}
+
+        for i0 in range(0, len(time), chunk_size):
+            i1 = min(i0 + chunk_size, len(time))
+            print('processing samples', i0, 'to', i1)
+            idx_chunk = idx_bin[i0:i1]
+            for resample_var, qc_var in resample_vars.items():
+                data_chunk = time_chunk(ds.variables[resample_var], i0, i1)
+                if qc_var is not None:
+                    qc_chunk = time_chunk(qc_var, i0, i1)
+                else:
+                    qc_chunk = np.ones(i1 - i0, dtype=np.int8)
 
-            data_in = var_to_resample_in[:].squeeze()
-            data_in = data_in[qc.squeeze() <= qc_in_level]
+                msk = qc_chunk <= qc_in_level
+                stats[resample_var].add(idx_chunk[msk], data_chunk[msk], qc_chunk[msk])
 
-            print()
-            print('len data', len(data_in))
-            if len(data_in) > 0:
-                time_deployment = var_time[qc.squeeze() <= qc_in_level]
-
-                print(resample_var, 'input data : ', data_in)
+        for resample_var in resample_vars:
+            var_to_resample_in = ds.variables[resample_var]
 
-                y = stats.binned_statistic(np.array(time_deployment), np.array(data_in), statistic='mean', bins=bins)
-                sd = stats.binned_statistic(np.array(time_deployment), np.array(data_in), statistic='std', bins=bins)
-                n = stats.binned_statistic(np.array(time_deployment), np.array(data_in), statistic='count', bins=bins)
+            print()
+            print('len data', stats[resample_var].n_selected)
+            if stats[resample_var].n_selected > 0:
 
-                qc_out = stats.binned_statistic(np.array(time_deployment), np.array(qc[qc <= qc_in_level]), statistic='max', bins=bins)
+                y, sd, n, qc_out = stats[resample_var].statistic()
 
                 #print('sampled data', y)
 
@@ -244,7 +319,7 @@ def down_sample(files, method):
                     var_resample_dist_out.flag_values = np.array([0, 1, 2, 3, 4, 6, 7, 9], dtype=np.int8)
                     var_resample_dist_out.flag_meanings = "unknown good_data probably_good_data probably_bad_data bad_data not_deployed interpolated missing_value"
 
-                    var_resample_dist_out[:] = qc_out.statistic
+                    var_resample_dist_out[:] = qc_out
 
                     aux_vars.append(resample_var + '_quality_control')
 
@@ -252,20 +327,20 @@ def down_sample(files, method):
                 var_resample_dist_out.long_name = ds.variables[resample_var].long_name + ' standard error'
                 var_resample_dist_out.units = var_resample_out.units
                 var_resample_dist_out.comment = 'sample bin standard deviation'
-                var_resample_dist_out[:] = sd.statistic
+                var_resample_dist_out[:] = sd
                 aux_vars.append(resample_var + '_standard_error')
 
                 var_resample_dist_out = ds_new.createVariable(resample_var + '_number_of_observations', 'f4', 'TIME', fill_value=np.nan, zlib=True)
                 var_resample_dist_out.long_name = ds.variables[resample_var].long_name + ' number of observations'
                 var_resample_dist_out.units = '1'
                 var_resample_dist_out.comment = 'number of samples'
-                var_resample_dist_out[:] = n.statistic
+                var_resample_dist_out[:] = n
                 aux_vars.append(resample_var + '_number_of_observations')
 
                 var_resample_out.ancillary_variables = " ".join(aux_vars)
 
-                print("shape", var_resample_out.shape, y.statistic.shape)
-                var_resample_out[:] = y.statistic
+                print("shape", var_resample_out.shape, y.shape)
+                var_resample_out[:] = y
 
         #  create history
         # update the history attribute
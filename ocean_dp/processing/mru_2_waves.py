@@ -29,6 +29,13 @@ import time
 zl = False
 append_to_file = False
 
+# number of bursts read, rotated and transformed at a time
+block_size = 64
+
+# welch FFT length and sample rate
+nfft = 512
+fs = 5
+
 # is this quicker than using the Rotation library, not really
 
 
@@ -48,31 +55,60 @@ def point_rotation_by_quaternion(point, q):
 
 def quaternion_mult_vect(q, r):
 
-    w = r[:, 0]*q[:, 0]-r[:, 1]*q[:, 1]-r[:, 2]*q[:, 2]-r[:, 3]*q[:, 3]
-    x = r[:, 0]*q[:, 1]+r[:, 1]*q[:, 0]-r[:, 2]*q[:, 3]+r[:, 3]*q[:, 2]
-    y = r[:, 0]*q[:, 2]+r[:, 1]*q[:, 3]+r[:, 2]*q[:, 0]-r[:, 3]*q[:, 1]
-    z = r[:, 0]*q[:, 3]-r[:, 1]*q[:, 2]+r[:, 2]*q[:, 1]+r[:, 3]*q[:, 0]
+    # quaternions are on the last axis, so this works for (sample, 4) and (burst, sample, 4) arrays
+    w = r[..., 0]*q[..., 0]-r[..., 1]*q[..., 1]-r[..., 2]*q[..., 2]-r[..., 3]*q[..., 3]
+    x = r[..., 0]*q[..., 1]+r[..., 1]*q[..., 0]-r[..., 2]*q[..., 3]+r[..., 3]*q[..., 2]
+    y = r[..., 0]*q[..., 2]+r[..., 1]*q[..., 3]+r[..., 2]*q[..., 0]-r[..., 3]*q[..., 1]
+    z = r[..., 0]*q[..., 3]-r[..., 1]*q[..., 2]+r[..., 2]*q[..., 1]+r[..., 3]*q[..., 0]
 
-    return np.array((w, x, y, z,)).transpose()
+    return np.stack((w, x, y, z), axis=-1)
 
 
 def point_rotation_by_quaternion_vect(point, q):
 
-    r = np.array([np.zeros_like(point[:, 0]), point[:, 0], point[:, 1], point[:, 2]]).transpose()
-    q_conj = np.array((q[:, 0], -1 * q[:, 1], -1 * q[:, 2], -1 * q[:, 3])).transpose()
-
-    #print('vect shape', point.shape, q.shape, r.shape, q_conj.shape)
+    r = np.stack([np.zeros_like(point[..., 0]), point[..., 0], point[..., 1], point[..., 2]], axis=-1)
+    q_conj = np.stack((q[..., 0], -1 * q[..., 1], -1 * q[..., 2], -1 * q[..., 3]), axis=-1)
 
     qr = quaternion_mult_vect(q, r)
-    #print('res1', res1.shape)
     qrq = quaternion_mult_vect(qr, q_conj)
 
-    #print('return', res.shape)
+    return qrq[..., 1:]
+
+
+def wave_spectra_block(a):
+
+    # a is the vertical world acceleration (burst, sample), returns the frequency, displacement spectra (burst, freq),
+    # significant wave height and zero crossing period of each burst
+
+    # compute power spectral density from vertical acceleration
+    # removing mean seems to work as well as detrend='linear' or detrend='constant'
+    a_mean = np.nanmean(a, axis=1)
+    nan_a = np.isnan(a)
+    a = np.where(nan_a, a_mean[:, None], a) # mean fill
+    freq_spec, wave_acceleration_spectra = signal.welch(a, fs=fs, nfft=nfft, scaling='density', window='hamming', detrend='linear', nperseg=nfft, axis=-1)
+
+    # compute displacement spectra from wave acceleration spectra
+    # by divinding by (2*pi*f) ^ 4, first point is nan as f[0] = 0
+    f_wave_disp = freq_spec[0:-1]
+    wave_displacement_spectra = np.full((a.shape[0], len(f_wave_disp)), np.nan)
+    wave_displacement_spectra[:, 1:] = wave_acceleration_spectra[:, 1:-1] / (2*np.pi*freq_spec[1:-1])**4
+
+    # calculate wave height, NOAA use frequency band 0.0325 to 0.485 https://www.ndbc.noaa.gov/wavecalc.shtml
+    # 0.05 = 20 sec wave period, MRU overestimates the acceleration at this low frequency,
+    # almost 1m at 7m SWH, ~ 10% because of noise
+    # use f[1] as the delta frequency (the width of a frequency bin width)
+    msk = (f_wave_disp > 0.05) & (f_wave_disp < 0.485)
+    m0 = np.sum(wave_displacement_spectra[:, msk] * freq_spec[1], axis=1)
+    swh = 4 * np.sqrt(m0)
+
+    m2 = np.sum(wave_displacement_spectra[:, msk] * freq_spec[1] * (f_wave_disp[msk] ** 2), axis=1)
 
-    return qrq[:, 1:]
+    apd = np.sqrt(m0/m2)
 
+    return f_wave_disp, wave_displacement_spectra, swh, apd
 
-def add_wave_spectra(netCDFfile):
+
+def add_wave_spectra(netCDFfile, block=block_size):
     if append_to_file:
         dsIn = Dataset(netCDFfile, 'a')
         dsOut = dsIn
@@ -106,7 +142,7 @@ def add_wave_spectra(netCDFfile):
 
     # create frequency dimension
     if "FREQ" not in dsOut.dimensions:
-        dsOut.createDimension('FREQ', 256)
+        dsOut.createDimension('FREQ', nfft // 2)
     if "FREQ" in dsOut.variables:
         freq_var_var = dsOut.variables["FREQ"]
     else:
@@ -140,75 +176,53 @@ def add_wave_spectra(netCDFfile):
     # handle for variables
     var_q = dsIn.variables["orientation"]
     var_accel = dsIn.variables["acceleration"]
-    accel = var_accel[:]
-    q = var_q[:]
 
-    # create an array for wave_displacement spectra
-    wave_displacement_spectra = np.zeros(256) * np.nan
+    # frequency of the displacement spectra, as returned by welch, without the nyquist frequency
+    f_wave_disp = np.fft.rfftfreq(nfft, 1/fs)[0:-1]
 
-    accel_world = np.zeros([var_q.shape[0], 3])
-    for i in range(len(dsIn.variables['TIME'])):
-        nans_missing = np.sum(np.isnan(var_accel[:, :, i]), axis=0)
-        print('accel inst nans', nans_missing)
+    # process a block of bursts at a time, reading the acceleration and quaternion slabs as (burst, sample, vector)
+    n_time = len(var_time)
+    for i0 in range(0, n_time, block):
+        i1 = min(i0 + block, n_time)
         start = time.time()
 
-        if nans_missing[2] < 1000:
-
-            # read quaternion for this time
-
-            accel_world[:, :] = point_rotation_by_quaternion_vect(accel[:, :, i], q[:, :, i])
-
-            if append_to_file:
-                accel_w_var[:, :, i] = accel_world[:, :]
-
-            # convert accelerations to world coordinates
+        accel = np.moveaxis(var_accel[:, :, i0:i1].astype(float), -1, 0)
+        q = np.moveaxis(var_q[:, :, i0:i1].astype(float), -1, 0)
+        t = num2date(var_time[i0:i1], calendar=var_time.calendar, units=var_time.units)
 
-            print("rotation % s seconds" % (time.time() - start))
-            start = time.time()
+        nans_missing = np.sum(np.isnan(accel), axis=1)
+        good = nans_missing[:, 2] < 1000
 
-            # compute power spectral density from vertical acceleration
-            # removing mean seems to work as well as detrend='linear' or detrend='constant'
+        # convert accelerations to world coordinates, all bursts at once
+        accel_world = point_rotation_by_quaternion_vect(accel, q)
+        accel_world[~good] = np.nan
 
-            a = accel_world[:, 2]
-            #accel_w_var[:] = a
-            a_mean = np.nanmean(a)
-            #a = a - a_mean
-            nan_a = np.isnan(a)
-            #a[nan_a] = 0 # zero fill
-            a[nan_a] = a_mean # mean fill
-            freq_spec, wave_acceleration_spectra = signal.welch(a, fs=5, nfft=512, scaling='density', window='hamming', detrend='linear', nperseg=512)
+        if append_to_file:
+            accel_w_var[:, :, i0:i1] = np.moveaxis(accel_world, 0, -1)
 
-            # compute displacement spectra from wave acceleration spectra
-            # by divinding by (2*pi*f) ^ 4, first point is nan as f[0] = 0
-            f_wave_disp = freq_spec[0:-1]
-            wave_displacement_spectra[0] = np.nan
-            wave_displacement_spectra[1:] = wave_acceleration_spectra[1:-1] / (2*np.pi*freq_spec[1:-1])**4
-
-            # save wave displacement spectra
-            wave_spec_out_var[:, i] = wave_displacement_spectra
+        print("rotation % s seconds" % (time.time() - start))
+        start = time.time()
 
-            # calculate wave height, NOAA use frequency band 0.0325 to 0.485 https://www.ndbc.noaa.gov/wavecalc.shtml
-            # 0.05 = 20 sec wave period, MRU overestimates the acceleration at this low frequency,
-            # almost 1m at 7m SWH, ~ 10% because of noise
-            # use f[1] as the delta frequency (the width of a frequency bin width)
-            msk = (f_wave_disp > 0.05) & (f_wave_disp < 0.485)
-            m0 = sum(wave_displacement_spectra[msk] * freq_spec[1])
-            swh = 4 * np.sqrt(m0)
+        wave_displacement_spectra = np.full((i1 - i0, len(f_wave_disp)), np.nan)
+        swh = np.full(i1 - i0, np.nan)
+        apd = np.full(i1 - i0, np.nan)
+        if np.any(good):
+            f_wave_disp, wave_displacement_spectra[good], swh[good], apd[good] = wave_spectra_block(accel_world[good, :, 2])
 
-            m2 = sum(wave_displacement_spectra[msk] * freq_spec[1] * (f_wave_disp[msk] ** 2))
+        print("calc % s seconds" % (time.time() - start))
+        start = time.time()
 
-            apd = np.sqrt(m0/m2)
-            print("calc % s seconds" % (time.time() - start))
-            start = time.time()
+        for j in range(i1 - i0):
+            print('accel inst nans', nans_missing[j])
+            if good[j]:
+                print(t[j], 'wave height', swh[j], 'period', apd[j])
+            else:
+                print('missing data', t[j])
 
-            print(num2date(var_time[i], calendar=var_time.calendar, units=var_time.units), 'wave height', swh, 'period', apd)
-            swh_out_var[i] = swh
-            apd_out_var[i] = apd
-        else:
-            print('missing data', num2date(var_time[i], calendar=var_time.calendar, units=var_time.units))
-            swh_out_var[i] = np.nan
-            apd_out_var[i] = np.nan
-            wave_spec_out_var[:, i] = np.nan
+        # save wave displacement spectra, wave height and period for the block
+        wave_spec_out_var[:, i0:i1] = wave_displacement_spectra.T
+        swh_out_var[i0:i1] = swh
+        apd_out_var[i0:i1] = apd
 
         print("save % s seconds" % (time.time() - start))
 
@@ -231,5 +245,9 @@ def add_wave_spectra(netCDFfile):
 
 
 if __name__ == "__main__":
-    for f in sys.argv[1:]:
-        add_wave_spectra(f)
+    args = iter(sys.argv[1:])
+    for f in args:
+        if f == '--block':
+            block_size = int(next(args))
+            continue
+        add_wave_spectra(f, block=block_size)
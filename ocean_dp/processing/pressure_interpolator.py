@@ -20,7 +20,6 @@ from datetime import datetime, timedelta, UTC
 import numpy as np
 from netCDF4 import Dataset
 import glob
-import pandas as pd
 import shutil
 import os
 import sys
@@ -28,6 +27,92 @@ import sys
 # Supply netCDFfiles as a ['list'] of files, agg as a 'string'
 
 
+def agg_instrument_pressure(agg):
+    # read the aggregate TIME, PRES and instrument_index once, and split them into the samples from each instrument
+    instrument_index = np.array(agg.variables["instrument_index"][:])
+    order = np.argsort(instrument_index, kind='stable')
+    split_idx = np.searchsorted(instrument_index[order], np.arange(1, len(agg.variables["NOMINAL_DEPTH"])))
+
+    agg_time = np.split(agg.variables["TIME"][:][order], split_idx)
+    agg_pres = np.split(agg.variables["PRES"][:][order], split_idx)
+
+    return agg_time, agg_pres
+
+
+def agg_pressure_profile(agg, agg_time, agg_pres, time):
+    # interpolate the pressure of each aggregate instrument to the file times, with 0m as 0dbar,
+    # returns the sorted nominal depths, and the (depth x time) pressure matrix
+    interp_agg_pres = np.full((len(agg_time)+1, len(time)), np.nan)
+    interp_agg_pres[0, :] = 0
+
+    agg_nominal_depths = np.insert(np.array(agg.variables["NOMINAL_DEPTH"][:]), 0, 0)
+
+    # TODO: look at only calculating pressures for sensors above and below the NOMINAL_DEPTH that we're interested in
+    for j in range(1, len(agg_nominal_depths)):
+        interp_agg_pres[j, :] = np.interp(time, agg_time[j-1], agg_pres[j-1])
+
+    # Sort the nominal depths and pressures according to nominal depth
+    interp_agg_pres = interp_agg_pres[np.argsort(agg_nominal_depths), :]
+    agg_nominal_depths.sort()
+
+    return agg_nominal_depths, interp_agg_pres
+
+
+def fill_pressure_profile(agg_nominal_depths, interp_agg_pres):
+    # fill NaNs in the (depth x time) pressure matrix, all times at once
+
+    # for the times where the deepest pressure is NaN, starting below the deepest row with any pressure
+    # for those times, continue down using a nominal depth difference of 1m equating to 1dbar
+    nan_cols = np.isnan(interp_agg_pres[-1, :])
+    if np.any(nan_cols):
+        valid_rows = np.where(~np.all(np.isnan(interp_agg_pres[:, nan_cols]), axis=1))[0]
+        shallowest_idx = valid_rows[-1]
+        depth_diff = np.diff(agg_nominal_depths)
+        for k in range(shallowest_idx+1, len(agg_nominal_depths)):
+            interp_agg_pres[k, nan_cols] = interp_agg_pres[k-1, nan_cols] + depth_diff[k-1]
+
+    # linearly interpolate any remaining NaNs along nominal depth, below the deepest valid pressure use that pressure
+    valid = ~np.isnan(interp_agg_pres)
+    if np.all(valid):
+        return interp_agg_pres
+
+    row = np.arange(len(agg_nominal_depths))[:, None]
+    idx_prev = np.maximum.accumulate(np.where(valid, row, -1), axis=0)
+    idx_next = np.minimum.accumulate(np.where(valid, row, len(agg_nominal_depths))[::-1], axis=0)[::-1]
+
+    cols = np.broadcast_to(np.arange(interp_agg_pres.shape[1]), interp_agg_pres.shape)
+    fill = ~valid & (idx_prev >= 0)
+    has_next = fill & (idx_next < len(agg_nominal_depths))
+    trailing = fill & ~has_next
+
+    p0 = interp_agg_pres[idx_prev[has_next], cols[has_next]]
+    p1 = interp_agg_pres[idx_next[has_next], cols[has_next]]
+    d0 = agg_nominal_depths[idx_prev[has_next]]
+    d1 = agg_nominal_depths[idx_next[has_next]]
+    d = np.broadcast_to(agg_nominal_depths[:, None], interp_agg_pres.shape)[has_next]
+
+    interp_agg_pres[trailing] = interp_agg_pres[idx_prev[trailing], cols[trailing]]
+    interp_agg_pres[has_next] = (p1 - p0) / (d1 - d0) * (d - d0) + p0
+
+    return interp_agg_pres
+
+
+def interp_depth(depth, agg_nominal_depths, interp_agg_pres):
+    # interpolate the (depth x time) pressure matrix to one depth, same as np.interp() on each time
+    if depth <= agg_nominal_depths[0]:
+        return interp_agg_pres[0, :].copy()
+    if depth >= agg_nominal_depths[-1]:
+        return interp_agg_pres[-1, :].copy()
+
+    j = np.searchsorted(agg_nominal_depths, depth, side='right') - 1
+    if depth == agg_nominal_depths[j]:
+        return interp_agg_pres[j, :].copy()
+
+    slope = (interp_agg_pres[j+1, :] - interp_agg_pres[j, :]) / (agg_nominal_depths[j+1] - agg_nominal_depths[j])
+
+    return slope * (depth - agg_nominal_depths[j]) + interp_agg_pres[j, :]
+
+
 def pressure_interpolator(netCDFfiles=None, agg_file=None):
 
     if not netCDFfiles:
@@ -42,6 +127,9 @@ def pressure_interpolator(netCDFfiles=None, agg_file=None):
 
     agg = Dataset(agg_file, mode="r")
 
+    print(datetime.now(UTC), 'reading aggregate pressure')
+    agg_time, agg_pres = agg_instrument_pressure(agg)
+
     out_file_list = []
 
     # Loop through each of the fv01 files
@@ -82,72 +170,21 @@ def pressure_interpolator(netCDFfiles=None, agg_file=None):
             print('variables ', fv01_contents.variables.keys())
             print('aggregate variables', agg.variables.keys())
             
-            # Create a NaN array to fill with pressure values
-            interp_agg_pres = np.full((len(agg.variables["NOMINAL_DEPTH"])+1,len(fv01_contents.variables["TIME"])),np.nan)
-            
-            # Set the first row as zeros to set 0m as 0dbar
-            interp_agg_pres[0,:] = 0
-            
-            # Create a new array representing the nominal depths of the agg file,
-            # including the 0m values
-            agg_nominal_depths = np.insert(np.array(agg.variables["NOMINAL_DEPTH"][:]),0,0)
-
             print(datetime.now(UTC), 'interpolating aggregate to file times')
 
             # For each nominal depth, interpolate the agg data at the fv01 times
-            # TODO: look at only calculating pressures for sensors above and below the NOMINAL_DEPTH that we're interested in
-            for j in range(1, len(agg_nominal_depths)):
-                
-                time_selection = agg.variables["TIME"][agg.variables["instrument_index"][:]==(j-1)]
-                
-                pres_selection = agg.variables["PRES"][agg.variables["instrument_index"][:]==(j-1)]
-                
-                interp_agg_pres[j,:] = np.interp(fv01_contents.variables["TIME"][:],time_selection,pres_selection)
-                                           
-            # Sort the nominal depths and pressures according to nominal depth
-            interp_agg_pres = interp_agg_pres[np.argsort(agg_nominal_depths),:]
-        
-            agg_nominal_depths.sort()
-            
+            time = np.array(fv01_contents.variables["TIME"][:])
+            agg_nominal_depths, interp_agg_pres = agg_pressure_profile(agg, agg_time, agg_pres, time)
+
             # If there are any NaN values, linearly interpolate profilewise
             if np.isnan(np.sum(interp_agg_pres)):
-                
-                # Make a dataframe of the interpolated pressure to handle NaNs easily
-                interp_agg_pres_df = pd.DataFrame(data=interp_agg_pres,index=agg_nominal_depths)
-                
-                # Find all the columns where the lowest element is NaN
-                nan_cols = np.where(interp_agg_pres_df.iloc[-1].isna())
-                
-                # Select each column containing an NaN as the deepest value
-                for j in nan_cols:
-                    
-                    # Find the shallowest nominal depth that isn't NaN
-                    shallowest_val = pd.Series.last_valid_index(interp_agg_pres_df.iloc[:,j])
-                    
-                    # Find the index of that nominal depth
-                    shallowest_idx = interp_agg_pres_df.index.tolist().index(shallowest_val)
-                    
-                    # Starting at the shallowest NaN in a continous block of NaNs to the bottom
-                    for k in range(shallowest_idx+1,len(interp_agg_pres_df)):
-                        
-                        # Linearly interpolate from shallow to deep, based on a nominal depth difference of 1m equating to 1dbar
-                        interp_agg_pres_df.iloc[k,j] = interp_agg_pres_df.iloc[k-1,j]+np.diff(interp_agg_pres_df.index)[k-1]
-                        
-                # Linearly interpolate any remaining NaNs
-                interp_agg_pres_df = interp_agg_pres_df.interpolate(method="index")
-                
-                # Convert the DataFrame back to an array
-                interp_agg_pres =  interp_agg_pres_df.to_numpy()
-            
-            # Create a NaN array to receive the fv01 interpolated pressures
-            interp_fv01_pres = np.full((np.shape(fv01_contents.variables["TIME"][:])),np.nan)
+                interp_agg_pres = fill_pressure_profile(agg_nominal_depths, interp_agg_pres)
 
             print(datetime.now(UTC), 'interpolating pressure')
 
-            # At each timestamp, interpolate pressure for the fv01 data
-            for j in range(len(fv01_contents.variables["TIME"])):
-                interp_fv01_pres[j] = np.interp(fv01_contents.variables["NOMINAL_DEPTH"][0], agg_nominal_depths, interp_agg_pres[:, j])
-        
+            # interpolate pressure for the fv01 data, at all timestamps at once
+            interp_fv01_pres = interp_depth(fv01_contents.variables["NOMINAL_DEPTH"][0], agg_nominal_depths, interp_agg_pres)
+
             # Create the PRES and PRES_quality_control variables, and their attributes
             pres_var = fv01_contents.createVariable('PRES', 'f8', fv01_contents.variables['TIME'].dimensions, fill_value=np.NaN, zlib=True)
             
@@ -175,65 +212,19 @@ def pressure_interpolator(netCDFfiles=None, agg_file=None):
             
             print("file contains pressure and agg contains NaNs")
             
-            # Create a NaN array to fill with pressure values
-            interp_agg_pres = np.full((len(agg.variables["NOMINAL_DEPTH"])+1,len(fv01_contents.variables["TIME"])),np.nan)
-            
-            # Set the first row as zeros to set 0m as 0dbar
-            interp_agg_pres[0,:] = 0
-            
-            # Create a new array representing the nominal depths of the agg file,
-            # including the 0m values
-            agg_nominal_depths = np.insert(np.array(agg.variables["NOMINAL_DEPTH"][:]),0,0)
-            
             # For each nominal depth, interpolate the agg data at the fv01 times
-            for j in range(1,len(agg_nominal_depths)):
-                
-                time_selection = agg.variables["TIME"][agg.variables["instrument_index"][:]==(j-1)]
-                pres_selection = agg.variables["PRES"][agg.variables["instrument_index"][:]==(j-1)]
-                
-                interp_agg_pres[j,:] = np.interp(fv01_contents.variables["TIME"][:],time_selection,pres_selection)
-                                           
-            # Sort the nominal depths and pressures according to nominal depth
-            interp_agg_pres = interp_agg_pres[np.argsort(agg_nominal_depths),:]
-        
-            agg_nominal_depths.sort()
-                
-            # Make a dataframe of the interpolated pressure to handle NaNs easily
-            interp_agg_pres_df = pd.DataFrame(data=interp_agg_pres,index=agg_nominal_depths)
-            
-            # Find all the columns where the lowest element is NaN
-            nan_cols = np.where(interp_agg_pres_df.iloc[-1].isna())
-            
-            # Select each column containing an NaN as the deepest value
-            for j in nan_cols:
-                
-                # Find the shallowest nominal depth that isn't NaN
-                shallowest_val = pd.Series.last_valid_index(interp_agg_pres_df.iloc[:,j])
-                
-                # Find the index of that nominal depth
-                shallowest_idx = interp_agg_pres_df.index.tolist().index(shallowest_val)
-                
-                # Starting at the shallowest NaN in a continous block of NaNs to the bottom
-                for k in range(shallowest_idx+1,len(interp_agg_pres_df)):
-                    
-                    # Linearly interpolate from shallow to deep, based on a nominal depth difference of 1m equating to 1dbar
-                    interp_agg_pres_df.iloc[k,j] = interp_agg_pres_df.iloc[k-1,j]+np.diff(interp_agg_pres_df.index)[k-1]
-                    
-            # Linearly interpolate any remaining NaNs
-            interp_agg_pres_df = interp_agg_pres_df.interpolate(method="index")
-            
-            # Convert the DataFrame back to an array
-            interp_agg_pres =  interp_agg_pres_df.to_numpy()
-        
-            # Create a NaN array to receive the fv01 interpolated pressures
-            interp_fv01_pres = np.full((np.shape(fv01_contents.variables["TIME"][:])),np.nan)
-        
+            time = np.array(fv01_contents.variables["TIME"][:])
+            agg_nominal_depths, interp_agg_pres = agg_pressure_profile(agg, agg_time, agg_pres, time)
+
+            interp_agg_pres = fill_pressure_profile(agg_nominal_depths, interp_agg_pres)
+
             # Extract the interpolated pressures (NaNs removed) to store in netCDF4
-            interp_fv01_pres = interp_agg_pres_df[interp_agg_pres_df.index==fv01_contents.variables["NOMINAL_DEPTH"][:]]
-        
+            interp_fv01_pres = interp_depth(fv01_contents.variables["NOMINAL_DEPTH"][0], agg_nominal_depths, interp_agg_pres)
+
             # Find indices where the netcdf data and interpolated data don't match (where the NaNs are in the netcdf)
-            nan_rep_idx = np.where(interp_fv01_pres != fv01_contents.variables['PRES'][:])[1]
-            
+            pres = np.ma.filled(fv01_contents.variables['PRES'][:].astype(np.float64), np.nan)
+            nan_rep_idx = np.where(interp_fv01_pres != pres)[0]
+
             # update the quality flags
             fv01_contents.variables['PRES_quality_control'][nan_rep_idx] = 7
         
@@ -8,33 +8,95 @@ from datetime import datetime, UTC
 import matplotlib.pyplot as plt
 
 import numpy as np
-from scipy import interpolate
-
-
-def bisection(array, value):
-    '''Given an ``array`` , and given a ``value`` , returns an index j such that ``value`` is between array[j]
-    and array[j+1]. ``array`` must be monotonic increasing. j=-1 or j=len(array) is returned
-    to indicate that ``value`` is out of range below and above respectively.'''
-    n = len(array)
-    if (value < array[0]):
-        return -1
-    elif (value > array[n-1]):
-        return n
-    jl = 0# Initialize lower
-    ju = n-1# and upper limits.
-    while (ju-jl > 1):# If we are not yet done,
-        jm=(ju+jl) >> 1# compute a midpoint with a bitshift
-        if (value >= array[jm]):
-            jl=jm# and replace either the lower limit
-        else:
-            ju=jm# or the upper limit, as appropriate.
-        # Repeat until the test condition is satisfied.
-    if (value == array[0]):# edge cases at bottom
-        return 0
-    elif (value == array[n-1]):# and top
-        return n-1
-    else:
-        return jl
+
+
+def resample_index(x, resample_times, window_width=30, nearest_max=120, widen_max=240):
+    # for all the resample times at once, find
+    # 1. the index of the sample at (or before) the new time, this must be within nearest_max (minutes)
+    # 2. the window of samples within +/- window_width (minutes) of the resample time
+    # 3. if there are less than 3 points in the window, widen it by one point each way if the point is within
+    #    widen_max (minutes)
+    # 4. the new time must be inside a window of 3 or more points
+    # returns the index of the sample before each new time, and the mask of new times that can be interpolated
+    # x must be monotonic increasing
+    n = len(x)
+    m = len(resample_times)
+    ok = np.zeros(m, dtype=bool)
+    if n < 2 or m == 0:
+        return np.zeros(m, dtype=np.int64), ok
+
+    w = window_width/60/24
+
+    in_range = (resample_times >= x[0]) & (resample_times <= x[-1])
+    idx_resample = np.clip(np.searchsorted(x, resample_times, side='right') - 1, 0, n-1)
+
+    near = in_range & ~(np.abs(resample_times - x[idx_resample]) > nearest_max/60/24)
+    no_near = np.count_nonzero(in_range & ~near)
+    if no_near > 0:
+        print('nearest point is more than', nearest_max, 'mins away for', no_near, 'samples')
+
+    r = resample_times[near]
+    j = idx_resample[near]
+
+    # start of window, first point with (x - r) > -w, but not before point 1 (or j if before that)
+    k0 = np.searchsorted(x, r - w, side='right')
+    # fix up any rounding of (r - w) so the window uses the same test as (x - r) > -w
+    while True:
+        back = (k0 > 0) & ((x[np.maximum(k0-1, 0)] - r) > -w)
+        if not np.any(back):
+            break
+        k0[back] -= 1
+    while True:
+        fwd = (k0 < n) & ~((x[np.minimum(k0, n-1)] - r) > -w)
+        if not np.any(fwd):
+            break
+        k0[fwd] += 1
+    idx_start_window = np.where(j <= 1, j, np.maximum(np.minimum(k0, j), 1))
+
+    # end of window, last point with (x - r) < w, but not after point n-2
+    k1 = np.searchsorted(x, r + w, side='left')
+    while True:
+        back = (k1 > 0) & ~((x[np.maximum(k1-1, 0)] - r) < w)
+        if not np.any(back):
+            break
+        k1[back] -= 1
+    while True:
+        fwd = (k1 < n) & ((x[np.minimum(k1, n-1)] - r) < w)
+        if not np.any(fwd):
+            break
+        k1[fwd] += 1
+    idx_end_window = np.where(j >= n-2, j, np.minimum(np.maximum(k1-1, j), n-2))
+
+    # widen the window if there are too few points
+    narrow = (idx_end_window - idx_start_window) < 3
+    widen_fwd = narrow & (idx_end_window + 1 < n)
+    widen_fwd[widen_fwd] = (x[idx_end_window[widen_fwd] + 1] - r[widen_fwd]) < widen_max/60/24
+    widen_back = narrow & (idx_start_window > 0)
+    widen_back[widen_back] = (x[idx_start_window[widen_back] - 1] - r[widen_back]) > -widen_max/60/24
+    idx_end_window = idx_end_window + widen_fwd
+    idx_start_window = idx_start_window - widen_back
+
+    # if we have 3 or more points in window, interpolate to centre time
+    enough = (idx_end_window - idx_start_window) >= 2
+    inside = (r > x[idx_start_window]) & (r < x[idx_end_window])
+    print('less than 3 samples around', np.count_nonzero(~enough), 'samples')
+
+    ok[near] = enough & inside
+    print('no sample for', m - np.count_nonzero(in_range), 'samples')
+
+    return idx_resample, ok
+
+
+def resample_linear(x, y, idx_resample, ok, resample_times):
+    # linear interpolation between the samples either side of each new time, the window from resample_index()
+    # only decides if the new time can be interpolated
+    y_resample = np.zeros_like(resample_times)*np.nan
+
+    j = idx_resample[ok]
+    r = resample_times[ok]
+    y_resample[ok] = y[j] + (y[j+1] - y[j]) * (r - x[j]) / (x[j+1] - x[j])
+
+    return y_resample
 
 
 def resample(files):
@@ -135,14 +197,15 @@ def resample(files):
         # print('input file vars', in_vars)
         z = in_vars.intersection(['TEMP', 'PSAL', 'DENSITY', 'DOX2', 'PRES'])
         print ('vars to smooth', z)
-        for var_name in z:
+        window_index = {}  # window index for each QC mask
+        for var_name in sorted(z):
 
             var_to_resample = ds.variables[var_name]
             qc = np.zeros_like(var_to_resample)
             if var_name + '_quality_control' in ds.variables:
                 qc = ds.variables[var_name + '_quality_control'][:]
 
-            var_msk = qc < 2
+            var_msk = np.ma.getdata(qc < 2)
             # need to use QC variable as mask also
             resample_data = var_to_resample[var_msk]
 
@@ -150,66 +213,18 @@ def resample(files):
             x = np.array(var_time[var_msk])
             y = np.array(resample_data)
 
-            y_resample = np.zeros_like(resample_times)*np.nan
-
             # resample to new times (resample_times), by
             # 1. find the nearest point to the new time
-            # 2. find points within +/-45 min range of the resample time
+            # 2. find points within +/-30 min range of the resample time
             # 3. if there are more than 3 points in this range
-            # 4. fit a linear line between the points in the window
-            # 5. calculate the new value along the line at the new time
-            # this time search must be done for each variable as the QC fags maybe different
-            for idx in range(0, len(resample_times)):
-                resample_time = resample_times[idx]
-                idx_resample = bisection(x, resample_time) # find the index of the nearest point to the new sample time
-                if (idx_resample >= 0) and (idx_resample < len(x)):
-                    #print(idx_resample, y[idx_resample], num2date(x[idx_resample], units=var_time.units), 'resample time', num2date(resample_time, units=var_time.units))
-
-                    if abs(resample_time - x[idx_resample]) > 120/60/24:
-                        print('nearest point', num2date(resample_time, units=var_time.units)-num2date(x[idx_resample], units=var_time.units), 'is more than 120 mins away')
-                        continue
-
-                    # find indexes of window which is +/- 30 mins wide
-                    window_width = 30
-                    idx_start_window = idx_resample
-                    while (idx_start_window > 1) and (x[idx_start_window-1] - resample_time) > -window_width/60/24:
-                        idx_start_window -= 1
-                    idx_end_window = idx_resample
-                    while (idx_end_window < len(x)-1-1) and (x[idx_end_window+1] - resample_time) < window_width/60/24:
-                        idx_end_window += 1
-
-                    # TODO: might be better to check that the 'next point' is within 2x window than number of points
-                    if (idx_end_window - idx_start_window) < 3:
-                        #print('back offset', (x[idx_end_window-1]-resample_time)*60*24, 'forward offset', (x[idx_end_window+1]-resample_time)*60*24)
-                        if (x[idx_end_window+1]-resample_time) < 240/60/24:
-                            #print((idx_end_window - idx_start_window), "points, widening window forward")
-                            idx_end_window += 1
-                        if (x[idx_start_window-1]-resample_time) > -240/60/24:
-                            #print((idx_end_window - idx_start_window), "points, widening window back")
-                            idx_start_window -= 1
-
-                    #print('window points', idx_end_window-idx_start_window, 'for', num2date(resample_time, units=var_time.units),
-                    #      'nearest_offset', num2date(resample_time, units=var_time.units)-num2date(x[idx_resample], units=var_time.units),
-                    #      'back_offset', num2date(resample_time, units=var_time.units)-num2date(x[idx_start_window], units=var_time.units),
-                    #      'forward_offset', num2date(x[idx_end_window], units=var_time.units)-num2date(resample_time, units=var_time.units))
-
-                    # if we have more than 3 points in window, interpolate to centre time
-                    if (idx_end_window - idx_start_window) >= 2:
-                        if (resample_time > x[idx_start_window]) and (resample_time < x[idx_end_window]):
-                            f = interpolate.interp1d(x[idx_start_window:idx_end_window+1], y[idx_start_window:idx_end_window+1])
-                            try:
-                                y_resample[idx] = f(resample_time)
-                                #print(num2date(resample_time, units=var_time.units), y_resample[idx])
-                            except ValueError:
-                                print('value error', idx_start_window, idx_resample, idx_end_window, len(x), num2date(resample_time, units=var_time.units))
-                                for z in range(idx_start_window, idx_end_window+1):
-                                    print('ts', num2date(x[z], units=var_time.units), '=', y[z])
-                    else:
-                        print('less than 3 sample around', num2date(resample_time, units=var_time.units), num2date(x[idx_resample], units=var_time.units))
-                else:
-                    print('no sample for', num2date(resample_time, units=var_time.units))
-
-                    #print(num2date(resample_time, units=var_time.units), 'points in resample', idx_end_window - idx_start_window, 'new sample', y_resample[idx])
+            # 4. interpolate linearly between the points either side of the new time
+            # the time search is done for all resample times at once, and shared by variables with the same QC mask
+            msk_key = var_msk.tobytes()
+            if msk_key not in window_index:
+                window_index[msk_key] = resample_index(x, resample_times)
+            idx_resample, ok = window_index[msk_key]
+
+            y_resample = resample_linear(x, y, idx_resample, ok, resample_times)
 
             # do the resample
 
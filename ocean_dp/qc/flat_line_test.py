@@ -6,6 +6,7 @@ import numpy.ma as ma
 import sys
 from netCDF4 import Dataset
 import numpy as np
+from scipy.ndimage import maximum_filter1d, minimum_filter1d
 import argparse
 import glob
 import pytz
@@ -13,13 +14,13 @@ import os
 
 
 # If files aren't specified, take all the IMOS*.nc files in the current folder
-def flatline_test_all_files(target_vars_in=[], window=5, flag=4):
+def flatline_test_all_files(target_vars_in=[], window=5, flag=4, tolerance=0, skip_masked=False):
     target_files = glob.glob('IMOS*.nc')
 
-    flatline_test_files(target_files, target_vars_in=target_vars_in, window=window, flag=flag)
+    flatline_test_files(target_files, target_vars_in=target_vars_in, window=window, flag=flag, tolerance=tolerance, skip_masked=skip_masked)
 
 
-def flatline_test_files(target_files, target_vars_in=[], window=5, flag=4):
+def flatline_test_files(target_files, target_vars_in=[], window=5, flag=4, tolerance=0, skip_masked=False):
     # Loop through each files in target_files
     for current_file in target_files:
         # Print each filename
@@ -29,10 +30,61 @@ def flatline_test_files(target_files, target_vars_in=[], window=5, flag=4):
         nc = Dataset(current_file, mode="a")
 
         # run the flat line test
-        flatline_test(nc=nc, target_vars_in=target_vars_in, window=window, flag=flag)
+        flatline_test(nc=nc, target_vars_in=target_vars_in, window=window, flag=flag, tolerance=tolerance, skip_masked=skip_masked)
+
+
+def flat_runs(var_data, window=5, tolerance=0):
+    # return a mask of the values that are part of a run of 'window' or more consecutive values,
+    # equal values with tolerance 0, or with a range (max - min) within tolerance, NaN never matches
+
+    var_data = np.asarray(var_data)
+    n = len(var_data)
+
+    if window <= 1:
+        return np.ones(n, dtype=bool)
+    flat = np.zeros(n, dtype=bool)
+    if n < window:
+        return flat
+
+    # mark the start (+1) and end (-1) of each flat run, the cumulative sum is then > 0 inside a flat run
+    edges = np.zeros(n + 1, dtype=np.int32)
+
+    if tolerance > 0:
+        # comparing only neighbouring values would make a slow drift one long run, so each 'window' values
+        # must be within tolerance of each other, a run is then all the overlapping windows which are
+        # the running max and min filters take the same time whatever the window, values at index i cover the
+        # window starting at i - window//2, a window with a NaN never matches
+        x = var_data.astype(np.float64)
+        nan_x = np.isnan(x)
+        x[nan_x] = 0
+        n_win = n - window + 1
+        centre = slice(window // 2, window // 2 + n_win)
+        win_max = maximum_filter1d(x, window)[centre]
+        win_min = minimum_filter1d(x, window)[centre]
+        nan_count = np.cumsum(np.concatenate(([0], nan_x)))
+        win_nan = nan_count[window:] - nan_count[:n_win]
+        win_start = np.flatnonzero((win_max - win_min <= tolerance) & (win_nan == 0))
+
+        edges[win_start] += 1
+        edges[win_start + window] -= 1
+    else:
+        same = np.diff(var_data.astype(np.float64)) == 0
+
+        # start index and length of each run of equal values
+        run_start = np.flatnonzero(np.concatenate(([True], ~same)))
+        run_length = np.diff(np.append(run_start, n))
+
+        long_runs = run_length >= window
+
+        edges[run_start[long_runs]] += 1
+        edges[run_start[long_runs] + run_length[long_runs]] -= 1
 
+    flat[:] = np.cumsum(edges[:-1]) > 0
 
-def flatline_test(nc, target_vars_in=[], window=5, flag=4):
+    return flat
+
+
+def flatline_test(nc, target_vars_in=[], window=5, flag=4, tolerance=0, skip_masked=False):
     print('Window is ' + str(window))
 
     # If target_vars aren't user specified, set it to all the variables of
@@ -57,6 +109,8 @@ def flatline_test(nc, target_vars_in=[], window=5, flag=4):
     else:
         target_vars = target_vars_in
 
+    points_marked = 0
+
     # For each variable, extract the data
     for current_var in target_vars:
 
@@ -66,11 +120,8 @@ def flatline_test(nc, target_vars_in=[], window=5, flag=4):
         if nc_var.name + "_quality_control_flt" in nc.variables:
             print('flt qc variable already present')
             ncVarOut = nc.variables[nc_var.name + "_quality_control_flt"]
-            ncVarOut[:] = 0
         else:
             ncVarOut = nc.createVariable(nc_var.name + "_quality_control_flt", "i1", nc_var.dimensions, fill_value=99, zlib=True)  # fill_value=0 otherwise defaults to max
-            ncVarOut[:] = 0
-            # print(all(nc.variables[nc_var.name + "_quality_control_flt"]==0))
             ncVarOut.long_name = "quality flag for " + nc_var.long_name
             try:
                 ncVarOut.standard_name = nc_var.standard_name + " status_flag"
@@ -82,29 +133,30 @@ def flatline_test(nc, target_vars_in=[], window=5, flag=4):
             # add new variable to list of aux variables
             nc_var.ancillary_variables = nc_var.ancillary_variables + " " + nc_var.name + "_quality_control_flt"
 
-        var_data = np.array(nc.variables[current_var][:])
-
-        if (all(nc.variables[nc_var.name + "_quality_control_flt"][:] == 0)):
-            print('All test specific qc values are zero before filling')
+        var_data = nc_var[:]
 
         print('checking ' + current_var)
 
-        print('Window is ' + str(window))
-
-        # Step through the data, one element at a time, using the window
-        for i in range(0, (len(var_data) - window + 1)):
+        # find the runs of equal values in one pass, masked values are either compared as their fill value (the
+        # default), or skipped so a run can continue across them
+        if skip_masked:
+            valid = ~np.ma.getmaskarray(var_data)
+            flat = np.zeros(var_data.shape, dtype=bool)
+            flat[valid] = flat_runs(np.ma.getdata(var_data)[valid], window=window, tolerance=tolerance)
+        else:
+            flat = flat_runs(np.ma.getdata(var_data), window=window, tolerance=tolerance)
 
-            # This is true if 'window' elements in a row are equal
-            if len(set(var_data[i:(i + window)])) == 1:
-                print(str(i))
-                # set corresponding QC value to...
-                ncVarOut[i:(i + window)] = flag
+        # build the flags in memory, and write them once
+        new_qc_flags = np.zeros(var_data.shape, dtype=np.int8)
+        new_qc_flags[flat] = flag
+        ncVarOut[:] = new_qc_flags
 
-        points_marked = len([elem for elem in ncVarOut[:] if elem == 4])
-        print('Data points flagged: ', points_marked)
+        count = np.count_nonzero(flat)
+        print('Data points flagged: ', count)
+        points_marked += count
 
         qc_var = nc.variables[current_var + "_quality_control"]
-        qc_var[:] = np.maximum(ncVarOut[:], qc_var[:])
+        qc_var[:] = np.maximum(new_qc_flags, qc_var[:])
 
     # update the history attribute
     try:
@@ -112,14 +164,22 @@ def flatline_test(nc, target_vars_in=[], window=5, flag=4):
     except AttributeError:
         hist = ""
 
-    nc.setncattr('history', hist + datetime.now(UTC).strftime("%Y-%m-%d") + ' : flatline_test performed on ' + str(target_vars) + ', window ' + str(window) + ' consecutive values or more were flagged with ' + str(flag) + ' marked ' + str(int(points_marked)))
+    if tolerance > 0:
+        window_str = str(window) + ' consecutive values (tolerance ' + str(tolerance) + ')'
+    else:
+        window_str = str(window) + ' consecutive values'
+
+    nc.setncattr('history', hist + datetime.now(UTC).strftime("%Y-%m-%d") + ' : flatline_test performed on ' + str(target_vars) + ', window ' + window_str + ' or more were flagged with ' + str(flag) + ' marked ' + str(int(points_marked)))
 
     nc.close()
 
 
 if __name__ == "__main__":
-    # usage is <file_name> <variable_name> <window> <flag value>
-    flatline_test_files(target_files=[sys.argv[1]], target_vars_in=[sys.argv[2]], window=int(sys.argv[3]), flag=float(sys.argv[4]))
+    # usage is <file_name> <variable_name> <window> <flag value> [<tolerance>]
+    if len(sys.argv) > 5:
+        flatline_test_files(target_files=[sys.argv[1]], target_vars_in=[sys.argv[2]], window=int(sys.argv[3]), flag=float(sys.argv[4]), tolerance=float(sys.argv[5]))
+    else:
+        flatline_test_files(target_files=[sys.argv[1]], target_vars_in=[sys.argv[2]], window=int(sys.argv[3]), flag=float(sys.argv[4]))
 
 
 
@@ -16,25 +16,13 @@
 # You should have received a copy of the GNU General Public License
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 
-from netCDF4 import Dataset, num2date
 import sys
-from datetime import datetime, UTC
-import numpy as np
-from dateutil import parser
-import pytz
-import os
 
-# flag data from input variables
+from ocean_dp.qc.qc_pipeline import QCPipeline, propagate_from
 
-data = [{'out': 'PSAL', 'in': ('TEMP', 'PRES', 'CNDC')},
-        {'out': 'CNDC', 'in': ('TEMP', 'PRES', 'PSAL')},
-        {'out': 'DENSITY', 'in': ('TEMP', 'PRES', 'PSAL')},
-        {'out': 'SIGMA_T0', 'in': ('TEMP', 'PRES', 'PSAL')},
-        {'out': 'SIGMA_T0_SM', 'in': ('TEMP', 'PRES', 'PSAL')},
-        {'out': 'OXSOL', 'in': ('TEMP', 'PRES', 'PSAL')},
-        {'out': 'DOX2', 'in': ('TEMP', 'PRES', 'PSAL', 'DOX', 'OXSOL', 'DOXS')},
-        {'out': 'DOXS', 'in': ('TEMP', 'PRES', 'PSAL', 'DOX', 'OXSOL', 'DOX2')},
-       ]
+# flag data from input variables, the test is done by QCPipeline
+
+data = propagate_from
 
 
 def propogate(netCDFfile, var_name=None):
@@ -42,71 +30,9 @@ def propogate(netCDFfile, var_name=None):
     out_file = []
 
     for fn in netCDFfile:
-        ds = Dataset(fn, 'a')
-        ds.set_auto_mask(False)
-
-        var_list = []
-        for d in data:
-            v = d['out']
-            if v in ds.variables:
-                if not var_name or v == var_name:
-                    print('processing variable', v)
-                    var_list.append(v)
-
-                    # get the existing flags
-                    if v + '_quality_control' in ds.variables:
-                        ncVarFinal = ds.variables[v + '_quality_control']
-                    else:
-                        ncVarFinal = ds.createVariable(v + "_quality_control", "i1", ds.variables[v].dimensions, fill_value=99, zlib=True)  # fill_value=0 otherwise defaults to max
-                        ncVarFinal.units = "1"
-                        ds.variables[v].ancillary_variables = v + "_quality_control"
-                        if 'long_name' in ds.variables[v].ncattrs():
-                            ncVarFinal.long_name = "quality flag for " + ds.variables[v].long_name
-                        if 'standard_name' in ds.variables[v].ncattrs():
-                            ncVarFinal.standard_name = ds.variables[v].standard_name + " status_flag"
-
-                        ncVarFinal.quality_control_conventions = "IMOS standard flags"
-                        ncVarFinal.flag_values = np.array([0, 1, 2, 3, 4, 6, 7, 9], dtype=np.int8)
-                        ncVarFinal.flag_meanings = 'unknown good_data probably_good_data probably_bad_data bad_data not_deployed interpolated missing_value'
-
-                        ncVarFinal[:] = 0
-
-                    # create a qc variable just for this test flags
-                    if v + "_quality_control_in" in ds.variables:
-                        ncVarOut = ds.variables[v + "_quality_control_in"]
-                    else:
-                        ncVarOut = ds.createVariable(v + "_quality_control_in", "i1", ds.variables[v].dimensions, fill_value=99, zlib=True)  # fill_value=0 otherwise defaults to max
-                        try:
-                            ds.variables[v].ancillary_variables = ds.variables[v].ancillary_variables + " " + v + "_quality_control_in"
-                        except AttributeError:
-                            ds.variables[v].ancillary_variables = v + "_quality_control_in"
-
-                    if 'long_name' in ds.variables[v].ncattrs():
-                        ncVarOut.long_name = "input data flag for " + ds.variables[v].long_name
-
-                    ncVarOut.units = "1"
-                    ncVarOut.comment = 'data flagged from input variables : ' + ','.join(d['in'])
-
-                    ncVarOut[:] = 0
-                    for in_d in d['in']:
-                        if in_d in ds.variables:
-                            print('propagating from ', in_d)
-                            qc_in = ds.variables[in_d + '_quality_control'][:]
-                            qc_in[qc_in == 8] = 0  # don't propogate the interpolated flag
-                            ncVarOut[:] = np.max([ncVarOut[:], qc_in], axis=0)
-
-                    ncVarFinal[:] = np.max([ncVarOut[:], ds.variables[v + '_quality_control']], axis=0)
-
-        if len(var_list) > 0:
-            # update the history attribute
-            try:
-                hist = ds.history + "\n"
-            except AttributeError:
-                hist = ""
-
-            ds.setncattr('history', hist + datetime.now(UTC).strftime("%Y-%m-%d") + ' propagate flags to : ' + ','.join(var_list))
-
-        ds.close()
+        qc = QCPipeline(fn)
+        qc.propogate(var_name)
+        qc.close()
 
         out_file.append(fn)
 
@@ -0,0 +1,586 @@
+#!/usr/bin/python3
+
+# qc_pipeline
+# Copyright (C) 2026 Peter Jansen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+from netCDF4 import Dataset, date2num
+
+import numpy as np
+from dateutil import parser
+from datetime import datetime, UTC
+
+# run an ordered list of QC tests on a file, the variable data and quality_control flags are read once into memory,
+# each test updates the in memory flags, and all the quality_control (and _quality_control_xxx sub flag) variables
+# and the history are written back to the file in a single flush
+#
+# usage:
+#   tests = [('in_out_water', {}),
+#            ('global_range', {'variable': 'TEMP', 'max': 30, 'min': -2}),
+#            ('spike_test', {'variable': 'TEMP', 'height': 2, 'qc_value': 3})]
+#   qc_pipeline(files, tests)
+
+create_sub_qc = True
+
+# flag data from input variables, used by propogate()
+propagate_from = [{'out': 'PSAL', 'in': ('TEMP', 'PRES', 'CNDC')},
+                  {'out': 'CNDC', 'in': ('TEMP', 'PRES', 'PSAL')},
+                  {'out': 'DENSITY', 'in': ('TEMP', 'PRES', 'PSAL')},
+                  {'out': 'SIGMA_T0', 'in': ('TEMP', 'PRES', 'PSAL')},
+                  {'out': 'SIGMA_T0_SM', 'in': ('TEMP', 'PRES', 'PSAL')},
+                  {'out': 'OXSOL', 'in': ('TEMP', 'PRES', 'PSAL')},
+                  {'out': 'DOX2', 'in': ('TEMP', 'PRES', 'PSAL', 'DOX', 'OXSOL', 'DOXS')},
+                  {'out': 'DOXS', 'in': ('TEMP', 'PRES', 'PSAL', 'DOX', 'OXSOL', 'DOX2')},
+                  ]
+
+
+class QCPipeline:
+
+    def __init__(self, netCDFfile):
+        self.netCDFfile = netCDFfile
+        self.ds = Dataset(netCDFfile, 'a')
+        self.nc_vars = self.ds.variables
+
+        self.data = {}  # variable data, read on first use
+        self.flags = {}  # quality_control flags, read (or created) on first use
+        self.dirty = []  # quality_control variables to write back on flush
+        self.new_qc = {}  # quality_control variables to create on flush, name : source variable
+        self.qc_attrs = {}  # attributes to set on the quality_control variables on flush
+        self.history = []
+        self.time = None
+        self.time_sorted = False
+
+    def var_data(self, var_name):
+        if var_name not in self.data:
+            self.data[var_name] = self.nc_vars[var_name][:]
+
+        return self.data[var_name]
+
+    def time_num(self):
+        # TIME as float64 in the file units, and if it is sorted so ranges can be found with searchsorted
+        if self.time is None:
+            self.time = np.ma.getdata(self.var_data('TIME')).astype(np.float64)
+            self.time_sorted = bool(np.all(np.diff(self.time) >= 0))
+
+        return self.time
+
+    def date_num(self, date):
+        # convert a datetime to the file's time units
+        time_var = self.nc_vars['TIME']
+
+        return date2num(date, units=time_var.units, calendar=time_var.calendar)
+
+    def time_range(self, start=None, end=None):
+        # index of the samples after start, up to and including end (datetimes, None for the start/end of the file),
+        # a slice when TIME is sorted, otherwise a mask, and the number of samples in the range
+        time = self.time_num()
+
+        start_num = None
+        end_num = None
+        if start:
+            start_num = self.date_num(start)
+        if end:
+            end_num = self.date_num(end)
+
+        if self.time_sorted:
+            i0 = 0
+            i1 = len(time)
+            if start_num is not None:
+                i0 = np.searchsorted(time, start_num, side='right')
+            if end_num is not None:
+                i1 = np.searchsorted(time, end_num, side='right')
+            i1 = max(i0, i1)
+
+            return slice(i0, i1), i1 - i0
+
+        mask = np.ones(time.shape, dtype=bool)
+        if end_num is not None:
+            mask[time > end_num] = False  # clear flags for data after end
+        if start_num is not None:
+            mask[time <= start_num] = False  # clear flags for data before start
+
+        return mask, np.count_nonzero(mask)
+
+    def qc_flags(self, qc_name, source=None, init=0, update=True):
+        # return the in memory flags for qc_name, if the variable is not in the file it is created
+        # (with the dimensions of source) when flushed
+        if qc_name not in self.flags:
+            if qc_name in self.nc_vars:
+                qc_var = self.nc_vars[qc_name]
+                qc_var.set_auto_mask(False)
+                self.flags[qc_name] = qc_var[:]
+            else:
+                self.flags[qc_name] = np.full(self.nc_vars[source].shape, init, dtype=np.int8)
+                self.new_qc[qc_name] = source
+
+        if update and qc_name not in self.dirty:
+            self.dirty.append(qc_name)
+
+        return self.flags[qc_name]
+
+    def set_qc_attrs(self, qc_name, **attrs):
+        self.qc_attrs.setdefault(qc_name, {}).update(attrs)
+
+    def qc_var_name(self, var_name):
+        try:
+            # find the existing quality_control variable in the auxillary variables list
+            aux_vars = self.nc_vars[var_name].ancillary_variables
+            aux_var = aux_vars.split(" ")
+            qc_vars = [i for i in aux_var if i.endswith("_quality_control")]
+            qc_var = qc_vars[0]
+            print("QC var name ", qc_var)
+        except (AttributeError, IndexError):
+            print("no QC variable found")
+            return None
+
+        if qc_var not in self.nc_vars and qc_var not in self.new_qc:
+            print("no QC variable found")
+            return None
+
+        return qc_var
+
+    def time_vars(self, var_name=None):
+        # list of variables to flag, either var_name or all variables with a TIME dimension which are not ancillary variables
+        if var_name:
+            return [var_name]
+
+        to_add = []
+        for v in self.nc_vars:
+            if "TIME" in self.nc_vars[v].dimensions:
+                if v != 'TIME':
+                    to_add.append(v)
+        # remove any anx variables from the list
+        for v in self.nc_vars:
+            if 'ancillary_variables' in self.nc_vars[v].ncattrs():
+                remove = self.nc_vars[v].getncattr('ancillary_variables').split(' ')
+                print("remove ", remove)
+                for r in remove:
+                    to_add.remove(r)
+
+        return to_add
+
+    def add_history(self, text):
+        self.history.append(datetime.now(UTC).strftime("%Y-%m-%d") + " " + text)
+
+    def _store_test_flags(self, var_name, qc_var, data_to_qc_msk, new_qc_flags, suffix, long_name, comment):
+        # store the flags for data that was tested in the sub flag variable, and the maximum in the main qc variable
+        nc_var = self.nc_vars[var_name]
+
+        if create_sub_qc:
+            # create a qc variable just for this test flags
+            sub_flags = self.qc_flags(var_name + suffix, source=var_name)
+
+            if 'long_name' in nc_var.ncattrs():
+                self.set_qc_attrs(var_name + suffix, long_name=long_name + nc_var.long_name)
+            self.set_qc_attrs(var_name + suffix, units="1", comment=comment)
+
+            # store new flags
+            sub_flags[data_to_qc_msk] = new_qc_flags
+            sub_flags[~data_to_qc_msk] = 2
+
+        # update the existing qc-flags
+        existing_qc_flags = self.flags[qc_var]
+        existing_qc_flags[data_to_qc_msk] = np.max([existing_qc_flags[data_to_qc_msk], new_qc_flags], axis=0)
+
+        # existing_qc_flags 66666666----------------------------------------6666666666
+        # var_data          ----------------------------------------------------------
+        # data_to_qc_msk    00000000----------------------------------------0000000000
+        # var_data_qc               -----------x----------------------------
+        # new_qc_flags              -----------4----------------------------
+        # var_qc            66666666-----------4----------------------------6666666666
+
+    # QC tests, each returns None if the test could not be run
+
+    def global_range(self, variable, max, min, qc_value=4):
+        # flag 4 (bad) when out of global range
+        qc_var = self.qc_var_name(variable)
+        if qc_var is None:
+            return None
+
+        var_data = self.var_data(variable)
+
+        # read existing quality_control flags
+        existing_qc_flags = self.qc_flags(qc_var)
+        data_to_qc_msk = existing_qc_flags < 3
+        var_data_qc = var_data[data_to_qc_msk]
+
+        # this is where the actual QC test is done
+        mask = ((var_data_qc > max) | (var_data_qc < min))
+
+        new_qc_flags = np.ones_like(var_data_qc)
+        new_qc_flags.mask = False  # incase its a masked array
+        new_qc_flags[mask] = qc_value
+
+        self._store_test_flags(variable, qc_var, data_to_qc_msk, new_qc_flags, "_quality_control_gr", "global_range flag for ", 'Test 4. gross range test')
+
+        # calculate the number of points marked as bad_data
+        count = np.count_nonzero(np.ma.getdata(mask))
+
+        self.add_history(variable + " global range min = " + str(min) + " max = " + str(max) + " marked " + str(int(count)))
+
+        return count
+
+    def spike_test(self, variable, height, qc_value=4):
+        # flag 4 (bad) when spike
+        qc_var = self.qc_var_name(variable)
+        if qc_var is None:
+            return None
+
+        var_data = self.var_data(variable)
+
+        # read existing quality_control flags
+        existing_qc_flags = self.qc_flags(qc_var)
+        data_to_qc_msk = existing_qc_flags < 3
+        var_data_qc = var_data[data_to_qc_msk]
+        if sum(data_to_qc_msk) == 0:
+            print("no good data")
+            return 0
+
+        # this is where the actual QC test is done
+        mask = np.zeros(len(var_data_qc), dtype=bool)
+        spk = np.abs(var_data_qc[1:-2] - (var_data_qc[0:-3] + var_data_qc[2:-1]) / 2)
+        mask[1:-2] = spk > height
+        print('mask data ', mask)
+
+        new_qc_flags = np.ones_like(var_data_qc)
+        new_qc_flags.mask = False
+        new_qc_flags[mask] = qc_value
+
+        self._store_test_flags(variable, qc_var, data_to_qc_msk, new_qc_flags, "_quality_control_spk", "spike flag for ", 'Test 6. spike test')
+
+        # calculate the number of points marked as bad_data
+        count = np.count_nonzero(mask)
+        print('marked records ', count)
+
+        self.add_history(variable + " spike height = " + str(height) + " marked " + str(int(count)))
+
+        return count
+
+    def rate_of_change(self, variable, rate, qc_value=4):
+        # flag 4 (bad) when the rate of change (per hour) is more than rate
+        qc_var = self.qc_var_name(variable)
+        if qc_var is None:
+            return None
+
+        time = self.var_data('TIME') * 24  # time in hours, ok its a hack
+        var_data = self.var_data(variable)
+
+        # read existing quality_control flags
+        existing_qc_flags = self.qc_flags(qc_var)
+        data_to_qc_msk = existing_qc_flags < 3
+        var_data_qc = var_data[data_to_qc_msk]
+        if sum(data_to_qc_msk) == 0:
+            print("no good data")
+            return 0
+
+        # this is where the actual QC test is done
+        mask = np.zeros(len(var_data_qc), dtype=bool)
+        mask[1:] = np.abs(np.diff(var_data_qc)/np.diff(time[data_to_qc_msk])) > rate
+        print('mask data ', mask)
+
+        new_qc_flags = np.ones_like(var_data_qc)
+        new_qc_flags.mask = False
+        new_qc_flags[mask] = qc_value
+
+        self._store_test_flags(variable, qc_var, data_to_qc_msk, new_qc_flags, "_quality_control_roc", "rate_of_change flag for ", 'Test 7. rate of change test')
+
+        # calculate the number of points marked as bad_data
+        count = np.count_nonzero(mask)
+        print('marked records ', count)
+
+        self.add_history(variable + " max rate = " + str(rate) + " marked " + str(int(count)))
+
+        return count
+
+    def climate_range(self, variable_name, qc_value=3):
+        # flag PAR above the (depth attenuated) incoming solar radiation, needs ALT and ePAR from add_incoming_radiation
+        qc_var = self.qc_var_name(variable_name)
+        if qc_var is None:
+            return None
+
+        nc_var = self.nc_vars[variable_name]
+        var_data = self.var_data(variable_name)
+
+        alt = self.var_data('ALT')
+        alt_msk = (alt < -15) | (alt > 10)
+
+        e_var = self.var_data('e' + variable_name).copy()
+        e_var.mask = False
+
+        # Southern Ocean Time Series (SOTS) Quality Assessment and Control Report PAR Instruments Version 1.0 page 9 : Test 7:
+        # the +10 QC's the night time data as well
+        spherical = 'spherical' in nc_var.comment_sensor_type
+        if spherical:
+            e_var = (e_var * 3) + 15
+            note = 'spherical sensor, par < (3 * SOLAR) + 15'
+        else:
+            e_var = (e_var * 2) + 15
+            note = 'cosine sensor, par < (2 * SOLAR) + 15'
+
+        # this is where the actual QC test is done
+        mask = (var_data > e_var) & alt_msk
+        print('mask data ', mask)
+
+        new_qc_flags = np.zeros(nc_var.shape) + 2
+        new_qc_flags[alt_msk] = 1
+        new_qc_flags[mask] = qc_value
+
+        # create a qc variable just for this test flags
+        sub_flags = self.qc_flags(variable_name + "_quality_control_cl", source=variable_name)
+        sub_flags[:] = new_qc_flags
+        self.set_qc_attrs(variable_name + "_quality_control_cl", long_name="climate flag for " + nc_var.long_name, units="1",
+                          comment='Test 7. climatology test', comment_note=note)
+
+        # update the existing qc-flags
+        existing_qc_flags = self.qc_flags(qc_var)
+        existing_qc_flags[:] = np.max([existing_qc_flags, new_qc_flags], axis=0)
+
+        # calculate the number of points marked as bad_data
+        count = np.count_nonzero(np.ma.getdata(mask))
+        print('marked records ', count)
+
+        self.add_history(variable_name + " climate range, marked " + str(int(count)))
+
+        return count
+
+    def in_out_water(self, var_name=None):
+        # flag out of water as QC value 6 (not_deployed), with wise leave as 0
+        to_add = self.time_vars(var_name)
+
+        time = self.time_num()
+
+        time_deploy = parser.parse(self.ds.time_deployment_start, ignoretz=True)
+        time_recovery = parser.parse(self.ds.time_deployment_end, ignoretz=True)
+
+        print('in/out water file', self.netCDFfile)
+        print('deployment time', time_deploy)
+
+        print('var to add', to_add)
+
+        # create a mask for the time range
+        mask = (time <= self.date_num(time_deploy)) | (time >= self.date_num(time_recovery))
+        count = -1
+        for v in to_add:
+            if v in self.nc_vars:
+                print("qc for var", v, ' dimensions ', self.nc_vars[v].dimensions)
+
+                qc_flags = self.qc_flags(v + "_quality_control")
+                qc_flags[mask] = 6
+
+                if create_sub_qc:
+                    # create a qc variable just for this test flags
+                    sub_flags = self.qc_flags(v + "_quality_control_loc", source=v)
+                    sub_flags[:] = 1
+                    sub_flags[mask] = 6
+
+                    if 'long_name' in self.nc_vars[v].ncattrs():
+                        self.set_qc_attrs(v + "_quality_control_loc", long_name="in/out of water flag for " + self.nc_vars[v].long_name)
+                    self.set_qc_attrs(v + "_quality_control_loc", units="1", comment='data flagged not deployed (6) when out of water')
+
+                # calculate the number of points marked as bad_data
+                count = np.count_nonzero(mask)
+
+        self.ds.file_version = "Level 1 - Quality Controlled Data"
+        if count > 0:
+            self.add_history('in/out marked ' + str(int(count)))
+
+        return count
+
+    def manual(self, var_name=None, start_str=None, flag=4, reason=None, end_str=None):
+        # flag data after (and/or before) a date
+        return self.manual_ranges([(start_str, end_str, flag, var_name, reason)])
+
+    def manual_ranges(self, ranges):
+        # flag data in a list of (start, end, flag, var_name[, reason]) time ranges, all in one pass over the flags,
+        # start or end of None (or 'All' for start) flags from the start or to the end of the file, var_name of None
+        # flags all variables
+        print('file', self.netCDFfile)
+
+        new_flags = {}  # var_name : flags from all the ranges
+        comments = {}
+        counts = []
+        for r in ranges:
+            start_str, end_str, flag, var_name = r[0:4]
+            reason = r[4] if len(r) > 4 else None
+            if start_str == 'All':
+                start_str = None
+
+            # time range index, without converting TIME to datetime objects
+            start = None
+            end = None
+            if start_str:
+                start = parser.parse(start_str, ignoretz=True)
+            if end_str:
+                end = parser.parse(end_str, ignoretz=True)
+            index, count = self.time_range(start, end)
+            counts.append(count)
+
+            to_add = self.time_vars(var_name)
+            print('vars to add flags to : ', to_add, 'flag', flag, 'records', count)
+
+            comment = 'manual'
+            if start_str:
+                comment += ', by date, start ' + start.strftime("%Y-%m-%d")
+            if end_str:
+                comment += ', by date, end ' + end.strftime("%Y-%m-%d")
+            if reason:
+                comment += ', ' + reason
+
+            for v in to_add:
+                if v not in new_flags:
+                    new_flags[v] = np.zeros(self.nc_vars[v].shape, dtype=np.int8)
+                    comments[v] = []
+                new_flags[v][index] = np.maximum(new_flags[v][index], flag)
+                comments[v].append(comment)
+
+            # update the history attribute
+            if var_name:
+                hist = var_name + " manual QC, marked " + str(int(count))
+            else:
+                hist = "manual QC, marked " + str(int(count))
+            hist = hist + " with flag="+str(flag)
+            if start_str:
+                hist = hist + ", start " + start.strftime("%Y-%m-%d %H:%M:%S")
+            if end_str:
+                hist = hist + ", end " + end.strftime("%Y-%m-%d %H:%M:%S")
+            if reason:
+                hist += ', ' + reason
+
+            self.add_history(hist)
+
+        for v in new_flags:
+            print("var", v, ' dimensions ', self.nc_vars[v].dimensions)
+
+            # read existing quality_control flags
+            existing_qc_flags = self.qc_flags(v + "_quality_control")
+
+            # create a qc variable just for this test flags
+            man_qc_flags = self.qc_flags(v + "_quality_control_man", source=v)
+
+            if 'long_name' in self.nc_vars[v].ncattrs():
+                self.set_qc_attrs(v + "_quality_control_man", long_name="manual flag for " + self.nc_vars[v].long_name)
+            self.set_qc_attrs(v + "_quality_control_man", units="1", comment='; '.join(comments[v]))
+
+            np.maximum(man_qc_flags, new_flags[v], out=man_qc_flags)
+
+            # update the existing qc-flags
+            np.maximum(existing_qc_flags, man_qc_flags, out=existing_qc_flags)
+
+        self.ds.file_version = "Level 1 - Quality Controlled Data"
+
+        return counts[-1] if len(counts) > 0 else 0
+
+    def propogate(self, var_name=None):
+        # flag data from input variables
+        var_list = []
+        for d in propagate_from:
+            v = d['out']
+            if v in self.nc_vars:
+                if not var_name or v == var_name:
+                    print('processing variable', v)
+                    var_list.append(v)
+
+                    # get the existing flags
+                    flags_final = self.qc_flags(v + '_quality_control', source=v)
+                    if v + '_quality_control' in self.new_qc:
+                        nc_var = self.nc_vars[v]
+                        if 'long_name' in nc_var.ncattrs():
+                            self.set_qc_attrs(v + '_quality_control', long_name="quality flag for " + nc_var.long_name)
+                        if 'standard_name' in nc_var.ncattrs():
+                            self.set_qc_attrs(v + '_quality_control', standard_name=nc_var.standard_name + " status_flag")
+                        self.set_qc_attrs(v + '_quality_control', units="1", quality_control_conventions="IMOS standard flags",
+                                          flag_values=np.array([0, 1, 2, 3, 4, 6, 7, 9], dtype=np.int8),
+                                          flag_meanings='unknown good_data probably_good_data probably_bad_data bad_data not_deployed interpolated missing_value')
+
+                    # create a qc variable just for this test flags
+                    flags_in = self.qc_flags(v + "_quality_control_in", source=v)
+                    if 'long_name' in self.nc_vars[v].ncattrs():
+                        self.set_qc_attrs(v + "_quality_control_in", long_name="input data flag for " + self.nc_vars[v].long_name)
+                    self.set_qc_attrs(v + "_quality_control_in", units="1", comment='data flagged from input variables : ' + ','.join(d['in']))
+
+                    flags_in[:] = 0
+                    for in_d in d['in']:
+                        if in_d in self.nc_vars:
+                            print('propagating from ', in_d)
+                            qc_in = self.qc_flags(in_d + '_quality_control', update=False).copy()
+                            qc_in[qc_in == 8] = 0  # don't propogate the interpolated flag
+                            flags_in[:] = np.maximum(flags_in, qc_in)
+
+                    flags_final[:] = np.maximum(flags_in, flags_final)
+
+        if len(var_list) > 0:
+            self.add_history('propagate flags to : ' + ','.join(var_list))
+
+        return var_list
+
+    def run(self, tests):
+        # run the list of (test name, keyword arguments) in order
+        for test, kwargs in tests:
+            print('qc pipeline', test, kwargs)
+            getattr(self, test)(**kwargs)
+
+        self.flush()
+
+    def flush(self):
+        # write all the changed quality_control variables and history back to the file
+        for qc_name in self.dirty:
+            if qc_name in self.new_qc:
+                source = self.nc_vars[self.new_qc[qc_name]]
+                print("adding : ", qc_name)
+                ncVarOut = self.ds.createVariable(qc_name, "i1", source.dimensions, fill_value=99, zlib=True)  # fill_value=99 otherwise defaults to max, imos-toolbox uses 99
+
+                # add new variable to list of aux variables
+                if 'ancillary_variables' in source.ncattrs():
+                    source.ancillary_variables = source.ancillary_variables + " " + qc_name
+                else:
+                    source.ancillary_variables = qc_name
+            else:
+                ncVarOut = self.nc_vars[qc_name]
+
+            for att, value in self.qc_attrs.get(qc_name, {}).items():
+                ncVarOut.setncattr(att, value)
+
+            ncVarOut[:] = self.flags[qc_name]
+
+        self.dirty = []
+        self.new_qc = {}
+        self.qc_attrs = {}
+
+        if len(self.history) > 0:
+            # update the history attribute
+            try:
+                hist = self.ds.history + "\n"
+            except AttributeError:
+                hist = ""
+            self.ds.setncattr("history", hist + "\n".join(self.history))
+
+            self.history = []
+
+    def close(self):
+        self.flush()
+        self.ds.close()
+
+
+def qc_pipeline(netCDFfiles, tests):
+
+    for netCDFfile in netCDFfiles:
+        print('qc pipeline, processing', netCDFfile)
+
+        qc = QCPipeline(netCDFfile)
+        qc.run(tests)
+        qc.close()
+
+    return netCDFfiles
+
@@ -0,0 +1,142 @@
+#!/usr/bin/python3
+
+# qc_rules
+# Copyright (C) 2026 Peter Jansen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import csv
+import sys
+from bisect import bisect_right
+
+# read the manual QC rules and depth dependent QC parameter tables (csv files)
+#
+# manual rules file columns:
+#   deployment_code, model, serial_number, var_name, time_start, time_end, flag, reason
+# an empty deployment_code, model or serial_number matches any, an empty var_name flags all variables,
+# an empty time_start or time_end flags from the start or to the end of the file
+#
+# QC parameter file columns:
+#   variable, depth, global_max, global_min, climate_max, climate_min, spike_height, rate_max
+# the parameters used are from the first row with a depth deeper than the instrument, or the last row
+#
+# lines starting with # are ignored
+
+
+def read_csv_rows(filename):
+    with open(filename, mode='r') as csv_file:
+        lines = [line for line in csv_file if not line.startswith('#')]
+
+    csv_reader = csv.reader(lines, quotechar='"', delimiter=',', skipinitialspace=True)
+    headers = [h.strip() for h in next(csv_reader)]
+    rows = []
+    for row in csv_reader:
+        if len(row) > 0:
+            rows.append({key: value.strip() for key, value in zip(headers, row)})
+
+    return rows
+
+
+class ManualRules:
+    # manual QC rules, indexed on (deployment_code, model, serial_number) so the rules for a file are found
+    # with (at most 8) dictionary lookups, rather than testing every rule
+
+    def __init__(self, rules):
+        self.index = {}
+        for n, rule in enumerate(rules):
+            key = (rule['deployment_code'], rule['model'], rule['serial_number'])
+            self.index.setdefault(key, []).append((n, rule))
+
+    def lookup(self, deployment_code, model, serial_number):
+        # return the rules for an instrument, in the order they are in the table
+        found = []
+        for d in (deployment_code, ''):
+            for m in (model, ''):
+                for s in (serial_number, ''):
+                    found.extend(self.index.get((d, m, s), []))
+
+        return [rule for n, rule in sorted(found, key=lambda r: r[0])]
+
+    def lookup_dataset(self, ds):
+        try:
+            deployment_code = ds.deployment_code
+        except AttributeError:
+            deployment_code = None
+
+        return self.lookup(deployment_code, ds.instrument_model, ds.instrument_serial_number)
+
+
+def manual_args(rule):
+    # convert a rule into the keyword arguments of manual_by_date.maunal() and QCPipeline.manual()
+    return {'var_name': rule['var_name'] or None,
+            'start_str': rule['time_start'] or None,
+            'flag': int(rule['flag']),
+            'reason': rule['reason'] or None,
+            'end_str': rule['time_end'] or None}
+
+
+def manual_range(rule):
+    # convert a rule into a (start, end, flag, var_name, reason) range for QCPipeline.manual_ranges()
+    a = manual_args(rule)
+
+    return a['start_str'], a['end_str'], a['flag'], a['var_name'], a['reason']
+
+
+def read_manual_rules(filename):
+    rules = read_csv_rows(filename)
+    print('manual rules', filename, 'rules', len(rules))
+
+    return ManualRules(rules)
+
+
+def number(value):
+    # keep integer values as int, so they print in the history as they are in the table
+    try:
+        return int(value)
+    except ValueError:
+        return float(value)
+
+
+class QCParams:
+    # depth dependent QC parameters for each variable, the depths are sorted so the row is found with a bisection
+
+    def __init__(self, rows):
+        self.depths = {}
+        self.params = {}
+        for row in rows:
+            p = {k: number(v) for k, v in row.items() if k != 'variable'}
+            self.params.setdefault(row['variable'], []).append(p)
+
+        for v in self.params:
+            self.params[v].sort(key=lambda p: p['depth'])
+            self.depths[v] = [p['depth'] for p in self.params[v]]
+
+    def lookup(self, variable, depth):
+        # first row deeper than depth, or the deepest row
+        i = min(bisect_right(self.depths[variable], depth), len(self.depths[variable]) - 1)
+
+        return self.params[variable][i]
+
+
+def read_qc_params(filename):
+    rows = read_csv_rows(filename)
+    print('qc params', filename, 'rows', len(rows))
+
+    return QCParams(rows)
+
+
+if __name__ == "__main__":
+    # usage is <manual rules file> <deployment_code> <model> <serial_number>
+    for r in read_manual_rules(sys.argv[1]).lookup(sys.argv[2], sys.argv[3], sys.argv[4]):
+        print(manual_args(r))
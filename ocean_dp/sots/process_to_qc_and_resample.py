@@ -20,6 +20,12 @@
 #print('Python %s on %s' % (sys.version, sys.platform))
 import re
 import sys, os
+import io
+import argparse
+import contextlib
+import concurrent.futures
+import functools
+import traceback
 
 sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), '..'))
 
@@ -30,12 +36,8 @@ from netCDF4 import Dataset
 import glob
 
 import ocean_dp.qc.add_qc_flags
-import ocean_dp.qc.in_out_water
-import ocean_dp.qc.global_range
-import ocean_dp.qc.spike_test
-import ocean_dp.qc.rate_of_change
-import ocean_dp.qc.manual_by_date
-import ocean_dp.qc.propogate_flags
+import ocean_dp.qc.qc_pipeline
+import ocean_dp.qc.qc_rules
 import ocean_dp.processing.addPSAL
 import ocean_dp.processing.add_density
 import ocean_dp.processing.add_sigma_theta0_sm
@@ -45,38 +47,20 @@ import ocean_dp.processing.calc_DOX_to_DOX2
 import ocean_dp.processing.apply_scale_offset_attributes
 from ocean_dp.processing.down_sample import down_sample
 import ocean_dp.processing.add_incoming_radiation
-import ocean_dp.qc.par_climate_range
 
 import ocean_dp.file_name.imosNetCDFfileName
 
 
 import ocean_dp.file_name.find_file_with
 
-# for each of the new files, process them
+# default manual QC rules, and depth dependent QC parameters
+manual_rules_file = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'sots_manual_qc.csv')
+qc_params_file = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'sots_qc_params.csv')
 
-temp_qc_params = [
-              {'depth': 0,    'global_max': 50, 'global_min': -20, 'climate_max': 30, 'climate_min': -10, 'spike_height': 5, 'rate_max': 100},
-              {'depth': 10,   'global_max': 30, 'global_min': -2, 'climate_max': 20, 'climate_min': 6, 'spike_height': 2, 'rate_max': 80},
-              {'depth': 600,  'global_max': 30, 'global_min': -2, 'climate_max': 16, 'climate_min': 5, 'spike_height': 2, 'rate_max': 80},
-              {'depth': 1500, 'global_max': 30, 'global_min': -2, 'climate_max': 12, 'climate_min': 2, 'spike_height': 2, 'rate_max': 20},
-              {'depth': 5000, 'global_max': 30, 'global_min': -2, 'climate_max': 5, 'climate_min': 0.8, 'spike_height': 0.1, 'rate_max': 3}
-            ]
 
-psal_qc_params = [
-              {'depth': 0,    'global_max': 41, 'global_min': 2, 'climate_max': 35.5, 'climate_min': 34, 'spike_height': 0.4, 'rate_max': 30},
-              {'depth': 400,  'global_max': 41, 'global_min': 2, 'climate_max': 35.5, 'climate_min': 34, 'spike_height': 0.4, 'rate_max': 30},
-              {'depth': 1500, 'global_max': 41, 'global_min': 2, 'climate_max': 35.5, 'climate_min': 34, 'spike_height': 0.2, 'rate_max': 10},
-              {'depth': 5000, 'global_max': 41, 'global_min': 2, 'climate_max': 34.8, 'climate_min': 34.3, 'spike_height': 0.02, 'rate_max': 1.2}
-            ]
-
-
-ncFiles = []
-# get list of files from command line, expand and wild cards
-for cmd_args in sys.argv[1:]:
-    ncFiles.extend(glob.glob(cmd_args))
-
-qc_files = []
-for fv00_file in ncFiles:
+def process_file(fv00_file, manual_rules, qc_params):
+    # add_qc -> derived variables -> QC tests -> manual flags -> down_sample for one FV00 file,
+    # returns the list of FV01 and FV02 files created
 
     print ("processing ", fv00_file)
     ds = Dataset(fv00_file, 'r')
@@ -121,13 +105,6 @@ for fv00_file in ncFiles:
     if re.match(r'SBE16.*', ds.instrument_model):
         is_pumped = True
 
-    # QC report manual flagging
-    manual_flag = None
-    maunal_date_start = None
-    maunal_date_end = None
-    manual_reason = None
-    manual_var = None
-
     sn = ds.instrument_serial_number
     model = ds.instrument_model
     deployment = ds.deployment_code
@@ -154,268 +131,94 @@ for fv00_file in ncFiles:
         ocean_dp.qc.add_qc_flags.add_qc(fv01_file_list, 'DOX2')
 
 
-    fv01_file_list = ocean_dp.qc.in_out_water.in_out_water(fv01_file_list)
-
     # scale/offset needs to be applied before range/spike/rate of change tests
     fv01_file_list = ocean_dp.processing.apply_scale_offset_attributes.apply_scale_offset(fv01_file_list)
 
+    if has_dox2:
+        print('dox_qc:', fv01_file_list)
+        fv01_file_list = ocean_dp.processing.add_doxs.add_doxs(fv01_file_list)  # does a re-calculate after apply_scale_offset
+
+    # the QC tests are run in memory, and the flags written back to the file once for each list of tests
+    qc_tests = [('in_out_water', {})]
+
     if has_temp:
         # temperature QC
-        for q in temp_qc_params:
-            if q['depth'] > ndepth:
-                break
+        q = qc_params.lookup('TEMP', float(ndepth))
 
         print('temp_qc:', q)
 
-        fv01_file_list = ocean_dp.qc.global_range.global_range(fv01_file_list, 'TEMP', q['global_max'], q['global_min'])
-        fv01_file_list = ocean_dp.qc.global_range.global_range(fv01_file_list, 'TEMP', q['climate_max'], q['climate_min'], 3)
-        fv01_file_list = ocean_dp.qc.spike_test.spike_test(fv01_file_list, 'TEMP', q['spike_height'], 3)
-        fv01_file_list = ocean_dp.qc.rate_of_change.rate_of_change(fv01_file_list, 'TEMP', q['rate_max'], 3)
+        qc_tests.append(('global_range', {'variable': 'TEMP', 'max': q['global_max'], 'min': q['global_min']}))
+        qc_tests.append(('global_range', {'variable': 'TEMP', 'max': q['climate_max'], 'min': q['climate_min'], 'qc_value': 3}))
+        qc_tests.append(('spike_test', {'variable': 'TEMP', 'height': q['spike_height'], 'qc_value': 3}))
+        qc_tests.append(('rate_of_change', {'variable': 'TEMP', 'rate': q['rate_max'], 'qc_value': 3}))
 
     if has_cndc:
-        fv01_file_list = ocean_dp.qc.global_range.global_range(fv01_file_list, 'CNDC', 4.5, 3)
+        qc_tests.append(('global_range', {'variable': 'CNDC', 'max': 4.5, 'min': 3}))
 
         # salinity QC
-        for q in psal_qc_params:
-            if q['depth'] > ndepth:
-                break
+        q = qc_params.lookup('PSAL', float(ndepth))
 
         print('psal_qc:', q)
 
-        fv01_file_list = ocean_dp.qc.global_range.global_range(fv01_file_list, 'PSAL', q['global_max'], q['global_min'])
-        fv01_file_list = ocean_dp.qc.global_range.global_range(fv01_file_list, 'PSAL', q['climate_max'], q['climate_min'], 3)
-        fv01_file_list = ocean_dp.qc.spike_test.spike_test(fv01_file_list, 'PSAL', q['spike_height'], 3)
-        fv01_file_list = ocean_dp.qc.rate_of_change.rate_of_change(fv01_file_list, 'PSAL', q['rate_max'], 3)
-
-        if not is_pumped:
-            fv01_file_list = ocean_dp.processing.add_density.add_density(fv01_file_list[0])
-
-            if ndepth > 4000:
-                limit = 0.001
-            else:
-                limit = 0.02
-            fv01_file_list = ocean_dp.processing.add_sigma_theta0_sm.add_sigma_theta0_sm(fv01_file_list[0], limit=limit)
+        qc_tests.append(('global_range', {'variable': 'PSAL', 'max': q['global_max'], 'min': q['global_min']}))
+        qc_tests.append(('global_range', {'variable': 'PSAL', 'max': q['climate_max'], 'min': q['climate_min'], 'qc_value': 3}))
+        qc_tests.append(('spike_test', {'variable': 'PSAL', 'height': q['spike_height'], 'qc_value': 3}))
+        qc_tests.append(('rate_of_change', {'variable': 'PSAL', 'rate': q['rate_max'], 'qc_value': 3}))
 
     if has_dox2:
         # oxygen QC
-
-        print('dox_qc:', fv01_file_list)
-        fv01_file_list = ocean_dp.processing.add_doxs.add_doxs(fv01_file_list)  # does a re-calculate after apply_scale_offset
-
-        fv01_file_list = ocean_dp.qc.global_range.global_range(fv01_file_list, 'DOX2', 350, 150)
-        fv01_file_list = ocean_dp.qc.global_range.global_range(fv01_file_list, 'DOX2', 310, 180, 3)
-        #fv01_file_list = ocean_dp.qc.global_range.global_range(fv01_file_list, 'DOXS', 1.2, 0.5)
-        #fv01_file_list = ocean_dp.qc.global_range.global_range(fv01_file_list, 'DOXS', 1.15, 0.6, 3)
+        qc_tests.append(('global_range', {'variable': 'DOX2', 'max': 350, 'min': 150}))
+        qc_tests.append(('global_range', {'variable': 'DOX2', 'max': 310, 'min': 180, 'qc_value': 3}))
+        #qc_tests.append(('global_range', {'variable': 'DOXS', 'max': 1.2, 'min': 0.5}))
+        #qc_tests.append(('global_range', {'variable': 'DOXS', 'max': 1.15, 'min': 0.6, 'qc_value': 3}))
 
     if has_wave:
         # wave QC
-
-        print('wave_qc:', fv01_file_list)
-
-        fv01_file_list = ocean_dp.qc.global_range.global_range(fv01_file_list, 'Hm0', 25, 0)
-        fv01_file_list = ocean_dp.qc.global_range.global_range(fv01_file_list, 'Tz', 25, 2)
+        qc_tests.append(('global_range', {'variable': 'Hm0', 'max': 25, 'min': 0}))
+        qc_tests.append(('global_range', {'variable': 'Tz', 'max': 25, 'min': 2}))
 
     if has_par:
         # par QC
+        qc_tests.append(('global_range', {'variable': 'PAR', 'max': 25, 'min': 0}))
 
-        print('par_qc:', fv01_file_list)
+    fv01_file_list = ocean_dp.qc.qc_pipeline.qc_pipeline(fv01_file_list, qc_tests)
 
-        fv01_file_list = ocean_dp.qc.global_range.global_range(fv01_file_list, 'PAR', 25, 0)
+    # density and smoothed sigma-theta0 (which also flags PSAL) are added after the salinity QC
+    if has_cndc and not is_pumped:
+        fv01_file_list = ocean_dp.processing.add_density.add_density(fv01_file_list[0])
 
+        if ndepth > 4000:
+            limit = 0.001
+        else:
+            limit = 0.02
+        fv01_file_list = ocean_dp.processing.add_sigma_theta0_sm.add_sigma_theta0_sm(fv01_file_list[0], limit=limit)
+
+    qc_tests = []
+
+    if has_par:
+        # incoming radiation is added after in/out water, so ALT, SOLAR and ePAR do not need quality_control variables
         ocean_dp.processing.add_incoming_radiation.add_solar(fv01_file_list)
 
         print('step 8 global range')
-        ocean_dp.qc.global_range.global_range(fv01_file_list, 'PAR', max=10000, min=-1.7)
+        qc_tests.append(('global_range', {'variable': 'PAR', 'max': 10000, 'min': -1.7}))
 
         print('step 9 global range, pbad 4500')
-        ocean_dp.qc.global_range.global_range(fv01_file_list, 'PAR', max=4500, min=-1.7, qc_value=3)
+        qc_tests.append(('global_range', {'variable': 'PAR', 'max': 4500, 'min': -1.7, 'qc_value': 3}))
 
         print('step 10 climate qc')
-        ocean_dp.qc.par_climate_range.climate_range(fv01_file_list, "PAR")
-
-
-    # Pulse 6,7,8 SOFS 1,2 Vemco Mini sensors with SN < 10000 -> flag 3
-    if model == 'Minilog-T':
-        manual_flag = 2
-        manual_reason = 'difference to higher precision sensors'
-    # Pulse 8 SBE16plusV2 battery fail (after 2012-01-30 15:25) -> flag 3 after Pressure fails
-    if model == 'SBE16plus' and deployment == 'Pulse-8-2011':
-        manual_flag = 4
-        manual_var = None
-        manual_reason = 'battery failed'
-        maunal_date_start = '2012-01-30 15:25:00'
-    # Pulse 9 SBE16plusV2 battery fail (after 2012-12-29 12:30) -> flag 3 after Pressure fails
-    if model == 'SBE16plusV2' and deployment == 'Pulse-9-2012':
-        manual_flag = 4
-        manual_var = None
-        manual_reason = 'battery failed'
-        maunal_date_start = '2012-12-29 12:30:00'
-    # SOFS-7.5 70 and 75m Starmon mini -> flag 4
-    if (sn == '4052' or sn == '4053') and model == 'Starmon mini' and deployment == 'SOFS-7.5-2018':
-        manual_flag = 4
-        manual_reason = 'sensor data noisy'
-    # SOFS-8 55m and 320m show bias -> flag 4
-    if (sn == '5304' or sn == '5320') and model == 'Starmon mini' and deployment == 'SOFS-8-2019':
-        manual_flag = 4
-        manual_reason = 'sensor data noisy'
-
-    mark_rest = False
-    # SOFS-7.5-2018 SBE37 ODO at 200m salinity jump after Feb 09
-    if model == 'SBE37SMP-ODO-RS232' and deployment == 'SOFS-7.5-2018' and sn == '03715971':
-        manual_flag = 4
-        manual_var = 'PSAL'
-        manual_reason = 'density inversion'
-        maunal_date_start = '2019-02-09 00:00:00'
-        mark_rest = True
-    # SAZ 15 2013-02-19 2013-03-06
-    if model == 'SBE37SM-RS232' and deployment == 'SAZ47-15-2012' and sn == '03708597':
-        manual_flag = 4
-        manual_var = 'PSAL'
-        manual_reason = 'drop in salinity, cell contamination'
-        maunal_date_start = '2013-02-19 00:00:00'
-        maunal_date_end = '2013-03-06 00:00:00'
-    # SAZ 16 2014-01-20 2014-01-24
-    if model == 'SBE37-SM' and deployment == 'SAZ47-16-2013' and sn == '1778':
-        manual_flag = 4
-        manual_var = 'PSAL'
-        manual_reason = 'drop in salinity, cell contamination'
-        maunal_date_start = '2014-01-20 00:00:00'
-        maunal_date_end = '2014-01-24 00:00:00'
-    # SAZ 17 2015-05-01 2015-05-03
-    if model == 'SBE37SM-RS232' and deployment == 'SAZ47-17-2015' and sn == '03708985':
-        manual_flag = 4
-        manual_var = 'PSAL'
-        manual_reason = 'drop in salinity, cell contamination'
-        maunal_date_start = '2015-05-01 00:00:00'
-        maunal_date_end = '2015-05-03 00:00:00'
-    # SAZ 18 2017-01-05 2015-01-23
-    if model == 'SBE37SM-RS232' and deployment == 'SAZ47-18-2016' and sn == '03708597':
-        manual_flag = 4
-        manual_var = 'PSAL'
-        manual_reason = 'drop in salinity, cell contamination'
-        maunal_date_start = '2017-01-12 00:00:00'
-        maunal_date_end = '2017-01-23 00:00:00'
-    # SOFS-5 add data bad
-    #    if model == 'SBE37SM-RS485' and deployment == 'SOFS-5-2015' and sn == '03707409':
-    #        manual_flag = 3
-    #        manual_var = 'PSAL'
-    #        manual_reason = 'calibration issue, reading high'
-    # SOFS-9 add data bad
-    if model == 'SBE37SMP-ODO-RS232' and deployment == 'SOFS-9-2020' and sn == '03715971':
-        manual_flag = 4
-        manual_var = 'PSAL'
-        manual_reason = 'high salinity'
-        maunal_date_start = '2020-08-01 00:00:00'
-        maunal_date_end = '2020-10-25 00:00:00'
-        mark_rest = True
-    # SOFS-9 70m Starmon mini -> flag 4
-    if (sn == '4052') and model == 'Starmon mini' and deployment == 'SOFS-9-2020':
-        manual_flag = 4
-        manual_reason = 'sensor data noisy'
-
-    if (sn == '3854') and model == 'Starmon mini' and deployment == 'SOFS-10-2021':
-        manual_flag = 2
-        manual_reason = 'sensor data noisy'
-    if (sn == '3993') and model == 'Starmon mini' and deployment == 'SOFS-10-2021':
-        manual_flag = 3
-        manual_reason = 'sensor data noisy'
-    if (sn == '3996') and model == 'Starmon mini' and deployment == 'SOFS-10-2021':
-        manual_flag = 3
-        manual_reason = 'sensor data noisy'
-    if model == 'SBE37-SM' and deployment == 'SAZ47-26-2024' and sn == '2971':
-        manual_flag = 4
-        manual_var = 'PSAL'
-        manual_reason = 'drop in salinity, cell contamination'
-        maunal_date_start = '2024-04-13 12:00:00'
-        maunal_date_end = '2024-04-16 00:00:00'
-        
-
-    if manual_flag:
-        fv01_file_list = ocean_dp.qc.manual_by_date.maunal(fv01_file_list, manual_var, maunal_date_start, manual_flag, manual_reason, end_str=maunal_date_end)
-    if model == 'SBE37SMP-ODO-RS232' and deployment == 'Pulse-9-2012' and sn == '03709515':
-        manual_flag = 3
-        manual_var = 'DOX2'
-        manual_reason = 'oxygen sensor failed'
-        fv01_file_list = ocean_dp.qc.manual_by_date.maunal(fv01_file_list, manual_var, '2012-07-21', manual_flag, manual_reason, end_str=None)
-    if model == 'Optode 3830' and deployment == 'SOFS-6-2017' and sn == '1158':
-        manual_flag = 3
-        manual_var = 'DOX2'
-        manual_reason = 'oxygen sensor reading high'
-        fv01_file_list = ocean_dp.qc.manual_by_date.maunal(fv01_file_list, manual_var, None, manual_flag, manual_reason, end_str=None)
-    if model == 'SBE37SMP-ODO-RS232' and deployment == 'SOFS-9-2020' and sn == '03715971':
-        manual_flag = 2
-        manual_var = 'PSAL'
-        manual_reason = 'high salinity at start, rest of data suspect'
-        fv01_file_list = ocean_dp.qc.manual_by_date.maunal(fv01_file_list, manual_var, None, manual_flag, manual_reason, end_str=None)
-    if model == 'SBE37SMP-ODO-RS232' and deployment == 'SOFS-7.5-2018' and sn == '03715971':
-        manual_flag = 2
-        manual_var = 'PSAL'
-        manual_reason = 'high salinity at end, reset of data suspect'
-        fv01_file_list = ocean_dp.qc.manual_by_date.maunal(fv01_file_list, manual_var, None, manual_flag, manual_reason, end_str=None)
-    if model == 'Optode 3830' and deployment == 'SOFS-9-2020':
-        manual_flag = 3
-        manual_var = 'DOX2'
-        manual_reason = 'drift low, biofouling'
-        fv01_file_list = ocean_dp.qc.manual_by_date.maunal(fv01_file_list, manual_var, '2020-11-24', manual_flag, manual_reason, end_str=None)
-    if model == 'Optode 4831' and deployment == 'SOFS-10-2021':
-        manual_flag = 3
-        manual_var = 'DOX2'
-        manual_reason = 'drift low, biofouling'
-        fv01_file_list = ocean_dp.qc.manual_by_date.maunal(fv01_file_list, manual_var, '2021-05-27', manual_flag, manual_reason, end_str=None)
-    if model == 'Optode 4831' and deployment == 'SOFS-13-2024':
-        manual_flag = 3
-        manual_var = 'DOX2'
-        manual_reason = 'drift low, biofouling'
-        fv01_file_list = ocean_dp.qc.manual_by_date.maunal(fv01_file_list, manual_var, '2025-01-08', manual_flag, manual_reason, end_str=None)
-
-    if model == 'SBE37SMP-ODO-RS232' and deployment == 'SOFS-11-2022' and sn == '03715971':
-        manual_flag = 4
-        manual_var = 'PSAL'
-        manual_reason = 'high salinity at start, rest of data suspect'
-        fv01_file_list = ocean_dp.qc.manual_by_date.maunal(fv01_file_list, manual_var, None, manual_flag, manual_reason, end_str=None)
-    if model == 'SBE37SMP-ODO-RS232' and deployment == 'SOFS-11-2022' and sn == '03723332':
-        manual_flag = 3
-        manual_var = 'PSAL'
-        manual_reason = 'battery failed'
-        fv01_file_list = ocean_dp.qc.manual_by_date.maunal(fv01_file_list, manual_var, '2022-12-30', manual_flag, manual_reason, end_str=None)
-    if model == 'Deep SeapHox2' and deployment == 'SOFS-11-2022' and sn == '0002026':
-        manual_flag = 3
-        manual_var = 'PSAL'
-        manual_reason = 'drifted high, possible bio-fouling'
-        fv01_file_list = ocean_dp.qc.manual_by_date.maunal(fv01_file_list, manual_var, '2022-11-15', manual_flag, manual_reason, end_str=None)
-    if model == 'SBE37SM-RS232' and deployment == 'SAZ47-24-2022' and sn == '03713264':
-        manual_flag = 3
-        manual_var = 'PSAL'
-        manual_reason = 'drift high'
-        fv01_file_list = ocean_dp.qc.manual_by_date.maunal(fv01_file_list, manual_var, '2022-08-01', manual_flag, manual_reason, end_str=None)
-
-    if model == 'SBE37SMP-ODO-RS232' and deployment == 'SOFS-13-2024' and sn == '03723332':
-        manual_flag = 3
-        manual_var = 'PSAL'
-        manual_reason = 'suspect cracked cell'
-        fv01_file_list = ocean_dp.qc.manual_by_date.maunal(fv01_file_list, manual_var, '2024-05-16', manual_flag, manual_reason, end_str=None)
-    if model == 'Deep SeapHox2' and deployment == 'SOFS-13-2024' and sn == '0002026':
-        manual_flag = 3
-        manual_var = None
-        manual_reason = 'cable failed'
-        fv01_file_list = ocean_dp.qc.manual_by_date.maunal(fv01_file_list, manual_var, '2025-01-20', manual_flag, manual_reason, end_str=None)
-    if model == 'SBE37SMP-ODO-RS232' and deployment == 'SOFS-14-2025' and sn == '03726389':
-        manual_flag = 3
-        manual_var = 'PSAL'
-        manual_reason = 'suspect cracked cell'
-        fv01_file_list = ocean_dp.qc.manual_by_date.maunal(fv01_file_list, manual_var, None, manual_flag, manual_reason, end_str=None)
-
-    if model == 'SBE37SM-RS232' and deployment == 'SAZ47-26-2024' and sn == '03713264':
-        manual_flag = 3
-        manual_var = 'PSAL'
-        manual_reason = 'drift high'
-        fv01_file_list = ocean_dp.qc.manual_by_date.maunal(fv01_file_list, manual_var, '2024-07-01', manual_flag, manual_reason, end_str=None)
-        
+        qc_tests.append(('climate_range', {'variable_name': 'PAR'}))
+
+    # QC report manual flagging, all the rules for this instrument from the manual rules table
+    manual_ranges = [ocean_dp.qc.qc_rules.manual_range(rule) for rule in manual_rules.lookup(deployment, model, sn)]
+    if manual_ranges:
+        qc_tests.append(('manual_ranges', {'ranges': manual_ranges}))
 
     # need to propagate flags from temp -> PSAL, SIGMA-THETA0, OXSOL, DOX2
     #                              PSAL -> CNDC, SIGMA-THETA0, OXSOL, DOX2
 
-    fv01_file_list = ocean_dp.qc.propogate_flags.propogate(fv01_file_list)
+    qc_tests.append(('propogate', {}))
+
+    fv01_file_list = ocean_dp.qc.qc_pipeline.qc_pipeline(fv01_file_list, qc_tests)
 
     ds = Dataset(fv01_file_list[0], 'a')
     ds.references += '; Jansen P, Weeding B, Shadwick EH and Trull TW (2020). Southern Ocean Time Series (SOTS) Quality Assessment and Control Report Temperature Records Version 1.0. CSIRO, Australia. DOI: 10.26198/gfgr-fq47 (https://doi.org/10.26198/gfgr-fq47)'
@@ -423,4 +226,82 @@ for fv00_file in ncFiles:
         ds.references += '; Jansen P, Shadwick EH and Trull TW (2021). Southern Ocean Time Series (SOTS) Quality Assessment and Control Report Salinity Records Version 1.0. CSIRO, Australia. DOI: 10.26198/rv8y-2q14 (https://doi.org/10.26198/rv8y-2q14)'
     ds.close()
 
-    down_sample(fv01_file_list, 'mean')
+    fv02_file_list = down_sample(fv01_file_list, 'mean')
+
+    return fv01_file_list + fv02_file_list
+
+
+def process_file_logged(fv00_file, manual_rules, qc_params):
+    # run process_file collecting the log, so the output from files processed in parallel is not interleaved,
+    # an exception is returned (as the traceback) rather than raised so one bad file does not stop the batch
+
+    log = io.StringIO()
+    error = None
+    out_files = []
+    with contextlib.redirect_stdout(log), contextlib.redirect_stderr(log):
+        try:
+            out_files = process_file(fv00_file, manual_rules, qc_params)
+        except Exception:
+            error = traceback.format_exc()
+
+    return fv00_file, out_files, error, log.getvalue()
+
+
+def process_files(ncFiles, jobs=1, manual_rules=None, qc_params=None):
+    # process each file, with jobs > 1 the files are processed in a pool of worker processes (the files do not
+    # depend on each other until aggregation), the output files are returned in the order of the input files
+
+    if manual_rules is None:
+        manual_rules = ocean_dp.qc.qc_rules.read_manual_rules(manual_rules_file)
+    if qc_params is None:
+        qc_params = ocean_dp.qc.qc_rules.read_qc_params(qc_params_file)
+
+    out_files = []
+    failed = []
+
+    if jobs > 1:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+            # map returns the results in the order the files were given, print each files log as a block
+            process = functools.partial(process_file_logged, manual_rules=manual_rules, qc_params=qc_params)
+            for fv00_file, files, error, log in pool.map(process, ncFiles):
+                print('==== ', fv00_file)
+                print(log, end='')
+                if error:
+                    print(error)
+                    failed.append(fv00_file)
+                out_files.extend(files)
+    else:
+        for fv00_file in ncFiles:
+            try:
+                out_files.extend(process_file(fv00_file, manual_rules, qc_params))
+            except Exception:
+                traceback.print_exc()
+                failed.append(fv00_file)
+
+    print('output files')
+    for f in out_files:
+        print('  ', f)
+    if failed:
+        print('failed files')
+        for f in failed:
+            print('  ', f)
+
+    return out_files
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-j', '--jobs', dest='jobs', type=int, default=1, help='number of files to process in parallel (default 1)')
+    parser.add_argument('--manual-rules', dest='manual_rules', default=manual_rules_file, help='manual QC rules csv file (default sots_manual_qc.csv)')
+    parser.add_argument('--qc-params', dest='qc_params', default=qc_params_file, help='depth dependent QC parameters csv file (default sots_qc_params.csv)')
+    parser.add_argument('file', nargs='+', help='input FV00 file name (or wild card)')
+    args = parser.parse_args()
+
+    ncFiles = []
+    # get list of files from command line, expand and wild cards
+    for cmd_args in args.file:
+        ncFiles.extend(sorted(glob.glob(cmd_args)))
+
+    process_files(ncFiles, jobs=args.jobs,
+                  manual_rules=ocean_dp.qc.qc_rules.read_manual_rules(args.manual_rules),
+                  qc_params=ocean_dp.qc.qc_rules.read_qc_params(args.qc_params))
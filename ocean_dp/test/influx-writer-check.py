@@ -0,0 +1,77 @@
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from netCDF4 import Dataset
+import numpy as np
+
+# check netcdf_insert_influx2.py writes every point through its writer threads, run with --host= and --port= against
+# a local server which accepts influxdb /write requests and keeps the line protocol points sent
+
+received = []
+lock = threading.Lock()
+
+
+class WriteHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        with lock:
+            received.extend(body.decode('utf-8').splitlines())
+        self.send_response(204)
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def make_file(file_name, n):
+    ds = Dataset(file_name, 'w')
+    ds.platform_code = 'Pulse=1, SOFS'
+    ds.deployment_code = 'SOFS-1'
+    ds.time_deployment_start = '2020-01-01T00:00:00Z'
+    ds.time_deployment_end = '2021-01-01T00:00:00Z'
+
+    ds.createDimension('TIME', n)
+    time_var = ds.createVariable('TIME', 'f8', ('TIME',))
+    time_var.standard_name = 'time'
+    time_var.units = 'days since 1950-01-01 00:00:00 UTC'
+    time_var.calendar = 'gregorian'
+    time_var[:] = 25569 + np.arange(n) / 24  # from 2020-01-01
+
+    temp_var = ds.createVariable('TEMP', 'f4', ('TIME',), fill_value=np.nan)
+    temp_var.ancillary_variables = 'TEMP_quality_control'
+    temp_var[:] = 10 + np.arange(n) / n
+    qc_var = ds.createVariable('TEMP_quality_control', 'i1', ('TIME',))
+    qc = np.ones(n, dtype=np.int8)
+    qc[::10] = 4
+    qc_var[:] = qc
+    ds.close()
+
+    # the first point is at the deployment start, which is not in the deployment, and QC 4 points are not written
+    return np.count_nonzero(qc[1:] <= 2)
+
+
+server = ThreadingHTTPServer(('127.0.0.1', 0), WriteHandler)
+threading.Thread(target=server.serve_forever, daemon=True).start()
+
+with tempfile.TemporaryDirectory() as tmp:
+    file_name = os.path.join(tmp, 'IMOS_influx_check.nc')
+    expected = make_file(file_name, 1000)
+
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'dbms', 'netcdf_insert_influx2.py')
+    out = subprocess.run([sys.executable, script, '--host=127.0.0.1', '--port=%d' % server.server_address[1],
+                          '--batch=37', '--threads=4', file_name], capture_output=True, text=True)
+    print(out.stdout.splitlines()[-1])
+
+server.shutdown()
+
+assert out.returncode == 0, out.stderr
+assert len(received) == expected, (len(received), expected)
+assert len(set(received)) == expected
+assert all(line.startswith('Pulse=1\\,\\ SOFS,site=SOFS-1 TEMP=') for line in received), received[0]
+assert 'points written %d errors 0' % expected in out.stdout
+
+print('points received', len(received), 'ok')
@@ -0,0 +1,40 @@
+import struct
+
+from ocean_dp.parse.ubx_decode import decode_buffer
+
+# check the UBX block decoder on a file truncated part way through a message header, the tail of the last block
+# is then 2 to 5 bytes of a header, on its own or after a complete message
+
+
+def ubx_message(cls, id, payload):
+    frame = struct.pack('<BBH', cls, id, len(payload)) + payload
+    ck_a = 0
+    ck_b = 0
+    for c in frame:
+        ck_a = (ck_a + c) & 0xff
+        ck_b = (ck_b + ck_a) & 0xff
+
+    return b'\xb5\x62' + frame + bytes([ck_a, ck_b])
+
+
+# a NAV-STATUS message, and the header of a NAV-PVT message
+status = ubx_message(0x01, 0x03, struct.pack('<IBBBBII', 1000, 3, 0xdd, 0, 0, 500, 400))
+header = b'\xb5\x62\x01\x07\x5c\x00'
+
+for tail_len in range(2, 6):
+    tail = header[:tail_len]
+
+    # the tail on its own
+    for final in (True, False):
+        messages, other, nmea, errors, resume = decode_buffer(tail, 0, final)
+        assert messages == {} and other == [] and nmea == [] and errors == 0, tail
+        assert resume == (len(tail) if final else 0), (tail, resume)
+
+    # the tail after a complete message
+    raw = status + tail
+    for final in (True, False):
+        messages, other, nmea, errors, resume = decode_buffer(raw, 0, final)
+        assert len(messages['STATUS'][0]) == 1 and errors == 0, tail
+        assert resume == (len(raw) if final else len(status)), (tail, resume)
+
+    print('tail', tail, 'ok')